@@ -8,14 +8,43 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5432'),
     'database': os.getenv('DB_NAME', 'sales_analytics'),
     'user': os.getenv('DB_USER', 'postgres'),
-    'password': os.getenv('DB_PASSWORD', 'password')
+    'password': os.getenv('DB_PASSWORD', 'password'),
+    # None — search_path сервера по умолчанию; перезагрузка данных временно
+    # направляет соединения в теневую схему
+    'search_path': None,
 }
 
-def get_connection_string():
-    return (
-        f"host={DB_CONFIG['host']} "
-        f"port={DB_CONFIG['port']} "
-        f"dbname={DB_CONFIG['database']} "
+def parse_endpoint(value):
+    """'host[:port][/база]' -> {'host', 'port'[, 'database']}; по умолчанию — как у основного сервера"""
+    address, _, database = value.strip().partition('/')
+    host, _, port = address.partition(':')
+    endpoint = {'host': host, 'port': port or DB_CONFIG['port']}
+    if database:
+        endpoint['database'] = database
+    return endpoint
+
+# Реплики только для чтения: DB_REPLICAS=host1:5433,host2:5434. База и учетные
+# данные — те же, что у основного сервера (DB_CONFIG), куда идут запись, DDL и REFRESH
+DB_REPLICAS = [parse_endpoint(item) for item in os.getenv('DB_REPLICAS', '').split(',') if item.strip()]
+# Отчеты читаются с реплики, только если ее отставание не больше этого значения (с)
+MAX_REPLICA_LAG = float(os.getenv('MAX_REPLICA_LAG', '30'))
+# Как долго результат проверки реплики считается актуальным (с)
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', '5'))
+
+# Шарды заказов: DB_SHARDS=host1:5432/sales_shard_0,host2:5432/sales_shard_1.
+# Пусто — шардирование выключено, все данные на основном сервере
+DB_SHARDS = [parse_endpoint(item) for item in os.getenv('DB_SHARDS', '').split(',') if item.strip()]
+
+def get_connection_string(database=None, search_path=None, endpoint=None):
+    endpoint = endpoint or DB_CONFIG
+    connection_string = (
+        f"host={endpoint['host']} "
+        f"port={endpoint['port']} "
+        f"dbname={database or endpoint.get('database') or DB_CONFIG['database']} "
         f"user={DB_CONFIG['user']} "
         f"password={DB_CONFIG['password']}"
     )
+    search_path = search_path or DB_CONFIG['search_path']
+    if search_path:
+        connection_string += f" options='-c search_path={search_path.replace(' ', '')}'"
+    return connection_string
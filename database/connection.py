@@ -0,0 +1,48 @@
+import psycopg2
+from database.config import get_connection_string
+from database.instrumentation import InstrumentedConnection
+from database.routing import router, endpoint_name
+
+def get_connection(label=None, database=None, search_path=None, replica=False, max_staleness=None,
+                   endpoint=None, **kwargs):
+    """Открывает инструментированное соединение с базой.
+
+    label добавляется к меткам всех запросов этого соединения.
+    replica=True — соединение только для чтения: с реплики, отстающей не
+    больше max_staleness секунд, а если такой нет — с основного сервера.
+    endpoint — явно заданный сервер (например, шард) вместо основного.
+    """
+    if endpoint is not None:
+        conn = psycopg2.connect(
+            get_connection_string(database=database, search_path=search_path, endpoint=endpoint),
+            connection_factory=InstrumentedConnection,
+            **kwargs
+        )
+        conn.label = label
+        conn.endpoint = endpoint_name(endpoint)
+        return conn
+
+    endpoint = router.read_endpoint(max_staleness) if replica else None
+    conn = None
+    if endpoint is not None:
+        try:
+            conn = psycopg2.connect(
+                get_connection_string(database=database, search_path=search_path, endpoint=endpoint),
+                connection_factory=InstrumentedConnection,
+                **kwargs
+            )
+        except psycopg2.OperationalError as e:
+            print(f"⚠️  Реплика {endpoint_name(endpoint)} недоступна, чтение с основного сервера: {e}")
+            router.mark_unhealthy(endpoint)
+            endpoint = None
+    if conn is None:
+        conn = psycopg2.connect(
+            get_connection_string(database=database, search_path=search_path),
+            connection_factory=InstrumentedConnection,
+            **kwargs
+        )
+    if replica:
+        conn.set_session(readonly=True)
+    conn.label = label
+    conn.endpoint = endpoint_name(endpoint) if endpoint else 'primary'
+    return conn
@@ -0,0 +1,307 @@
+"""Пакетная запись заказов с групповой фиксацией.
+
+Раньше заказ записывался построчно: INSERT заказа, INSERT каждого товара,
+UPDATE итоговой суммы — по обращению к серверу на каждую строку и по
+фиксации на каждый заказ. Здесь пачка заказов записывается одним запросом:
+заказы и товары передаются массивами и разворачиваются через unnest, id
+заказов выделяются из последовательности на сервере, цена товара (если не
+задана) и итоговая сумма тоже считаются на сервере, и вся пачка фиксируется
+одной транзакцией.
+
+OrderIngestor принимает заказы из многих потоков, копит их не дольше
+max_delay (или до batch_size) и записывает пачкой: каждый вызывающий
+получает свой id или ошибку. Ошибка одного заказа не мешает остальным.
+Запись идет на основной сервер; шарды (DB_SHARDS) получают заказы только при
+следующей раскладке (python -m scripts.sharding distribute).
+
+Заказ — словарь:
+
+    {'user_id': 17, 'order_status': 'processing',  # статус и order_date необязательны
+     'items': [{'product_id': 3, 'quantity': 2},    # unit_price по умолчанию — цена товара
+               {'product_id': 8, 'quantity': 1, 'unit_price': '19.99'}]}
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+
+from database.connection import get_connection
+from database.instrumentation import metrics
+
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+# Сколько первый заказ пачки может ждать остальных, мс
+INGEST_MAX_DELAY_MS = float(os.getenv('INGEST_MAX_DELAY_MS', '5'))
+
+ORDER_STATUSES = ('processing', 'completed', 'cancelled')
+
+# Один запрос на пачку. Порядковый номер заказа в пачке (ord) связывает заказы
+# с товарами и с результатом; id выделяются до INSERT, потому что RETURNING не
+# может сопоставить вставленные строки с исходными. Заказы с неизвестным
+# пользователем или товаром не вставляются, а возвращаются с причиной.
+# Внешние ключи проверяются в конце запроса, когда заказы пачки уже вставлены.
+# Цена приводится к типу столбца заранее, чтобы сумма заказа сходилась с subtotal.
+INSERT_ORDERS_SQL = """
+WITH input_orders AS (
+    SELECT *
+    FROM unnest(%(ords)s::int[], %(user_ids)s::int[], %(order_dates)s::timestamp[], %(statuses)s::text[])
+        AS t(ord, user_id, order_date, order_status)
+),
+input_items AS (
+    SELECT i.ord, i.product_id, i.quantity, COALESCE(i.unit_price, p.price)::numeric(10, 2) AS unit_price
+    FROM unnest(%(item_ords)s::int[], %(product_ids)s::int[], %(quantities)s::int[], %(unit_prices)s::numeric[])
+        AS i(ord, product_id, quantity, unit_price)
+    LEFT JOIN products p ON p.id = i.product_id
+),
+checked AS (
+    SELECT
+        o.*,
+        CASE
+            WHEN o.user_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM users u WHERE u.id = o.user_id)
+                THEN 'неизвестный пользователь ' || o.user_id
+            WHEN EXISTS (SELECT 1 FROM input_items i WHERE i.ord = o.ord AND i.unit_price IS NULL)
+                THEN 'неизвестный товар ' || (
+                    SELECT MIN(i.product_id) FROM input_items i WHERE i.ord = o.ord AND i.unit_price IS NULL)
+        END AS error
+    FROM input_orders o
+),
+new_ids AS MATERIALIZED (
+    SELECT ord, nextval(pg_get_serial_sequence('orders', 'id'))::int AS id
+    FROM (SELECT ord FROM checked WHERE error IS NULL ORDER BY ord) AS valid
+),
+inserted_orders AS (
+    INSERT INTO orders (id, user_id, order_date, total_amount, order_status)
+    SELECT n.id, c.user_id, COALESCE(c.order_date, now()),
+           (SELECT SUM(i.quantity * i.unit_price) FROM input_items i WHERE i.ord = c.ord),
+           c.order_status
+    FROM new_ids n
+    JOIN checked c ON c.ord = n.ord
+    ORDER BY n.id
+),
+inserted_items AS (
+    INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+    SELECT n.id, i.product_id, i.quantity, i.unit_price
+    FROM new_ids n
+    JOIN input_items i ON i.ord = n.ord
+    ORDER BY n.id
+)
+SELECT c.ord, n.id, c.error
+FROM checked c
+LEFT JOIN new_ids n ON n.ord = c.ord
+ORDER BY c.ord
+"""
+
+
+class OrderResult:
+    """Итог записи одного заказа: id или текст ошибки"""
+
+    __slots__ = ('order_id', 'error')
+
+    def __init__(self, order_id=None, error=None):
+        self.order_id = order_id
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"OrderResult(order_id={self.order_id!r}, error={self.error!r})"
+
+
+def validate_order(order):
+    """Текст ошибки или None; то, что проверяют CHECK-ограничения, проверяется до отправки"""
+    items = order.get('items') or []
+    if not items:
+        return "заказ без товаров"
+    if order.get('order_status', 'processing') not in ORDER_STATUSES:
+        return f"недопустимый статус {order.get('order_status')!r}"
+    for item in items:
+        quantity = item.get('quantity')
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            return f"недопустимое количество {quantity!r} товара {item.get('product_id')}"
+        if item.get('product_id') is None:
+            return "товар без product_id"
+        if item.get('unit_price') is not None:
+            try:
+                if Decimal(str(item['unit_price'])) < 0:
+                    return f"отрицательная цена товара {item['product_id']}"
+            except InvalidOperation:
+                return f"недопустимая цена {item['unit_price']!r} товара {item['product_id']}"
+    return None
+
+def _batch_params(orders):
+    params = {key: [] for key in ('ords', 'user_ids', 'order_dates', 'statuses',
+                                  'item_ords', 'product_ids', 'quantities', 'unit_prices')}
+    for ord, order in enumerate(orders):
+        params['ords'].append(ord)
+        params['user_ids'].append(order.get('user_id'))
+        params['order_dates'].append(order.get('order_date'))
+        params['statuses'].append(order.get('order_status', 'processing'))
+        for item in order['items']:
+            params['item_ords'].append(ord)
+            params['product_ids'].append(item['product_id'])
+            params['quantities'].append(item['quantity'])
+            price = item.get('unit_price')
+            params['unit_prices'].append(Decimal(str(price)) if price is not None else None)
+    return params
+
+def _error_text(error):
+    text = str(error).strip()
+    return text.splitlines()[0] if text else repr(error)
+
+def _insert_in_savepoint(cursor, orders):
+    """Запрос пачки под точкой сохранения: при ошибке транзакция вызывающего кода не прерывается"""
+    cursor.execute("SAVEPOINT insert_orders")
+    try:
+        cursor.execute(INSERT_ORDERS_SQL, _batch_params(orders))
+        rows = cursor.fetchall()
+    except psycopg2.Error:
+        cursor.execute("ROLLBACK TO SAVEPOINT insert_orders")
+        cursor.execute("RELEASE SAVEPOINT insert_orders")
+        raise
+    cursor.execute("RELEASE SAVEPOINT insert_orders")
+    return [OrderResult(order_id, error) for _, order_id, error in rows]
+
+def insert_orders(cursor, orders):
+    """Записывает пачку заказов одним запросом; [OrderResult] в порядке orders.
+
+    Фиксацию выполняет вызывающий код. Если запрос пачки падает целиком
+    (например, переполнение суммы), заказы записываются по одному под
+    точками сохранения, чтобы ошибку получил только виновный заказ.
+    """
+    results = [None] * len(orders)
+    valid = []
+    for index, order in enumerate(orders):
+        error = validate_order(order)
+        if error:
+            results[index] = OrderResult(error=error)
+        else:
+            valid.append(index)
+    if not valid:
+        return results
+
+    batch = [orders[index] for index in valid]
+    try:
+        written = _insert_in_savepoint(cursor, batch)
+    except psycopg2.Error:
+        written = []
+        for order in batch:
+            try:
+                written.extend(_insert_in_savepoint(cursor, [order]))
+            except psycopg2.Error as e:
+                written.append(OrderResult(error=_error_text(e)))
+
+    for index, result in zip(valid, written):
+        results[index] = result
+    return results
+
+
+class OrderIngestor:
+    """Принимает заказы из любых потоков и записывает их пачками с групповой фиксацией.
+
+    batch_size — максимальный размер пачки, max_delay_ms — сколько первый
+    заказ пачки ждет остальных. Чем больше задержка, тем крупнее пачки при
+    умеренном потоке заказов и тем меньше фиксаций на заказ.
+    """
+
+    def __init__(self, batch_size=None, max_delay_ms=None, label='ingest'):
+        self.batch_size = batch_size or INGEST_BATCH_SIZE
+        self.max_delay = (INGEST_MAX_DELAY_MS if max_delay_ms is None else max_delay_ms) / 1000
+        self.label = label
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._conn = None
+        self._thread = threading.Thread(target=self._run, name='order-ingestor', daemon=True)
+        self._thread.start()
+
+    def submit(self, order):
+        """Ставит заказ в очередь; Future с OrderResult"""
+        if self._closed.is_set():
+            raise RuntimeError("OrderIngestor закрыт")
+        future = Future()
+        self._queue.put((order, future))
+        return future
+
+    def ingest(self, order, timeout=None):
+        """Записывает заказ и ждет фиксации его пачки; OrderResult"""
+        return self.submit(order).result(timeout)
+
+    def ingest_many(self, orders, timeout=None):
+        """Записывает заказы (пачками) и ждет фиксации всех; [OrderResult] в порядке orders"""
+        futures = [self.submit(order) for order in orders]
+        return [future.result(timeout) for future in futures]
+
+    def close(self):
+        """Дописывает все принятые заказы и останавливает поток записи"""
+        self._closed.set()
+        self._thread.join()
+        # Заказы, поставленные в очередь одновременно с закрытием, не останутся без ответа
+        while True:
+            try:
+                _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_result(OrderResult(error="OrderIngestor закрыт"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        orders = [order for order, _ in batch]
+        started = time.perf_counter()
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = get_connection(label=self.label)
+            cursor = self._conn.cursor()
+            try:
+                results = insert_orders(cursor, orders)
+                self._conn.commit()
+            finally:
+                cursor.close()
+        except Exception as e:
+            # Пачка не записана (например, потеряно соединение): ошибка у всех ее заказов
+            if self._conn is not None and not self._conn.closed:
+                try:
+                    self._conn.rollback()
+                except psycopg2.Error:
+                    self._conn.close()
+            results = [OrderResult(error=_error_text(e)) for _ in orders]
+
+        failed = sum(1 for result in results if not result.ok)
+        metrics.observe(f"{self.label}.batch", time.perf_counter() - started, len(orders))
+        metrics.increment(f"{self.label}.orders", len(orders) - failed)
+        metrics.increment(f"{self.label}.errors", failed)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run(self):
+        try:
+            while not (self._closed.is_set() and self._queue.empty()):
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
+        finally:
+            if self._conn is not None:
+                self._conn.close()
@@ -1,10 +1,26 @@
-import psycopg2
-from database.config import get_connection_string
+from psycopg2 import sql
+from database.connection import get_connection
 
-def init_database():
-    """Инициализация базовых таблиц"""
-    
-    schema_sql = """
+def ensure_database(name, template=None, endpoint=None):
+    """Создает базу данных name, если ее еще нет (опционально из шаблона и на другом сервере)"""
+    conn = get_connection(database='postgres', endpoint=endpoint)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", [name])
+        if cursor.fetchone():
+            return False
+
+        statement = sql.SQL("CREATE DATABASE {} ENCODING 'UTF8' TEMPLATE {}").format(
+            sql.Identifier(name), sql.Identifier(template or 'template0')
+        )
+        cursor.execute(statement)
+        return True
+    finally:
+        cursor.close()
+        conn.close()
+
+SCHEMA_SQL = """
     -- Таблица пользователей
     CREATE TABLE IF NOT EXISTS users (
         id SERIAL PRIMARY KEY,
@@ -49,9 +65,78 @@ def init_database():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
-    """
-    
-    indexes_sql = """
+
+    -- Архив закрытых месяцев (scripts.archive): строки заказов старше границы
+    -- выгружаются в файлы, а здесь остаются агрегаты, нужные представлениям
+    CREATE TABLE IF NOT EXISTS archive_state (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        archived_before TIMESTAMP NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Недели целиком до границы архива
+    CREATE TABLE IF NOT EXISTS archive_weekly_sales (
+        week_start TIMESTAMP NOT NULL,
+        category VARCHAR(50),
+        orders BIGINT NOT NULL,
+        customers BIGINT NOT NULL,
+        revenue DECIMAL NOT NULL,
+        items BIGINT NOT NULL,
+        products BIGINT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_archive_weekly_sales_key
+        ON archive_weekly_sales (week_start, COALESCE(category, ''));
+
+    -- Архивные позиции недели, через которую проходит граница (не больше недели строк)
+    CREATE TABLE IF NOT EXISTS archive_boundary_items (
+        week_start TIMESTAMP NOT NULL,
+        category VARCHAR(50),
+        order_id INTEGER NOT NULL,
+        user_id INTEGER,
+        product_id INTEGER,
+        subtotal DECIMAL(10,2) NOT NULL,
+        quantity INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS archive_monthly_sales (
+        month_start TIMESTAMP PRIMARY KEY,
+        orders BIGINT NOT NULL,
+        customers BIGINT NOT NULL,
+        revenue DECIMAL NOT NULL,
+        items BIGINT NOT NULL,
+        joined_rows BIGINT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS archive_daily_sales (
+        sale_date DATE PRIMARY KEY,
+        orders BIGINT NOT NULL,
+        revenue DECIMAL NOT NULL,
+        customers BIGINT NOT NULL
+    );
+
+    -- По парам (категория, клиент): уникальных клиентов категории за все время
+    -- можно посчитать вместе с живыми заказами; пар не больше, чем клиентов × категорий
+    CREATE TABLE IF NOT EXISTS archive_category_sales (
+        category VARCHAR(50),
+        user_id INTEGER,
+        orders BIGINT NOT NULL,
+        items BIGINT NOT NULL,
+        revenue DECIMAL NOT NULL,
+        price_sum DECIMAL NOT NULL,
+        joined_rows BIGINT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_archive_category_sales_key
+        ON archive_category_sales (COALESCE(category, ''), COALESCE(user_id, 0));
+
+    CREATE TABLE IF NOT EXISTS archive_customer_sales (
+        user_id INTEGER PRIMARY KEY,
+        orders BIGINT NOT NULL,
+        spent DECIMAL NOT NULL,
+        last_order_date TIMESTAMP
+    );
+"""
+
+INDEXES_SQL = """
     -- Индексы для быстрого поиска
     CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(order_date);
     CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
@@ -63,9 +148,36 @@ def init_database():
     
     -- Индекс для продуктов
     CREATE INDEX IF NOT EXISTS idx_products_category ON products(category);
-    """
 
-    triggers_sql = """
+    -- Индексы для инкрементальной выгрузки изменений (scripts.cdc): порядок выгрузки
+    -- (updated_at, id) читается по индексу, и синхронизация стоит столько, сколько изменений
+    CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at, id);
+    CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products(updated_at, id);
+    CREATE INDEX IF NOT EXISTS idx_orders_updated_at ON orders(updated_at, id);
+    CREATE INDEX IF NOT EXISTS idx_order_items_updated_at ON order_items(updated_at, id);
+
+    -- Поиск товаров и клиентов (reports.search): префикс строки и префиксы слов
+    CREATE INDEX IF NOT EXISTS idx_products_title_prefix ON products(lower(title) text_pattern_ops);
+    CREATE INDEX IF NOT EXISTS idx_products_title_words ON products USING gin (to_tsvector('simple', title));
+    CREATE INDEX IF NOT EXISTS idx_users_email_prefix ON users(lower(email) text_pattern_ops);
+    CREATE INDEX IF NOT EXISTS idx_users_name_prefix ON users(lower(first_name || ' ' || last_name) text_pattern_ops);
+    CREATE INDEX IF NOT EXISTS idx_users_search_words ON users
+        USING gin (to_tsvector('simple', first_name || ' ' || last_name || ' ' || email));
+"""
+
+# Триграммные индексы для поиска по подстроке и с опечатками. pg_trgm есть не
+# везде (это contrib-модуль), поэтому индексы создаются отдельно и только если
+# расширение доступно; без них поиск работает по префиксам слов
+TRIGRAM_AVAILABLE_SQL = "SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')"
+
+TRIGRAM_INDEXES_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_products_title_trgm ON products USING gin (lower(title) gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_users_email_trgm ON users USING gin (lower(email) gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_users_name_trgm ON users
+        USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops);
+"""
+
+FUNCTIONS_SQL = """
     CREATE OR REPLACE FUNCTION set_updated_at()
     RETURNS TRIGGER AS $$
     BEGIN
@@ -74,11 +186,49 @@ def init_database():
     END;
     $$ LANGUAGE plpgsql;
 
+    -- Уведомление слушателю живых итогов (scripts.live_aggregates): заказ стал
+    -- выполненным (s = 1) или перестал им быть (s = -1). Триггер отложен до
+    -- COMMIT, поэтому сумма и позиции заказа уже окончательные; x — транзакция,
+    -- по ней слушатель не учитывает заказ дважды после сверки с базой
+    CREATE OR REPLACE FUNCTION notify_order_event()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        final_date TIMESTAMP;
+        final_amount DECIMAL(10,2);
+    BEGIN
+        SELECT order_date, total_amount INTO final_date, final_amount FROM orders WHERE id = NEW.id;
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+        PERFORM pg_notify('order_events', json_build_object(
+            'id', NEW.id,
+            'x', pg_current_xact_id()::text,
+            't', EXTRACT(EPOCH FROM clock_timestamp()),
+            'u', NEW.user_id,
+            'd', final_date,
+            's', CASE WHEN NEW.order_status = 'completed' THEN 1 ELSE -1 END,
+            'a', final_amount,
+            'c', (SELECT json_object_agg(category, revenue)
+                  FROM (SELECT COALESCE(p.category, '') AS category, SUM(oi.subtotal) AS revenue
+                        FROM order_items oi
+                        JOIN products p ON oi.product_id = p.id
+                        WHERE oi.order_id = NEW.id
+                        GROUP BY 1) split)
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# Триггеры проверяются по таблице, а не только по имени: в теневой схеме
+# (scripts.reload) создаются такие же триггеры для ее копий таблиц
+TRIGGERS_SQL = """
     -- Триггер для users
     DO $$
     BEGIN
         IF NOT EXISTS (
-            SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_users_updated_at'
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'trigger_users_updated_at' AND tgrelid = 'users'::regclass
         ) THEN
             CREATE TRIGGER trigger_users_updated_at
             BEFORE UPDATE ON users
@@ -91,7 +241,8 @@ def init_database():
     DO $$
     BEGIN
         IF NOT EXISTS (
-            SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_products_updated_at'
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'trigger_products_updated_at' AND tgrelid = 'products'::regclass
         ) THEN
             CREATE TRIGGER trigger_products_updated_at
             BEFORE UPDATE ON products
@@ -104,7 +255,8 @@ def init_database():
     DO $$
     BEGIN
         IF NOT EXISTS (
-            SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_orders_updated_at'
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'trigger_orders_updated_at' AND tgrelid = 'orders'::regclass
         ) THEN
             CREATE TRIGGER trigger_orders_updated_at
             BEFORE UPDATE ON orders
@@ -117,7 +269,8 @@ def init_database():
     DO $$
     BEGIN
         IF NOT EXISTS (
-            SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_order_items_updated_at'
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'trigger_order_items_updated_at' AND tgrelid = 'order_items'::regclass
         ) THEN
             CREATE TRIGGER trigger_order_items_updated_at
             BEFORE UPDATE ON order_items
@@ -125,16 +278,61 @@ def init_database():
         END IF;
     END;
     $$;
-    """
 
+    -- Уведомления о выполнении и отмене заказов текущей недели: более старые
+    -- заказы живым итогам не нужны, и массовая загрузка истории их не шлет
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'trigger_orders_completed_notify' AND tgrelid = 'orders'::regclass
+        ) THEN
+            CREATE CONSTRAINT TRIGGER trigger_orders_completed_notify
+            AFTER INSERT ON orders
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW
+            WHEN (NEW.order_status = 'completed' AND NEW.order_date >= DATE_TRUNC('week', LOCALTIMESTAMP))
+            EXECUTE FUNCTION notify_order_event();
+        END IF;
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'trigger_orders_status_notify' AND tgrelid = 'orders'::regclass
+        ) THEN
+            CREATE CONSTRAINT TRIGGER trigger_orders_status_notify
+            AFTER UPDATE OF order_status ON orders
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW
+            WHEN (OLD.order_status IS DISTINCT FROM NEW.order_status
+                  AND 'completed' IN (OLD.order_status, NEW.order_status)
+                  AND NEW.order_date >= DATE_TRUNC('week', LOCALTIMESTAMP))
+            EXECUTE FUNCTION notify_order_event();
+        END IF;
+    END;
+    $$;
+"""
+
+def enable_trigram_search(cursor):
+    """Устанавливает pg_trgm и триграммные индексы поиска; False, если расширения нет на сервере"""
+    cursor.execute(TRIGRAM_AVAILABLE_SQL)
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    cursor.execute(TRIGRAM_INDEXES_SQL)
+    return True
+
+def init_database():
+    """Инициализация базовых таблиц"""
     
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute(schema_sql)
-        cursor.execute(indexes_sql)
-        cursor.execute(triggers_sql)
+        cursor.execute(SCHEMA_SQL)
+        cursor.execute(INDEXES_SQL)
+        cursor.execute(FUNCTIONS_SQL)
+        cursor.execute(TRIGGERS_SQL)
+        if not enable_trigram_search(cursor):
+            print("⚠️  pg_trgm недоступен: поиск будет работать только по префиксам слов")
         conn.commit()
         print("✅ Базовые таблицы созданы!")
         
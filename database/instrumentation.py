@@ -0,0 +1,342 @@
+"""Инструментирование запросов к базе данных.
+
+Каждый запрос, выполненный через InstrumentedCursor, учитывается под своей
+меткой: гистограмма времени выполнения, количество возвращенных строк,
+примерный объем полученных данных и ошибки по SQLSTATE. Метрики выгружаются
+в текстовом формате Prometheus или в JSON. Запросы медленнее порога
+попадают в журнал медленных запросов вместе с EXPLAIN (ANALYZE, BUFFERS);
+повторное выполнение под EXPLAIN всегда откатывается, а запросы, меняющие
+данные, не объясняются.
+"""
+
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import psycopg2.extensions
+
+# Границы корзин гистограммы времени выполнения, в секундах
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '500'))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'slow_queries.log')
+# Не чаще одного EXPLAIN ANALYZE на метку за этот интервал: план медленного
+# запроса стоит еще одного его выполнения
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', '300'))
+METRICS_EXPORT_PATH = os.getenv('METRICS_EXPORT_PATH')
+
+# EXPLAIN ANALYZE выполняет запрос еще раз, поэтому объясняются только чтения:
+# WITH может содержать INSERT/UPDATE/DELETE (например, пачка заказов в
+# database.ingestion), а последовательности и advisory lock уровня сеанса не
+# откатываются вместе с транзакцией
+EXPLAIN_STATEMENTS = ('SELECT', 'TABLE')
+NON_TRANSACTIONAL_CALLS = re.compile(
+    r"\b(nextval|setval|pg_advisory_lock\w*|pg_try_advisory_lock\w*|pg_advisory_unlock\w*|dblink\w*)\s*\(",
+    re.IGNORECASE)
+
+
+class QueryStats:
+    __slots__ = ('count', 'errors', 'total_seconds', 'buckets', 'rows', 'bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = {}
+        self.total_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def to_dict(self):
+        cumulative = []
+        running = 0
+        for count in self.buckets:
+            running += count
+            cumulative.append(running)
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total_seconds, 6),
+            'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], cumulative)),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'errors': dict(self.errors),
+        }
+
+
+class MetricsRegistry:
+    """Потокобезопасный реестр метрик запросов по меткам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._counters = {}
+        self.slow_queries = deque(maxlen=100)
+        self._last_explain = {}
+
+    def _get(self, label):
+        stats = self._stats.get(label)
+        if stats is None:
+            stats = self._stats[label] = QueryStats()
+        return stats
+
+    def observe(self, label, seconds, rows=0):
+        with self._lock:
+            stats = self._get(label)
+            stats.observe(seconds)
+            stats.rows += rows
+
+    def add_bytes(self, label, size):
+        with self._lock:
+            self._get(label).bytes += size
+
+    def record_error(self, label, seconds, error):
+        code = getattr(error, 'pgcode', None) or type(error).__name__
+        with self._lock:
+            stats = self._get(label)
+            stats.observe(seconds)
+            stats.errors[code] = stats.errors.get(code, 0) + 1
+
+    def increment(self, name, value=1):
+        """Произвольный счетчик (например, число таймаутов отчетов)"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def should_explain(self, label):
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_explain.get(label)
+            if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return False
+            self._last_explain[label] = now
+            return True
+
+    def total_seconds(self):
+        """Суммарное время всех запросов (для профилирования этапов)"""
+        with self._lock:
+            return sum(stats.total_seconds for stats in self._stats.values())
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._counters.clear()
+            self.slow_queries.clear()
+            self._last_explain.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'queries': {label: stats.to_dict() for label, stats in sorted(self._stats.items())},
+                'counters': dict(self._counters),
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP sales_query_duration_seconds Время выполнения запросов по меткам',
+            '# TYPE sales_query_duration_seconds histogram',
+        ]
+        for label, stats in snapshot['queries'].items():
+            name = _escape_label(label)
+            for bound, count in stats['buckets'].items():
+                lines.append(f'sales_query_duration_seconds_bucket{{query="{name}",le="{bound}"}} {count}')
+            lines.append(f'sales_query_duration_seconds_sum{{query="{name}"}} {stats["total_seconds"]}')
+            lines.append(f'sales_query_duration_seconds_count{{query="{name}"}} {stats["count"]}')
+
+        lines += ['# HELP sales_query_rows_total Количество строк, возвращенных запросами',
+                  '# TYPE sales_query_rows_total counter']
+        for label, stats in snapshot['queries'].items():
+            lines.append(f'sales_query_rows_total{{query="{_escape_label(label)}"}} {stats["rows"]}')
+
+        lines += ['# HELP sales_query_bytes_total Примерный объем данных, полученных запросами',
+                  '# TYPE sales_query_bytes_total counter']
+        for label, stats in snapshot['queries'].items():
+            lines.append(f'sales_query_bytes_total{{query="{_escape_label(label)}"}} {stats["bytes"]}')
+
+        lines += ['# HELP sales_query_errors_total Ошибки запросов по SQLSTATE',
+                  '# TYPE sales_query_errors_total counter']
+        for label, stats in snapshot['queries'].items():
+            for code, count in stats['errors'].items():
+                lines.append(f'sales_query_errors_total{{query="{_escape_label(label)}",'
+                             f'sqlstate="{_escape_label(code)}"}} {count}')
+
+        lines += ['# HELP sales_events_total Счетчики событий приложения',
+                  '# TYPE sales_events_total counter']
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'sales_events_total{{event="{_escape_label(name)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _row_bytes(rows):
+    """Примерный объем строк в текстовом представлении"""
+    return sum(len(str(value)) for row in rows for value in row if value is not None)
+
+
+metrics = MetricsRegistry()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Курсор, учитывающий каждый запрос в реестре metrics.
+
+    Метка запроса передается явно (execute(sql, params, label=...)) или
+    берется из метки соединения и имени вызывающей функции.
+    """
+
+    _label = None
+
+    def _resolve_label(self, label):
+        if label:
+            return label
+        frame = sys._getframe(2)
+        caller = f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+        prefix = getattr(self.connection, 'label', None)
+        return f"{prefix}:{caller}" if prefix else caller
+
+    def execute(self, query, vars=None, label=None):
+        self._label = self._resolve_label(label)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception as e:
+            metrics.record_error(self._label, time.perf_counter() - started, e)
+            raise
+        elapsed = time.perf_counter() - started
+        rows = self.rowcount if self.description is not None and self.rowcount > 0 else 0
+        metrics.observe(self._label, elapsed, rows)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            self._log_slow_query(query, vars, elapsed)
+        return result
+
+    def executemany(self, query, vars_list, label=None):
+        self._label = self._resolve_label(label)
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception as e:
+            metrics.record_error(self._label, time.perf_counter() - started, e)
+            raise
+        metrics.observe(self._label, time.perf_counter() - started)
+        return result
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            metrics.add_bytes(self._label, _row_bytes([row]))
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        metrics.add_bytes(self._label, _row_bytes(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        metrics.add_bytes(self._label, _row_bytes(rows))
+        return rows
+
+    def _log_slow_query(self, query, vars, elapsed):
+        statement = self.query.decode('utf-8', 'replace') if self.query else str(query)
+        entry = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'label': self._label,
+            'duration_ms': round(elapsed * 1000, 2),
+            'query': statement.strip(),
+            'plan': None,
+        }
+
+        if _explainable(statement) and metrics.should_explain(self._label):
+            entry['plan'] = self._explain(statement, entry)
+
+        metrics.slow_queries.append(entry)
+        if SLOW_QUERY_LOG:
+            try:
+                with open(SLOW_QUERY_LOG, 'a') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            except OSError:
+                pass
+
+
+    def _explain(self, statement, entry):
+        # Все, что сделал повторный запрос, откатывается: внутри транзакции
+        # вызывающего кода — до точки сохранения, иначе — отдельной транзакцией
+        in_transaction = (self.connection.get_transaction_status()
+                          == psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+        explain_cursor = psycopg2.extensions.cursor(self.connection)
+        try:
+            explain_cursor.execute("SAVEPOINT slow_query_explain" if in_transaction else "BEGIN")
+            try:
+                explain_cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}")
+                return explain_cursor.fetchone()[0]
+            except Exception as e:
+                entry['plan_error'] = str(e)
+                return None
+            finally:
+                if in_transaction:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+                else:
+                    explain_cursor.execute("ROLLBACK")
+        finally:
+            explain_cursor.close()
+
+
+def _explainable(statement):
+    """Можно ли повторить запрос под EXPLAIN ANALYZE без последствий"""
+    words = statement.split(None, 1)
+    if not words or words[0].upper() not in EXPLAIN_STATEMENTS:
+        return False
+    return NON_TRANSACTIONAL_CALLS.search(statement) is None
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Соединение, по умолчанию создающее InstrumentedCursor"""
+
+    label = None
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', InstrumentedCursor)
+        return super().cursor(*args, **kwargs)
+
+
+def export_prometheus(path):
+    """Сохраняет метрики в текстовом формате Prometheus (для node_exporter textfile)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(metrics.to_prometheus())
+    os.replace(tmp_path, path)
+
+def export_json(path):
+    """Сохраняет снимок метрик в JSON"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(metrics.snapshot(), f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+def export_metrics(path):
+    """Выгрузка метрик; формат определяется расширением файла (.json или .prom)"""
+    if path.endswith('.json'):
+        export_json(path)
+    else:
+        export_prometheus(path)
+
+
+if METRICS_EXPORT_PATH:
+    atexit.register(export_metrics, METRICS_EXPORT_PATH)
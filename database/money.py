@@ -0,0 +1,75 @@
+"""Денежные значения в целых копейках.
+
+psycopg2 возвращает NUMERIC как Decimal: каждое значение — отдельный объект
+около сотни байт, а сложение и сравнение Decimal заметно медленнее, чем у int.
+Денежные столбцы проекта имеют не больше двух знаков после запятой, поэтому
+их можно без потерь хранить целым числом сотых — для денег это копейки
+(центы). Преобразование к строке — только при выводе (format_cents).
+
+Приведение включается для отдельного курсора (register_cents) и действует
+на все его столбцы NUMERIC: значение с большим числом знаков после запятой
+вызывает ошибку, а не теряет точность.
+"""
+
+from decimal import Decimal
+
+import psycopg2.extensions
+
+NUMERIC_OID = 1700
+
+
+def parse_hundredths(text):
+    """'1234.5' -> 123450; больше двух ненулевых знаков после запятой — ValueError"""
+    whole, _, fraction = text.partition('.')
+    if len(fraction) == 2:
+        # Обычный случай для NUMERIC(10,2) и ROUND(..., 2): одно преобразование строки в int
+        return int(whole + fraction)
+    negative = text.startswith('-')
+    whole, _, fraction = text.lstrip('+-').partition('.')
+    if len(fraction) > 2:
+        if fraction[2:].strip('0'):
+            raise ValueError(f"{text} не представимо в сотых без потери точности")
+        fraction = fraction[:2]
+    value = int(whole or '0') * 100 + int(fraction.ljust(2, '0'))
+    return -value if negative else value
+
+def _cast_hundredths(value, cursor):
+    return None if value is None else parse_hundredths(value)
+
+CENTS = psycopg2.extensions.new_type((NUMERIC_OID,), 'CENTS', _cast_hundredths)
+
+def register_cents(cursor):
+    """NUMERIC в результатах cursor (и только его) приходит целыми сотыми"""
+    psycopg2.extensions.register_type(CENTS, cursor)
+    return cursor
+
+def to_hundredths(value):
+    """Целые сотые из int (уже приведенного), Decimal или строки"""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, Decimal):
+        scaled = value.scaleb(2)
+        if scaled != scaled.to_integral_value():
+            raise ValueError(f"{value} не представимо в сотых без потери точности")
+        return int(scaled)
+    return parse_hundredths(str(value))
+
+def format_cents(cents, grouping=True):
+    """123456 -> '1,234.56' (без grouping — '1234.56'), как format(Decimal, ',.2f')"""
+    sign = '-' if cents < 0 else ''
+    whole, fraction = divmod(abs(cents), 100)
+    whole = f"{whole:,}" if grouping else str(whole)
+    return f"{sign}{whole}.{fraction:02d}"
+
+def format_tenths(hundredths):
+    """Значение ROUND(..., 1) в сотых: 4530 -> '45.3', как str(Decimal('45.3'))"""
+    sign = '-' if hundredths < 0 else ''
+    return f"{sign}{abs(hundredths) // 100}.{abs(hundredths) % 100 // 10}"
+
+def divide_half_even(total, count):
+    """total / count с округлением до целого половины к четному — как format(Decimal, '.2f') в сотых"""
+    quotient, remainder = divmod(total, count)
+    doubled = 2 * remainder
+    if doubled > count or (doubled == count and quotient % 2):
+        quotient += 1
+    return quotient
@@ -0,0 +1,121 @@
+"""Маршрутизация чтения на реплики.
+
+Запись, DDL и обновление MV всегда идут на основной сервер (DB_CONFIG).
+Отчеты могут читать с реплик из DB_REPLICAS: реплика используется, если она
+доступна, находится в режиме восстановления (не была повышена) и отстает не
+больше допустимого. Результаты проверки кэшируются на REPLICA_CHECK_INTERVAL
+секунд; если подходящих реплик нет, чтение уходит на основной сервер.
+"""
+
+import itertools
+import threading
+import time
+
+import psycopg2
+
+from database.config import DB_REPLICAS, MAX_REPLICA_LAG, REPLICA_CHECK_INTERVAL, get_connection_string
+from database.instrumentation import metrics
+
+# Отставание считается нулевым, если реплика в потоковой репликации и
+# применила все полученное: иначе на простаивающем основном сервере
+# «возраст последней транзакции» рос бы без реального отставания
+REPLICA_LAG_SQL = """
+SELECT
+    pg_is_in_recovery(),
+    EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'),
+    pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn(),
+    EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+"""
+
+REPLICA_CONNECT_TIMEOUT = 2
+
+
+def endpoint_name(endpoint):
+    name = f"{endpoint['host']}:{endpoint['port']}"
+    return f"{name}/{endpoint['database']}" if endpoint.get('database') else name
+
+
+class ReplicaRouter:
+    """Выбор реплики для чтения с учетом ее отставания"""
+
+    def __init__(self, replicas=None, max_lag=None, check_interval=None):
+        self.replicas = DB_REPLICAS if replicas is None else replicas
+        self.max_lag = MAX_REPLICA_LAG if max_lag is None else max_lag
+        self.check_interval = REPLICA_CHECK_INTERVAL if check_interval is None else check_interval
+        self._lock = threading.Lock()
+        # имя реплики -> (время проверки, отставание в секундах или None, если реплика непригодна)
+        self._health = {}
+        self._order = itertools.count()
+
+    def check_replica(self, endpoint):
+        """Отставание реплики в секундах или None, если читать с нее нельзя"""
+        try:
+            conn = psycopg2.connect(get_connection_string(endpoint=endpoint),
+                                    connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        except psycopg2.Error:
+            return None
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(REPLICA_LAG_SQL)
+            in_recovery, streaming, caught_up, replay_age = cursor.fetchone()
+            cursor.close()
+        except psycopg2.Error:
+            return None
+        finally:
+            conn.close()
+
+        if not in_recovery:
+            # Повышенная реплика живет своей историей и больше не копия основного сервера
+            return None
+        if streaming and caught_up:
+            return 0.0
+        return float(replay_age) if replay_age is not None else None
+
+    def replica_lag(self, endpoint):
+        """Отставание реплики с учетом кэша проверок"""
+        name = endpoint_name(endpoint)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._health.get(name)
+        if cached and now - cached[0] < self.check_interval:
+            return cached[1]
+        lag = self.check_replica(endpoint)
+        with self._lock:
+            self._health[name] = (time.monotonic(), lag)
+        return lag
+
+    def mark_unhealthy(self, endpoint):
+        """Исключает реплику до следующей проверки (например, после ошибки соединения)"""
+        with self._lock:
+            self._health[endpoint_name(endpoint)] = (time.monotonic(), None)
+
+    def read_endpoint(self, max_staleness=None):
+        """Реплика для чтения или None, если читать нужно с основного сервера"""
+        if not self.replicas:
+            return None
+        max_staleness = self.max_lag if max_staleness is None else max_staleness
+        start = next(self._order)
+        for offset in range(len(self.replicas)):
+            endpoint = self.replicas[(start + offset) % len(self.replicas)]
+            lag = self.replica_lag(endpoint)
+            if lag is not None and lag <= max_staleness:
+                metrics.increment('routing.replica_reads')
+                return endpoint
+        metrics.increment('routing.primary_fallbacks')
+        return None
+
+    def status(self):
+        """Текущее состояние реплик: [{endpoint, lag, healthy}]"""
+        result = []
+        for endpoint in self.replicas:
+            lag = self.replica_lag(endpoint)
+            result.append({
+                'endpoint': endpoint_name(endpoint),
+                'lag': lag,
+                'healthy': lag is not None and lag <= self.max_lag,
+            })
+        return result
+
+
+router = ReplicaRouter()
@@ -0,0 +1,71 @@
+"""Профили настроек сессии для разных видов нагрузки.
+
+Обновление MV и тяжелые отчеты по живым представлениям (customer_analytics,
+category_analysis) с настройками по умолчанию сбрасывают сортировки и хеши
+на диск и выполняются без параллельных процессов, а короткие выборки из MV
+платят за JIT-компиляцию. Профиль — набор настроек, который применяется
+через SET LOCAL в начале транзакции и действует только до ее конца, поэтому
+не протекает в соединения из пула.
+
+Значения по умолчанию подобраны консервативно; scripts.calibrate_profiles
+подбирает их под текущее железо и объем данных и сохраняет в
+SESSION_PROFILES_PATH, откуда они загружаются при импорте.
+"""
+
+import json
+import os
+
+SESSION_PROFILES_PATH = os.getenv('SESSION_PROFILES_PATH', 'session_profiles.json')
+
+# Настройки, которые может задавать профиль: имена подставляются в SET LOCAL
+# напрямую, поэтому из файла калибровки принимаются только они
+PROFILE_SETTINGS = ('work_mem', 'max_parallel_workers_per_gather', 'jit')
+
+DEFAULT_PROFILES = {
+    # REFRESH MATERIALIZED VIEW: полный проход по заказам с сортировкой и агрегацией
+    'refresh': {'work_mem': '256MB', 'max_parallel_workers_per_gather': 4, 'jit': 'on'},
+    # Отчеты по живым представлениям поверх базовых таблиц
+    'heavy_report': {'work_mem': '64MB', 'max_parallel_workers_per_gather': 2, 'jit': 'on'},
+    # Выборки из MV по индексу: десятки строк, JIT и параллельность только мешают
+    'point_lookup': {'work_mem': '4MB', 'max_parallel_workers_per_gather': 0, 'jit': 'off'},
+}
+
+
+def load_profiles(path=None):
+    """Профили по умолчанию, поверх которых наложены результаты калибровки из path"""
+    path = path or SESSION_PROFILES_PATH
+    profiles = {name: dict(settings) for name, settings in DEFAULT_PROFILES.items()}
+    if not path or not os.path.exists(path):
+        return profiles
+    try:
+        with open(path) as f:
+            calibrated = json.load(f).get('profiles', {})
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Не удалось прочитать профили сессии из {path}: {e}")
+        return profiles
+    for name, settings in calibrated.items():
+        if name in profiles:
+            profiles[name].update({key: value for key, value in settings.items() if key in PROFILE_SETTINGS})
+    return profiles
+
+PROFILES = load_profiles()
+
+
+def apply_settings(cursor, settings):
+    """SET LOCAL для каждой настройки (одним обращением к серверу); действует до конца транзакции"""
+    for name in settings:
+        if name not in PROFILE_SETTINGS:
+            raise ValueError(f"Недопустимая настройка профиля: {name}")
+    if settings:
+        statements = "; ".join(f"SET LOCAL {name} = %s" for name in settings)
+        cursor.execute(statements, [str(value) for value in settings.values()])
+
+def apply_profile(cursor, name):
+    """Применяет профиль name к текущей транзакции cursor.
+
+    Соединение не должно быть в autocommit: там каждая команда — отдельная
+    транзакция, и SET LOCAL ни на что не влияет.
+    """
+    if name not in PROFILES:
+        raise ValueError(f"Неизвестный профиль сессии: {name}")
+    apply_settings(cursor, PROFILES[name])
@@ -0,0 +1,62 @@
+"""Шардирование заказов по user_id.
+
+users, orders и order_items распределяются по шардам по user_id % N: заказы
+пользователя лежат на одном шарде вместе с ним, поэтому внешние ключи
+остаются локальными, а множества заказов и клиентов разных шардов не
+пересекаются. products копируется на каждый шард целиком.
+
+Последовательности id на шарде i выдают значения i, i + N, i + 2N, ...,
+поэтому новый пользователь, созданный на шарде i, принадлежит ему же, а id
+заказов уникальны по всем шардам.
+
+Данные шардов — снимок основного сервера (scripts.sharding distribute): запись
+идет на основной сервер, и шарды обновляются только следующей раскладкой.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from database.config import DB_SHARDS
+from database.connection import get_connection
+from database.routing import endpoint_name
+from database.session_profiles import apply_profile
+
+SHARDS = DB_SHARDS
+
+
+def shard_for_user(user_id, shard_count):
+    """Номер шарда пользователя; заказы без пользователя хранятся на шарде 0"""
+    return (user_id or 0) % shard_count
+
+def shard_filter_sql(column, shard_index, shard_count):
+    """SQL-условие «строка принадлежит шарду» — то же правило, что shard_for_user"""
+    return f"COALESCE({column}, 0) % {int(shard_count)} = {int(shard_index)}"
+
+def get_shard_connection(endpoint, label=None):
+    return get_connection(label=label or f"shard.{endpoint_name(endpoint)}", endpoint=endpoint)
+
+def _query_shard(endpoint, query, params, label, profile):
+    conn = get_shard_connection(endpoint, label)
+    try:
+        conn.set_session(readonly=True)
+        cursor = conn.cursor()
+        if profile:
+            apply_profile(cursor, profile)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+    finally:
+        conn.close()
+
+def scatter(query, params=None, shards=None, label=None, profile='heavy_report'):
+    """Выполняет запрос на всех шардах параллельно; список строк каждого шарда в порядке shards.
+
+    Частичные агрегаты — полный проход по заказам шарда, поэтому по умолчанию
+    с профилем сессии heavy_report.
+    """
+    shards = SHARDS if shards is None else shards
+    if not shards:
+        raise RuntimeError("Шарды не настроены (DB_SHARDS)")
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard") as executor:
+        futures = [executor.submit(_query_shard, endpoint, query, params, label, profile) for endpoint in shards]
+        return [future.result() for future in futures]
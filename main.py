@@ -1,92 +1,389 @@
-import psycopg2
-from database.init_database import init_database
-from scripts.generate_data import generate_sample_data, verify_data_integrity
-from scripts.create_views import create_analytical_views, refresh_materialized_views, show_view_info
-from reports.weekly_sales_report import show_comprehensive_report
-from database.config import get_connection_string
+"""Командная строка проекта аналитики продаж.
+
+Каждая подкоманда импортирует только то, что ей нужно, поэтому, например,
+`python main.py report weekly` не загружает Faker и не выполняет DDL.
+
+    python main.py init                 # таблицы, представления, первое обновление MV
+    python main.py generate [--force]   # тестовые данные
+    python main.py generate --reload    # новые данные через теневую схему, без простоя
+    python main.py refresh              # обновление материализованных представлений
+    python main.py refresh --daemon     # фоновое обновление по расписанию, согласованное между узлами
+    python main.py live [status]        # живые итоги за сегодня и неделю по уведомлениям о заказах
+    python main.py health               # состояние базы по системному каталогу
+    python main.py report <раздел>      # weekly, monthly, categories, customers, daily, performance, all
+    python main.py report daily --sample-percent 1     # приближенно, по выборке заказов
+    python main.py report weekly --max-staleness 60 --max-error 0.05   # источник по стоимости
+    python main.py segments weekly --by country --by category   # отчеты по всем сегментам в файлы
+    python main.py search products "ноутбук" [--orders 5]   # поиск товаров или клиентов (customers)
+    python main.py archive [--horizon-months 12 | --status]   # закрытые месяцы — в архив
+    python main.py bench [...]          # бенчмарк (аргументы scripts.benchmark)
+    python main.py calibrate            # подбор профилей сессии (work_mem, параллельность, JIT)
+    python main.py all [--regenerate]   # полный конвейер без интерактивных вопросов
+    python main.py --profile-stages all # то же с профилем этапов: база, процессор, память
+"""
+
+import argparse
+import sys
 
 
 def check_existing_data():
     """Проверка на наличие данных в базе"""
+    from database.connection import get_connection
+    from scripts.health import has_rows
+
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM users")
-        users_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM orders")
-        orders_count = cursor.fetchone()[0]
-        
+
+        # EXISTS с OFFSET читает не больше 11 строк вместо подсчета всей таблицы
+        has_data = has_rows(cursor, 'users', more_than=10) and has_rows(cursor, 'orders', more_than=10)
+
         cursor.close()
         conn.close()
-        
-        return users_count > 10 and orders_count > 10
-        
+
+        return has_data
+
     except Exception as e:
         print(f"❌ Ошибка при проверке данных: {e}")
         return False
 
 def clear_existing_data():
     """Очищение всех тестовых данных"""
+    from database.connection import get_connection
+    from scripts.archive import RESET_ARCHIVE_SQL
+
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
-        
+
         clear_sql = """
         DELETE FROM order_items;
         DELETE FROM orders;
         DELETE FROM products;
         DELETE FROM users;
         """
-        
+
         cursor.execute(clear_sql)
+        # Архив относится к старым данным: иначе отчеты сложат его с новыми
+        cursor.execute(RESET_ARCHIVE_SQL)
         conn.commit()
-        
+
         print("✅ Старые данные очищены")
-        
+
         cursor.close()
         conn.close()
-        
+
     except Exception as e:
         print(f"❌ Ошибка при очистке данных: {e}")
 
-def main():
-    print("🚀 ЗАПУСК ПРОЕКТА АНАЛИТИКИ ПРОДАЖ")
-    print("=" * 50)
-    
-    # 1. Создание таблиц
-    init_database()
-    
-    # 2. Интерактивный запрос о генерации тестовых данных
-    has_data = check_existing_data()
-
-    if has_data:
-        print("✅ В базе уже есть данные")
-        regenerate = input("Сгенерировать новые данные? (старые будут удалены) [y/N]: ").strip().lower()
-        if regenerate == 'y':
-            print("🗑️  Очистка старых данных...")
+
+def cmd_init(args):
+    """Создание таблиц и представлений"""
+    from database.init_database import init_database
+    from scripts.create_views import create_analytical_views, refresh_materialized_views
+    from scripts.stage_profiler import profiler
+
+    with profiler.stage('init'):
+        init_database()
+    with profiler.stage('create_views'):
+        create_analytical_views()
+    with profiler.stage('refresh'):
+        refresh_materialized_views()
+
+def cmd_generate(args):
+    """Генерация тестовых данных"""
+    from scripts.generate_data import generate_sample_data, verify_data_integrity
+    from scripts.stage_profiler import profiler
+
+    if getattr(args, 'reload', False):
+        from scripts.reload import reload_dataset
+
+        with profiler.stage('generate'):
+            if not reload_dataset(generate_sample_data):
+                return 1
+        with profiler.stage('verify'):
+            verify_data_integrity()
+        return
+
+    if check_existing_data():
+        if not args.force:
+            print("✅ В базе уже есть данные (используйте --force для пересоздания)")
+            return
+        print("🗑️  Очистка старых данных...")
+        with profiler.stage('clear'):
             clear_existing_data()
-            has_data = False
 
-    if not has_data:
-        print("📝 Генерация тестовых данных...")
+    print("📝 Генерация тестовых данных...")
+    with profiler.stage('generate'):
         generate_sample_data()
+    with profiler.stage('verify'):
         verify_data_integrity()
+
+def cmd_refresh(args):
+    """Обновление материализованных представлений (--daemon — по расписанию, пока не остановят)"""
+    if args.daemon:
+        from scripts.refresh_daemon import main as daemon_main
+
+        return daemon_main(['run'])
+
+    from scripts.create_views import refresh_materialized_views
+    from scripts.stage_profiler import profiler
+
+    with profiler.stage('refresh'):
+        refresh_materialized_views()
+
+def cmd_live(args):
+    """Слушатель живых итогов или его последнее состояние"""
+    from scripts.live_aggregates import main as live_main
+
+    argv = [args.action]
+    if args.reconcile_interval is not None:
+        argv += ['--reconcile-interval', str(args.reconcile_interval)]
+    return live_main(argv)
+
+def cmd_health(args):
+    """Снимок состояния базы без подсчета строк"""
+    from scripts.health import main as health_main
+
+    return health_main(['--json', args.json] if args.json else [])
+
+REPORT_SECTIONS = ['weekly', 'monthly', 'categories', 'customers', 'daily', 'performance', 'all']
+
+def cmd_report(args):
+    """Вывод одного раздела отчета или всего отчета"""
+    from reports import weekly_sales_report as reports
+    from reports.approximate_reports import Sampling
+    from reports.source_router import Requirements
+    from scripts.stage_profiler import profiler
+
+    try:
+        requirements = Requirements(args.max_staleness, args.max_error)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+
+    sampling = None
+    if args.sample_percent is not None or args.target_error is not None:
+        if args.section in ('customers', 'performance'):
+            print(f"⚠️  Раздел {args.section} не имеет приближенного режима, выводится точный отчет")
+        else:
+            try:
+                sampling = Sampling(args.sample_percent, args.target_error, args.sample_method,
+                                    args.seed, args.confidence)
+            except ValueError as e:
+                print(f"❌ {e}")
+                return 2
+
+    sections = {
+        'weekly': lambda: reports.show_weekly_report(weeks_back=args.weeks_back, sampling=sampling,
+                                                     requirements=requirements),
+        'monthly': lambda: reports.show_monthly_report(months_back=args.months_back, sampling=sampling,
+                                                       requirements=requirements),
+        'categories': lambda: reports.show_category_analysis(sampling=sampling, requirements=requirements),
+        'customers': lambda: reports.show_top_customers(limit=args.limit),
+        'daily': lambda: reports.show_daily_sales_trend(days_back=args.days_back, sampling=sampling,
+                                                        requirements=requirements),
+        'performance': reports.performance_comparison,
+        'all': lambda: reports.show_comprehensive_report(sampling=sampling, requirements=requirements),
+    }
+    if args.section == 'all':
+        # Комплексный отчет сам измеряет каждый раздел
+        sections['all']()
     else:
-        print("✅ Используем существующие данные")
-    
+        with profiler.stage(f'report.{args.section}'):
+            sections[args.section]()
+
+def cmd_segments(args):
+    """Недельный или месячный отчет по всем странам, городам и категориям в файлы"""
+    from reports.segmented_reports import DIMENSIONS, SEGMENTS_OUTPUT_DIR, show_segmented_reports
+
+    periods_back = args.weeks_back if args.period == 'weekly' else args.months_back
+    files = show_segmented_reports(args.period, periods_back, tuple(args.by or DIMENSIONS),
+                                   output_dir=args.output or SEGMENTS_OUTPUT_DIR,
+                                   workers=args.workers, partitions=args.partitions)
+    return 0 if files is not None else 1
+
+def cmd_search(args):
+    """Поиск товаров или клиентов с их последними заказами"""
+    from reports.search import show_search
+
+    show_search(args.kind, args.query, limit=args.limit, orders=args.orders)
+
+def cmd_archive(args):
+    """Перенос закрытых месяцев в архив или состояние архива"""
+    from scripts.archive import main as archive_main
+
+    argv = ['--horizon-months', str(args.horizon_months)] if args.horizon_months is not None else []
+    if args.before:
+        argv += ['--before', args.before]
+    if args.output:
+        argv += ['--output', args.output]
+    if args.status:
+        argv.append('--status')
+    return archive_main(argv)
+
+def cmd_bench(args):
+    """Бенчмарк представлений и отчетов"""
+    from scripts.benchmark import main as benchmark_main
+
+    return benchmark_main(args.bench_args)
+
+def cmd_calibrate(args):
+    """Калибровка профилей сессии на текущих данных"""
+    from scripts.calibrate_profiles import main as calibrate_main
+
+    argv = ['--repetitions', str(args.repetitions)]
+    for profile in args.profile or []:
+        argv += ['--profile', profile]
+    return calibrate_main(argv)
+
+def cmd_all(args):
+    """Полный конвейер: таблицы, данные, представления, отчет"""
+    from database.init_database import init_database
+    from scripts.create_views import create_analytical_views, refresh_materialized_views, show_view_info
+    from scripts.stage_profiler import profiler
+    from reports.weekly_sales_report import show_comprehensive_report
+
+    print("🚀 ЗАПУСК ПРОЕКТА АНАЛИТИКИ ПРОДАЖ")
+    print("=" * 50)
+
+    # 1. Создание таблиц
+    with profiler.stage('init'):
+        init_database()
+
+    # 2. Генерация тестовых данных (при --regenerate старые данные удаляются)
+    args.force = args.regenerate
+    cmd_generate(args)
+
     # 3. Создание аналитические представления
-    create_analytical_views()
-    
+    with profiler.stage('create_views'):
+        create_analytical_views()
+
     # 4. Обновление материализованных представлений
-    refresh_materialized_views()
-    
+    with profiler.stage('refresh'):
+        refresh_materialized_views()
+
     # 5. Отображение информации о представлениях
-    show_view_info()
-    
+    with profiler.stage('view_info'):
+        show_view_info()
+
     # 6. Комплексный отчет
     show_comprehensive_report()
 
+
+def build_parser():
+    # Без сокращений: иначе --profile подкоманды calibrate совпадает с --profile-stages
+    parser = argparse.ArgumentParser(description="Аналитика продаж на PostgreSQL", allow_abbrev=False)
+    parser.add_argument('--profile-stages', action='store_true',
+                        help="профиль этапов: время базы и процессора, пик памяти, дампы cProfile")
+    parser.add_argument('--profile-dir', help="каталог профилей этапов (STAGE_PROFILE_DIR)")
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('init', help="создать таблицы и представления").set_defaults(func=cmd_init)
+
+    generate = subparsers.add_parser('generate', help="сгенерировать тестовые данные")
+    generate.add_argument('--force', action='store_true', help="удалить существующие данные")
+    generate.add_argument('--reload', action='store_true',
+                          help="загрузить новые данные в теневую схему и атомарно подменить текущие")
+    generate.set_defaults(func=cmd_generate)
+
+    refresh = subparsers.add_parser('refresh', help="обновить материализованные представления")
+    refresh.add_argument('--daemon', action='store_true',
+                         help="обновлять по расписанию (REFRESH_INTERVAL), согласуясь с другими узлами")
+    refresh.set_defaults(func=cmd_refresh)
+
+    live = subparsers.add_parser('live', help="живые итоги продаж по LISTEN/NOTIFY")
+    live.add_argument('action', choices=['run', 'status'], nargs='?', default='run')
+    live.add_argument('--reconcile-interval', type=float, help="секунд между сверками (LIVE_RECONCILE_INTERVAL)")
+    live.set_defaults(func=cmd_live)
+
+    health = subparsers.add_parser('health', help="состояние таблиц, индексов и MV по каталогу")
+    health.add_argument('--json', help="сохранить снимок в JSON")
+    health.set_defaults(func=cmd_health)
+
+    report = subparsers.add_parser('report', help="показать отчет")
+    report.add_argument('section', choices=REPORT_SECTIONS, nargs='?', default='all')
+    report.add_argument('--weeks-back', type=int, default=8)
+    report.add_argument('--months-back', type=int, default=6)
+    report.add_argument('--days-back', type=int, default=30)
+    report.add_argument('--limit', type=int, default=10)
+    sample = report.add_mutually_exclusive_group()
+    sample.add_argument('--sample-percent', type=float, help="приближенный отчет по выборке заказов, %%")
+    sample.add_argument('--target-error', type=float,
+                        help="приближенный отчет с долей выборки под целевую ошибку выручки (0.02 = ±2%%)")
+    report.add_argument('--sample-method', choices=['bernoulli', 'system'], default='bernoulli')
+    report.add_argument('--seed', type=int, help="воспроизводимая выборка")
+    report.add_argument('--confidence', type=float, default=0.95, help="уровень доверия интервалов")
+    report.add_argument('--max-staleness', type=float,
+                        help="допустимое отставание MV, с: иначе живой запрос или выборка (ROUTER_MAX_STALENESS)")
+    report.add_argument('--max-error', type=float,
+                        help="допустимая ошибка выручки: разрешает выборку, если она дешевле (ROUTER_MAX_ERROR)")
+    report.set_defaults(func=cmd_report)
+
+    segments = subparsers.add_parser('segments', help="отчеты по всем сегментам одним запросом")
+    segments.add_argument('period', choices=['weekly', 'monthly'])
+    segments.add_argument('--by', action='append', choices=['country', 'city', 'category'],
+                          help="сегменты (по умолчанию все)")
+    segments.add_argument('--weeks-back', type=int, default=8)
+    segments.add_argument('--months-back', type=int, default=6)
+    segments.add_argument('--output', help="каталог отчетов (SEGMENTS_OUTPUT_DIR)")
+    segments.add_argument('--workers', type=int, help="процессов отрисовки (по умолчанию по числу ядер)")
+    segments.add_argument('--partitions', type=int, default=1, help="параллельных диапазонов запроса")
+    segments.set_defaults(func=cmd_segments)
+
+    search = subparsers.add_parser('search', help="найти товары или клиентов")
+    search.add_argument('kind', choices=['products', 'customers'])
+    search.add_argument('query', help="начало названия, слова, email или имя клиента")
+    search.add_argument('--limit', type=int, default=20)
+    search.add_argument('--orders', type=int, default=0, help="показать последние N заказов каждого найденного")
+    search.set_defaults(func=cmd_search)
+
+    archive = subparsers.add_parser('archive', help="перенести закрытые месяцы в архив")
+    archive.add_argument('--horizon-months', type=int, help="старше скольких месяцев (ARCHIVE_HORIZON_MONTHS)")
+    archive.add_argument('--before', help="граница архива — начало месяца, ГГГГ-ММ-01")
+    archive.add_argument('--output', help="каталог файлов архива (ARCHIVE_DIR)")
+    archive.add_argument('--status', action='store_true', help="показать границу архива и размеры таблиц")
+    archive.set_defaults(func=cmd_archive)
+
+    bench = subparsers.add_parser('bench', help="бенчмарк (аргументы передаются scripts.benchmark)")
+    bench.set_defaults(func=cmd_bench)
+
+    calibrate = subparsers.add_parser('calibrate', help="подобрать настройки профилей сессии")
+    calibrate.add_argument('--profile', action='append', choices=['refresh', 'heavy_report', 'point_lookup'])
+    calibrate.add_argument('--repetitions', type=int, default=3)
+    calibrate.set_defaults(func=cmd_calibrate)
+
+    everything = subparsers.add_parser('all', help="полный конвейер")
+    everything.add_argument('--regenerate', action='store_true', help="пересоздать тестовые данные")
+    everything.set_defaults(func=cmd_all)
+
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command is None:
+        # Без подкоманды — полный конвейер, как раньше, но без вопросов
+        options = args
+        args, extra = parser.parse_known_args(['all'] + extra)
+        args.profile_stages, args.profile_dir = options.profile_stages, options.profile_dir
+    if args.command == 'bench':
+        args.bench_args = extra
+    elif extra:
+        parser.error(f"неизвестные аргументы: {' '.join(extra)}")
+    if not args.profile_stages:
+        return args.func(args) or 0
+
+    from scripts.stage_profiler import profiler
+
+    profiler.enable(args.profile_dir)
+    try:
+        with profiler.stage(args.command):
+            return args.func(args) or 0
+    finally:
+        profiler.report()
+        profiler.disable()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
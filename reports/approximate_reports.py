@@ -0,0 +1,522 @@
+"""Приближенные отчеты по выборке заказов.
+
+На очень большой истории полный проход по заказам долог, а для решения часто
+достаточно оценки. Здесь те же агрегаты, что у отчетов, считаются по выборке
+заказов (TABLESAMPLE SYSTEM — случайные страницы, или BERNOULLI — случайные
+строки), умножаются на 1/доля и печатаются с доверительным интервалом.
+
+Единица выборки — страница таблицы orders (SYSTEM) или заказ (BERNOULLI).
+Запрос сначала агрегирует строки каждой единицы выборки, а затем по группам
+отчета считает суммы и суммы квадратов этих агрегатов. По ним:
+
+* сумма (выручка, заказы, товары) — оценка Горвица — Томпсона Σy/p с
+  дисперсией (1 - p)/p² · Σy²;
+* среднее (средний чек, средняя цена) — отношение двух сумм с дисперсией по
+  линеаризации: (1 - p)/p² · Σ(y - R·x)² / X̂².
+
+Суммы квадратов складываются, поэтому при настроенных DB_SHARDS выборка
+делается на каждом шарде, а результаты просто суммируются. Число уникальных
+клиентов и товаров по выборке так не масштабируется и в приближенном режиме
+не выводится. Отчет о клиентах приближенного режима не имеет: оценка по
+каждому клиенту бессмысленна.
+
+Закрытые месяцы, перенесенные в архив (scripts.archive), в orders уже нет:
+их итоги из таблиц archive_* прибавляются к оценкам как известные константы
+с нулевой дисперсией — так же, как представления складывают их с живыми
+строками. Интервал при этом отражает только разброс выборки живых заказов.
+
+Долю выборки задает либо пользователь (percent), либо целевая ошибка
+(target_error): тогда сначала делается пробная выборка APPROX_PILOT_PERCENT,
+и по ее худшей группе доля подбирается так, чтобы относительная полуширина
+интервала выручки в каждой группе была не больше target_error.
+"""
+
+import math
+import os
+from datetime import datetime, timedelta
+from statistics import NormalDist
+
+from database.connection import get_connection
+from database.session_profiles import apply_profile
+from database.sharding import SHARDS, scatter
+
+SAMPLE_METHODS = ('system', 'bernoulli')
+APPROX_PILOT_PERCENT = float(os.getenv('APPROX_PILOT_PERCENT', '1'))
+# Группа, в выборку которой попало меньше единиц, печатается с предупреждением:
+# нормальное приближение интервала на ней ненадежно
+MIN_SAMPLE_UNITS = 30
+
+# Единица выборки: номер страницы строки заказа или сам заказ
+SAMPLE_UNITS = {
+    'system': "(o.ctid::text::point)[0]",
+    'bernoulli': "o.id",
+}
+
+# Агрегаты каждой единицы выборки по группам отчета. Столбцы после ключей
+# группы: unit, revenue, orders, items, avg_num, avg_den — числитель и
+# знаменатель среднего. Агрегаты те же, что в определениях представлений.
+WEEKLY_UNITS_SQL = """
+SELECT
+    DATE_TRUNC('week', o.order_date) AS week_start,
+    p.category,
+    {unit} AS unit,
+    SUM(oi.subtotal) AS revenue,
+    COUNT(DISTINCT o.id) AS orders,
+    SUM(oi.quantity) AS items,
+    SUM(oi.subtotal) AS avg_num,
+    COUNT(DISTINCT o.id) AS avg_den
+FROM orders o {sample}
+JOIN order_items oi ON o.id = oi.order_id
+JOIN products p ON oi.product_id = p.id
+WHERE o.order_status = 'completed'
+  AND DATE_TRUNC('week', o.order_date) >= %(since)s
+GROUP BY 1, 2, 3
+"""
+
+MONTHLY_UNITS_SQL = """
+SELECT
+    DATE_TRUNC('month', o.order_date) AS month_start,
+    {unit} AS unit,
+    SUM(o.total_amount) AS revenue,
+    COUNT(DISTINCT o.id) AS orders,
+    SUM(oi.quantity) AS items,
+    SUM(o.total_amount) AS avg_num,
+    COUNT(*) AS avg_den
+FROM orders o {sample}
+JOIN order_items oi ON o.id = oi.order_id
+WHERE o.order_status = 'completed'
+  AND DATE_TRUNC('month', o.order_date) >= %(since)s
+GROUP BY 1, 2
+"""
+
+CATEGORY_UNITS_SQL = """
+SELECT
+    p.category,
+    {unit} AS unit,
+    SUM(oi.subtotal) AS revenue,
+    COUNT(DISTINCT o.id) AS orders,
+    SUM(oi.quantity) AS items,
+    SUM(p.price) AS avg_num,
+    COUNT(*) AS avg_den
+FROM orders o {sample}
+JOIN order_items oi ON oi.order_id = o.id
+JOIN products p ON p.id = oi.product_id
+WHERE o.order_status = 'completed'
+GROUP BY 1, 2
+"""
+
+DAILY_UNITS_SQL = """
+SELECT
+    DATE(o.order_date) AS sale_date,
+    {unit} AS unit,
+    SUM(o.total_amount) AS revenue,
+    COUNT(*) AS orders,
+    NULL::numeric AS items,
+    SUM(o.total_amount) AS avg_num,
+    COUNT(*) AS avg_den
+FROM orders o {sample}
+WHERE o.order_status = 'completed'
+  AND o.order_date >= %(since)s
+GROUP BY 1, 2
+"""
+
+# Итоги архива по группам отчета: те же столбцы, что у единиц выборки, без
+# unit. Фильтры по since — как у отчетов по представлениям. На шардах архив
+# разложен так, что итоги шардов складываются (scripts.sharding)
+WEEKLY_ARCHIVED_SQL = """
+SELECT week_start, category, revenue, orders, items, revenue AS avg_num, orders AS avg_den
+FROM archive_weekly_sales
+WHERE week_start >= %(since)s
+UNION ALL
+SELECT week_start, category, SUM(subtotal), COUNT(DISTINCT order_id), SUM(quantity),
+       SUM(subtotal), COUNT(DISTINCT order_id)
+FROM archive_boundary_items
+WHERE week_start >= %(since)s
+GROUP BY 1, 2
+"""
+
+MONTHLY_ARCHIVED_SQL = """
+SELECT month_start, revenue, orders, items, revenue AS avg_num, joined_rows AS avg_den
+FROM archive_monthly_sales
+WHERE month_start >= %(since)s
+"""
+
+CATEGORY_ARCHIVED_SQL = """
+SELECT category, SUM(revenue) AS revenue, SUM(orders) AS orders, SUM(items) AS items,
+       SUM(price_sum) AS avg_num, SUM(joined_rows) AS avg_den
+FROM archive_category_sales
+GROUP BY 1
+"""
+
+DAILY_ARCHIVED_SQL = """
+SELECT sale_date, revenue, orders, NULL::numeric AS items, revenue AS avg_num, orders AS avg_den
+FROM archive_daily_sales
+WHERE sale_date >= %(since)s
+"""
+
+# Суммы и суммы квадратов по группам отчета и (is_total) по всему отчету,
+# затем известные итоги архива (у строк выборки их нет, у строк архива
+# нет единиц выборки). Итог считается по единицам выборки отдельно: одна
+# страница может содержать заказы разных групп, и квадраты ее вкладов в группы
+# не дают квадрат ее итога.
+MOMENTS_SQL = """
+WITH units AS MATERIALIZED ({units}),
+unit_totals AS (
+    SELECT unit, SUM(revenue) AS revenue, SUM(orders) AS orders, SUM(items) AS items,
+           SUM(avg_num) AS avg_num, SUM(avg_den) AS avg_den
+    FROM units
+    GROUP BY unit
+),
+archived AS ({archived})
+SELECT false AS is_total, {keys}, {moments}, {no_known}
+FROM units
+GROUP BY {keys}
+UNION ALL
+SELECT true, {null_keys}, {moments}, {no_known}
+FROM unit_totals
+UNION ALL
+SELECT false, {keys}, {no_moments}, {known}
+FROM archived
+GROUP BY {keys}
+UNION ALL
+SELECT true, {null_keys}, {no_moments}, {known}
+FROM archived
+"""
+
+MOMENTS = """COUNT(*),
+    SUM(revenue), SUM(revenue * revenue),
+    SUM(orders), SUM(orders * orders),
+    SUM(items), SUM(items * items),
+    SUM(avg_num), SUM(avg_num * avg_num), SUM(avg_den), SUM(avg_den * avg_den), SUM(avg_num * avg_den)"""
+NO_MOMENTS = "0::bigint, " + ", ".join(["NULL::numeric"] * 11)
+
+KNOWN = "SUM(revenue), SUM(orders), SUM(items), SUM(avg_num), SUM(avg_den)"
+NO_KNOWN = ", ".join(["NULL::numeric"] * 5)
+
+# Отчет -> (агрегаты единиц выборки, итоги архива, ключи группы)
+APPROXIMATE_REPORTS = {
+    'weekly': (WEEKLY_UNITS_SQL, WEEKLY_ARCHIVED_SQL, ('week_start', 'category')),
+    'monthly': (MONTHLY_UNITS_SQL, MONTHLY_ARCHIVED_SQL, ('month_start',)),
+    'categories': (CATEGORY_UNITS_SQL, CATEGORY_ARCHIVED_SQL, ('category',)),
+    'daily': (DAILY_UNITS_SQL, DAILY_ARCHIVED_SQL, ('sale_date',)),
+}
+
+
+class Sampling:
+    """Параметры приближенного режима.
+
+    percent — доля выборки в процентах (0, 100]; target_error — целевая
+    относительная полуширина интервала выручки (0.05 = ±5%), если доля не
+    задана; method — 'bernoulli' (по умолчанию) или 'system'; seed — для воспроизводимой
+    выборки (REPEATABLE); confidence — уровень доверия интервалов.
+    """
+
+    __slots__ = ('percent', 'target_error', 'method', 'seed', 'confidence')
+
+    def __init__(self, percent=None, target_error=None, method='bernoulli', seed=None, confidence=0.95):
+        if (percent is None) == (target_error is None):
+            raise ValueError("Нужно задать либо долю выборки, либо целевую ошибку")
+        if percent is not None and not 0 < percent <= 100:
+            raise ValueError(f"Доля выборки {percent} должна быть в (0, 100]")
+        if target_error is not None and not 0 < target_error < 1:
+            raise ValueError(f"Целевая ошибка {target_error} должна быть в (0, 1)")
+        if method not in SAMPLE_METHODS:
+            raise ValueError(f"Неизвестный метод выборки {method!r}, допустимы: {', '.join(SAMPLE_METHODS)}")
+        if not 0 < confidence < 1:
+            raise ValueError(f"Уровень доверия {confidence} должен быть в (0, 1)")
+        self.percent = percent
+        self.target_error = target_error
+        self.method = method
+        self.seed = seed
+        self.confidence = confidence
+
+    @property
+    def z(self):
+        return NormalDist().inv_cdf((1 + self.confidence) / 2)
+
+    def describe(self, percent):
+        return f"{self.method.upper()} {percent:.3g}%, интервалы {self.confidence:.0%}"
+
+
+class Estimate:
+    """Оценка и полуширина доверительного интервала"""
+
+    __slots__ = ('value', 'margin')
+
+    def __init__(self, value, margin):
+        self.value = value
+        self.margin = margin
+
+    @property
+    def relative(self):
+        """Полуширина интервала относительно оценки"""
+        return self.margin / abs(self.value) if self.value else math.inf
+
+    def __repr__(self):
+        return f"Estimate({self.value!r} ± {self.margin!r})"
+
+
+class ApproximateRow:
+    """Оценки одной группы отчета (key is None — весь отчет)"""
+
+    __slots__ = ('key', 'units', 'revenue', 'orders', 'items', 'average')
+
+    def __init__(self, key, units, revenue, orders, items, average):
+        self.key = key
+        self.units = units
+        self.revenue = revenue
+        self.orders = orders
+        self.items = items
+        self.average = average
+
+
+def estimate_total(sum_y, sum_y2, fraction, z, known=None):
+    """Оценка суммы по Σy и Σy² единиц выборки с вероятностью включения fraction
+    плюс известная без ошибки часть known (итог архива)"""
+    if sum_y is None and known is None:
+        return None
+    variance = (1 - fraction) / fraction ** 2 * (sum_y2 or 0.0)
+    return Estimate((sum_y or 0.0) / fraction + (known or 0.0), z * math.sqrt(max(variance, 0.0)))
+
+def estimate_ratio(sum_n, sum_n2, sum_d, sum_d2, sum_nd, fraction, z, known_n=None, known_d=None):
+    """Оценка отношения сумм (N̂ + known_n)/(D̂ + known_d) (среднего) с дисперсией
+    по линеаризации; известные части дисперсии не добавляют"""
+    sum_n, sum_n2, sum_d, sum_d2, sum_nd = (value or 0.0 for value in (sum_n, sum_n2, sum_d, sum_d2, sum_nd))
+    denominator = sum_d / fraction + (known_d or 0.0)
+    if not denominator:
+        return None
+    ratio = (sum_n / fraction + (known_n or 0.0)) / denominator
+    residuals = sum_n2 - 2 * ratio * sum_nd + ratio ** 2 * sum_d2
+    variance = (1 - fraction) / fraction ** 2 * residuals / denominator ** 2
+    return Estimate(ratio, z * math.sqrt(max(variance, 0.0)))
+
+def moments_query(report, method, seed=None):
+    """SQL сумм и сумм квадратов для отчета report при выборке method"""
+    units_sql, archived_sql, keys = APPROXIMATE_REPORTS[report]
+    if method not in SAMPLE_METHODS:
+        raise ValueError(f"Неизвестный метод выборки {method!r}")
+    sample = f"TABLESAMPLE {method.upper()} (%(percent)s)"
+    if seed is not None:
+        sample += " REPEATABLE (%(seed)s)"
+    units = units_sql.format(unit=SAMPLE_UNITS[method], sample=sample)
+    return MOMENTS_SQL.format(units=units, archived=archived_sql, keys=", ".join(keys),
+                              null_keys=", ".join("NULL" for _ in keys), moments=MOMENTS,
+                              no_moments=NO_MOMENTS, known=KNOWN, no_known=NO_KNOWN)
+
+def _sample_moments(cursor, report, percent, sampling, params, shards):
+    """{(is_total, *ключи): суммы} — со всех шардов, если они переданы"""
+    query = moments_query(report, sampling.method, sampling.seed)
+    params = dict(params, percent=percent, seed=sampling.seed)
+    if shards:
+        partials = scatter(query, params, shards, label=f"approximate.{report}")
+    else:
+        apply_profile(cursor, 'heavy_report')
+        cursor.execute(query, params)
+        partials = [cursor.fetchall()]
+
+    key_size = 1 + len(APPROXIMATE_REPORTS[report][2])
+    merged = {}
+    for rows in partials:
+        for row in rows:
+            key = tuple(row[:key_size])
+            values = [float(value) if value is not None else None for value in row[key_size:]]
+            if key in merged:
+                # NULL — сумма по пустой выборке шарда или группе без архива;
+                # строки выборки и архива одной группы складываются здесь же
+                values = [b if a is None else a if b is None else a + b for a, b in zip(merged[key], values)]
+            merged[key] = values
+    return merged
+
+def _estimate_rows(moments, percent, sampling):
+    """([ApproximateRow] по группам, ApproximateRow всего отчета или None)"""
+    fraction, z = percent / 100, sampling.z
+    rows, total = [], None
+    for (is_total, *key), values in moments.items():
+        (units, revenue, revenue2, orders, orders2, items, items2, num, num2, den, den2, num_den,
+         known_revenue, known_orders, known_items, known_num, known_den) = values
+        row = ApproximateRow(
+            None if is_total else tuple(key),
+            int(units),
+            estimate_total(revenue, revenue2, fraction, z, known_revenue),
+            estimate_total(orders, orders2, fraction, z, known_orders),
+            estimate_total(items, items2, fraction, z, known_items),
+            estimate_ratio(num, num2, den, den2, num_den, fraction, z, known_num, known_den),
+        )
+        if row.units == 1 and row.average is not None and fraction < 1:
+            # По одной единице выборки разброс отношения не оценить
+            row.average.margin = math.inf
+        if is_total:
+            total = row
+        else:
+            rows.append(row)
+    return rows, total
+
+def choose_percent(pilot_rows, pilot_percent, target_error):
+    """Доля выборки (в процентах), при которой худшая группа пробной выборки уложится в target_error.
+
+    Дисперсия оценки суммы пропорциональна (1 - p)/p, поэтому
+    (1 - p)/p = (target/e₀)² · (1 - p₀)/p₀. Если уже пробная выборка
+    достаточно точна, возвращается pilot_percent.
+    """
+    errors = [row.revenue.relative for row in pilot_rows if row.revenue is not None and row.revenue.value > 0]
+    if not errors:
+        # Пробная выборка пуста: данных мало, их проще прочитать целиком
+        return 100.0
+    worst = max(errors)
+    if worst <= target_error:
+        return pilot_percent
+    pilot_fraction = pilot_percent / 100
+    odds = (target_error / worst) ** 2 * (1 - pilot_fraction) / pilot_fraction
+    return min(100.0, 100 / (1 + odds))
+
+def fetch_approximate(cursor, report, sampling, shards=None, **params):
+    """(доля выборки в процентах, [ApproximateRow], ApproximateRow всего отчета)
+
+    params — параметры запроса отчета (since для weekly, monthly и daily).
+    При target_error сначала выполняется пробная выборка APPROX_PILOT_PERCENT.
+    """
+    percent = sampling.percent
+    if percent is None:
+        pilot_percent = min(APPROX_PILOT_PERCENT, 100.0)
+        pilot_rows, pilot_total = _estimate_rows(
+            _sample_moments(cursor, report, pilot_percent, sampling, params, shards), pilot_percent, sampling)
+        percent = choose_percent(pilot_rows, pilot_percent, sampling.target_error)
+        if percent == pilot_percent:
+            return percent, pilot_rows, pilot_total
+    rows, total = _estimate_rows(_sample_moments(cursor, report, percent, sampling, params, shards),
+                                 percent, sampling)
+    return percent, rows, total
+
+
+def _money(estimate, width=10):
+    if estimate is None:
+        return "—"
+    if math.isinf(estimate.margin):
+        return f"${estimate.value:>{width},.2f} ± ?"
+    return f"${estimate.value:>{width},.2f} ± {estimate.margin:,.2f} (±{estimate.relative:.1%})"
+
+def _count(estimate):
+    if estimate is None:
+        return "—"
+    return f"~{estimate.value:,.0f} ± {estimate.margin:,.0f}"
+
+def _sparse(row):
+    # Группа только из архива (или прочитанная целиком) известна точно
+    exact = row.revenue is not None and row.revenue.margin == 0
+    return f" ⚠️ в выборке {row.units} ед." if row.units < MIN_SAMPLE_UNITS and not exact else ""
+
+def _run(report, sampling, **params):
+    """Выполняет приближенный отчет на своем соединении (или на шардах)"""
+    if SHARDS:
+        return fetch_approximate(None, report, sampling, shards=SHARDS, **params)
+    conn = get_connection(replica=True)
+    try:
+        return fetch_approximate(conn.cursor(), report, sampling, **params)
+    finally:
+        conn.close()
+
+def show_weekly_report(weeks_back=8, sampling=None):
+    """Приближенный недельный отчет по выборке заказов"""
+    try:
+        cutoff_date = datetime.now() - timedelta(weeks=weeks_back)
+        percent, rows, total = _run('weekly', sampling, since=cutoff_date)
+
+        print(f"📊 НЕДЕЛЬНЫЙ ОТЧЕТ ПО ПРОДАЖАМ (≈ по выборке {sampling.describe(percent)})")
+        print("=" * 90)
+
+        if not rows:
+            print("❌ Нет данных для отображения")
+            return
+
+        rows.sort(key=lambda row: row.revenue.value, reverse=True)
+        rows.sort(key=lambda row: row.key[0], reverse=True)
+        for row in rows:
+            print(f"\n🗓️  Неделя с: {row.key[0].strftime('%Y-%m-%d')}{_sparse(row)}")
+            print(f"   🏷️  Категория: {row.key[1]}")
+            print(f"   📦 Заказов в категории: {_count(row.orders)} | 🛒 Товаров: {_count(row.items)}")
+            print(f"   💰 Выручка в категории: {_money(row.revenue)}")
+            print(f"   📊 Средний чек в категории: {_money(row.average, 8)}")
+
+        print("\n" + "=" * 90)
+        print("📈 СВОДНАЯ СТАТИСТИКА:")
+        print(f"   📦 Всего заказов по категориям: {_count(total.orders)}")
+        print(f"   💰 Общая выручка по категориям: {_money(total.revenue, 12)}")
+        print(f"   📦 Всего товаров продано по категориям: {_count(total.items)}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при генерации приближенного отчета: {e}")
+
+def show_monthly_report(months_back=6, sampling=None):
+    """Приближенный месячный отчет по выборке заказов"""
+    try:
+        cutoff_date = datetime.now() - timedelta(days=months_back*30)
+        percent, rows, total = _run('monthly', sampling, since=cutoff_date)
+
+        print(f"\n📅 МЕСЯЧНЫЙ ОТЧЕТ ПО ПРОДАЖАМ (≈ по выборке {sampling.describe(percent)})")
+        print("=" * 80)
+
+        if not rows:
+            print("❌ Нет данных для отображения")
+            return
+
+        rows.sort(key=lambda row: row.key[0], reverse=True)
+        for row in rows:
+            print(f"\n📅 {row.key[0].strftime('%B %Y')}:{_sparse(row)}")
+            print(f"   📦 Заказов: {_count(row.orders)} | 🛒 Товаров продано: {_count(row.items)}")
+            print(f"   💰 Выручка: {_money(row.revenue, 12)}")
+            print(f"   📊 Средний чек: {_money(row.average, 8)}")
+
+        print(f"\n💰 ВЫРУЧКА ЗА ПЕРИОД: {_money(total.revenue, 12)}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при генерации приближенного месячного отчета: {e}")
+
+def show_category_analysis(sampling=None):
+    """Приближенный анализ продаж по категориям по выборке заказов"""
+    try:
+        percent, rows, total = _run('categories', sampling)
+
+        print(f"\n🏷️  АНАЛИЗ ПРОДАЖ ПО КАТЕГОРИЯМ (≈ по выборке {sampling.describe(percent)})")
+        print("=" * 90)
+
+        if not rows:
+            print("❌ Нет данных для отображения")
+            return
+
+        rows.sort(key=lambda row: row.revenue.value, reverse=True)
+        for row in rows:
+            share = row.revenue.value / total.revenue.value * 100
+            print(f"\n📁 {row.key[0]:>15}:{_sparse(row)}")
+            print(f"   💰 Выручка: {_money(row.revenue)} (≈{share:.1f}% от общей)")
+            print(f"   📦 Заказов: {_count(row.orders)} | 🛒 Товаров: {_count(row.items)}")
+            print(f"   💵 Средняя цена: {_money(row.average, 7)}")
+
+        print(f"\n💰 ОБЩАЯ ВЫРУЧКА ПО ВСЕМ КАТЕГОРИЯМ: {_money(total.revenue, 12)}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при приближенном анализе категорий: {e}")
+
+def show_daily_sales_trend(days_back=30, sampling=None):
+    """Приближенный тренд ежедневных продаж по выборке заказов"""
+    try:
+        cutoff_date = datetime.now() - timedelta(days=days_back)
+        percent, rows, total = _run('daily', sampling, since=cutoff_date)
+
+        print(f"\n📈 ТРЕНД ЕЖЕДНЕВНЫХ ПРОДАЖ (последние {days_back} дней, ≈ по выборке {sampling.describe(percent)})")
+        print("=" * 80)
+
+        if not rows:
+            print("❌ Нет данных для отображения")
+            return
+
+        rows.sort(key=lambda row: row.key[0], reverse=True)
+        for row in rows[:10]:
+            print(f"   📅 {row.key[0].strftime('%Y-%m-%d')}: {_money(row.revenue, 8)} | "
+                  f"{_count(row.orders)} заказов | чек {_money(row.average, 6)}{_sparse(row)}")
+
+        print(f"\n📊 СТАТИСТИКА ЗА {days_back} ДНЕЙ:")
+        print(f"   💰 Общая выручка: {_money(total.revenue, 12)}")
+        print(f"   📦 Заказов: {_count(total.orders)} | 📊 Средний чек: {_money(total.average, 8)}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при приближенном анализе ежедневных продаж: {e}")
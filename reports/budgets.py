@@ -0,0 +1,266 @@
+"""Бюджеты времени отчетов и откат на сохраненный результат.
+
+Без ограничений один медленный раздел держит весь комплексный отчет, а под
+нагрузкой запросы копятся на сервере: клиент уже не ждет ответа, а процесс
+базы продолжает считать. Здесь у каждого отчета есть бюджет времени:
+
+- SET LOCAL statement_timeout — сервер сам отменяет запрос, даже если клиент
+  пропал;
+- таймер клиента отменяет запрос (conn.cancel()) по истечении бюджета на все
+  запросы отчета вместе, а не на каждый по отдельности.
+
+Успешный результат сохраняется (в памяти процесса и в REPORT_CACHE_DIR), и при
+превышении бюджета отчет показывает последний сохраненный результат с пометкой
+об устаревании. После превышения бюджета отчет REPORT_BUDGET_COOLDOWN секунд
+отдается из сохраненного результата без запросов: перегруженная база не
+получает новых тяжелых запросов того же отчета. Таймауты и откаты считаются в
+метриках report_budget.<отчет>.timeouts / .fallbacks.
+
+Бюджеты по умолчанию — DEFAULT_BUDGETS_MS, переопределяются в REPORT_BUDGETS:
+"category_analysis=2000,performance=5000"; для остальных — REPORT_BUDGET_MS.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import psycopg2.errors
+
+from database.instrumentation import metrics
+from reports.records import Record
+
+REPORT_BUDGET_MS = int(os.getenv('REPORT_BUDGET_MS', '5000'))
+REPORT_CACHE_DIR = os.getenv('REPORT_CACHE_DIR', 'report_cache')
+REPORT_BUDGET_COOLDOWN = float(os.getenv('REPORT_BUDGET_COOLDOWN', '30'))
+
+DEFAULT_BUDGETS_MS = {
+    # Выборки из MV по индексу
+    'weekly_report': 2000,
+    'weekly_summary': 2000,
+    'monthly_report': 2000,
+    'monthly_growth': 2000,
+    # Живые представления поверх базовых таблиц
+    'category_analysis': 10000,
+    'top_customers': 10000,
+    'daily_sales': 10000,
+    # EXPLAIN ANALYZE запроса недельного отчета к базовым таблицам
+    'performance': 15000,
+}
+
+
+def _parse_budgets(text):
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    for item in text.split(','):
+        if item.strip():
+            name, _, value = item.partition('=')
+            budgets[name.strip()] = int(value)
+    return budgets
+
+REPORT_BUDGETS = _parse_budgets(os.getenv('REPORT_BUDGETS', ''))
+
+
+def budget_for(name):
+    """Бюджет отчета name, мс"""
+    return REPORT_BUDGETS.get(name, REPORT_BUDGET_MS)
+
+
+class ReportTimeout(Exception):
+    """Отчет не уложился в бюджет, а сохраненного результата нет"""
+
+    def __init__(self, name, budget_ms):
+        super().__init__(f"Отчет {name} не уложился в {budget_ms} мс, сохраненного результата нет")
+        self.name = name
+        self.budget_ms = budget_ms
+
+
+class Stale:
+    """Пометка результата, взятого из сохраненного вместо выполнения запроса"""
+
+    __slots__ = ('name', 'cached_at', 'reason')
+
+    def __init__(self, name, cached_at, reason):
+        self.name = name
+        self.cached_at = cached_at
+        self.reason = reason
+
+    def to_dict(self):
+        return {'cached_at': self.cached_at.isoformat(timespec='seconds'), 'reason': self.reason}
+
+    def describe(self):
+        return f"⚠️  Данные устарели ({self.reason}): показан результат от {self.cached_at:%Y-%m-%d %H:%M:%S}"
+
+
+# Результаты хранятся в JSON: Decimal, даты, кортежи и компактные строки
+# отчетов (reports.records) помечаются, чтобы вернуться теми же типами
+RECORD_TYPES = {cls.__name__: cls for cls in Record.__subclasses__()}
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, Record):
+        return {'__record__': type(value).__name__, 'values': [_encode(getattr(value, name))
+                                                             for name in value.__slots__]}
+    return value
+
+def _decode(obj):
+    if '__decimal__' in obj:
+        return Decimal(obj['__decimal__'])
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    if '__tuple__' in obj:
+        return tuple(obj['__tuple__'])
+    if '__record__' in obj:
+        return RECORD_TYPES[obj['__record__']](*obj['values'])
+    return obj
+
+
+class ReportCache:
+    """Последние успешные результаты отчетов: в памяти процесса и в файлах каталога directory"""
+
+    def __init__(self, directory=None):
+        self.directory = REPORT_CACHE_DIR if directory is None else directory
+        self._lock = threading.Lock()
+        self._results = {}
+        self._cooldown = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, re.sub(r'[^\w.-]+', '_', key) + '.json')
+
+    def put(self, key, value):
+        cached_at = datetime.now()
+        with self._lock:
+            self._results[key] = (value, cached_at)
+        if not self.directory:
+            return
+        # Сохраненный результат нужен и следующему запуску; ошибка записи не роняет отчет
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'cached_at': cached_at.isoformat(), 'value': _encode(value)}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  Не удалось сохранить результат отчета {key}: {e}")
+
+    def get(self, key):
+        """(результат, время сохранения) или None"""
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                data = json.load(f, object_hook=_decode)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        entry = (data['value'], datetime.fromisoformat(data['cached_at']))
+        with self._lock:
+            self._results.setdefault(key, entry)
+        return entry
+
+    def open_circuit(self, name, seconds):
+        """Отчет name следующие seconds секунд отдается из сохраненного результата"""
+        with self._lock:
+            self._cooldown[name] = time.monotonic() + seconds
+
+    def close_circuit(self, name):
+        with self._lock:
+            self._cooldown.pop(name, None)
+
+    def circuit_open(self, name):
+        with self._lock:
+            return time.monotonic() < self._cooldown.get(name, 0)
+
+
+cache = ReportCache()
+
+
+def cache_key(name, args):
+    return "_".join([name] + [str(arg) for arg in args])
+
+def _fallback(name, key, reason, budget_ms, report_cache):
+    cached = report_cache.get(key)
+    if cached is None:
+        raise ReportTimeout(name, budget_ms)
+    metrics.increment(f"report_budget.{name}.fallbacks")
+    return cached[0], Stale(name, cached[1], reason)
+
+def run_budgeted(conn, name, fetch, *args, key=None, budget_ms=None, report_cache=None, store=True):
+    """Выполняет fetch(cursor, *args) в пределах бюджета отчета name.
+
+    Возвращает (результат, None) или, если бюджет превышен, (сохраненный
+    результат, Stale). Без сохраненного результата — ReportTimeout; store=False
+    (выборки с неограниченным набором параметров, например поиск) только
+    ограничивает время и ничего не сохраняет. Соединение
+    не должно быть в autocommit (statement_timeout ставится через SET LOCAL);
+    после превышения бюджета транзакция откатывается.
+    """
+    report_cache = cache if report_cache is None else report_cache
+    budget_ms = budget_for(name) if budget_ms is None else budget_ms
+    key = key or cache_key(name, args)
+
+    if store and report_cache.circuit_open(name) and report_cache.get(key) is not None:
+        return _fallback(name, key, "отчет недавно не уложился в бюджет", budget_ms, report_cache)
+
+    cursor = conn.cursor()
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def cancel():
+        # Под той же блокировкой, что и отметка о завершении: отмена не попадет в следующий запрос
+        with lock:
+            if not done.is_set():
+                conn.cancel()
+
+    timer = threading.Timer(budget_ms / 1000, cancel)
+    timer.daemon = True
+    try:
+        cursor.execute("SET LOCAL statement_timeout = %s", [f"{budget_ms}ms"])
+        timer.start()
+        try:
+            value = fetch(cursor, *args)
+        finally:
+            with lock:
+                done.set()
+            timer.cancel()
+    except psycopg2.errors.QueryCanceled:
+        conn.rollback()
+        metrics.increment(f"report_budget.{name}.timeouts")
+        if not store:
+            raise ReportTimeout(name, budget_ms)
+        report_cache.open_circuit(name, REPORT_BUDGET_COOLDOWN)
+        return _fallback(name, key, f"превышен бюджет {budget_ms} мс", budget_ms, report_cache)
+    finally:
+        cursor.close()
+
+    if store:
+        report_cache.put(key, value)
+    return value, None
+
+def budget_counters():
+    """{отчет: {'timeouts': n, 'fallbacks': n}} по метрикам процесса"""
+    counters = {}
+    for name, value in metrics.snapshot()['counters'].items():
+        prefix, _, rest = name.partition('.')
+        if prefix == 'report_budget':
+            report, _, kind = rest.rpartition('.')
+            counters.setdefault(report, {'timeouts': 0, 'fallbacks': 0})[kind] = value
+    return counters
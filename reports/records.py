@@ -0,0 +1,82 @@
+"""Компактные строки отчетов.
+
+Строка хранится в __slots__ объекта, а не в кортеже Decimal: денежные поля —
+целые копейки (database.money), доли процента — целые сотые. Такие строки
+занимают примерно вдвое меньше памяти, суммируются и сравниваются как int,
+а в строку превращаются только при выводе.
+"""
+
+from database.money import to_hundredths
+
+
+class Record:
+    """Базовый класс: поля — __slots__ в порядке столбцов запроса"""
+
+    __slots__ = ()
+    # Поля в целых сотых
+    HUNDREDTHS = ()
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Строки курсора с register_cents: поля в сотых уже int"""
+        return [cls(*row) for row in rows]
+
+    @classmethod
+    def from_decimal_rows(cls, rows):
+        """Строки с Decimal (обычный курсор, слияние шардов): поля в сотых переводятся в int"""
+        positions = [cls.__slots__.index(name) for name in cls.HUNDREDTHS]
+        records = []
+        for row in rows:
+            values = list(row)
+            for position in positions:
+                values[position] = to_hundredths(values[position])
+            records.append(cls(*values))
+        return records
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class CategoryRecord(Record):
+    __slots__ = ('category', 'orders_count', 'items_sold', 'revenue', 'avg_price',
+                 'unique_customers', 'revenue_share')
+    HUNDREDTHS = ('revenue', 'avg_price', 'revenue_share')
+
+    def __init__(self, category, orders_count, items_sold, revenue, avg_price, unique_customers, revenue_share):
+        self.category = category
+        self.orders_count = orders_count
+        self.items_sold = items_sold
+        self.revenue = revenue
+        self.avg_price = avg_price
+        self.unique_customers = unique_customers
+        self.revenue_share = revenue_share
+
+
+class DailySalesRecord(Record):
+    __slots__ = ('sale_date', 'orders_count', 'revenue', 'avg_order_value', 'unique_customers')
+    HUNDREDTHS = ('revenue', 'avg_order_value')
+
+    def __init__(self, sale_date, orders_count, revenue, avg_order_value, unique_customers):
+        self.sale_date = sale_date
+        self.orders_count = orders_count
+        self.revenue = revenue
+        self.avg_order_value = avg_order_value
+        self.unique_customers = unique_customers
+
+
+class CustomerRecord(Record):
+    __slots__ = ('customer_name', 'email', 'city', 'country', 'total_orders', 'total_spent',
+                 'avg_order_value', 'last_order_date')
+    HUNDREDTHS = ('total_spent', 'avg_order_value')
+
+    def __init__(self, customer_name, email, city, country, total_orders, total_spent,
+                 avg_order_value, last_order_date):
+        self.customer_name = customer_name
+        self.email = email
+        self.city = city
+        self.country = country
+        self.total_orders = total_orders
+        self.total_spent = total_spent
+        self.avg_order_value = avg_order_value
+        self.last_order_date = last_order_date
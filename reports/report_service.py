@@ -0,0 +1,416 @@
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import urlsplit, parse_qs
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from database.config import get_connection_string
+from database.instrumentation import InstrumentedConnection
+from database.routing import router, endpoint_name
+from reports.budgets import run_budgeted, cache_key, ReportTimeout
+from reports.weekly_sales_report import (
+    fetch_weekly_report,
+    fetch_weekly_summary,
+    fetch_monthly_report,
+    fetch_monthly_growth,
+    fetch_category_analysis,
+    fetch_top_customers,
+    fetch_daily_sales,
+)
+from reports.search import (
+    MAX_QUERY_LENGTH,
+    search_products,
+    search_customers,
+    fetch_product_orders,
+    fetch_customer_orders,
+)
+
+
+def _rows_to_dicts(cursor, rows):
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def _weekly(cursor, weeks_back):
+    rows = _rows_to_dicts(cursor, fetch_weekly_report(cursor, weeks_back))
+    summary = fetch_weekly_summary(cursor, weeks_back)
+    return {"rows": rows, "summary": _rows_to_dicts(cursor, [summary])[0]}
+
+def _monthly(cursor, months_back):
+    rows = _rows_to_dicts(cursor, fetch_monthly_report(cursor, months_back))
+    growth = _rows_to_dicts(cursor, fetch_monthly_growth(cursor, months_back))
+    return {"rows": rows, "growth": growth}
+
+def _categories(cursor):
+    return {"rows": _rows_to_dicts(cursor, fetch_category_analysis(cursor))}
+
+def _top_customers(cursor, limit):
+    return {"rows": _rows_to_dicts(cursor, fetch_top_customers(cursor, limit))}
+
+def _daily(cursor, days_back):
+    return {"rows": _rows_to_dicts(cursor, fetch_daily_sales(cursor, days_back))}
+
+def _search_products(cursor, q, limit):
+    return {"rows": _rows_to_dicts(cursor, search_products(cursor, q, limit))}
+
+def _search_customers(cursor, q, limit):
+    return {"rows": _rows_to_dicts(cursor, search_customers(cursor, q, limit))}
+
+def _product_orders(cursor, id, limit):
+    return {"rows": _rows_to_dicts(cursor, fetch_product_orders(cursor, id, limit))}
+
+def _customer_orders(cursor, id, limit):
+    return {"rows": _rows_to_dicts(cursor, fetch_customer_orders(cursor, id, limit))}
+
+
+# Эндпоинт -> (функция выборки, {параметр: (по умолчанию, минимум, максимум)});
+# для строковых параметров (по умолчанию строка) минимум и максимум — границы длины
+ENDPOINTS = {
+    "/weekly": (_weekly, {"weeks_back": (8, 1, 520)}),
+    "/monthly": (_monthly, {"months_back": (6, 1, 120)}),
+    "/categories": (_categories, {}),
+    "/top-customers": (_top_customers, {"limit": (10, 1, 1000)}),
+    "/daily": (_daily, {"days_back": (30, 1, 3650)}),
+    "/search/products": (_search_products, {"q": ("", 1, MAX_QUERY_LENGTH), "limit": (20, 1, 100)}),
+    "/search/customers": (_search_customers, {"q": ("", 1, MAX_QUERY_LENGTH), "limit": (20, 1, 100)}),
+    "/products/orders": (_product_orders, {"id": (0, 1, 2**31 - 1), "limit": (10, 1, 100)}),
+    "/customers/orders": (_customer_orders, {"id": (0, 1, 2**31 - 1), "limit": (10, 1, 100)}),
+}
+
+
+# Отчеты, последний результат которых отдается при превышении бюджета времени;
+# поиск и заказы по id только ограничены бюджетом (значений параметров слишком много)
+CACHED_ENDPOINTS = {"/weekly", "/monthly", "/categories", "/top-customers", "/daily"}
+
+
+class _QueryCancel:
+    """Отмена запроса, выполняемого в потоке пула, из цикла событий.
+
+    Поток пула нельзя прервать, поэтому по таймауту отменяется запрос на
+    сервере (conn.cancel()): поток и соединение освобождаются, а не заняты
+    брошенным запросом до его конца.
+    """
+
+    __slots__ = ('_lock', '_conn', 'cancelled')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.cancelled = False
+
+    def attach(self, conn):
+        """Соединение, на котором сейчас выполняется запрос; False, если запрос уже отменен"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._conn = conn
+            return True
+
+    def detach(self):
+        # До возврата соединения в пул: отмена не попадет в чужой запрос
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                self._conn.cancel()
+
+
+def _retrieve_exception(future):
+    # Если все ожидавшие клиенты отключились, ошибка не попадет в журнал asyncio как неполученная
+    if not future.cancelled():
+        future.exception()
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ReportService:
+    """Асинхронный HTTP/JSON сервис отчетов.
+
+    Одинаковые одновременные запросы объединяются в один запрос к базе
+    (single-flight), запросы к базе выполняются в ограниченном пуле
+    потоков, а при превышении лимитов сервис сразу отвечает 503.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, max_workers=4,
+                 max_pending=64, max_clients=512, query_timeout=30.0):
+        self.host = host
+        self.port = port
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_clients = max_clients
+        self.query_timeout = query_timeout
+
+        self._executor = None
+        # Пул соединений на каждый сервер: основной и реплики, выбираемые router
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self._server = None
+        self._inflight = {}
+        self._tasks = set()
+        self._clients = 0
+        self.stats = {
+            "requests": 0,
+            "db_queries": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "errors": 0,
+            "stale": 0,
+            "budget_timeouts": 0,
+        }
+
+    async def start(self):
+        self._get_pool(None)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="report-worker")
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"🌐 Сервис отчетов слушает http://{self.host}:{self.port}")
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        for pool in self._pools.values():
+            pool.closeall()
+        self._pools = {}
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def _get_pool(self, endpoint):
+        name = endpoint_name(endpoint) if endpoint else "primary"
+        with self._pools_lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                pool = ThreadedConnectionPool(
+                    1, self.max_workers, get_connection_string(endpoint=endpoint),
+                    connection_factory=InstrumentedConnection
+                )
+                self._pools[name] = pool
+        return pool
+
+    def _query_on(self, endpoint, path, handler, params, query):
+        pool = self._get_pool(endpoint)
+        conn = pool.getconn()
+        broken = False
+        try:
+            if not query.attach(conn):
+                raise HTTPError(504, "Превышено время выполнения запроса")
+            # Не autocommit: выборки применяют профили сессии и бюджет времени
+            # через SET LOCAL, а откат в конце сбрасывает их до возврата соединения в пул
+            conn.set_session(readonly=True, autocommit=False)
+            name = path.strip("/").replace("/", ".")
+            try:
+                result, stale = run_budgeted(conn, name, lambda cursor: handler(cursor, **params),
+                                             key=cache_key(name, [f"{k}={v}" for k, v in sorted(params.items())]),
+                                             store=path in CACHED_ENDPOINTS)
+            finally:
+                query.detach()
+                conn.rollback()
+            # Бюджет превышен: последний успешный результат с пометкой об устаревании
+            return dict(result, stale=stale.to_dict()) if stale else result
+        except psycopg2.extensions.QueryCanceledError:
+            raise
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            pool.putconn(conn, close=broken)
+
+    def _run_query(self, path, handler, params, query):
+        """Выполняется в потоке пула: берет соединение (с реплики, если она годится), выполняет выборку"""
+        endpoint = router.read_endpoint()
+        try:
+            return self._query_on(endpoint, path, handler, params, query)
+        except psycopg2.OperationalError:
+            if endpoint is None or query.cancelled:
+                raise
+            # Реплика перестала отвечать: исключаем ее и повторяем запрос на основном сервере
+            router.mark_unhealthy(endpoint)
+            return self._query_on(None, path, handler, params, query)
+
+    async def _fetch(self, path, handler, params):
+        loop = asyncio.get_running_loop()
+        query = _QueryCancel()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor, self._run_query, path, handler, params, query),
+                timeout=self.query_timeout,
+            )
+        except asyncio.TimeoutError:
+            query.cancel()
+            raise HTTPError(504, "Превышено время выполнения запроса")
+        except ReportTimeout as e:
+            self.stats["budget_timeouts"] += 1
+            raise HTTPError(504, str(e))
+
+    def _settle(self, key, future, task):
+        """Передает итог запроса всем ожидающим (вызывается по завершении задачи запроса)"""
+        self._tasks.discard(task)
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.done():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            result = task.result()
+            if "stale" in result:
+                self.stats["stale"] += 1
+            future.set_result(result)
+
+    async def get_report(self, path, params):
+        """Возвращает отчет, объединяя одинаковые одновременные запросы"""
+        handler, _ = ENDPOINTS[path]
+        key = (path, tuple(sorted(params.items())))
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        if len(self._inflight) >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HTTPError(503, "Слишком много различных запросов в обработке")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._inflight[key] = future
+        self.stats["db_queries"] += 1
+        # Запрос выполняется отдельной задачей, а не в задаче первого клиента: если тот
+        # отключится (его задачу отменят), присоединившиеся все равно получат результат
+        task = loop.create_task(self._fetch(path, handler, params))
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._settle, key, future))
+        # Исключение будет получено и здесь, и у всех присоединившихся запросов
+        return await asyncio.shield(future)
+
+    def parse_request_target(self, target):
+        parts = urlsplit(target)
+        if parts.path == "/health":
+            return parts.path, {}
+        if parts.path not in ENDPOINTS:
+            raise HTTPError(404, f"Неизвестный отчет: {parts.path}")
+
+        _, spec = ENDPOINTS[parts.path]
+        query = parse_qs(parts.query)
+        params = {}
+        for name, (default, minimum, maximum) in spec.items():
+            raw = query.get(name, [default])[-1]
+            if isinstance(default, str):
+                if not minimum <= len(raw) <= maximum:
+                    raise HTTPError(400, f"Длина параметра {name} должна быть в диапазоне [{minimum}, {maximum}]")
+                params[name] = raw
+                continue
+            try:
+                value = int(raw)
+            except (TypeError, ValueError):
+                raise HTTPError(400, f"Параметр {name} должен быть целым числом")
+            if not minimum <= value <= maximum:
+                raise HTTPError(400, f"Параметр {name} должен быть в диапазоне [{minimum}, {maximum}]")
+            params[name] = value
+        return parts.path, params
+
+    async def _handle_client(self, reader, writer):
+        if self._clients >= self.max_clients:
+            self.stats["rejected"] += 1
+            await self._respond(writer, 503, {"error": "Сервис перегружен"})
+            return
+
+        self._clients += 1
+        try:
+            request_line = await reader.readline()
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+
+            self.stats["requests"] += 1
+            try:
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            except ValueError:
+                raise HTTPError(400, "Некорректная строка запроса")
+            if method != "GET":
+                raise HTTPError(405, "Поддерживается только GET")
+
+            path, params = self.parse_request_target(target)
+            if path == "/health":
+                replicas = await asyncio.get_running_loop().run_in_executor(self._executor, router.status)
+                body = dict(self.stats, inflight=len(self._inflight), clients=self._clients, replicas=replicas)
+            else:
+                body = await self.get_report(path, params)
+            await self._respond(writer, 200, body)
+
+        except HTTPError as e:
+            await self._respond(writer, e.status, {"error": e.message})
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"❌ Ошибка при обработке запроса: {e}")
+            await self._respond(writer, 500, {"error": "Внутренняя ошибка сервера"})
+        finally:
+            self._clients -= 1
+
+    async def _respond(self, writer, status, body):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                   500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+        payload = json.dumps(body, ensure_ascii=False, default=_json_default).encode("utf-8")
+        headers = [
+            f"HTTP/1.1 {status} {reasons.get(status, '')}",
+            "Content-Type: application/json; charset=utf-8",
+            f"Content-Length: {len(payload)}",
+            "Connection: close",
+        ]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        try:
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def run_report_service(host="127.0.0.1", port=8080, max_workers=4, max_pending=64):
+    """Запуск сервиса отчетов до прерывания (Ctrl+C)"""
+    service = ReportService(host=host, port=port, max_workers=max_workers, max_pending=max_pending)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        print("\n🛑 Сервис отчетов остановлен")
+
+
+if __name__ == "__main__":
+    run_report_service()
@@ -0,0 +1,272 @@
+"""Поиск товаров и клиентов с переходом к их заказам.
+
+ILIKE '%...%' по products.title или users.email — последовательный проход по
+таблице. Здесь каждое условие поиска читается по индексу (database.init_database):
+
+* префикс строки (начало названия, email, «имя фамилия») — B-tree по lower(...)
+  с text_pattern_ops;
+* префиксы слов (любое слово названия, имя, фамилия, email) — GIN по
+  to_tsvector('simple', ...), запрос 'слово:*';
+* подстрока и опечатки — GIN pg_trgm (word_similarity), если расширение
+  установлено. Без pg_trgm поиск работает по префиксам слов.
+
+Результаты ранжируются: совпадение с начала строки, затем (с pg_trgm)
+вхождение подстроки, затем сходство, и ограничиваются limit. Найденный товар
+или клиент связывается со строками order_details его последних заказов;
+order_details — обычное представление с GROUP BY по заказу, и условие на
+order_id проталкивается в него, поэтому группируются только эти заказы.
+"""
+
+import re
+import time
+
+from database.connection import get_connection
+from database.sharding import SHARDS, get_shard_connection, scatter, shard_for_user
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_QUERY_LENGTH = 100
+# Короче этого по триграммам искать нечего: такие запросы ищутся по префиксам
+MIN_TRIGRAM_LENGTH = 3
+
+TRIGRAM_INSTALLED_SQL = "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+
+PRODUCTS_WORDS_SQL = """
+SELECT
+    id, title, category, price,
+    lower(title) LIKE %(prefix)s AS prefix_match,
+    ts_rank(to_tsvector('simple', title), to_tsquery('simple', %(words)s)) AS score
+FROM products
+WHERE lower(title) LIKE %(prefix)s
+   OR to_tsvector('simple', title) @@ to_tsquery('simple', %(words)s)
+ORDER BY prefix_match DESC, score DESC, title, id
+LIMIT %(limit)s
+"""
+
+PRODUCTS_TRIGRAM_SQL = """
+SELECT
+    id, title, category, price,
+    lower(title) LIKE %(prefix)s AS prefix_match,
+    CASE WHEN lower(title) LIKE %(contains)s THEN 1 ELSE 0 END
+        + word_similarity(%(query)s, lower(title)) AS score
+FROM products
+WHERE lower(title) LIKE %(contains)s
+   OR to_tsvector('simple', title) @@ to_tsquery('simple', %(words)s)
+   OR %(query)s <%% lower(title)
+ORDER BY prefix_match DESC, score DESC, title, id
+LIMIT %(limit)s
+"""
+
+CUSTOMERS_WORDS_SQL = """
+SELECT
+    id, first_name || ' ' || last_name AS customer_name, email, city, country,
+    lower(email) LIKE %(prefix)s OR lower(first_name || ' ' || last_name) LIKE %(prefix)s AS prefix_match,
+    ts_rank(to_tsvector('simple', first_name || ' ' || last_name || ' ' || email),
+            to_tsquery('simple', %(words)s)) AS score
+FROM users
+WHERE lower(email) LIKE %(prefix)s
+   OR lower(first_name || ' ' || last_name) LIKE %(prefix)s
+   OR to_tsvector('simple', first_name || ' ' || last_name || ' ' || email) @@ to_tsquery('simple', %(words)s)
+ORDER BY prefix_match DESC, score DESC, customer_name, id
+LIMIT %(limit)s
+"""
+
+CUSTOMERS_TRIGRAM_SQL = """
+SELECT
+    id, first_name || ' ' || last_name AS customer_name, email, city, country,
+    lower(email) LIKE %(prefix)s OR lower(first_name || ' ' || last_name) LIKE %(prefix)s AS prefix_match,
+    CASE WHEN lower(email) LIKE %(contains)s OR lower(first_name || ' ' || last_name) LIKE %(contains)s
+         THEN 1 ELSE 0 END
+        + GREATEST(word_similarity(%(query)s, lower(first_name || ' ' || last_name)),
+                   word_similarity(%(query)s, lower(email))) AS score
+FROM users
+WHERE lower(email) LIKE %(contains)s
+   OR lower(first_name || ' ' || last_name) LIKE %(contains)s
+   OR to_tsvector('simple', first_name || ' ' || last_name || ' ' || email) @@ to_tsquery('simple', %(words)s)
+   OR %(query)s <%% lower(first_name || ' ' || last_name)
+ORDER BY prefix_match DESC, score DESC, customer_name, id
+LIMIT %(limit)s
+"""
+
+# Последние заказы товара или клиента: id заказов выбираются по индексам, а
+# order_details фильтруется по ним через = ANY(ARRAY(...)). Такое условие —
+# параметр, и планировщик проталкивает его внутрь GROUP BY представления;
+# с JOIN или LATERAL подзапрос раскрывается, и группируются все заказы
+PRODUCT_ORDERS_SQL = """
+SELECT order_id, customer_name, order_date, total_amount, order_status, items_count, products
+FROM order_details
+WHERE order_id = ANY(ARRAY(
+    SELECT o.id
+    FROM orders o
+    WHERE o.id IN (SELECT oi.order_id FROM order_items oi WHERE oi.product_id = %(id)s)
+    ORDER BY o.order_date DESC, o.id DESC
+    LIMIT %(limit)s
+))
+ORDER BY order_date DESC, order_id DESC
+"""
+
+CUSTOMER_ORDERS_SQL = """
+SELECT order_id, customer_name, order_date, total_amount, order_status, items_count, products
+FROM order_details
+WHERE order_id = ANY(ARRAY(
+    SELECT o.id
+    FROM orders o
+    WHERE o.user_id = %(id)s
+    ORDER BY o.order_date DESC, o.id DESC
+    LIMIT %(limit)s
+))
+ORDER BY order_date DESC, order_id DESC
+"""
+
+SEARCH_QUERIES = {
+    'products': (PRODUCTS_WORDS_SQL, PRODUCTS_TRIGRAM_SQL),
+    'customers': (CUSTOMERS_WORDS_SQL, CUSTOMERS_TRIGRAM_SQL),
+}
+
+# pg_trgm установлен? — по строке подключения, проверяется один раз
+_trigram_installed = {}
+
+
+def normalize_query(text):
+    """Строка поиска в нижнем регистре без лишних пробелов, не длиннее MAX_QUERY_LENGTH"""
+    return " ".join(str(text).lower().split())[:MAX_QUERY_LENGTH]
+
+def _like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_params(text, limit=DEFAULT_LIMIT):
+    """Параметры запросов поиска; None, если в строке нет ни одного слова"""
+    query = normalize_query(text)
+    words = re.findall(r'[^\W_]+', query)
+    if not words:
+        return None
+    return {
+        'query': query,
+        'prefix': _like_escape(query) + '%',
+        'contains': '%' + _like_escape(query) + '%',
+        # Слова — только буквы и цифры, поэтому в синтаксисе tsquery их экранировать не нужно
+        'words': ' & '.join(f"{word}:*" for word in words),
+        'limit': max(1, min(int(limit), MAX_LIMIT)),
+    }
+
+def trigram_installed(cursor):
+    dsn = cursor.connection.dsn
+    if dsn not in _trigram_installed:
+        cursor.execute(TRIGRAM_INSTALLED_SQL)
+        _trigram_installed[dsn] = cursor.fetchone()[0]
+    return _trigram_installed[dsn]
+
+def search_query(kind, params, trigram):
+    """SQL поиска kind ('products' или 'customers') с pg_trgm или по префиксам слов"""
+    words_sql, trigram_sql = SEARCH_QUERIES[kind]
+    if trigram and len(params['query']) >= MIN_TRIGRAM_LENGTH:
+        return trigram_sql
+    return words_sql
+
+def _search(cursor, kind, text, limit):
+    params = search_params(text, limit)
+    if params is None:
+        return []
+    cursor.execute(search_query(kind, params, trigram_installed(cursor)), params)
+    return cursor.fetchall()
+
+def search_products(cursor, text, limit=DEFAULT_LIMIT):
+    """Товары по названию: (id, title, category, price, prefix_match, score), лучшие первыми"""
+    return _search(cursor, 'products', text, limit)
+
+def search_customers(cursor, text, limit=DEFAULT_LIMIT):
+    """Клиенты по имени, фамилии или email: (id, customer_name, email, city, country, prefix_match, score)"""
+    return _search(cursor, 'customers', text, limit)
+
+def fetch_product_orders(cursor, product_id, limit=10):
+    """Строки order_details последних limit заказов с товаром product_id"""
+    cursor.execute(PRODUCT_ORDERS_SQL, {'id': product_id, 'limit': limit})
+    return cursor.fetchall()
+
+def fetch_customer_orders(cursor, user_id, limit=10):
+    """Строки order_details последних limit заказов клиента user_id"""
+    cursor.execute(CUSTOMER_ORDERS_SQL, {'id': user_id, 'limit': limit})
+    return cursor.fetchall()
+
+
+# Шардированный вариант: клиенты и заказы разложены по шардам по user_id,
+# товары скопированы на каждый шард
+
+def _rank_key(row):
+    # prefix_match и score — два последних столбца строки поиска
+    return (not row[-2], -row[-1])
+
+def search_sharded(shards, kind, text, limit=DEFAULT_LIMIT):
+    """Поиск на всех шардах; товары с каждого шарда одни и те же, поэтому повторы убираются по id"""
+    params = search_params(text, limit)
+    if params is None:
+        return []
+    conn = get_shard_connection(shards[0], label='search')
+    try:
+        trigram = trigram_installed(conn.cursor())
+    finally:
+        conn.close()
+    partials = scatter(search_query(kind, params, trigram), params, shards, label=f"search.{kind}", profile=None)
+    rows = {}
+    for shard_rows in partials:
+        for row in shard_rows:
+            rows.setdefault(row[0], row)
+    return sorted(rows.values(), key=lambda row: _rank_key(row) + (row[1], row[0]))[:params['limit']]
+
+def fetch_product_orders_sharded(shards, product_id, limit=10):
+    partials = scatter(PRODUCT_ORDERS_SQL, {'id': product_id, 'limit': limit}, shards,
+                       label='search.product_orders', profile=None)
+    rows = [row for shard_rows in partials for row in shard_rows]
+    return sorted(rows, key=lambda row: (row[2], row[0]), reverse=True)[:limit]
+
+def fetch_customer_orders_sharded(shards, user_id, limit=10):
+    endpoint = shards[shard_for_user(user_id, len(shards))]
+    conn = get_shard_connection(endpoint, label='search.customer_orders')
+    try:
+        return fetch_customer_orders(conn.cursor(), user_id, limit)
+    finally:
+        conn.close()
+
+
+def show_search(kind, text, limit=DEFAULT_LIMIT, orders=0):
+    """Выводит найденные товары или клиентов (kind — 'products' или 'customers'),
+    с orders > 0 — и их последние заказы; при настроенных DB_SHARDS ищет на всех шардах"""
+    conn = None
+    try:
+        started = time.perf_counter()
+        if SHARDS:
+            rows = search_sharded(SHARDS, kind, text, limit)
+        else:
+            conn = get_connection(label=f"search.{kind}", replica=True)
+            cursor = conn.cursor()
+            rows = _search(cursor, kind, text, limit)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        title = "ТОВАРЫ" if kind == 'products' else "КЛИЕНТЫ"
+        print(f"🔎 {title} ПО ЗАПРОСУ «{normalize_query(text)}»: {len(rows)} за {elapsed:.1f} мс")
+        print("=" * 90)
+        if not rows:
+            print("❌ Ничего не найдено")
+            return
+
+        for row in rows:
+            if kind == 'products':
+                print(f"   #{row[0]:<8} {row[1][:40]:<40} | 🏷️  {row[2]:<15} | ${row[3]:>9,.2f}")
+            else:
+                print(f"   #{row[0]:<8} {row[1][:30]:<30} | 📧 {row[2][:30]:<30} | 📍 {row[3]}, {row[4]}")
+            if orders > 0:
+                if kind == 'products':
+                    sales = (fetch_product_orders_sharded(SHARDS, row[0], orders) if SHARDS
+                             else fetch_product_orders(cursor, row[0], orders))
+                else:
+                    sales = (fetch_customer_orders_sharded(SHARDS, row[0], orders) if SHARDS
+                             else fetch_customer_orders(cursor, row[0], orders))
+                for order_id, customer_name, order_date, total, status, items, _ in sales:
+                    print(f"      🧾 Заказ #{order_id} от {order_date.strftime('%Y-%m-%d')} | {customer_name} | "
+                          f"${total:>9,.2f} | {status} | позиций: {items}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при поиске: {e}")
+    finally:
+        if conn:
+            conn.close()
@@ -0,0 +1,294 @@
+"""Недельные и месячные отчеты сразу по всем сегментам: странам, городам, категориям.
+
+Вызов show_* в цикле с фильтром по сегменту — это тысячи запросов, и каждый
+читает заказы заново. Здесь все сегменты считаются одним запросом с
+GROUP BY период, GROUPING SETS (...): заказы, позиции, товары и клиенты
+соединяются и читаются один раз, а агрегаты по каждому набору сегментов
+PostgreSQL считает из того же потока строк. GROUPING() отличает «столбец не
+входит в набор» от настоящего NULL (заказ без клиента, клиент без страны).
+
+Период можно разбить на несколько диапазонов по границам недель или месяцев
+(partitions): диапазоны считаются параллельно на разных соединениях, и так как
+период входит в ключ группировки, их строки просто складываются в один список.
+При настроенных DB_SHARDS запрос выполняется на всех шардах и сливается так же,
+как в reports.sharded_reports.
+
+Отрисовка и запись файлов — по одному файлу на сегмент — распределяются по
+пулу процессов пачками, а не по задаче на сегмент.
+"""
+
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from database.connection import get_connection
+from database.session_profiles import apply_profile
+from database.sharding import SHARDS, scatter
+
+SEGMENTS_OUTPUT_DIR = os.getenv('SEGMENTS_OUTPUT_DIR', 'segment_reports')
+
+# Отчет -> (единица DATE_TRUNC, подпись периода)
+PERIODS = {
+    'weekly': ('week', "Неделя с"),
+    'monthly': ('month', "Месяц"),
+}
+
+# Сегмент -> столбцы его ключа. Запрос всегда возвращает SEGMENT_COLUMNS в этом порядке
+SEGMENT_COLUMNS = ('u.country', 'u.city', 'p.category')
+DIMENSIONS = {
+    'country': ('u.country',),
+    'city': ('u.country', 'u.city'),
+    'category': ('p.category',),
+}
+DIMENSION_TITLES = {'country': "страна", 'city': "город", 'category': "категория"}
+UNKNOWN_SEGMENT = "не указано"
+
+SEGMENTS_SQL = """
+SELECT
+    DATE_TRUNC('{unit}', o.order_date) AS period_start,
+    GROUPING({grouped}) AS grouping_id,
+    {columns},
+    COUNT(DISTINCT o.id),
+    COUNT(DISTINCT o.user_id),
+    SUM(oi.subtotal),
+    SUM(oi.quantity),
+    {products}
+FROM orders o
+JOIN order_items oi ON o.id = oi.order_id
+JOIN products p ON oi.product_id = p.id
+LEFT JOIN users u ON u.id = o.user_id
+WHERE o.order_status = 'completed'
+  AND o.order_date >= %(since)s
+  AND (%(until)s::timestamp IS NULL OR o.order_date < %(until)s)
+GROUP BY DATE_TRUNC('{unit}', o.order_date), GROUPING SETS ({sets})
+"""
+
+# На одном сервере уникальные товары считаются в запросе; шарды передают
+# множества id, потому что товары на всех шардах одни и те же
+PRODUCTS_COUNT = "COUNT(DISTINCT oi.product_id)"
+PRODUCTS_SET = "ARRAY_AGG(DISTINCT oi.product_id)"
+
+CENTS = Decimal('0.01')
+# Сегментов в одной пачке для процесса отрисовки
+RENDER_BATCH_SIZE = 200
+
+
+def grouped_columns(dimensions):
+    """Столбцы, входящие хотя бы в один набор: только они допустимы в GROUPING() и SELECT"""
+    return [column for column in SEGMENT_COLUMNS if any(column in DIMENSIONS[name] for name in dimensions)]
+
+def grouping_id(dimension, dimensions):
+    """Значение GROUPING(grouped_columns(dimensions)) для строк сегмента: бит 1 — столбец не в ключе"""
+    grouped = grouped_columns(dimensions)
+    return sum(1 << (len(grouped) - 1 - position)
+               for position, column in enumerate(grouped) if column not in DIMENSIONS[dimension])
+
+def segments_query(period, dimensions, sharded=False):
+    unit, _ = PERIODS[period]
+    grouped = grouped_columns(dimensions)
+    columns = [column if column in grouped else f"NULL AS {column.split('.')[1]}" for column in SEGMENT_COLUMNS]
+    sets = ", ".join(f"({', '.join(DIMENSIONS[name])})" for name in dimensions)
+    return SEGMENTS_SQL.format(unit=unit, grouped=", ".join(grouped), columns=", ".join(columns), sets=sets,
+                               products=PRODUCTS_SET if sharded else PRODUCTS_COUNT)
+
+def period_start(period, moment):
+    """DATE_TRUNC(unit, moment) в Python: понедельник недели или первое число месяца"""
+    day = datetime(moment.year, moment.month, moment.day)
+    if PERIODS[period][0] == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def next_period(period, start):
+    if PERIODS[period][0] == 'week':
+        return start + timedelta(weeks=1)
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+def first_period(period, cutoff):
+    """Начало первого периода, который начинается не раньше cutoff (как period_start >= cutoff в отчетах)"""
+    start = period_start(period, cutoff)
+    return start if start >= cutoff else next_period(period, start)
+
+def period_ranges(period, since, partitions):
+    """Диапазоны [since, until) по границам периодов; у последнего until = None"""
+    starts = [since]
+    while True:
+        start = next_period(period, starts[-1])
+        if start > datetime.now():
+            break
+        starts.append(start)
+    partitions = max(1, min(partitions, len(starts)))
+    bounds = [starts[len(starts) * i // partitions] for i in range(partitions)]
+    return list(zip(bounds, bounds[1:] + [None]))
+
+def _segment_key(dimension, values):
+    country, city, category = values
+    return {'country': (country,), 'city': (country, city), 'category': (category,)}[dimension]
+
+def _collect(rows, dimensions):
+    """Строки запроса -> {(сегмент, ключ): {начало периода: [заказы, клиенты, выручка, товары, id или число]}}"""
+    dimension_by_id = {grouping_id(name, dimensions): name for name in dimensions}
+    segments = defaultdict(dict)
+    for period_start_, grouping, country, city, category, *values in rows:
+        dimension = dimension_by_id[grouping]
+        periods = segments[(dimension, _segment_key(dimension, (country, city, category)))]
+        if period_start_ in periods:
+            total = periods[period_start_]
+            # Частичные агрегаты шардов: множества заказов и клиентов не пересекаются, товары — объединяются
+            periods[period_start_] = [a + b for a, b in zip(total[:4], values[:4])] + [set(total[4]) | set(values[4])]
+        else:
+            periods[period_start_] = values
+    return segments
+
+def _finish(segments):
+    """Строки сегментов как у недельного отчета: (начало периода, заказы, клиенты, выручка,
+    товары, средний чек, уникальные товары), новые периоды первыми"""
+    result = {}
+    for key, periods in segments.items():
+        rows = []
+        for start, (orders, customers, revenue, items, products) in periods.items():
+            average = (revenue / orders).quantize(CENTS, rounding=ROUND_HALF_UP) if orders else Decimal('0.00')
+            rows.append((start, orders, customers, revenue, items, average,
+                         products if isinstance(products, int) else len(set(products))))
+        rows.sort(key=lambda row: row[0], reverse=True)
+        result[key] = rows
+    return result
+
+def fetch_segments(cursor, period, since, until=None, dimensions=tuple(DIMENSIONS)):
+    """Строки одного запроса с GROUPING SETS за [since, until) на текущем соединении"""
+    apply_profile(cursor, 'heavy_report')
+    cursor.execute(segments_query(period, dimensions), {'since': since, 'until': until})
+    return cursor.fetchall()
+
+def _fetch_range(period, since, until, dimensions):
+    conn = get_connection(label=f"segments.{period}", replica=True)
+    try:
+        conn.set_session(readonly=True)
+        return fetch_segments(conn.cursor(), period, since, until, dimensions)
+    finally:
+        conn.close()
+
+def collect_segments(period='weekly', periods_back=8, dimensions=tuple(DIMENSIONS), partitions=1, shards=None):
+    """Все сегменты отчета period за последние periods_back периодов: {(сегмент, ключ): [строки]}.
+
+    partitions > 1 делит период на столько диапазонов, считаемых параллельно.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Неизвестный отчет {period}: ожидается один из {', '.join(PERIODS)}")
+    unknown = set(dimensions) - set(DIMENSIONS)
+    if not dimensions or unknown:
+        raise ValueError(f"Неизвестные сегменты {sorted(unknown)}: ожидаются {', '.join(DIMENSIONS)}")
+
+    cutoff = datetime.now() - (timedelta(weeks=periods_back) if period == 'weekly' else timedelta(days=periods_back * 30))
+    since = first_period(period, cutoff)
+    shards = SHARDS if shards is None else shards
+    if shards:
+        partials = scatter(segments_query(period, dimensions, sharded=True), {'since': since, 'until': None},
+                           shards, label=f"sharded.segments.{period}")
+        rows = [row for shard_rows in partials for row in shard_rows]
+    else:
+        ranges = period_ranges(period, since, partitions)
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="segments") as executor:
+            futures = [executor.submit(_fetch_range, period, lo, hi, dimensions) for lo, hi in ranges]
+            rows = [row for future in futures for row in future.result()]
+    return _finish(_collect(rows, dimensions))
+
+
+def _file_part(value):
+    """Имя файла или каталога для значения сегмента"""
+    if value is None:
+        return "_" + UNKNOWN_SEGMENT.replace(" ", "_")
+    return re.sub(r'[^\w.-]+', '_', str(value)).strip('._') or "_"
+
+def segment_paths(keys, period):
+    """Относительные пути файлов сегментов: weekly/city/Russia/Kazan.txt; совпавшие после очистки имена нумеруются"""
+    paths, used = {}, set()
+    for dimension, key in sorted(keys, key=lambda item: (item[0], [str(part) for part in item[1]])):
+        base = os.path.join(period, dimension, *[_file_part(part) for part in key])
+        path, suffix = base, 2
+        while path in used:
+            path, suffix = f"{base}-{suffix}", suffix + 1
+        used.add(path)
+        paths[(dimension, key)] = path + ".txt"
+    return paths
+
+def render_segment(period, dimension, key, rows):
+    """Текст отчета одного сегмента в формате show_weekly_report"""
+    _, period_title = PERIODS[period]
+    name = ", ".join(UNKNOWN_SEGMENT if part is None else str(part) for part in key)
+    title = "НЕДЕЛЬНЫЙ" if period == 'weekly' else "МЕСЯЧНЫЙ"
+    lines = [f"📊 {title} ОТЧЕТ ПО ПРОДАЖАМ: {DIMENSION_TITLES[dimension]} {name}", "=" * 90]
+    for start, orders, customers, revenue, items, average, products in rows:
+        label = start.strftime('%Y-%m-%d') if period == 'weekly' else start.strftime('%Y-%m')
+        lines.append(f"\n🗓️  {period_title}: {label}")
+        lines.append(f"   📦 Заказов: {orders:>6} | 👥 Клиентов: {customers:>6}")
+        lines.append(f"   💰 Выручка: ${revenue:>12,.2f} | 📊 Средний чек: ${average:>8.2f}")
+        lines.append(f"   📦 Товаров продано: {int(items):>6} | 🏷️  Уникальных товаров: {products:>4}")
+    lines.append("\n" + "=" * 90)
+    lines.append(f"📈 Итого: заказов {sum(row[1] for row in rows)}, "
+                 f"выручка ${sum(row[3] for row in rows):,.2f}, периодов {len(rows)}")
+    return "\n".join(lines) + "\n"
+
+def _render_batch(output_dir, period, batch):
+    """Выполняется в процессе пула: отрисовывает и записывает пачку сегментов"""
+    for path, dimension, key, rows in batch:
+        target = os.path.join(output_dir, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(render_segment(period, dimension, key, rows))
+    return len(batch)
+
+def write_segment_reports(segments, period, output_dir=SEGMENTS_OUTPUT_DIR, workers=None):
+    """Записывает отчет каждого сегмента в свой файл и index.tsv со сводкой; список путей.
+
+    Пачки по RENDER_BATCH_SIZE сегментов отрисовываются в пуле процессов;
+    workers=1 — в текущем процессе.
+    """
+    paths = segment_paths(segments, period)
+    tasks = [(paths[key], key[0], key[1], rows) for key, rows in segments.items()]
+    tasks.sort(key=lambda task: task[0])
+    batches = [tasks[i:i + RENDER_BATCH_SIZE] for i in range(0, len(tasks), RENDER_BATCH_SIZE)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(batches) <= 1:
+        for batch in batches:
+            _render_batch(output_dir, period, batch)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            list(executor.map(_render_batch, [output_dir] * len(batches), [period] * len(batches), batches))
+
+    index_path = os.path.join(output_dir, period, 'index.tsv')
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        f.write("segment\tkey\torders\trevenue\tfile\n")
+        for path, dimension, key, rows in tasks:
+            name = " / ".join(UNKNOWN_SEGMENT if part is None else str(part) for part in key)
+            f.write(f"{dimension}\t{name}\t{sum(row[1] for row in rows)}\t"
+                    f"{sum(row[3] for row in rows):.2f}\t{path}\n")
+    return [os.path.join(output_dir, task[0]) for task in tasks]
+
+def show_segmented_reports(period='weekly', periods_back=8, dimensions=tuple(DIMENSIONS),
+                           output_dir=SEGMENTS_OUTPUT_DIR, workers=None, partitions=1):
+    """Считает все сегменты отчета одним запросом (или partitions параллельными) и записывает их в файлы"""
+    try:
+        started = time.perf_counter()
+        segments = collect_segments(period, periods_back, dimensions, partitions)
+        queried = time.perf_counter()
+        files = write_segment_reports(segments, period, output_dir, workers)
+        written = time.perf_counter()
+
+        print(f"🧮 СЕГМЕНТИРОВАННЫЙ ОТЧЕТ ({period}, сегменты: {', '.join(dimensions)})")
+        print("=" * 90)
+        counts = defaultdict(int)
+        for dimension, _ in segments:
+            counts[dimension] += 1
+        for dimension in dimensions:
+            print(f"   📂 {DIMENSION_TITLES[dimension]}: {counts[dimension]} сегментов")
+        print(f"   ⏱️  Запрос: {queried - started:.2f} с | Отрисовка и запись: {written - queried:.2f} с")
+        print(f"✅ {len(files)} отчетов записано в {os.path.join(output_dir, period)} (сводка — index.tsv)")
+        return files
+
+    except Exception as e:
+        print(f"❌ Ошибка при генерации сегментированных отчетов: {e}")
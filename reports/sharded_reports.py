@@ -0,0 +1,210 @@
+"""Отчеты scatter-gather по шардам заказов.
+
+С каждого шарда параллельно запрашиваются частичные агрегаты, которые
+сливаются в Python в те же строки, что дают weekly_sales_report,
+monthly_sales_summary и category_analysis на одном сервере:
+
+* суммы и количества строк складываются;
+* COUNT(DISTINCT) по заказам и клиентам тоже складывается — шарды делятся по
+  user_id, поэтому их множества заказов и клиентов не пересекаются;
+* товары копируются на все шарды, поэтому уникальные товары передаются
+  множеством id (точный сливаемый «скетч») и объединяются;
+* средние считаются по слитым суммам и количествам, а не усредняются;
+* архивные недели, месяцы и дни есть только на шарде 0, а архивные строки по
+  клиентам разложены по шардам так же, как заказы (scripts.sharding).
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from database.sharding import scatter
+
+# Как и представления основного сервера (scripts.create_views), частичные
+# агрегаты складывают живые строки шарда с архивом закрытых месяцев
+# (scripts.sharding раскладывает его вместе с заказами)
+WEEKLY_PARTIAL_SQL = """
+SELECT
+    week_start,
+    category,
+    COUNT(DISTINCT order_id),
+    COUNT(DISTINCT user_id),
+    SUM(subtotal),
+    SUM(quantity),
+    ARRAY_AGG(DISTINCT product_id),
+    0::bigint
+FROM (
+    SELECT
+        DATE_TRUNC('week', o.order_date) AS week_start,
+        p.category,
+        o.id AS order_id,
+        o.user_id,
+        oi.product_id,
+        oi.subtotal,
+        oi.quantity
+    FROM orders o
+    JOIN order_items oi ON o.id = oi.order_id
+    JOIN products p ON oi.product_id = p.id
+    WHERE o.order_status = 'completed'
+    UNION ALL
+    SELECT week_start, category, order_id, user_id, product_id, subtotal, quantity
+    FROM archive_boundary_items
+) lines
+WHERE %(since)s::timestamp IS NULL OR week_start >= %(since)s
+GROUP BY week_start, category
+UNION ALL
+-- Недели целиком в архиве есть только на шарде 0: уникальные товары — готовым числом
+SELECT week_start, category, orders, customers, revenue, items, ARRAY[]::integer[], products
+FROM archive_weekly_sales
+WHERE %(since)s::timestamp IS NULL OR week_start >= %(since)s
+"""
+
+MONTHLY_PARTIAL_SQL = """
+SELECT
+    DATE_TRUNC('month', o.order_date) AS month_start,
+    EXTRACT(YEAR FROM o.order_date) AS year,
+    EXTRACT(MONTH FROM o.order_date) AS month,
+    COUNT(DISTINCT o.id),
+    COUNT(DISTINCT o.user_id),
+    SUM(o.total_amount),
+    SUM(oi.quantity),
+    COUNT(*)
+FROM orders o
+JOIN order_items oi ON o.id = oi.order_id
+WHERE o.order_status = 'completed'
+  AND (%(since)s::timestamp IS NULL OR DATE_TRUNC('month', o.order_date) >= %(since)s)
+GROUP BY DATE_TRUNC('month', o.order_date), year, month
+UNION ALL
+SELECT
+    month_start, EXTRACT(YEAR FROM month_start), EXTRACT(MONTH FROM month_start),
+    orders, customers, revenue, items, joined_rows
+FROM archive_monthly_sales
+WHERE %(since)s::timestamp IS NULL OR month_start >= %(since)s
+"""
+
+CATEGORY_PARTIAL_SQL = """
+SELECT
+    category,
+    SUM(orders)::bigint,
+    SUM(items)::bigint,
+    SUM(revenue),
+    SUM(price_sum),
+    SUM(joined_rows)::bigint,
+    COUNT(DISTINCT user_id)
+FROM (
+    SELECT
+        p.category,
+        o.user_id,
+        COUNT(DISTINCT o.id) AS orders,
+        SUM(oi.quantity) AS items,
+        SUM(oi.subtotal) AS revenue,
+        SUM(p.price) AS price_sum,
+        COUNT(*) AS joined_rows
+    FROM products p
+    JOIN order_items oi ON p.id = oi.product_id
+    JOIN orders o ON oi.order_id = o.id
+    WHERE o.order_status = 'completed'
+    GROUP BY p.category, o.user_id
+    UNION ALL
+    SELECT category, user_id, orders, items, revenue, price_sum, joined_rows
+    FROM archive_category_sales
+) pairs
+GROUP BY category
+"""
+
+CENTS = Decimal('0.01')
+
+
+def _round(value, places=CENTS):
+    """ROUND(numeric, n) PostgreSQL: половина округляется от нуля"""
+    return Decimal(value).quantize(places, rounding=ROUND_HALF_UP)
+
+def _merge(partials, key_size, combine):
+    """Сливает строки всех шардов по первым key_size столбцам функцией combine(накоплено, строка)"""
+    merged = {}
+    for rows in partials:
+        for row in rows:
+            key, values = tuple(row[:key_size]), list(row[key_size:])
+            merged[key] = combine(merged[key], values) if key in merged else values
+    return merged
+
+def _add(total, values):
+    return [a + b for a, b in zip(total, values)]
+
+
+def weekly_sales_report(shards=None, since=None):
+    """Строки weekly_sales_report (в порядке столбцов MV), собранные со всех шардов"""
+    def combine(total, values):
+        return _add(total[:4], values[:4]) + [set(total[4]) | set(values[4]), total[5] + values[5]]
+
+    partials = scatter(WEEKLY_PARTIAL_SQL, {'since': since}, shards, label='sharded.weekly')
+    rows = []
+    for (week_start, category), values in _merge(partials, 2, combine).items():
+        orders, customers, revenue, items, products, archived_products = values
+        rows.append((
+            week_start, category, orders, customers, revenue, items,
+            _round(revenue / orders) if orders > 0 else Decimal('0.00'),
+            len(set(products)) + archived_products,
+        ))
+    rows.sort(key=lambda row: row[4], reverse=True)
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return rows
+
+def monthly_sales_summary(shards=None, since=None):
+    """Строки monthly_sales_summary, собранные со всех шардов"""
+    partials = scatter(MONTHLY_PARTIAL_SQL, {'since': since}, shards, label='sharded.monthly')
+    rows = []
+    for (month_start, year, month), values in _merge(partials, 3, _add).items():
+        orders, customers, revenue, items, joined_rows = values
+        rows.append((month_start, year, month, orders, customers, revenue, items,
+                     _round(revenue / joined_rows)))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return rows
+
+def category_analysis(shards=None):
+    """Строки category_analysis, собранные со всех шардов"""
+    partials = scatter(CATEGORY_PARTIAL_SQL, None, shards, label='sharded.categories')
+    rows = []
+    for (category,), values in _merge(partials, 1, _add).items():
+        orders, items, revenue, price_sum, joined_rows, customers = values
+        rows.append((category, orders, items, revenue, _round(price_sum / joined_rows), customers))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows
+
+
+# Те же выборки, что в reports.weekly_sales_report, но по шардам вместо MV
+
+def fetch_weekly_report(shards=None, weeks_back=8):
+    cutoff_date = datetime.now() - timedelta(weeks=weeks_back)
+    return weekly_sales_report(shards, since=cutoff_date)
+
+def fetch_weekly_summary(shards=None, weeks_back=8):
+    rows = fetch_weekly_report(shards, weeks_back)
+    if not rows:
+        return (0, None, None, None, None, None)
+    return (
+        len({row[0] for row in rows}),
+        sum(row[2] for row in rows),
+        sum(row[4] for row in rows),
+        sum(row[6] for row in rows) / len(rows),
+        max(row[4] for row in rows),
+        sum(row[5] for row in rows),
+    )
+
+def fetch_monthly_report(shards=None, months_back=6):
+    cutoff_date = datetime.now() - timedelta(days=months_back*30)
+    return monthly_sales_summary(shards, since=cutoff_date)
+
+def fetch_monthly_growth(shards=None, months_back=6):
+    growth = []
+    previous = None
+    for row in reversed(fetch_monthly_report(shards, months_back)):
+        month_start, revenue = row[0], row[5]
+        percent = _round((revenue - previous) / previous * 100, Decimal('0.1')) if previous else None
+        growth.append((month_start, revenue, previous, percent))
+        previous = revenue
+    return list(reversed(growth))
+
+def fetch_category_analysis(shards=None):
+    rows = category_analysis(shards)
+    total = sum(row[3] for row in rows)
+    return [row + (_round(row[3] / total * 100, Decimal('0.1')),) for row in rows]
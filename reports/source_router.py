@@ -0,0 +1,363 @@
+"""Выбор источника отчета по стоимости.
+
+Один и тот же отчет можно прочитать из разных источников:
+
+- материализованного представления — дешево, но данные на момент обновления;
+- живого запроса (обычного представления или определения MV) — точно и
+  свежо, но агрегирует базовые таблицы;
+- выборки заказов (reports.approximate_reports) — быстрее на большой истории,
+  но с погрешностью.
+
+Для каждого запроса отчета маршрутизатор оценивает стоимость кандидатов
+через EXPLAIN без ANALYZE (оценки планировщика по статистике каталога),
+определяет свежесть MV и выбирает самый дешевый источник, который
+удовлетворяет требованиям вызывающего кода (Requirements): допустимому
+отставанию и допустимой относительной ошибке. Каждое решение вместе со всеми
+кандидатами и причинами отказа пишется в ROUTING_LOG (JSON по строке на решение)
+и в счетчики source_router.<отчет>.<источник>.
+
+Свежесть MV: в комментарии (mark_refreshed) хранится граница снимка REFRESH
+по часам БД — начало самой ранней транзакции, открытой к обновлению, — а
+изменения базовых таблиц не раньше нее ищутся по индексам (updated_at, id).
+Если таких изменений нет, MV актуальна независимо от возраста; иначе
+отставание считается от самого раннего изменения, которого в ней может не быть. Удаления строк
+(кроме переноса в архив, после которого итоги не меняются) так не видны.
+
+Предагрегированные итоги закрытых месяцев (archive_*) входят в каждый
+источник: представления и MV складывают их с живыми строками, а выборка
+прибавляет их к оценке как точные константы, поэтому граница архива на выбор
+не влияет.
+"""
+
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from statistics import NormalDist
+
+from database.instrumentation import metrics
+from reports.approximate_reports import APPROX_PILOT_PERCENT, SAMPLE_METHODS, Sampling, moments_query
+from scripts.create_views import MONTHLY_SALES_SUMMARY_QUERY, WEEKLY_SALES_REPORT_QUERY
+from scripts.health import MATVIEWS_SQL, parse_refreshed_at
+
+ROUTING_LOG = os.getenv('ROUTING_LOG', 'routing_decisions.log')
+# Требования по умолчанию: отставание MV в секундах (пусто — любое) и
+# относительная ошибка выручки (0 — только точные источники)
+ROUTER_MAX_STALENESS = os.getenv('ROUTER_MAX_STALENESS', '')
+ROUTER_MAX_ERROR = float(os.getenv('ROUTER_MAX_ERROR', '0'))
+# Коэффициент вариации выручки заказа для оценки доли выборки до пробной выборки
+SAMPLE_REVENUE_CV = 1.0
+
+KIND_NAMES = {'materialized': 'материализованное представление', 'live': 'живой запрос', 'sample': 'выборка'}
+
+# Изменения каких таблиц делают MV устаревшей
+MATERIALIZED_BASE_TABLES = {
+    'weekly_sales_report': ('orders', 'order_items', 'products'),
+    'monthly_sales_summary': ('orders', 'order_items'),
+}
+
+# Самое раннее изменение не раньше границы снимка MV; по индексу (updated_at, id) каждой таблицы.
+# Строка с updated_at, равным границе, могла быть не зафиксирована к REFRESH
+FIRST_CHANGE_SQL = "SELECT MIN(updated_at) FROM {table} WHERE updated_at >= %s"
+STALENESS_SQL = "SELECT EXTRACT(EPOCH FROM now() - %s::timestamp)"
+
+# Заказы, по которым строится приближенный отчет: оценка планировщика дает размер групп
+SAMPLE_BASE_SQL = "SELECT 1 FROM orders o WHERE o.order_status = 'completed'"
+# Заказов на странице по статистике каталога: единица выборки SYSTEM — страница
+ORDERS_PER_PAGE_SQL = "SELECT reltuples / GREATEST(relpages, 1) FROM pg_class WHERE oid = 'orders'::regclass"
+
+
+class Source:
+    """Источник отчета: relation — отношение в SQL отчета; query — определение,
+    которым оно подменяется для живого запроса; approximate и method — отчет
+    approximate_reports и метод выборки"""
+
+    __slots__ = ('name', 'kind', 'relation', 'query', 'approximate', 'method')
+
+    def __init__(self, name, kind, relation=None, query=None, approximate=None, method=None):
+        self.name = name
+        self.kind = kind
+        self.relation = relation
+        self.query = query
+        self.approximate = approximate
+        self.method = method
+
+    def sql(self, report_sql):
+        """SQL отчета, читающий из этого источника"""
+        if self.query is None:
+            return report_sql
+        return report_sql.replace(f"FROM {self.relation}", f"FROM ({self.query}) {self.relation}", 1)
+
+    def __repr__(self):
+        return f"Source({self.name!r}, {self.kind!r})"
+
+
+def _samples(report):
+    # BERNOULLI читает всю таблицу, SYSTEM — только выбранные страницы, но
+    # заказы одной страницы коррелированы, и нужная доля выборки больше
+    return [Source(f"sample.{method}:{report}", 'sample', approximate=report, method=method)
+            for method in SAMPLE_METHODS]
+
+# Отчет -> источники. Топ клиентов и сравнение производительности имеют один источник
+REPORT_SOURCES = {
+    'weekly': [
+        Source('weekly_sales_report', 'materialized', 'weekly_sales_report'),
+        Source('weekly_sales_report:live', 'live', 'weekly_sales_report', WEEKLY_SALES_REPORT_QUERY),
+    ] + _samples('weekly'),
+    'monthly': [
+        Source('monthly_sales_summary', 'materialized', 'monthly_sales_summary'),
+        Source('monthly_sales_summary:live', 'live', 'monthly_sales_summary', MONTHLY_SALES_SUMMARY_QUERY),
+    ] + _samples('monthly'),
+    'categories': [Source('category_analysis', 'live', 'category_analysis')] + _samples('categories'),
+    'daily': [Source('daily_sales', 'live', 'daily_sales')] + _samples('daily'),
+}
+
+
+class Requirements:
+    """Требования к источнику: max_staleness — допустимое отставание MV в
+    секундах (None — любое), max_error — допустимая относительная ошибка
+    выручки (0 — только точные источники)"""
+
+    __slots__ = ('max_staleness', 'max_error')
+
+    def __init__(self, max_staleness=None, max_error=None):
+        if max_staleness is None and ROUTER_MAX_STALENESS:
+            max_staleness = float(ROUTER_MAX_STALENESS)
+        max_error = ROUTER_MAX_ERROR if max_error is None else max_error
+        if max_staleness is not None and max_staleness < 0:
+            raise ValueError(f"Допустимое отставание {max_staleness} не может быть отрицательным")
+        if not 0 <= max_error < 1:
+            raise ValueError(f"Допустимая ошибка {max_error} должна быть в [0, 1)")
+        self.max_staleness = max_staleness
+        self.max_error = max_error
+
+    def to_dict(self):
+        return {'max_staleness': self.max_staleness, 'max_error': self.max_error}
+
+
+class Candidate:
+    """Оценка одного источника для конкретного запроса отчета"""
+
+    __slots__ = ('source', 'cost', 'rows', 'staleness', 'error', 'percent', 'reason')
+
+    def __init__(self, source):
+        self.source = source
+        self.cost = None
+        self.rows = None
+        self.staleness = 0.0
+        self.error = 0.0
+        self.percent = None
+        # Причина, по которой источник не подходит (None — подходит)
+        self.reason = None
+
+    @property
+    def eligible(self):
+        return self.reason is None
+
+    def to_dict(self):
+        return {
+            'source': self.source.name,
+            'kind': self.source.kind,
+            'cost': round(self.cost, 2) if self.cost is not None else None,
+            'staleness': round(self.staleness, 1) if self.staleness is not None else None,
+            'error': self.error,
+            'percent': round(self.percent, 3) if self.percent is not None else None,
+            'rejected': self.reason,
+        }
+
+
+class Decision:
+    """Выбранный источник и все рассмотренные кандидаты"""
+
+    __slots__ = ('report', 'params', 'requirements', 'candidates', 'chosen', 'planning_ms')
+
+    def __init__(self, report, params, requirements, candidates, chosen, planning_ms):
+        self.report = report
+        self.params = params
+        self.requirements = requirements
+        self.candidates = candidates
+        self.chosen = chosen
+        self.planning_ms = planning_ms
+
+    @property
+    def source(self):
+        return self.chosen.source
+
+    def sampling(self, confidence=0.95):
+        """Параметры приближенного отчета для выбранной выборки"""
+        return Sampling(target_error=self.requirements.max_error, method=self.source.method, confidence=confidence)
+
+    def to_dict(self):
+        return {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'report': self.report,
+            'params': {key: str(value) for key, value in self.params.items()},
+            'requirements': self.requirements.to_dict(),
+            'chosen': self.source.name,
+            'planning_ms': round(self.planning_ms, 2),
+            'candidates': [candidate.to_dict() for candidate in self.candidates],
+        }
+
+    def describe(self):
+        chosen = self.chosen
+        details = [KIND_NAMES[self.source.kind]]
+        if self.source.kind == 'materialized':
+            details.append("данные актуальны" if chosen.staleness == 0
+                           else f"отстает на {format_seconds(chosen.staleness)}")
+        elif self.source.kind == 'sample':
+            details.append(f"≈{chosen.percent:.2g}% заказов, ошибка до ±{chosen.error:.0%}")
+        details.append(f"стоимость {chosen.cost:,.0f}")
+        others = [f"{candidate.source.name} {candidate.cost:,.0f}" if candidate.eligible
+                  else f"{candidate.source.name}: {candidate.reason}"
+                  for candidate in self.candidates if candidate is not chosen]
+        line = f"🧭 Источник: {self.source.name} ({', '.join(details)})"
+        return line + (f"; другие: {'; '.join(others)}" if others else "")
+
+
+def format_seconds(seconds):
+    if seconds < 120:
+        return f"{seconds:.0f} с"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+
+def _explain(cursor, sql, params):
+    """(стоимость, строк) по оценке планировщика; EXPLAIN без ANALYZE запрос не выполняет"""
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params, label="source_router.explain")
+    plan = cursor.fetchone()[0][0]['Plan']
+    return plan['Total Cost'], plan['Plan Rows']
+
+
+class SourceRouter:
+    """Выбор самого дешевого источника отчета, удовлетворяющего требованиям"""
+
+    def __init__(self, log_path=None):
+        self.log_path = ROUTING_LOG if log_path is None else log_path
+        self.decisions = deque(maxlen=100)
+
+    def staleness(self, cursor, relation):
+        """Отставание MV relation в секундах по часам БД: 0, если с границы снимка
+        базовые таблицы не менялись; None, если MV не заполнена или граница неизвестна"""
+        cursor.execute(MATVIEWS_SQL, label="source_router.freshness")
+        matviews = {name: (populated, comment) for name, populated, comment in cursor.fetchall()}
+        populated, comment = matviews.get(relation, (False, None))
+        refreshed_at = parse_refreshed_at(comment)
+        if not populated or refreshed_at is None:
+            return None
+        first_changes = []
+        for table in MATERIALIZED_BASE_TABLES[relation]:
+            cursor.execute(FIRST_CHANGE_SQL.format(table=table), [refreshed_at], label="source_router.freshness")
+            changed_at = cursor.fetchone()[0]
+            if changed_at is not None:
+                first_changes.append(changed_at)
+        if not first_changes:
+            return 0.0
+        cursor.execute(STALENESS_SQL, [min(first_changes)], label="source_router.freshness")
+        return max(0.0, float(cursor.fetchone()[0]))
+
+    def _sample_percent(self, cursor, params, groups, max_error, method):
+        """Доля выборки (в процентах), при которой ошибка выручки группы ожидается не больше max_error.
+
+        Оценка до пробной выборки: в группе около n = N/G единиц выборки (N и G —
+        оценки планировщика), и при коэффициенте вариации выручки единицы cv
+        (1 - p)/p · cv²/n · z² ≤ e², откуда p = 1 / (1 + e²·n / (z²·cv²)).
+        Для SYSTEM единица — страница, и заказы группы считаются собранными
+        на своих страницах (заказы пишутся по порядку дат): n делится на число
+        заказов на странице.
+        """
+        base_sql = SAMPLE_BASE_SQL + (" AND o.order_date >= %(since)s" if 'since' in params else "")
+        _, orders = _explain(cursor, base_sql, params)
+        per_group = orders / max(groups, 1)
+        if method == 'system':
+            cursor.execute(ORDERS_PER_PAGE_SQL, label="source_router.catalog")
+            per_group /= max(float(cursor.fetchone()[0] or 1), 1.0)
+        z = NormalDist().inv_cdf(0.975)
+        fraction = 1 / (1 + max_error ** 2 * per_group / (z * SAMPLE_REVENUE_CV) ** 2)
+        return min(100.0, 100 * fraction)
+
+    def _estimate(self, cursor, candidate, report_sql, sql_params, params, requirements, groups):
+        source = candidate.source
+        if source.kind == 'sample':
+            percent = self._sample_percent(cursor, params, groups, requirements.max_error, source.method)
+            query = moments_query(source.approximate, source.method)
+            # Приближенный отчет с целевой ошибкой сначала читает пробную выборку
+            pilot_percent = min(APPROX_PILOT_PERCENT, 100.0)
+            cost, _ = _explain(cursor, query, dict(params, percent=pilot_percent, seed=None))
+            if percent > pilot_percent:
+                cost += _explain(cursor, query, dict(params, percent=percent, seed=None))[0]
+            candidate.cost, candidate.percent, candidate.error = cost, percent, requirements.max_error
+            return
+
+        if source.kind == 'materialized':
+            candidate.staleness = self.staleness(cursor, source.relation)
+            if candidate.staleness is None:
+                candidate.reason = "MV не заполнена или время обновления неизвестно"
+                return
+            if requirements.max_staleness is not None and candidate.staleness > requirements.max_staleness:
+                candidate.reason = (f"отстает на {format_seconds(candidate.staleness)}, "
+                                    f"допустимо {format_seconds(requirements.max_staleness)}")
+        candidate.cost, candidate.rows = _explain(cursor, source.sql(report_sql), sql_params)
+
+    def choose(self, conn, report, report_sql, sql_params, requirements=None, **params):
+        """Decision для отчета report.
+
+        report_sql и sql_params — основной запрос отчета (к relation первого
+        источника); params — параметры приближенного отчета (since). Оценка
+        идет на соединении вызывающего кода: ошибка EXPLAIN одного кандидата
+        откатывается к точке сохранения и исключает только его.
+        """
+        requirements = requirements or Requirements()
+        started = time.perf_counter()
+        candidates = [Candidate(source) for source in REPORT_SOURCES[report]]
+        savepoint = not conn.autocommit
+
+        cursor = conn.cursor()
+        try:
+            # Выборка идет последней: число групп отчета для ее доли — по оценке точного источника
+            groups = 1
+            for candidate in candidates:
+                if candidate.source.kind == 'sample' and requirements.max_error <= 0:
+                    candidate.reason = "нужен точный результат"
+                    continue
+                if savepoint:
+                    cursor.execute("SAVEPOINT source_router", label="source_router.savepoint")
+                try:
+                    self._estimate(cursor, candidate, report_sql, sql_params, params, requirements, groups)
+                    if candidate.rows and groups == 1:
+                        groups = candidate.rows
+                except Exception as e:
+                    if not savepoint:
+                        raise
+                    cursor.execute("ROLLBACK TO SAVEPOINT source_router", label="source_router.savepoint")
+                    candidate.reason = f"оценка не удалась: {str(e).strip().splitlines()[0]}"
+                if savepoint:
+                    cursor.execute("RELEASE SAVEPOINT source_router", label="source_router.savepoint")
+        finally:
+            cursor.close()
+
+        eligible = [candidate for candidate in candidates if candidate.eligible]
+        if not eligible:
+            raise RuntimeError(f"Для отчета {report} нет подходящего источника: " + "; ".join(
+                f"{candidate.source.name}: {candidate.reason}" for candidate in candidates))
+        # При равной стоимости — точный и более свежий источник
+        chosen = min(eligible, key=lambda candidate: (candidate.cost, candidate.error, candidate.staleness))
+        planning_ms = (time.perf_counter() - started) * 1000
+        decision = Decision(report, params, requirements, candidates, chosen, planning_ms)
+        self._record(decision)
+        return decision
+
+    def _record(self, decision):
+        metrics.increment(f"source_router.{decision.report}.{decision.source.name}")
+        entry = decision.to_dict()
+        self.decisions.append(entry)
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            except OSError:
+                pass
+
+
+source_router = SourceRouter()
@@ -1,37 +1,241 @@
-import psycopg2
 import traceback
 from datetime import datetime, timedelta
-from database.config import get_connection_string
+from database.connection import get_connection
+from database.money import register_cents, format_cents, format_tenths, divide_half_even
+from database.session_profiles import apply_profile
+from database.sharding import SHARDS
+from reports import approximate_reports, sharded_reports
+from reports.budgets import run_budgeted, budget_counters, cache_key
+from reports.records import CategoryRecord, DailySalesRecord, CustomerRecord
+from reports.source_router import source_router
+from scripts.create_views import WEEKLY_SALES_REPORT_QUERY
+from scripts.stage_profiler import profiler
 
-def show_weekly_report(weeks_back=8):
-    """Показывает отчет из материализованного представления weekly_sales_report"""
+WEEKLY_REPORT_SQL = """
+SELECT 
+    week_start,
+    top_category,
+    orders_in_category,
+    unique_customers_in_category, 
+    revenue_in_category,
+    items_sold_in_category,
+    avg_order_value_in_category,
+    unique_products_in_category
+FROM weekly_sales_report
+WHERE week_start >= %s
+ORDER BY week_start DESC, revenue_in_category DESC;
+"""
+
+WEEKLY_SUMMARY_SQL = """
+SELECT 
+    COUNT(DISTINCT week_start) as weeks_count,
+    SUM(orders_in_category) as total_orders_in_categories,
+    SUM(revenue_in_category) as total_revenue_in_categories,
+    AVG(avg_order_value_in_category) as overall_avg_order_in_categories,
+    MAX(revenue_in_category) as best_category_week_revenue,
+    SUM(items_sold_in_category) as total_items_sold_in_categories
+FROM weekly_sales_report
+WHERE week_start >= %s;
+"""
+
+MONTHLY_REPORT_SQL = """
+SELECT 
+    month_start,
+    year,
+    month,
+    total_orders,
+    unique_customers,
+    total_revenue,
+    total_items_sold,
+    avg_order_value
+FROM monthly_sales_summary
+WHERE month_start >= %s
+ORDER BY month_start DESC;
+"""
+
+MONTHLY_GROWTH_SQL = """
+SELECT 
+    month_start,
+    total_revenue,
+    LAG(total_revenue) OVER (ORDER BY month_start) as prev_month_revenue,
+    CASE 
+        WHEN LAG(total_revenue) OVER (ORDER BY month_start) IS NOT NULL THEN
+            ROUND(
+                (total_revenue - LAG(total_revenue) OVER (ORDER BY month_start)) / 
+                LAG(total_revenue) OVER (ORDER BY month_start) * 100, 1
+            )
+        ELSE NULL
+    END as growth_percent
+FROM monthly_sales_summary
+WHERE month_start >= %s
+ORDER BY month_start DESC;
+"""
+
+CATEGORY_ANALYSIS_SQL = """
+SELECT 
+    category,
+    orders_count,
+    items_sold,
+    total_revenue,
+    avg_product_price,
+    unique_customers,
+    ROUND(total_revenue / SUM(total_revenue) OVER() * 100, 1) as revenue_share
+FROM category_analysis
+ORDER BY total_revenue DESC;
+"""
+
+TOP_CUSTOMERS_SQL = """
+SELECT 
+    customer_name,
+    email,
+    city,
+    country,
+    total_orders,
+    total_spent,
+    avg_order_value,
+    last_order_date
+FROM customer_analytics
+WHERE total_orders > 0
+ORDER BY total_spent DESC
+LIMIT %s;
+"""
+
+DAILY_SALES_SQL = """
+SELECT 
+    sale_date,
+    orders_count,
+    total_revenue,
+    avg_order_value,
+    unique_customers
+FROM daily_sales
+WHERE sale_date >= %s
+ORDER BY sale_date DESC;
+"""
+
+# Запросы отчетов с параметрами по умолчанию (для анализа планов выполнения)
+REPORT_QUERIES = {
+    'weekly_report': (WEEKLY_REPORT_SQL, lambda: [datetime.now() - timedelta(weeks=8)]),
+    'weekly_summary': (WEEKLY_SUMMARY_SQL, lambda: [datetime.now() - timedelta(weeks=8)]),
+    'monthly_report': (MONTHLY_REPORT_SQL, lambda: [datetime.now() - timedelta(days=180)]),
+    'monthly_growth': (MONTHLY_GROWTH_SQL, lambda: [datetime.now() - timedelta(days=180)]),
+    'category_analysis': (CATEGORY_ANALYSIS_SQL, lambda: []),
+    'top_customers': (TOP_CUSTOMERS_SQL, lambda: [10]),
+    'daily_sales': (DAILY_SALES_SQL, lambda: [datetime.now() - timedelta(days=30)]),
+}
+
+# Профиль сессии каждого запроса: выборки из MV — короткие, а top_customers,
+# category_analysis и daily_sales агрегируют базовые таблицы через представления
+REPORT_PROFILES = {
+    'weekly_report': 'point_lookup',
+    'weekly_summary': 'point_lookup',
+    'monthly_report': 'point_lookup',
+    'monthly_growth': 'point_lookup',
+    'category_analysis': 'heavy_report',
+    'top_customers': 'heavy_report',
+    'daily_sales': 'heavy_report',
+}
+
+
+def _from_source(cursor, name, sql, source):
+    """Применяет профиль запроса name и возвращает его SQL для источника source
+    (reports.source_router; None — материализованное представление)"""
+    if source is None or source.query is None:
+        apply_profile(cursor, REPORT_PROFILES[name])
+        return sql
+    # Живой запрос вместо MV агрегирует базовые таблицы
+    apply_profile(cursor, 'heavy_report')
+    return source.sql(sql)
+
+def fetch_weekly_report(cursor, weeks_back=8, source=None):
+    """Строки недельного отчета за последние weeks_back недель"""
+    cutoff_date = datetime.now() - timedelta(weeks=weeks_back)
+    cursor.execute(_from_source(cursor, 'weekly_report', WEEKLY_REPORT_SQL, source), [cutoff_date])
+    return cursor.fetchall()
+
+def fetch_weekly_summary(cursor, weeks_back=8, source=None):
+    """Сводная строка недельного отчета за последние weeks_back недель"""
+    cutoff_date = datetime.now() - timedelta(weeks=weeks_back)
+    cursor.execute(_from_source(cursor, 'weekly_summary', WEEKLY_SUMMARY_SQL, source), [cutoff_date])
+    return cursor.fetchone()
+
+def fetch_monthly_report(cursor, months_back=6, source=None):
+    """Строки месячного отчета за последние months_back месяцев"""
+    cutoff_date = datetime.now() - timedelta(days=months_back*30)
+    cursor.execute(_from_source(cursor, 'monthly_report', MONTHLY_REPORT_SQL, source), [cutoff_date])
+    return cursor.fetchall()
+
+def fetch_monthly_growth(cursor, months_back=6, source=None):
+    """Рост выручки месяц к месяцу за последние months_back месяцев"""
+    cutoff_date = datetime.now() - timedelta(days=months_back*30)
+    cursor.execute(_from_source(cursor, 'monthly_growth', MONTHLY_GROWTH_SQL, source), [cutoff_date])
+    return cursor.fetchall()
+
+def fetch_category_analysis(cursor):
+    """Строки анализа продаж по категориям"""
+    apply_profile(cursor, REPORT_PROFILES['category_analysis'])
+    cursor.execute(CATEGORY_ANALYSIS_SQL)
+    return cursor.fetchall()
+
+def fetch_top_customers(cursor, limit=10):
+    """Топ клиентов по объему покупок"""
+    apply_profile(cursor, REPORT_PROFILES['top_customers'])
+    cursor.execute(TOP_CUSTOMERS_SQL, [limit])
+    return cursor.fetchall()
+
+def fetch_daily_sales(cursor, days_back=30):
+    """Ежедневные продажи за последние days_back дней"""
+    cutoff_date = datetime.now() - timedelta(days=days_back)
+    apply_profile(cursor, REPORT_PROFILES['daily_sales'])
+    cursor.execute(DAILY_SALES_SQL, [cutoff_date])
+    return cursor.fetchall()
+
+# Те же выборки, но компактными строками с деньгами в копейках. Приведение NUMERIC
+# регистрируется на отдельном курсоре, чтобы не менять типы у курсора вызывающего кода
+
+def fetch_category_records(cursor):
+    """Анализ продаж по категориям: [CategoryRecord]"""
+    with register_cents(cursor.connection.cursor()) as cents_cursor:
+        return CategoryRecord.from_rows(fetch_category_analysis(cents_cursor))
+
+def fetch_top_customer_records(cursor, limit=10):
+    """Топ клиентов по объему покупок: [CustomerRecord]"""
+    with register_cents(cursor.connection.cursor()) as cents_cursor:
+        return CustomerRecord.from_rows(fetch_top_customers(cents_cursor, limit))
+
+def fetch_daily_sales_records(cursor, days_back=30):
+    """Ежедневные продажи за последние days_back дней: [DailySalesRecord]"""
+    with register_cents(cursor.connection.cursor()) as cents_cursor:
+        return DailySalesRecord.from_rows(fetch_daily_sales(cents_cursor, days_back))
+
+def show_weekly_report(weeks_back=8, sampling=None, requirements=None):
+    """Показывает недельный отчет из источника, выбранного по стоимости под
+    requirements (reports.source_router): MV weekly_sales_report, живого запроса
+    или выборки (при настроенных DB_SHARDS — собранный со всех шардов из MV;
+    с sampling — приближенный)"""
     
+    if sampling is not None:
+        return approximate_reports.show_weekly_report(weeks_back, sampling)
+    conn = None
     try:
-        conn = psycopg2.connect(get_connection_string())
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
-            week_start,
-            top_category,
-            orders_in_category,
-            unique_customers_in_category, 
-            revenue_in_category,
-            items_sold_in_category,
-            avg_order_value_in_category,
-            unique_products_in_category
-        FROM weekly_sales_report
-        WHERE week_start >= %s
-        ORDER BY week_start DESC, revenue_in_category DESC;
-        """
-        
-        cutoff_date = datetime.now() - timedelta(weeks=weeks_back)
-        
-        cursor.execute(query, [cutoff_date])
-        results = cursor.fetchall()
+        if SHARDS:
+            results = sharded_reports.fetch_weekly_report(SHARDS, weeks_back)
+        else:
+            conn = get_connection(replica=True)
+            cutoff_date = datetime.now() - timedelta(weeks=weeks_back)
+            decision = source_router.choose(conn, 'weekly', WEEKLY_REPORT_SQL, [cutoff_date],
+                                            requirements, since=cutoff_date)
+            if decision.source.kind == 'sample':
+                print(decision.describe())
+                return approximate_reports.show_weekly_report(weeks_back, decision.sampling())
+            results, stale = run_budgeted(conn, 'weekly_report', fetch_weekly_report, weeks_back, decision.source,
+                                          key=cache_key('weekly_report', [weeks_back]))
         
         print("📊 НЕДЕЛЬНЫЙ ОТЧЕТ ПО ПРОДАЖАМ")
         print("=" * 90)
+        if not SHARDS:
+            print(decision.describe())
+            if stale:
+                print(stale.describe())
         
         if not results:
             print("❌ Нет данных для отображения")
@@ -47,20 +251,13 @@ def show_weekly_report(weeks_back=8):
         print("\n" + "=" * 90)
         print("📈 СВОДНАЯ СТАТИСТИКА:")
         
-        summary_query = """
-        SELECT 
-            COUNT(DISTINCT week_start) as weeks_count,
-            SUM(orders_in_category) as total_orders_in_categories,
-            SUM(revenue_in_category) as total_revenue_in_categories,
-            AVG(avg_order_value_in_category) as overall_avg_order_in_categories,
-            MAX(revenue_in_category) as best_category_week_revenue,
-            SUM(items_sold_in_category) as total_items_sold_in_categories
-        FROM weekly_sales_report
-        WHERE week_start >= %s;
-        """
-        
-        cursor.execute(summary_query, [cutoff_date])
-        summary = cursor.fetchone()
+        if SHARDS:
+            summary = sharded_reports.fetch_weekly_summary(SHARDS, weeks_back)
+        else:
+            summary, stale = run_budgeted(conn, 'weekly_summary', fetch_weekly_summary, weeks_back, decision.source,
+                                          key=cache_key('weekly_summary', [weeks_back]))
+            if stale:
+                print(stale.describe())
         
         print(f"   📅 Период: {weeks_back} недель | Недель в отчете: {summary[0]}")
         print(f"   📦 Всего заказов по категориям: {summary[1]:>6}")
@@ -69,43 +266,41 @@ def show_weekly_report(weeks_back=8):
         print(f"   🏆 Лучшая неделя для категории: ${summary[4]:>10,.2f}")
         print(f"   📦 Всего товаров продано по категориям: {int(summary[5]):>6}")
         
-        cursor.close()
-        
     except Exception as e:
         print(f"❌ Ошибка при генерации отчета: {e}")
     finally:
         if conn:
             conn.close()
 
-def show_monthly_report(months_back=6):
-    """Показывает отчет из материализованного представления monthly_sales_summary"""
+def show_monthly_report(months_back=6, sampling=None, requirements=None):
+    """Показывает месячный отчет из источника, выбранного по стоимости под
+    requirements (reports.source_router): MV monthly_sales_summary, живого
+    запроса или выборки (при настроенных DB_SHARDS — собранный со всех шардов
+    из MV; с sampling — приближенный)"""
     
+    if sampling is not None:
+        return approximate_reports.show_monthly_report(months_back, sampling)
+    conn = None
     try:
-        conn = psycopg2.connect(get_connection_string())
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
-            month_start,
-            year,
-            month,
-            total_orders,
-            unique_customers,
-            total_revenue,
-            total_items_sold,
-            avg_order_value
-        FROM monthly_sales_summary
-        WHERE month_start >= %s
-        ORDER BY month_start DESC;
-        """
-        
-        cutoff_date = datetime.now() - timedelta(days=months_back*30)
-
-        cursor.execute(query, [cutoff_date])
-        results = cursor.fetchall()
+        if SHARDS:
+            results = sharded_reports.fetch_monthly_report(SHARDS, months_back)
+        else:
+            conn = get_connection(replica=True)
+            cutoff_date = datetime.now() - timedelta(days=months_back*30)
+            decision = source_router.choose(conn, 'monthly', MONTHLY_REPORT_SQL, [cutoff_date],
+                                            requirements, since=cutoff_date)
+            if decision.source.kind == 'sample':
+                print(decision.describe())
+                return approximate_reports.show_monthly_report(months_back, decision.sampling())
+            results, stale = run_budgeted(conn, 'monthly_report', fetch_monthly_report, months_back,
+                                          decision.source, key=cache_key('monthly_report', [months_back]))
         
         print("\n📅 МЕСЯЧНЫЙ ОТЧЕТ ПО ПРОДАЖАМ")
         print("=" * 80)
+        if not SHARDS:
+            print(decision.describe())
+            if stale:
+                print(stale.describe())
         
         if not results:
             print("❌ Нет данных для отображения")
@@ -124,26 +319,13 @@ def show_monthly_report(months_back=6):
         print("\n" + "=" * 80)
         print("📈 АНАЛИЗ РОСТА (месяц к месяцу):")
         
-        growth_query = """
-        SELECT 
-            month_start,
-            total_revenue,
-            LAG(total_revenue) OVER (ORDER BY month_start) as prev_month_revenue,
-            CASE 
-                WHEN LAG(total_revenue) OVER (ORDER BY month_start) IS NOT NULL THEN
-                    ROUND(
-                        (total_revenue - LAG(total_revenue) OVER (ORDER BY month_start)) / 
-                        LAG(total_revenue) OVER (ORDER BY month_start) * 100, 1
-                    )
-                ELSE NULL
-            END as growth_percent
-        FROM monthly_sales_summary
-        WHERE month_start >= %s
-        ORDER BY month_start DESC;
-        """
-        
-        cursor.execute(growth_query, [cutoff_date])
-        growth_data = cursor.fetchall()
+        if SHARDS:
+            growth_data = sharded_reports.fetch_monthly_growth(SHARDS, months_back)
+        else:
+            growth_data, stale = run_budgeted(conn, 'monthly_growth', fetch_monthly_growth, months_back,
+                                              decision.source, key=cache_key('monthly_growth', [months_back]))
+            if stale:
+                print(stale.describe())
         
         for row in growth_data:
             month_start, revenue, prev_revenue, growth = row
@@ -152,8 +334,6 @@ def show_monthly_report(months_back=6):
                 trend = "📈" if growth > 0 else "📉" if growth < 0 else "➡️"
                 print(f"   {month_str}: ${revenue:>10,.2f} {trend} {growth:>+5.1f}%")
         
-        cursor.close()
-        
     except Exception as e:
         print(f"❌ Ошибка при генерации месячного отчета: {e}")
         traceback.print_exc()
@@ -161,48 +341,45 @@ def show_monthly_report(months_back=6):
         if conn:
             conn.close()
 
-def show_category_analysis():
-    """Анализ продаж по категориям"""
+def show_category_analysis(sampling=None, requirements=None):
+    """Анализ продаж по категориям: из представления или, если requirements
+    допускают ошибку и это дешевле, по выборке (reports.source_router); при
+    настроенных DB_SHARDS — со всех шардов; с sampling — приближенный"""
     
+    if sampling is not None:
+        return approximate_reports.show_category_analysis(sampling)
+    conn = None
     try:
-        conn = psycopg2.connect(get_connection_string())
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
-            category,
-            orders_count,
-            items_sold,
-            total_revenue,
-            avg_product_price,
-            unique_customers,
-            ROUND(total_revenue / SUM(total_revenue) OVER() * 100, 1) as revenue_share
-        FROM category_analysis
-        ORDER BY total_revenue DESC;
-        """
-        
-        cursor.execute(query)
-        results = cursor.fetchall()
+        if SHARDS:
+            results = CategoryRecord.from_decimal_rows(sharded_reports.fetch_category_analysis(SHARDS))
+        else:
+            conn = get_connection(replica=True)
+            decision = source_router.choose(conn, 'categories', CATEGORY_ANALYSIS_SQL, [], requirements)
+            if decision.source.kind == 'sample':
+                print(decision.describe())
+                return approximate_reports.show_category_analysis(decision.sampling())
+            results, stale = run_budgeted(conn, 'category_analysis', fetch_category_records)
         
         print("\n🏷️  АНАЛИЗ ПРОДАЖ ПО КАТЕГОРИЯМ")
         print("=" * 90)
+        if not SHARDS:
+            print(decision.describe())
+            if stale:
+                print(stale.describe())
         
         if not results:
             print("❌ Нет данных для отображения")
             return
         
-        total_revenue = sum(row[3] for row in results)
+        total_revenue = sum(row.revenue for row in results)
         
         for row in results:
-            category, orders_count, items_sold, revenue, avg_price, unique_customers, revenue_share = row
-            print(f"\n📁 {category:>15}:")
-            print(f"   💰 Выручка: ${revenue:>10,.2f} ({revenue_share:>4}% от общей)")
-            print(f"   📦 Заказов: {orders_count:>4} | 🛒 Товаров: {items_sold:>5}")
-            print(f"   👥 Клиентов: {unique_customers:>4} | 💵 Средняя цена: ${avg_price:>7.2f}")
+            print(f"\n📁 {row.category:>15}:")
+            print(f"   💰 Выручка: ${format_cents(row.revenue):>10} ({format_tenths(row.revenue_share):>4}% от общей)")
+            print(f"   📦 Заказов: {row.orders_count:>4} | 🛒 Товаров: {row.items_sold:>5}")
+            print(f"   👥 Клиентов: {row.unique_customers:>4} | 💵 Средняя цена: ${format_cents(row.avg_price, grouping=False):>7}")
         
-        print(f"\n💰 ОБЩАЯ ВЫРУЧКА ПО ВСЕМ КАТЕГОРИЯМ: ${total_revenue:,.2f}")
-        
-        cursor.close()
+        print(f"\n💰 ОБЩАЯ ВЫРУЧКА ПО ВСЕМ КАТЕГОРИЯМ: ${format_cents(total_revenue)}")
         
     except Exception as e:
         print(f"❌ Ошибка при анализе категорий: {e}")
@@ -214,43 +391,25 @@ def show_top_customers(limit=10):
     """Показывает топ клиентов по объему покупок"""
     
     try:
-        conn = psycopg2.connect(get_connection_string())
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
-            customer_name,
-            email,
-            city,
-            country,
-            total_orders,
-            total_spent,
-            avg_order_value,
-            last_order_date
-        FROM customer_analytics
-        WHERE total_orders > 0
-        ORDER BY total_spent DESC
-        LIMIT %s;
-        """
-        
-        cursor.execute(query, [limit])
-        results = cursor.fetchall()
+        conn = get_connection(replica=True)
+        
+        results, stale = run_budgeted(conn, 'top_customers', fetch_top_customer_records, limit)
         
         print(f"\n👑 ТОП-{limit} КЛИЕНТОВ ПО ОБЪЕМУ ПОКУПОК")
         print("=" * 100)
+        if stale:
+            print(stale.describe())
         
         if not results:
             print("❌ Нет данных для отображения")
             return
         
         for i, row in enumerate(results, 1):
-            customer_name, email, city, country, total_orders, total_spent, avg_order_value, last_order_date = row
-            print(f"\n#{i:>2} {customer_name:>20} ({city}, {country})")
-            print(f"   📧 {email}")
-            print(f"   💰 Всего потрачено: ${total_spent:>10,.2f} | 📦 Заказов: {total_orders:>3}")
-            print(f"   📊 Средний чек: ${avg_order_value:>8.2f} | 📅 Последний заказ: {last_order_date.strftime('%Y-%m-%d')}")
-        
-        cursor.close()
+            print(f"\n#{i:>2} {row.customer_name:>20} ({row.city}, {row.country})")
+            print(f"   📧 {row.email}")
+            print(f"   💰 Всего потрачено: ${format_cents(row.total_spent):>10} | 📦 Заказов: {row.total_orders:>3}")
+            print(f"   📊 Средний чек: ${format_cents(row.avg_order_value, grouping=False):>8} | "
+                  f"📅 Последний заказ: {row.last_order_date.strftime('%Y-%m-%d')}")
         
     except Exception as e:
         print(f"❌ Ошибка при получении данных о клиентах: {e}")
@@ -258,32 +417,30 @@ def show_top_customers(limit=10):
         if conn:
             conn.close()
 
-def show_daily_sales_trend(days_back=30):
-    """Показывает тренд ежедневных продаж"""
+def show_daily_sales_trend(days_back=30, sampling=None, requirements=None):
+    """Показывает тренд ежедневных продаж: из представления или, если requirements
+    допускают ошибку и это дешевле, по выборке (reports.source_router); с
+    sampling — приближенный по выборке заказов"""
     
+    if sampling is not None:
+        return approximate_reports.show_daily_sales_trend(days_back, sampling)
+    conn = None
     try:
-        conn = psycopg2.connect(get_connection_string())
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
-            sale_date,
-            orders_count,
-            total_revenue,
-            avg_order_value,
-            unique_customers
-        FROM daily_sales
-        WHERE sale_date >= %s
-        ORDER BY sale_date DESC;
-        """
-        
+        conn = get_connection(replica=True)
         cutoff_date = datetime.now() - timedelta(days=days_back)
+        decision = source_router.choose(conn, 'daily', DAILY_SALES_SQL, [cutoff_date],
+                                        requirements, since=cutoff_date)
+        if decision.source.kind == 'sample':
+            print(decision.describe())
+            return approximate_reports.show_daily_sales_trend(days_back, decision.sampling())
         
-        cursor.execute(query, [cutoff_date])
-        results = cursor.fetchall()
+        results, stale = run_budgeted(conn, 'daily_sales', fetch_daily_sales_records, days_back)
         
         print(f"\n📈 ТРЕНД ЕЖЕДНЕВНЫХ ПРОДАЖ (последние {days_back} дней)")
         print("=" * 80)
+        print(decision.describe())
+        if stale:
+            print(stale.describe())
         
         if not results:
             print("❌ Нет данных для отображения")
@@ -292,23 +449,20 @@ def show_daily_sales_trend(days_back=30):
         recent_days = results[:10]
         
         for row in recent_days:
-            sale_date, orders_count, total_revenue, avg_order_value, unique_customers = row
-            print(f"   📅 {sale_date.strftime('%Y-%m-%d')}: "
-                  f"${total_revenue:>8,.2f} | {orders_count:>2} заказов | "
-                  f"{unique_customers:>2} клиентов | чек ${avg_order_value:>6.2f}")
+            print(f"   📅 {row.sale_date.strftime('%Y-%m-%d')}: "
+                  f"${format_cents(row.revenue):>8} | {row.orders_count:>2} заказов | "
+                  f"{row.unique_customers:>2} клиентов | чек ${format_cents(row.avg_order_value, grouping=False):>6}")
         
-        total_revenue = sum(row[2] for row in results) 
-        avg_daily_revenue = total_revenue / len(results) if results else 0
+        # Сумма и среднее — в целых копейках; среднее округляется так же, как format(Decimal)
+        total_revenue = sum(row.revenue for row in results)
+        avg_daily_revenue = divide_half_even(total_revenue, len(results))
         
-        best_day = max(results, key=lambda x: x[2]) if results else None
+        best_day = max(results, key=lambda row: row.revenue)
         
         print(f"\n📊 СТАТИСТИКА ЗА {days_back} ДНЕЙ:")
-        print(f"   💰 Общая выручка: ${total_revenue:,.2f}")
-        print(f"   📊 Средняя дневная выручка: ${avg_daily_revenue:,.2f}")
-        if best_day:
-            print(f"   🏆 Лучший день: {best_day[0].strftime('%Y-%m-%d')} (${best_day[2]:,.2f})")
-        
-        cursor.close()
+        print(f"   💰 Общая выручка: ${format_cents(total_revenue)}")
+        print(f"   📊 Средняя дневная выручка: ${format_cents(avg_daily_revenue)}")
+        print(f"   🏆 Лучший день: {best_day.sale_date.strftime('%Y-%m-%d')} (${format_cents(best_day.revenue)})")
         
     except Exception as e:
         print(f"❌ Ошибка при анализе ежедневных продаж: {e}")
@@ -316,68 +470,73 @@ def show_daily_sales_trend(days_back=30):
         if conn:
             conn.close()
 
+def measure_performance(cursor):
+    """Время выполнения (мс) выборки из weekly_sales_report и того же запроса к базовым таблицам"""
+    cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) SELECT * FROM weekly_sales_report;")
+    mv_time = cursor.fetchone()[0][0]['Execution Time']
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {WEEKLY_SALES_REPORT_QUERY}")
+    direct_time = cursor.fetchone()[0][0]['Execution Time']
+    return mv_time, direct_time
+
 def performance_comparison():
     """Сравнение производительности материализованных vs обычных представлений"""
     
     try:
-        conn = psycopg2.connect(get_connection_string())
-        cursor = conn.cursor()
+        conn = get_connection(replica=True)
         
         print("\n⚡ СРАВНЕНИЕ ПРОИЗВОДИТЕЛЬНОСТИ")
         print("=" * 60)
         
-        # Тест материализованного представления
-        print("🔄 Тестирование материализованного представления...")
-        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) SELECT * FROM weekly_sales_report;")
-        mv_result = cursor.fetchone()[0][0]
-        mv_time = mv_result['Execution Time']
-        
-        # Тест аналогичного запроса к базовым таблицам
-        print("🔄 Тестирование запроса к базовым таблицам...")
-        complex_query = """
-        EXPLAIN (ANALYZE, FORMAT JSON) 
-        SELECT 
-            DATE_TRUNC('week', o.order_date) AS week_start,
-            COUNT(DISTINCT o.id) AS total_orders,
-            COUNT(DISTINCT o.user_id) AS unique_customers,
-            SUM(o.total_amount) AS total_revenue
-        FROM orders o
-        JOIN order_items oi ON o.id = oi.order_id
-        WHERE o.order_status = 'completed'
-        GROUP BY DATE_TRUNC('week', o.order_date)
-        ORDER BY week_start DESC;
-        """
-        cursor.execute(complex_query)
-        direct_result = cursor.fetchone()[0][0]
-        direct_time = direct_result['Execution Time']
+        # Материализованное представление и тот же запрос, которым оно определено, к базовым таблицам
+        print("🔄 Тестирование материализованного представления и запроса к базовым таблицам...")
+        (mv_time, direct_time), stale = run_budgeted(conn, 'performance', measure_performance)
         
         print(f"\n📊 РЕЗУЛЬТАТЫ:")
+        if stale:
+            print(stale.describe())
         print(f"   💾 Материализованное представление: {mv_time:.2f} ms")
         print(f"   🗄️  Прямой запрос к таблицам: {direct_time:.2f} ms")
         
         speedup = direct_time / mv_time if mv_time > 0 else 0
         print(f"   🚀 Ускорение: {speedup:.1f}x")
         
-        cursor.close()
-        
     except Exception as e:
         print(f"❌ Ошибка при тестировании производительности: {e}")
     finally:
         if conn:
             conn.close()
 
-def show_comprehensive_report():
-    """Комплексный отчет со всей аналитикой"""
+def show_comprehensive_report(sampling=None, requirements=None):
+    """Комплексный отчет со всей аналитикой (с sampling — приближенные разделы
+    по выборке заказов, без топа клиентов и сравнения производительности;
+    requirements — требования к источникам разделов, reports.source_router)"""
     
     print("🎯 КОМПЛЕКСНЫЙ АНАЛИТИЧЕСКИЙ ОТЧЕТ")
     print("=" * 100)
     
-    show_weekly_report(weeks_back=12)
-    show_monthly_report(months_back=6)
-    show_category_analysis()
-    show_top_customers(limit=8)
-    show_daily_sales_trend(days_back=30)
-    performance_comparison()
+    # Каждый раздел — отдельный этап профиля (python main.py --profile-stages)
+    with profiler.stage('report.weekly'):
+        show_weekly_report(weeks_back=12, sampling=sampling, requirements=requirements)
+    with profiler.stage('report.monthly'):
+        show_monthly_report(months_back=6, sampling=sampling, requirements=requirements)
+    with profiler.stage('report.categories'):
+        show_category_analysis(sampling=sampling, requirements=requirements)
+    if sampling is None:
+        with profiler.stage('report.customers'):
+            show_top_customers(limit=8)
+    with profiler.stage('report.daily'):
+        show_daily_sales_trend(days_back=30, sampling=sampling, requirements=requirements)
+    if sampling is None:
+        with profiler.stage('report.performance'):
+            performance_comparison()
+
+    # Разделы, не уложившиеся в бюджет времени (reports.budgets)
+    counters = budget_counters()
+    if counters:
+        timeouts = sum(value['timeouts'] for value in counters.values())
+        fallbacks = sum(value['fallbacks'] for value in counters.values())
+        print(f"\n⚠️  Превышений бюджета: {timeouts}, разделов из сохраненных результатов: {fallbacks} "
+              f"({', '.join(sorted(counters))})")
 
 if __name__ == "__main__":
     show_comprehensive_report()
\ No newline at end of file
@@ -0,0 +1,387 @@
+"""Архив закрытых месяцев: сжатые файлы строк и предагрегированная история.
+
+Заказы старше горизонта (ARCHIVE_HORIZON_MONTHS) не смотрят построчно, но
+пока они лежат в orders и order_items, каждое обновление MV агрегирует их
+заново. Архивирование в одной транзакции:
+
+1. выгружает строки заказов и позиций каждого месяца до границы в
+   <ARCHIVE_DIR>/<ГГГГ-ММ>/orders.csv.gz и order_items.csv.gz (COPY CSV с
+   заголовком — их можно загрузить обратно COPY ... FROM);
+2. добавляет их агрегаты в таблицы archive_* — все, что нужно
+   weekly_sales_report, monthly_sales_summary, daily_sales, category_analysis
+   и customer_analytics (см. scripts.create_views);
+3. удаляет строки из orders (позиции — каскадно).
+
+До этого на orders ставится ограничение CHECK (order_date >= граница):
+закрытые месяцы заморожены, и заказ задним числом в них не попадет. Если
+перенос не удался, ограничение возвращается к прежней границе архива.
+
+Граница — всегда начало месяца, поэтому дни и месяцы не делятся между живыми
+и архивными данными, и их итоги просто складываются. Неделя, через которую
+проходит граница, делится; ее архивные позиции остаются в
+archive_boundary_items (не больше недели строк), чтобы уникальные клиенты и
+товары недели считались вместе с живыми. Уникальные клиенты категорий за
+все время считаются по парам (категория, клиент) в archive_category_sales.
+
+После архивирования отчеты дают те же числа, что и до него, а размер живых
+таблиц и время обновления MV больше не растут с длиной истории. Представления
+построчного уровня (order_details, поиск) видят только живые заказы.
+
+Архивируется основной сервер; шарды (DB_SHARDS) получают таблицы archive_*
+вместе с заказами при раскладке (python -m scripts.sharding distribute), и
+отчеты по шардам складывают их так же, как представления. Удаление строк
+выгрузка изменений (scripts.cdc) по updated_at не видит: получатель узнает
+границу из archive_state (--status) и сам удаляет заказы до нее.
+
+    python -m scripts.archive                      # месяцы старше ARCHIVE_HORIZON_MONTHS
+    python -m scripts.archive --before 2025-01-01  # все до января 2025
+    python -m scripts.archive --status
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import time
+from datetime import datetime
+
+from psycopg2 import sql
+
+from database.connection import get_connection
+from database.sharding import SHARDS
+from scripts.refresh_daemon import REFRESH_LOCK_NAMESPACE
+
+ARCHIVE_HORIZON_MONTHS = int(os.getenv('ARCHIVE_HORIZON_MONTHS', '12'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+# Ожидание блокировки orders при установке ограничения: не выстраивать очередь за долгими запросами
+ARCHIVE_LOCK_TIMEOUT_MS = int(os.getenv('ARCHIVE_LOCK_TIMEOUT_MS', '5000'))
+
+# Таблицы архива: создаются SCHEMA_SQL и переносятся вместе с данными при перезагрузке
+ARCHIVE_TABLES = (
+    'archive_state', 'archive_weekly_sales', 'archive_boundary_items', 'archive_monthly_sales',
+    'archive_daily_sales', 'archive_category_sales', 'archive_customer_sales',
+)
+
+# Столбцы выгрузки: subtotal вычисляемый и при загрузке обратно не указывается
+EXPORT_COLUMNS = {
+    'orders': ('id', 'user_id', 'order_date', 'total_amount', 'order_status', 'created_at', 'updated_at'),
+    'order_items': ('id', 'order_id', 'product_id', 'quantity', 'unit_price', 'created_at', 'updated_at'),
+}
+
+STATE_SQL = "SELECT archived_before, archived_at FROM archive_state"
+
+MONTHS_SQL = """
+SELECT DATE_TRUNC('month', order_date) AS month_start, COUNT(*)
+FROM orders
+WHERE order_date < %(before)s
+GROUP BY 1
+ORDER BY 1
+"""
+
+# Позиции выполненных заказов до границы: из них собираются все агрегаты
+ARCHIVED_LINES = """
+    SELECT
+        DATE_TRUNC('week', o.order_date) AS week_start,
+        p.category,
+        o.id AS order_id,
+        o.user_id,
+        oi.product_id,
+        oi.subtotal,
+        oi.quantity
+    FROM orders o
+    JOIN order_items oi ON o.id = oi.order_id
+    JOIN products p ON oi.product_id = p.id
+    WHERE o.order_status = 'completed'
+      AND o.order_date < %(before)s
+"""
+
+# Недели целиком до граничной: живые строки и архивная часть прежней граничной недели
+ARCHIVE_WEEKLY_SQL = f"""
+INSERT INTO archive_weekly_sales (week_start, category, orders, customers, revenue, items, products)
+SELECT
+    week_start, category,
+    COUNT(DISTINCT order_id), COUNT(DISTINCT user_id), SUM(subtotal), SUM(quantity), COUNT(DISTINCT product_id)
+FROM (
+    {ARCHIVED_LINES}
+    UNION ALL
+    SELECT week_start, category, order_id, user_id, product_id, subtotal, quantity
+    FROM archive_boundary_items
+) lines
+WHERE week_start < %(boundary_week)s
+GROUP BY week_start, category
+"""
+
+ARCHIVE_BOUNDARY_SQL = f"""
+INSERT INTO archive_boundary_items (week_start, category, order_id, user_id, product_id, subtotal, quantity)
+SELECT * FROM ({ARCHIVED_LINES}) lines
+WHERE week_start >= %(boundary_week)s
+"""
+
+ARCHIVE_MONTHLY_SQL = """
+INSERT INTO archive_monthly_sales (month_start, orders, customers, revenue, items, joined_rows)
+SELECT
+    DATE_TRUNC('month', o.order_date),
+    COUNT(DISTINCT o.id), COUNT(DISTINCT o.user_id), SUM(o.total_amount), SUM(oi.quantity), COUNT(*)
+FROM orders o
+JOIN order_items oi ON o.id = oi.order_id
+WHERE o.order_status = 'completed'
+  AND o.order_date < %(before)s
+GROUP BY 1
+"""
+
+ARCHIVE_DAILY_SQL = """
+INSERT INTO archive_daily_sales (sale_date, orders, revenue, customers)
+SELECT DATE(order_date), COUNT(DISTINCT id), SUM(total_amount), COUNT(DISTINCT user_id)
+FROM orders
+WHERE order_status = 'completed'
+  AND order_date < %(before)s
+GROUP BY 1
+"""
+
+ARCHIVE_CATEGORY_SQL = """
+INSERT INTO archive_category_sales (category, user_id, orders, items, revenue, price_sum, joined_rows)
+SELECT p.category, o.user_id, COUNT(DISTINCT o.id), SUM(oi.quantity), SUM(oi.subtotal), SUM(p.price), COUNT(*)
+FROM products p
+JOIN order_items oi ON p.id = oi.product_id
+JOIN orders o ON oi.order_id = o.id
+WHERE o.order_status = 'completed'
+  AND o.order_date < %(before)s
+GROUP BY p.category, o.user_id
+ON CONFLICT ((COALESCE(category, '')), (COALESCE(user_id, 0))) DO UPDATE SET
+    orders = archive_category_sales.orders + EXCLUDED.orders,
+    items = archive_category_sales.items + EXCLUDED.items,
+    revenue = archive_category_sales.revenue + EXCLUDED.revenue,
+    price_sum = archive_category_sales.price_sum + EXCLUDED.price_sum,
+    joined_rows = archive_category_sales.joined_rows + EXCLUDED.joined_rows
+"""
+
+ARCHIVE_CUSTOMERS_SQL = """
+INSERT INTO archive_customer_sales (user_id, orders, spent, last_order_date)
+SELECT user_id, COUNT(*), SUM(total_amount), MAX(order_date)
+FROM orders
+WHERE order_status = 'completed'
+  AND order_date < %(before)s
+  AND user_id IS NOT NULL
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET
+    orders = archive_customer_sales.orders + EXCLUDED.orders,
+    spent = archive_customer_sales.spent + EXCLUDED.spent,
+    last_order_date = GREATEST(archive_customer_sales.last_order_date, EXCLUDED.last_order_date)
+"""
+
+# Порядок важен: недели читают прежние граничные позиции до их замены
+ARCHIVE_AGGREGATES = [
+    ARCHIVE_WEEKLY_SQL,
+    "DELETE FROM archive_boundary_items",
+    ARCHIVE_BOUNDARY_SQL,
+    ARCHIVE_MONTHLY_SQL,
+    ARCHIVE_DAILY_SQL,
+    ARCHIVE_CATEGORY_SQL,
+    ARCHIVE_CUSTOMERS_SQL,
+]
+
+DELETE_SQL = "DELETE FROM orders WHERE order_date < %(before)s"
+
+SAVE_STATE_SQL = """
+INSERT INTO archive_state (archived_before) VALUES (%(before)s)
+ON CONFLICT (id) DO UPDATE SET archived_before = EXCLUDED.archived_before, archived_at = CURRENT_TIMESTAMP
+"""
+
+# Очистка данных (main.py generate --force) сбрасывает и архив: он описывает удаленные заказы
+RESET_ARCHIVE_SQL = "ALTER TABLE orders DROP CONSTRAINT IF EXISTS orders_not_archived;\n" + "".join(
+    f"DELETE FROM {name};\n" for name in ARCHIVE_TABLES
+)
+
+HOT_SIZE_SQL = "SELECT pg_total_relation_size('orders') + pg_total_relation_size('order_items')"
+
+
+def archive_cutoff(horizon_months, now=None):
+    """Граница архива: начало месяца, в который попадает «сейчас минус horizon_months месяцев»"""
+    now = now or datetime.now()
+    months = now.year * 12 + now.month - 1 - horizon_months
+    return datetime(months // 12, months % 12 + 1, 1)
+
+def _week_start(moment):
+    day = datetime(moment.year, moment.month, moment.day)
+    return datetime.fromordinal(day.toordinal() - day.weekday())
+
+def _next_month(month_start):
+    return month_start.replace(year=month_start.year + month_start.month // 12, month=month_start.month % 12 + 1)
+
+def _export_query(cursor, table, month_start, before):
+    columns = sql.SQL(", ").join(sql.SQL("t.{}").format(sql.Identifier(name)) for name in EXPORT_COLUMNS[table])
+    join = sql.SQL("JOIN orders o ON o.id = t.order_id") if table == 'order_items' else sql.SQL("")
+    date = sql.SQL("o.order_date") if table == 'order_items' else sql.SQL("t.order_date")
+    query = sql.SQL(
+        "COPY (SELECT {columns} FROM {table} t {join} WHERE {date} >= %s AND {date} < %s ORDER BY t.id) "
+        "TO STDOUT WITH (FORMAT csv, HEADER)"
+    ).format(columns=columns, table=sql.Identifier(table), join=join, date=date)
+    return cursor.mogrify(query, [month_start, min(_next_month(month_start), before)]).decode()
+
+def export_month(cursor, month_start, before, output_dir):
+    """Выгружает заказы и позиции месяца (до before) в сжатые CSV; пути файлов"""
+    directory = os.path.join(output_dir, month_start.strftime('%Y-%m'))
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for table in EXPORT_COLUMNS:
+        path = os.path.join(directory, f"{table}.csv.gz")
+        # Во временный файл и переименование: прерванная выгрузка не оставит обрезанный архив.
+        # Повтор после отката транзакции перезапишет файл теми же строками
+        temporary = path + ".tmp"
+        with gzip.open(temporary, 'wt', encoding='utf-8', newline='') as f:
+            cursor.copy_expert(_export_query(cursor, table, month_start, before), f)
+        os.replace(temporary, path)
+        paths.append(path)
+    return paths
+
+def _close_months(cursor, before):
+    """Ограничение orders_not_archived по границе before (None — без ограничения).
+    NOT VALID — без проверки существующих строк, поэтому эксклюзивная блокировка короткая"""
+    cursor.execute(f"SET LOCAL lock_timeout = '{ARCHIVE_LOCK_TIMEOUT_MS}ms'")
+    cursor.execute("ALTER TABLE orders DROP CONSTRAINT IF EXISTS orders_not_archived")
+    if before is not None:
+        cursor.execute(sql.SQL("ALTER TABLE orders ADD CONSTRAINT orders_not_archived "
+                               "CHECK (order_date >= {}) NOT VALID").format(sql.Literal(before)))
+
+def _reopen_months(conn, cursor, archived_before):
+    """После неудачного переноса возвращает ограничение к прежней границе архива"""
+    try:
+        _close_months(cursor, archived_before)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        boundary = f"к границе {archived_before:%Y-%m-%d}" if archived_before else "(снять)"
+        print(f"❌ Не удалось вернуть ограничение orders_not_archived {boundary}: {e}")
+
+def archive_status(cursor):
+    """(archived_before, archived_at) или None, если архивирования еще не было"""
+    cursor.execute(STATE_SQL)
+    return cursor.fetchone()
+
+def archive_closed_months(before=None, horizon_months=ARCHIVE_HORIZON_MONTHS, output_dir=ARCHIVE_DIR, vacuum=True):
+    """Переносит заказы до before (по умолчанию — старше horizon_months месяцев) в архив.
+
+    Возвращает словарь с итогами или None, если архивирование уже выполняет
+    другой процесс (сессионная рекомендательная блокировка).
+    """
+    before = before or archive_cutoff(horizon_months)
+    if (before.day, before.hour, before.minute, before.second, before.microsecond) != (1, 0, 0, 0, 0):
+        raise ValueError(f"Граница архива должна быть началом месяца, а не {before}")
+
+    conn = get_connection(label='archive')
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(%s, hashtext('archive'))", [REFRESH_LOCK_NAMESPACE])
+    if not cursor.fetchone()[0]:
+        conn.close()
+        print("⚠️  Архивирование уже выполняется другим процессом")
+        return None
+    try:
+        started = time.perf_counter()
+        state = archive_status(cursor)
+        if state and before <= state[0]:
+            print(f"✅ Все до {before:%Y-%m-%d} уже в архиве (граница {state[0]:%Y-%m-%d})")
+            return {'archived_before': state[0], 'months': [], 'orders': 0, 'files': []}
+
+        # Сначала закрываем месяцы: заказ с датой до границы отклоняется, и набор
+        # архивируемых строк больше не пополняется
+        _close_months(cursor, before)
+        conn.commit()
+
+        # Выгрузка, агрегаты и удаление видят один снимок; если архивируемый
+        # заказ изменят параллельно, транзакция откатится, а не разойдется с файлами
+        try:
+            conn.set_session(isolation_level='REPEATABLE READ')
+            cursor.execute(HOT_SIZE_SQL)
+            hot_before = cursor.fetchone()[0]
+            params = {'before': before, 'boundary_week': _week_start(before)}
+            cursor.execute(MONTHS_SQL, params)
+            months = cursor.fetchall()
+
+            files = []
+            for month_start, _ in months:
+                files += export_month(cursor, month_start, before, output_dir)
+            for statement in ARCHIVE_AGGREGATES:
+                cursor.execute(statement, params)
+            cursor.execute(DELETE_SQL, params)
+            orders = cursor.rowcount
+            cursor.execute(SAVE_STATE_SQL, params)
+            conn.commit()
+        except Exception:
+            # Месяцы закрыты, но не перенесены: ограничение возвращается к прежней
+            # границе, иначе их живые заказы нельзя было бы ни добавить, ни изменить
+            conn.rollback()
+            _reopen_months(conn, cursor, state[0] if state else None)
+            raise
+    finally:
+        # Незавершенная транзакция (ошибка или ранний выход) откатывается до снятия блокировки
+        conn.rollback()
+        conn.autocommit = True
+        cursor.execute("SELECT pg_advisory_unlock(%s, hashtext('archive'))", [REFRESH_LOCK_NAMESPACE])
+        cursor.close()
+        conn.close()
+
+    if vacuum:
+        # Освободившееся место переиспользуется новыми заказами: таблицы перестают расти
+        conn = get_connection(label='archive.vacuum')
+        conn.autocommit = True
+        try:
+            conn.cursor().execute("VACUUM (ANALYZE) orders, order_items")
+        finally:
+            conn.close()
+
+    result = {
+        'archived_before': before,
+        'months': [month_start for month_start, _ in months],
+        'orders': orders,
+        'files': files,
+        'file_bytes': sum(os.path.getsize(path) for path in files),
+        'hot_bytes_before': hot_before,
+        'seconds': time.perf_counter() - started,
+    }
+    print(f"🗄️  В архив перенесено {orders} заказов за {len(months)} мес. до {before:%Y-%m-%d} "
+          f"за {result['seconds']:.1f} с")
+    print(f"   📦 Файлы: {len(files)} ({result['file_bytes'] / 1024:.0f} КБ) в {output_dir}")
+    if SHARDS:
+        # Отчеты по шардам читают архив шардов: до раскладки на них остается прежняя история
+        print("⚠️  Настроены шарды (DB_SHARDS): разложите данные и архив заново — python -m scripts.sharding distribute")
+    return result
+
+def print_archive_status():
+    conn = get_connection(label='archive.status')
+    cursor = conn.cursor()
+    try:
+        state = archive_status(cursor)
+        cursor.execute(HOT_SIZE_SQL)
+        hot = cursor.fetchone()[0]
+        cursor.execute("SELECT " + " + ".join(f"pg_total_relation_size('{name}')" for name in ARCHIVE_TABLES))
+        archived = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+    if state is None:
+        print("🗄️  Архивирования еще не было")
+    else:
+        print(f"🗄️  В архиве все до {state[0]:%Y-%m-%d} (последний перенос {state[1]:%Y-%m-%d %H:%M})")
+    print(f"   🔥 orders + order_items: {hot / 1024 / 1024:.1f} МБ | 📚 таблицы archive_*: {archived / 1024 / 1024:.1f} МБ")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Перенос закрытых месяцев в архив")
+    parser.add_argument('--horizon-months', type=int, default=ARCHIVE_HORIZON_MONTHS,
+                        help="архивировать месяцы старше стольких месяцев (ARCHIVE_HORIZON_MONTHS)")
+    parser.add_argument('--before', type=datetime.fromisoformat, help="граница архива — начало месяца, ГГГГ-ММ-01")
+    parser.add_argument('--output', default=ARCHIVE_DIR, help="каталог файлов архива (ARCHIVE_DIR)")
+    parser.add_argument('--status', action='store_true', help="показать границу архива и размеры таблиц")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.status:
+            print_archive_status()
+            return 0
+        result = archive_closed_months(args.before, args.horizon_months, args.output)
+        return 0 if result is not None else 1
+    except Exception as e:
+        print(f"❌ Ошибка при архивировании: {e}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
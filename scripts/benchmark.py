@@ -0,0 +1,268 @@
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+from database.config import DB_CONFIG
+from database.connection import get_connection
+from database.init_database import init_database, ensure_database
+from database.session_profiles import apply_profile
+from scripts.create_views import (
+    VIEW_QUERIES,
+    MATERIALIZED_VIEW_QUERIES,
+    create_analytical_views,
+)
+from scripts.generate_data import generate_scaled_data
+from reports.weekly_sales_report import (
+    fetch_weekly_report,
+    fetch_weekly_summary,
+    fetch_monthly_report,
+    fetch_monthly_growth,
+    fetch_category_analysis,
+    fetch_top_customers,
+    fetch_daily_sales,
+)
+
+BENCH_DATABASE = 'sales_analytics_bench'
+DEFAULT_SCALES = [10_000, 1_000_000, 10_000_000]
+
+REPORT_CASES = {
+    'report.weekly': lambda cursor: fetch_weekly_report(cursor, weeks_back=12),
+    'report.weekly_summary': lambda cursor: fetch_weekly_summary(cursor, weeks_back=12),
+    'report.monthly': lambda cursor: fetch_monthly_report(cursor, months_back=6),
+    'report.monthly_growth': lambda cursor: fetch_monthly_growth(cursor, months_back=6),
+    'report.categories': fetch_category_analysis,
+    'report.top_customers': lambda cursor: fetch_top_customers(cursor, limit=10),
+    'report.daily': lambda cursor: fetch_daily_sales(cursor, days_back=30),
+}
+
+
+def percentile(values, p):
+    """Перцентиль p (0..100) с линейной интерполяцией"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def summarize(timings_ms):
+    """Сводная статистика по списку замеров в миллисекундах"""
+    return {
+        'repetitions': len(timings_ms),
+        'min_ms': round(min(timings_ms), 3),
+        'mean_ms': round(sum(timings_ms) / len(timings_ms), 3),
+        'p50_ms': round(percentile(timings_ms, 50), 3),
+        'p95_ms': round(percentile(timings_ms, 95), 3),
+        'p99_ms': round(percentile(timings_ms, 99), 3),
+        'max_ms': round(max(timings_ms), 3),
+    }
+
+def time_case(func, warmup, repetitions):
+    """Прогревочные и измеряемые запуски func, время в миллисекундах"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repetitions):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+
+def check_mv_equivalence(cursor, name):
+    """Количество строк, различающихся между MV и ее определяющим запросом"""
+    query = MATERIALIZED_VIEW_QUERIES[name]
+    cursor.execute(f"""
+    SELECT
+        (SELECT COUNT(*) FROM (TABLE {name} EXCEPT ALL ({query})) AS only_in_view),
+        (SELECT COUNT(*) FROM (({query}) EXCEPT ALL TABLE {name}) AS only_in_query)
+    """)
+    only_in_view, only_in_query = cursor.fetchone()
+    return {
+        'only_in_view': only_in_view,
+        'only_in_query': only_in_query,
+        'equivalent': only_in_view == 0 and only_in_query == 0,
+    }
+
+def benchmark_current_database(warmup=2, repetitions=10):
+    """Замеры всех представлений, обновлений MV и отчетов на текущих данных"""
+    conn = get_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    def select_all(relation):
+        def run():
+            cursor.execute(f"SELECT * FROM {relation}")
+            cursor.fetchall()
+        return run
+
+    def run_sql(statement):
+        return lambda: cursor.execute(statement)
+
+    def in_transaction(func, profile=None):
+        # Профилям сессии (SET LOCAL) нужна транзакция, а соединение в autocommit
+        def run():
+            cursor.execute("BEGIN")
+            try:
+                if profile:
+                    apply_profile(cursor, profile)
+                func()
+            finally:
+                cursor.execute("COMMIT")
+        return run
+
+    cases = {}
+    try:
+        for name in VIEW_QUERIES:
+            print(f"   ⏱️  view.{name}")
+            cases[f'view.{name}'] = time_case(select_all(name), warmup, repetitions)
+
+        for name, query in MATERIALIZED_VIEW_QUERIES.items():
+            print(f"   ⏱️  matview.{name}")
+            cases[f'matview.{name}'] = time_case(select_all(name), warmup, repetitions)
+            cases[f'live.{name}'] = time_case(select_all(f"({query}) AS live"), warmup, repetitions)
+            cases[f'refresh.{name}'] = time_case(
+                in_transaction(run_sql(f"REFRESH MATERIALIZED VIEW {name}"), 'refresh'), warmup, repetitions)
+            cases[f'refresh_concurrently.{name}'] = time_case(
+                in_transaction(run_sql(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"), 'refresh'),
+                warmup, repetitions)
+
+        for name, fetch in REPORT_CASES.items():
+            print(f"   ⏱️  {name}")
+            cases[name] = time_case(in_transaction(lambda: fetch(cursor)), warmup, repetitions)
+
+        equivalence = {name: check_mv_equivalence(cursor, name) for name in MATERIALIZED_VIEW_QUERIES}
+        return {'cases': cases, 'mv_equivalence': equivalence}
+
+    finally:
+        cursor.close()
+        conn.close()
+
+def run_benchmark(scales=None, warmup=2, repetitions=10, database=BENCH_DATABASE):
+    """Загружает каждый масштаб в отдельную базу и замеряет все сценарии.
+
+    Рабочая база не затрагивается: на время прогона DB_CONFIG переключается
+    на database, которая создается при необходимости.
+    """
+    scales = scales or DEFAULT_SCALES
+    original_database = DB_CONFIG['database']
+    ensure_database(database)
+    DB_CONFIG['database'] = database
+
+    results = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'database': database,
+            'warmup': warmup,
+            'repetitions': repetitions,
+        },
+        'scales': {},
+    }
+    try:
+        init_database()
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SHOW server_version")
+        results['meta']['server_version'] = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+
+        for orders_count in scales:
+            print(f"\n📏 МАСШТАБ: {orders_count:,} заказов")
+            load_started = time.perf_counter()
+            generate_scaled_data(orders_count)
+            create_analytical_views()
+            load_seconds = time.perf_counter() - load_started
+
+            scale_result = benchmark_current_database(warmup, repetitions)
+            scale_result['load_seconds'] = round(load_seconds, 2)
+            results['scales'][str(orders_count)] = scale_result
+
+            for name, check in scale_result['mv_equivalence'].items():
+                status = "✅" if check['equivalent'] else "❌"
+                print(f"   {status} {name} совпадает с определяющим запросом: {check['equivalent']}")
+    finally:
+        DB_CONFIG['database'] = original_database
+
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold=1.25, metric='p50_ms'):
+    """Сценарии, ставшие медленнее базовой линии более чем в threshold раз"""
+    regressions = []
+    for scale, scale_result in results['scales'].items():
+        baseline_cases = baseline.get('scales', {}).get(scale, {}).get('cases', {})
+        for name, stats in scale_result['cases'].items():
+            previous = baseline_cases.get(name)
+            if not previous or not previous.get(metric):
+                continue
+            ratio = stats[metric] / previous[metric]
+            if ratio > threshold:
+                regressions.append({
+                    'scale': scale,
+                    'case': name,
+                    'baseline': previous[metric],
+                    'current': stats[metric],
+                    'ratio': round(ratio, 2),
+                })
+        for name, check in scale_result['mv_equivalence'].items():
+            if not check['equivalent']:
+                regressions.append({'scale': scale, 'case': f'mv_equivalence.{name}', 'ratio': None})
+    return regressions
+
+def print_results(results):
+    for scale, scale_result in results['scales'].items():
+        print(f"\n📊 РЕЗУЛЬТАТЫ ДЛЯ {int(scale):,} ЗАКАЗОВ (загрузка {scale_result['load_seconds']} с)")
+        print(f"   {'Сценарий':<45} {'p50':>10} {'p95':>10} {'p99':>10}")
+        for name, stats in scale_result['cases'].items():
+            print(f"   {name:<45} {stats['p50_ms']:>8.2f}ms {stats['p95_ms']:>8.2f}ms {stats['p99_ms']:>8.2f}ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк представлений и отчетов на разных объемах данных")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="количество заказов для каждого масштаба")
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--repetitions', type=int, default=10)
+    parser.add_argument('--database', default=BENCH_DATABASE)
+    parser.add_argument('--output', default='bench_results.json', help="файл для результатов в JSON")
+    parser.add_argument('--baseline', help="файл базовой линии для поиска регрессий")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="допустимое замедление относительно базовой линии")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="сохранить результаты как новую базовую линию")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.scales, args.warmup, args.repetitions, args.database)
+    print_results(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Результаты сохранены в {args.output}")
+
+    if args.save_baseline and args.baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Базовая линия сохранена в {args.baseline}")
+        return 0
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ НАЙДЕНО РЕГРЕССИЙ: {len(regressions)}")
+            for regression in regressions:
+                if regression['ratio'] is None:
+                    print(f"   {regression['scale']:>10} {regression['case']}: результаты MV и запроса расходятся")
+                else:
+                    print(f"   {regression['scale']:>10} {regression['case']}: "
+                          f"{regression['baseline']:.2f}ms → {regression['current']:.2f}ms ({regression['ratio']}x)")
+            return 1
+        print("\n✅ Регрессий относительно базовой линии нет")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
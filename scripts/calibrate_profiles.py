@@ -0,0 +1,151 @@
+"""Калибровка профилей сессии под текущее железо и объем данных.
+
+Для каждого профиля берутся реальные запросы, которые с ним выполняются
+(определяющие запросы MV для refresh, запросы отчетов для heavy_report и
+point_lookup), и замеряются через EXPLAIN (ANALYZE, TIMING OFF) с
+кандидатными настройками. Настройки перебираются по одной (покоординатный
+спуск): значение меняется, только если заметно (MIN_GAIN, MIN_GAIN_MS)
+сокращает суммарное время запросов профиля. Лучшие значения сохраняются в
+SESSION_PROFILES_PATH и подхватываются database.session_profiles.
+
+    python -m scripts.calibrate_profiles
+    python -m scripts.calibrate_profiles --profile heavy_report --repetitions 5
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+from database.connection import get_connection
+from database import session_profiles
+from database.session_profiles import DEFAULT_PROFILES, SESSION_PROFILES_PATH, apply_settings, load_profiles
+from reports.weekly_sales_report import REPORT_QUERIES, REPORT_PROFILES
+from scripts.benchmark import percentile
+from scripts.create_views import MATERIALIZED_VIEW_QUERIES
+
+# Кандидатные значения в порядке перебора
+CANDIDATES = {
+    'work_mem': ['4MB', '16MB', '64MB', '256MB'],
+    'max_parallel_workers_per_gather': [0, 2, 4],
+    'jit': ['off', 'on'],
+}
+
+# Новое значение принимается, только если быстрее текущего больше чем на эту долю
+# и на столько миллисекунд: иначе шум замеров переключал бы настройки туда и обратно
+MIN_GAIN = 0.05
+MIN_GAIN_MS = 0.5
+
+
+def calibration_workload():
+    """Профиль -> [(имя, SQL, параметры)] запросов, которые с ним выполняются"""
+    workload = {name: [] for name in DEFAULT_PROFILES}
+    for name, query in MATERIALIZED_VIEW_QUERIES.items():
+        # REFRESH выполняет определяющий запрос MV
+        workload['refresh'].append((f'matview.{name}', query, []))
+    for name, (query, params) in REPORT_QUERIES.items():
+        workload[REPORT_PROFILES[name]].append((f'report.{name}', query, params()))
+    return workload
+
+def measure_query(cursor, settings, query, params):
+    """Время запроса (планирование + выполнение) в мс с настройками settings"""
+    cursor.execute("BEGIN")
+    try:
+        apply_settings(cursor, settings)
+        cursor.execute(f"EXPLAIN (ANALYZE, TIMING OFF, FORMAT JSON) {query}", params)
+        result = cursor.fetchone()[0][0]
+    finally:
+        cursor.execute("ROLLBACK")
+    return result['Planning Time'] + result['Execution Time']
+
+def measure_settings(cursor, settings, queries, warmup=1, repetitions=3):
+    """Сумма медиан времени всех запросов профиля в мс"""
+    total = 0.0
+    for _, query, params in queries:
+        for _ in range(warmup):
+            measure_query(cursor, settings, query, params)
+        timings = [measure_query(cursor, settings, query, params) for _ in range(repetitions)]
+        total += percentile(timings, 50)
+    return total
+
+def calibrate_profile(cursor, name, start, queries, warmup=1, repetitions=3):
+    """Покоординатный подбор настроек профиля: (лучшие настройки, время с начальными, время с лучшими)"""
+    best = dict(start)
+    best_ms = initial_ms = measure_settings(cursor, best, queries, warmup, repetitions)
+    print(f"   ⏱️  {name}: текущие настройки {initial_ms:.1f} ms")
+    for setting, values in CANDIDATES.items():
+        for value in values:
+            if str(value) == str(best.get(setting)):
+                continue
+            candidate = dict(best, **{setting: value})
+            elapsed = measure_settings(cursor, candidate, queries, warmup, repetitions)
+            if elapsed < best_ms * (1 - MIN_GAIN) and best_ms - elapsed >= MIN_GAIN_MS:
+                best, best_ms = candidate, elapsed
+        print(f"      {setting} = {best[setting]} ({best_ms:.1f} ms)")
+    return best, initial_ms, best_ms
+
+def calibrate(profiles=None, warmup=1, repetitions=3, path=None):
+    """Калибрует профили и сохраняет лучшие настройки в path; возвращает сохраненный результат"""
+    path = path or SESSION_PROFILES_PATH
+    workload = calibration_workload()
+    profiles = profiles or list(workload)
+    current = load_profiles(path)
+
+    conn = get_connection(label='calibrate_profiles')
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW server_version")
+        server_version = cursor.fetchone()[0]
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'orders'::regclass")
+        orders_estimate = cursor.fetchone()[0]
+
+        result = {
+            'calibrated_at': datetime.now().isoformat(timespec='seconds'),
+            'server_version': server_version,
+            'orders_estimate': orders_estimate,
+            'profiles': {name: current[name] for name in workload},
+            'timings_ms': {},
+        }
+        for name in profiles:
+            best, initial_ms, best_ms = calibrate_profile(
+                cursor, name, current[name], workload[name], warmup, repetitions)
+            result['profiles'][name] = best
+            result['timings_ms'][name] = {'initial': round(initial_ms, 3), 'calibrated': round(best_ms, 3)}
+    finally:
+        cursor.close()
+        conn.close()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    # Текущий процесс тоже переходит на новые значения
+    session_profiles.PROFILES.update(load_profiles(path))
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Подбор настроек профилей сессии на текущих данных")
+    parser.add_argument('--profile', action='append', choices=list(DEFAULT_PROFILES),
+                        help="калибровать только этот профиль (можно повторять)")
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--output', default=SESSION_PROFILES_PATH, help="файл для откалиброванных профилей")
+    args = parser.parse_args(argv)
+
+    print("🎛️  Калибровка профилей сессии...")
+    try:
+        result = calibrate(args.profile, args.warmup, args.repetitions, args.output)
+    except Exception as e:
+        print(f"❌ Ошибка калибровки профилей: {e}")
+        return 1
+
+    for name, timings in result['timings_ms'].items():
+        settings = ", ".join(f"{key}={value}" for key, value in result['profiles'][name].items())
+        print(f"   ✅ {name}: {timings['initial']:.1f} → {timings['calibrated']:.1f} ms ({settings})")
+    print(f"💾 Профили сохранены в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Инкрементальная выгрузка изменений (CDC) по updated_at.
+
+Триггеры из database.init_database ставят updated_at = NOW() при каждом
+UPDATE, а при INSERT его заполняет DEFAULT. Для каждого потребителя и таблицы
+хранится водяной знак — (updated_at, id) последней выгруженной строки; при
+синхронизации читаются только строки после него, пачками по индексу
+(updated_at, id).
+
+NOW() — время начала транзакции, а не фиксации: транзакция, начатая раньше,
+может зафиксироваться позже и записать строки «в прошлое» относительно уже
+выгруженных. Поэтому каждая синхронизация читает строки строго до безопасной
+границы — начала самой старой открытой транзакции в базе (но не позже
+текущего момента). Все, что раньше границы, уже зафиксировано или никогда не
+появится, а строки, измененные во время выгрузки, получают updated_at не
+раньше границы и попадают в следующую синхронизацию.
+
+Доставка «хотя бы один раз»: водяной знак сдвигается после того, как
+получатель принял пачку, поэтому после сбоя пачка может прийти повторно, а
+строка, измененная между синхронизациями, приходит в новой версии —
+получателю достаточно применять строки по id. Удаления по updated_at не
+видны и не выгружаются — в том числе заказы и позиции закрытых месяцев,
+которые удаляет scripts.archive: после архивирования получатель удаляет у
+себя заказы с order_date раньше archive_state.archived_before (позиции — по
+order_id).
+
+    python -m scripts.cdc sync --consumer warehouse --output-dir cdc_out
+    python -m scripts.cdc status
+    python -m scripts.cdc reset --consumer warehouse
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+
+from database.connection import get_connection
+
+# Порядок выгрузки: родительские таблицы раньше дочерних
+CDC_TABLES = ('users', 'products', 'orders', 'order_items')
+DEFAULT_BATCH_SIZE = 1000
+
+WATERMARKS_SQL = """
+CREATE TABLE IF NOT EXISTS cdc_watermarks (
+    consumer VARCHAR(100) NOT NULL,
+    table_name VARCHAR(100) NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT '-infinity',
+    last_id INTEGER NOT NULL DEFAULT 0,
+    synced_at TIMESTAMP,
+    PRIMARY KEY (consumer, table_name)
+);
+"""
+
+# Граница, до которой все изменения уже зафиксированы: updated_at пишется как
+# NOW() транзакции, поэтому строки открытых транзакций не раньше их начала
+SAFE_BOUND_SQL = """
+SELECT LEAST(
+    now(),
+    (SELECT MIN(xact_start)
+     FROM pg_stat_activity
+     WHERE datname = current_database()
+       AND pid <> pg_backend_pid()
+       AND backend_type = 'client backend'
+       AND xact_start IS NOT NULL)
+)::timestamp
+"""
+
+WATERMARK_SQL = """
+SELECT updated_at, last_id FROM cdc_watermarks WHERE consumer = %s AND table_name = %s
+"""
+
+SAVE_WATERMARK_SQL = """
+INSERT INTO cdc_watermarks (consumer, table_name, updated_at, last_id, synced_at)
+VALUES (%s, %s, %s, %s, now())
+ON CONFLICT (consumer, table_name) DO UPDATE
+SET updated_at = EXCLUDED.updated_at, last_id = EXCLUDED.last_id, synced_at = EXCLUDED.synced_at
+"""
+
+CHANGES_SQL = """
+SELECT *
+FROM {table}
+WHERE (updated_at, id) > (%(updated_at)s, %(last_id)s)
+  AND updated_at < %(bound)s
+ORDER BY updated_at, id
+LIMIT %(batch_size)s
+"""
+
+
+def setup_cdc(cursor):
+    """Таблица водяных знаков и индексы (updated_at, id) без блокировки записи.
+
+    CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции, поэтому cursor
+    должен быть в autocommit.
+    """
+    cursor.execute(WATERMARKS_SQL)
+    for table in CDC_TABLES:
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_{table}_updated_at "
+                       f"ON {table} (updated_at, id)")
+
+def safe_bound(cursor):
+    cursor.execute(SAFE_BOUND_SQL)
+    return cursor.fetchone()[0]
+
+def get_watermark(cursor, consumer, table):
+    """(updated_at, id) последней выгруженной строки; для нового потребителя — начало времен"""
+    cursor.execute(WATERMARK_SQL, [consumer, table])
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (datetime.min, 0)
+
+def save_watermark(cursor, consumer, table, watermark):
+    cursor.execute(SAVE_WATERMARK_SQL, [consumer, table, watermark[0], watermark[1]])
+
+def read_changes(cursor, table, watermark, bound, batch_size=DEFAULT_BATCH_SIZE):
+    """Одна пачка измененных строк таблицы после watermark и до bound, как словари"""
+    if table not in CDC_TABLES:
+        raise ValueError(f"Таблица не выгружается: {table}")
+    cursor.execute(CHANGES_SQL.format(table=table), {
+        'updated_at': watermark[0],
+        'last_id': watermark[1],
+        'bound': bound,
+        'batch_size': batch_size,
+    })
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def extract_changes(consumer, sink, tables=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Выгружает изменения всех таблиц в sink(table, rows) и сдвигает водяные знаки.
+
+    Возвращает {таблица: число выгруженных строк}.
+    """
+    tables = tables or CDC_TABLES
+    conn = get_connection(label='cdc')
+    conn.autocommit = True
+    cursor = conn.cursor()
+    extracted = {}
+    try:
+        setup_cdc(cursor)
+        bound = safe_bound(cursor)
+        for table in tables:
+            watermark = get_watermark(cursor, consumer, table)
+            extracted[table] = 0
+            while True:
+                rows = read_changes(cursor, table, watermark, bound, batch_size)
+                if not rows:
+                    break
+                sink(table, rows)
+                watermark = (rows[-1]['updated_at'], rows[-1]['id'])
+                save_watermark(cursor, consumer, table, watermark)
+                extracted[table] += len(rows)
+                if len(rows) < batch_size:
+                    break
+    finally:
+        cursor.close()
+        conn.close()
+    return extracted
+
+def reset_consumer(consumer):
+    """Удаляет водяные знаки потребителя: следующая синхронизация выгрузит все заново"""
+    conn = get_connection(label='cdc')
+    cursor = conn.cursor()
+    try:
+        cursor.execute(WATERMARKS_SQL)
+        cursor.execute("DELETE FROM cdc_watermarks WHERE consumer = %s", [consumer])
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+
+def consumer_status():
+    """Водяные знаки всех потребителей: [(потребитель, таблица, updated_at, id, время синхронизации)]"""
+    conn = get_connection(label='cdc')
+    cursor = conn.cursor()
+    try:
+        cursor.execute(WATERMARKS_SQL)
+        cursor.execute("""
+        SELECT consumer, table_name, updated_at, last_id, synced_at
+        FROM cdc_watermarks
+        ORDER BY consumer, table_name
+        """)
+        rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _json_default(value):
+    # Decimal — строкой, чтобы получатель не терял копейки на float
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+class JsonLinesSink:
+    """Дописывает строки в <directory>/<таблица>.jsonl.
+
+    Пачка сбрасывается на диск (fsync) до возврата, то есть до сдвига
+    водяного знака: после сбоя строки могут повториться, но не потеряться.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, table, rows):
+        path = os.path.join(self.directory, f"{table}.jsonl")
+        with open(path, 'a') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=_json_default) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Инкрементальная выгрузка изменений по updated_at")
+    parser.add_argument('command', choices=['sync', 'status', 'reset'])
+    parser.add_argument('--consumer', default='default', help="имя получателя (свои водяные знаки)")
+    parser.add_argument('--output-dir', default='cdc_out', help="каталог для файлов <таблица>.jsonl")
+    parser.add_argument('--tables', nargs='+', choices=CDC_TABLES)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'sync':
+            print(f"🔄 Выгрузка изменений для {args.consumer} в {args.output_dir}...")
+            extracted = extract_changes(args.consumer, JsonLinesSink(args.output_dir),
+                                        args.tables, args.batch_size)
+            for table, count in extracted.items():
+                print(f"   ✅ {table}: {count} строк")
+        elif args.command == 'status':
+            rows = consumer_status()
+            if not rows:
+                print("❌ Выгрузок еще не было")
+            for consumer, table, updated_at, last_id, synced_at in rows:
+                print(f"   📤 {consumer:<15} {table:<12} до {updated_at} (id {last_id}), "
+                      f"синхронизация {synced_at:%Y-%m-%d %H:%M:%S}")
+        else:
+            removed = reset_consumer(args.consumer)
+            print(f"✅ Водяные знаки {args.consumer} сброшены ({removed})")
+    except Exception as e:
+        print(f"❌ Ошибка выгрузки изменений: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,165 +1,266 @@
-import psycopg2
-from database.config import get_connection_string
 
-def create_analytical_views():
-    """Создание всех аналитических представлений и материализованных представлений"""
-    
-    regular_views_sql = """
-    -- Представление для ежедневных продаж
-    DROP VIEW IF EXISTS daily_sales;
-    CREATE VIEW daily_sales AS
-    SELECT 
-        DATE(o.order_date) as sale_date,
-        COUNT(DISTINCT o.id) as orders_count,
-        SUM(o.total_amount) as total_revenue,
-        ROUND(AVG(o.total_amount)::numeric, 2) as avg_order_value,
-        COUNT(DISTINCT o.user_id) as unique_customers
-    FROM orders o
-    WHERE o.order_status = 'completed'
-    GROUP BY DATE(o.order_date)
-    ORDER BY sale_date DESC;
+from database.connection import get_connection
+from database.session_profiles import apply_profile
+
+# Время последнего обновления MV хранится в комментарии к ней: PostgreSQL его не отслеживает
+REFRESHED_AT_PREFIX = 'refreshed_at='
 
-    -- Представление для анализа по категориям
-    DROP VIEW IF EXISTS category_analysis;
-    CREATE VIEW category_analysis AS
-    SELECT 
+# Граница снимка, который увидит REFRESH, по часам сервера БД (как SAFE_BOUND_SQL
+# в scripts.cdc): updated_at пишется как NOW() транзакции, поэтому строки
+# транзакций, еще не зафиксированных к REFRESH, не раньше этой границы.
+# В комментарий идет она, а не время окончания REFRESH на хосте приложения
+REFRESH_BOUND_SQL = """
+SELECT LEAST(
+    now(),
+    (SELECT MIN(xact_start)
+     FROM pg_stat_activity
+     WHERE datname = current_database()
+       AND pid <> pg_backend_pid()
+       AND backend_type = 'client backend'
+       AND xact_start IS NOT NULL)
+)
+"""
+
+# Определения представлений: используются и для DDL, и для сравнения
+# материализованных представлений с эквивалентными живыми запросами.
+# Закрытые месяцы, перенесенные в архив (scripts.archive), хранятся
+# предагрегированными в таблицах archive_*: каждое представление складывает
+# живые строки с архивными, и отчеты не видят, где проходит граница архива
+
+# Представление для ежедневных продаж
+DAILY_SALES_QUERY = """
+SELECT 
+    DATE(o.order_date) as sale_date,
+    COUNT(DISTINCT o.id) as orders_count,
+    SUM(o.total_amount) as total_revenue,
+    ROUND(AVG(o.total_amount)::numeric, 2) as avg_order_value,
+    COUNT(DISTINCT o.user_id) as unique_customers
+FROM orders o
+WHERE o.order_status = 'completed'
+GROUP BY DATE(o.order_date)
+UNION ALL
+-- Архивные дни (граница архива всегда между днями)
+SELECT sale_date, orders, revenue, ROUND(revenue / orders, 2), customers
+FROM archive_daily_sales
+ORDER BY sale_date DESC
+"""
+
+# Представление для анализа по категориям
+CATEGORY_ANALYSIS_QUERY = """
+SELECT 
+    category,
+    SUM(orders)::bigint as orders_count,
+    SUM(items)::bigint as items_sold,
+    SUM(revenue) as total_revenue,
+    ROUND(SUM(price_sum) / SUM(joined_rows), 2) as avg_product_price,
+    COUNT(DISTINCT user_id) as unique_customers
+FROM (
+    -- Живые строки по парам (категория, клиент): заказы разных клиентов не
+    -- пересекаются, поэтому суммы пар дают итоги категории, а число
+    -- уникальных клиентов считается по парам вместе с архивными
+    SELECT
         p.category,
-        COUNT(DISTINCT o.id) as orders_count,
-        SUM(oi.quantity) as items_sold,
-        SUM(oi.subtotal) as total_revenue,
-        ROUND(AVG(p.price)::numeric, 2) as avg_product_price,
-        COUNT(DISTINCT o.user_id) as unique_customers
+        o.user_id,
+        COUNT(DISTINCT o.id) as orders,
+        SUM(oi.quantity) as items,
+        SUM(oi.subtotal) as revenue,
+        SUM(p.price) as price_sum,
+        COUNT(*) as joined_rows
     FROM products p
     JOIN order_items oi ON p.id = oi.product_id
     JOIN orders o ON oi.order_id = o.id
     WHERE o.order_status = 'completed'
-    GROUP BY p.category
-    ORDER BY total_revenue DESC;
-
-    -- Представление для клиентской аналитики
-    DROP VIEW IF EXISTS customer_analytics;
-    CREATE VIEW customer_analytics AS
-    SELECT 
-        u.id as user_id,
-        u.first_name || ' ' || u.last_name as customer_name,
-        u.email,
-        u.city,
-        u.country,
-        COUNT(o.id) as total_orders,
-        SUM(o.total_amount) as total_spent,
-        ROUND(AVG(o.total_amount)::numeric, 2) as avg_order_value,
-        MAX(o.order_date) as last_order_date
-    FROM users u
-    LEFT JOIN orders o ON u.id = o.user_id AND o.order_status = 'completed'
-    GROUP BY u.id, u.first_name, u.last_name, u.email, u.city, u.country
-    ORDER BY total_spent DESC NULLS LAST;
-
-    -- Представление для детальной информации о заказах
-    DROP VIEW IF EXISTS order_details;
-    CREATE VIEW order_details AS
-    SELECT 
-        o.id as order_id,
-        u.first_name || ' ' || u.last_name as customer_name,
-        o.order_date,
-        o.total_amount,
-        o.order_status,
-        COUNT(oi.id) as items_count,
-        STRING_AGG(p.title || ' (x' || oi.quantity || ')', ', ') as products
-    FROM orders o
-    JOIN users u ON o.user_id = u.id
-    JOIN order_items oi ON o.id = oi.order_id
-    JOIN products p ON oi.product_id = p.id
-    GROUP BY o.id, u.first_name, u.last_name, o.order_date, o.total_amount, o.order_status
-    ORDER BY o.order_date DESC;
-    """
-
-    materialized_views_sql = """
-    -- Материализованное представление для недельных отчетов по продажам
-    DROP MATERIALIZED VIEW IF EXISTS weekly_sales_report;
-    CREATE MATERIALIZED VIEW weekly_sales_report AS
-    SELECT 
+    GROUP BY p.category, o.user_id
+    UNION ALL
+    SELECT category, user_id, orders, items, revenue, price_sum, joined_rows
+    FROM archive_category_sales
+) pairs
+GROUP BY category
+ORDER BY total_revenue DESC
+"""
+
+# Представление для клиентской аналитики
+CUSTOMER_ANALYTICS_QUERY = """
+SELECT 
+    u.id as user_id,
+    u.first_name || ' ' || u.last_name as customer_name,
+    u.email,
+    u.city,
+    u.country,
+    COALESCE(SUM(s.orders), 0)::bigint as total_orders,
+    SUM(s.spent) as total_spent,
+    ROUND(SUM(s.spent) / SUM(s.orders), 2) as avg_order_value,
+    MAX(s.last_order_date) as last_order_date
+FROM users u
+LEFT JOIN (
+    SELECT user_id, COUNT(*) as orders, SUM(total_amount) as spent, MAX(order_date) as last_order_date
+    FROM orders
+    WHERE order_status = 'completed'
+    GROUP BY user_id
+    UNION ALL
+    SELECT user_id, orders, spent, last_order_date
+    FROM archive_customer_sales
+) s ON u.id = s.user_id
+GROUP BY u.id, u.first_name, u.last_name, u.email, u.city, u.country
+ORDER BY total_spent DESC NULLS LAST
+"""
+
+# Представление для детальной информации о заказах
+ORDER_DETAILS_QUERY = """
+SELECT 
+    o.id as order_id,
+    u.first_name || ' ' || u.last_name as customer_name,
+    o.order_date,
+    o.total_amount,
+    o.order_status,
+    COUNT(oi.id) as items_count,
+    STRING_AGG(p.title || ' (x' || oi.quantity || ')', ', ') as products
+FROM orders o
+JOIN users u ON o.user_id = u.id
+JOIN order_items oi ON o.id = oi.order_id
+JOIN products p ON oi.product_id = p.id
+GROUP BY o.id, u.first_name, u.last_name, o.order_date, o.total_amount, o.order_status
+ORDER BY o.order_date DESC
+"""
+
+# Материализованное представление для недельных отчетов по продажам
+WEEKLY_SALES_REPORT_QUERY = """
+SELECT 
+    week_start,
+    category AS top_category,
+
+    -- Количество заказов в ЭТОЙ КАТЕГОРИИ на этой неделе
+    COUNT(DISTINCT order_id) AS orders_in_category,
+
+    -- Количество уникальных клиентов купивших товары ЭТОЙ КАТЕГОРИИ на этой неделе  
+    COUNT(DISTINCT user_id) AS unique_customers_in_category,
+
+    -- Выручка от товаров ЭТОЙ КАТЕГОРИИ на этой неделе
+    SUM(subtotal) AS revenue_in_category,
+
+    -- Количество товаров ЭТОЙ КАТЕГОРИИ проданных на этой неделе
+    SUM(quantity) AS items_sold_in_category,
+
+    -- Средняя стоимость заказа в ЭТОЙ КАТЕГОРИИ на этой неделе
+    ROUND(
+        CASE 
+            WHEN COUNT(DISTINCT order_id) > 0 THEN SUM(subtotal) / COUNT(DISTINCT order_id)
+            ELSE 0 
+        END::numeric, 2
+    ) AS avg_order_value_in_category,
+
+    -- Количество уникальных товаров в ЭТОЙ КАТЕГОРИИ на этой неделе
+    COUNT(DISTINCT product_id) AS unique_products_in_category
+FROM (
+    SELECT
         DATE_TRUNC('week', o.order_date) AS week_start,
-        p.category AS top_category,
-    
-        -- Количество заказов в ЭТОЙ КАТЕГОРИИ на этой неделе
-        COUNT(DISTINCT o.id) AS orders_in_category,
-    
-        -- Количество уникальных клиентов купивших товары ЭТОЙ КАТЕГОРИИ на этой неделе  
-        COUNT(DISTINCT o.user_id) AS unique_customers_in_category,
-    
-        -- Выручка от товаров ЭТОЙ КАТЕГОРИИ на этой неделе
-        SUM(oi.subtotal) AS revenue_in_category,
-    
-        -- Количество товаров ЭТОЙ КАТЕГОРИИ проданных на этой неделе
-        SUM(oi.quantity) AS items_sold_in_category,
-    
-        -- Средняя стоимость заказа в ЭТОЙ КАТЕГОРИИ на этой неделе
-        ROUND(
-            CASE 
-                WHEN COUNT(DISTINCT o.id) > 0 THEN SUM(oi.subtotal) / COUNT(DISTINCT o.id)
-                ELSE 0 
-            END::numeric, 2
-        ) AS avg_order_value_in_category,
-    
-        -- Количество уникальных товаров в ЭТОЙ КАТЕГОРИИ на этой неделе
-        COUNT(DISTINCT oi.product_id) AS unique_products_in_category
+        p.category,
+        o.id AS order_id,
+        o.user_id,
+        oi.product_id,
+        oi.subtotal,
+        oi.quantity
     FROM orders o
     JOIN order_items oi ON o.id = oi.order_id
     JOIN products p ON oi.product_id = p.id
     WHERE o.order_status = 'completed'
-    GROUP BY DATE_TRUNC('week', o.order_date), p.category
-    ORDER BY week_start DESC, revenue_in_category DESC;
+    UNION ALL
+    -- Архивная часть недели, через которую проходит граница архива: уникальные
+    -- клиенты и товары этой недели считаются вместе с живыми строками
+    SELECT week_start, category, order_id, user_id, product_id, subtotal, quantity
+    FROM archive_boundary_items
+) lines
+GROUP BY week_start, category
+UNION ALL
+-- Недели, целиком перенесенные в архив
+SELECT
+    week_start, category, orders, customers, revenue, items,
+    ROUND(CASE WHEN orders > 0 THEN revenue / orders ELSE 0 END::numeric, 2),
+    products
+FROM archive_weekly_sales
+ORDER BY week_start DESC, revenue_in_category DESC
+"""
 
-    
-    -- Материализованное представление для статистики за месяц
-    DROP MATERIALIZED VIEW IF EXISTS monthly_sales_summary;
-    CREATE MATERIALIZED VIEW monthly_sales_summary AS
-    SELECT 
-        DATE_TRUNC('month', o.order_date) AS month_start,
-        EXTRACT(YEAR FROM o.order_date) AS year,
-        EXTRACT(MONTH FROM o.order_date) AS month,
-        COUNT(DISTINCT o.id) AS total_orders,
-        COUNT(DISTINCT o.user_id) AS unique_customers,
-        SUM(o.total_amount) AS total_revenue,
-        SUM(oi.quantity) AS total_items_sold,
-        ROUND(AVG(o.total_amount)::numeric, 2) AS avg_order_value
-    FROM orders o
-    JOIN order_items oi ON o.id = oi.order_id
-    WHERE o.order_status = 'completed'
-    GROUP BY DATE_TRUNC('month', o.order_date), year, month
-    ORDER BY month_start DESC;
-    """
+# Материализованное представление для статистики за месяц
+MONTHLY_SALES_SUMMARY_QUERY = """
+SELECT 
+    DATE_TRUNC('month', o.order_date) AS month_start,
+    EXTRACT(YEAR FROM o.order_date) AS year,
+    EXTRACT(MONTH FROM o.order_date) AS month,
+    COUNT(DISTINCT o.id) AS total_orders,
+    COUNT(DISTINCT o.user_id) AS unique_customers,
+    SUM(o.total_amount) AS total_revenue,
+    SUM(oi.quantity) AS total_items_sold,
+    ROUND(AVG(o.total_amount)::numeric, 2) AS avg_order_value
+FROM orders o
+JOIN order_items oi ON o.id = oi.order_id
+WHERE o.order_status = 'completed'
+GROUP BY DATE_TRUNC('month', o.order_date), year, month
+UNION ALL
+-- Закрытые месяцы из архива
+SELECT
+    month_start, EXTRACT(YEAR FROM month_start), EXTRACT(MONTH FROM month_start),
+    orders, customers, revenue, items, ROUND(revenue / joined_rows, 2)
+FROM archive_monthly_sales
+ORDER BY month_start DESC
+"""
+
+VIEW_QUERIES = {
+    'daily_sales': DAILY_SALES_QUERY,
+    'category_analysis': CATEGORY_ANALYSIS_QUERY,
+    'customer_analytics': CUSTOMER_ANALYTICS_QUERY,
+    'order_details': ORDER_DETAILS_QUERY,
+}
 
-    indexes_sql = """
-    -- Индекс для weekly_sales_report
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_weekly_sales_week 
-    ON weekly_sales_report (week_start, top_category);
+MATERIALIZED_VIEW_QUERIES = {
+    'weekly_sales_report': WEEKLY_SALES_REPORT_QUERY,
+    'monthly_sales_summary': MONTHLY_SALES_SUMMARY_QUERY,
+}
 
-    -- Индекс для monthly_sales_summary  
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_monthly_sales_month
-    ON monthly_sales_summary (month_start);
+REGULAR_VIEWS_SQL = "".join(
+    f"DROP VIEW IF EXISTS {name};\nCREATE VIEW {name} AS {query};\n"
+    for name, query in VIEW_QUERIES.items()
+)
 
-    -- Дополнительные индексы для ускорения запросов
-    CREATE INDEX IF NOT EXISTS idx_weekly_sales_revenue 
-    ON weekly_sales_report (revenue_in_category DESC);
+MATERIALIZED_VIEWS_SQL = "".join(
+    f"DROP MATERIALIZED VIEW IF EXISTS {name};\nCREATE MATERIALIZED VIEW {name} AS {query};\n"
+    for name, query in MATERIALIZED_VIEW_QUERIES.items()
+)
 
-    CREATE INDEX IF NOT EXISTS idx_monthly_sales_revenue
-    ON monthly_sales_summary (total_revenue DESC);
-    """
+MATERIALIZED_VIEW_INDEXES_SQL = """
+-- Индекс для weekly_sales_report
+CREATE UNIQUE INDEX IF NOT EXISTS idx_weekly_sales_week 
+ON weekly_sales_report (week_start, top_category);
 
+-- Индекс для monthly_sales_summary  
+CREATE UNIQUE INDEX IF NOT EXISTS idx_monthly_sales_month
+ON monthly_sales_summary (month_start);
+
+-- Дополнительные индексы для ускорения запросов
+CREATE INDEX IF NOT EXISTS idx_weekly_sales_revenue 
+ON weekly_sales_report (revenue_in_category DESC);
+
+CREATE INDEX IF NOT EXISTS idx_monthly_sales_revenue
+ON monthly_sales_summary (total_revenue DESC);
+"""
+
+def create_analytical_views():
+    """Создание всех аналитических представлений и материализованных представлений"""
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
         
         print("🔄 Создание аналитических представлений...")
         
-        cursor.execute(regular_views_sql)
+        cursor.execute(REGULAR_VIEWS_SQL)
         print("   ✅ Представления созданы")
         
-        cursor.execute(materialized_views_sql)
+        # CREATE MATERIALIZED VIEW сразу заполняет MV — та же нагрузка, что REFRESH
+        apply_profile(cursor, 'refresh')
+        cursor.execute(MATERIALIZED_VIEWS_SQL)
         print("   ✅ Материализованные представления созданы")
         
-        cursor.execute(indexes_sql)
+        cursor.execute(MATERIALIZED_VIEW_INDEXES_SQL)
         print("   ✅ Индексы для материализованных представлений созданы")
         
         conn.commit()
@@ -172,18 +273,39 @@ def create_analytical_views():
             cursor.close()
             conn.close()
 
+def refresh_view(cursor, name, concurrently=True):
+    """Обновление одного материализованного представления"""
+    if name not in MATERIALIZED_VIEW_QUERIES:
+        raise ValueError(f"Неизвестное материализованное представление: {name}")
+    mode = "CONCURRENTLY " if concurrently else ""
+    label = f"refresh_concurrently.{name}" if concurrently else f"refresh.{name}"
+    apply_profile(cursor, 'refresh')
+    bound = refresh_bound(cursor)
+    cursor.execute(f"REFRESH MATERIALIZED VIEW {mode}{name}", label=label)
+    mark_refreshed(cursor, name, bound)
+
+def refresh_bound(cursor):
+    """Граница снимка для mark_refreshed; берется до REFRESH (или CREATE) MV"""
+    cursor.execute(REFRESH_BOUND_SQL, label="refresh.bound")
+    return cursor.fetchone()[0]
+
+def mark_refreshed(cursor, name, bound):
+    """Запоминает границу снимка MV в ее комментарии (в той же транзакции, что и REFRESH):
+    все изменения с updated_at раньше bound в MV уже есть"""
+    cursor.execute(f"COMMENT ON MATERIALIZED VIEW {name} IS %s", [REFRESHED_AT_PREFIX + bound.isoformat()])
+
 def refresh_materialized_views():
     """Обновление всех материализованных представлений"""
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
         
         print("🔄 Обновление материализованных представлений...")
         
-        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY weekly_sales_report")
+        refresh_view(cursor, "weekly_sales_report", concurrently=True)
         print("   ✅ weekly_sales_report обновлено")
         
-        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY monthly_sales_summary") 
+        refresh_view(cursor, "monthly_sales_summary", concurrently=True)
         print("   ✅ monthly_sales_summary обновлено")
         
         conn.commit()
@@ -193,8 +315,8 @@ def refresh_materialized_views():
         print(f"❌ Ошибка при обновлении представлений: {e}")
         try:
             conn.rollback()
-            cursor.execute("REFRESH MATERIALIZED VIEW weekly_sales_report")
-            cursor.execute("REFRESH MATERIALIZED VIEW monthly_sales_summary")
+            refresh_view(cursor, "weekly_sales_report", concurrently=False)
+            refresh_view(cursor, "monthly_sales_summary", concurrently=False)
             conn.commit()
             print("✅ Представления обновлены (без CONCURRENTLY)")
         except Exception as e2:
@@ -207,7 +329,7 @@ def refresh_materialized_views():
 def drop_all_views():
     """Удаление всех представлений (для пересоздания)"""
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
         
         print("🗑️  Удаление всех представлений...")
@@ -234,8 +356,10 @@ def drop_all_views():
 
 def show_view_info():
     """Отображение информации о созданных представлениях"""
+    from scripts.health import health_snapshot, format_age
+    
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
         
         print("📊 ИНФОРМАЦИЯ О ПРЕДСТАВЛЕНИЯХ:")
@@ -265,15 +389,13 @@ def show_view_info():
         for mv_name in materialized_views:
             print(f"   💽 {mv_name[0]}")
         
-        cursor.execute("SELECT COUNT(*) FROM weekly_sales_report")
-        weekly_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM monthly_sales_summary")
-        monthly_count = cursor.fetchone()[0]
+        # Оценки из каталога вместо COUNT(*) по каждому представлению
+        snapshot = health_snapshot(cursor)
         
         print(f"\n📈 СТАТИСТИКА:")
-        print(f"   📅 Записей в weekly_sales_report: {weekly_count}")
-        print(f"   📊 Записей в monthly_sales_summary: {monthly_count}")
+        for name, matview in snapshot['matviews'].items():
+            print(f"   📊 {name}: ≈{matview['estimated_rows']:,} строк, "
+                  f"обновлено {format_age(matview['age_seconds'])} назад")
         
         cursor.close()
         conn.close()
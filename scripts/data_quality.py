@@ -0,0 +1,201 @@
+"""Декларативные правила качества данных.
+
+Каждое правило — условие нарушения для строки таблицы. Все правила одной
+таблицы компилируются в один запрос с COUNT(*) FILTER (WHERE ...), поэтому
+проверка таблицы стоит одного прохода по ней независимо от числа правил.
+Для нарушенных правил отдельно выбирается несколько примеров строк (LIMIT),
+которые останавливаются на первых найденных нарушениях.
+"""
+
+import argparse
+import json
+import sys
+
+from database.connection import get_connection
+
+
+class Rule:
+    """Правило: имя, таблица, условие нарушения (алиас таблицы — t) и описание.
+
+    joins — LEFT JOIN, нужные условию; одинаковые соединения правил одной
+    таблицы выполняются один раз.
+    """
+
+    __slots__ = ('name', 'table', 'condition', 'description', 'joins')
+
+    def __init__(self, name, table, condition, description, joins=()):
+        self.name = name
+        self.table = table
+        self.condition = condition
+        self.description = description
+        self.joins = tuple(joins)
+
+
+ORDER_ITEMS_TOTALS_JOIN = """LEFT JOIN (
+    SELECT order_id, SUM(subtotal) AS items_total
+    FROM order_items
+    GROUP BY order_id
+) items ON items.order_id = t.id"""
+
+RULES = [
+    Rule('non_negative_price', 'products', "t.price < 0", "Отрицательная цена товара"),
+
+    Rule('positive_quantity', 'order_items', "t.quantity <= 0", "Неположительное количество товара"),
+    Rule('non_negative_unit_price', 'order_items', "t.unit_price < 0", "Отрицательная цена в заказе"),
+    Rule('subtotal_consistency', 'order_items', "t.subtotal <> t.quantity * t.unit_price",
+         "subtotal не равен quantity * unit_price"),
+    Rule('orphaned_item_order', 'order_items', "t.order_id IS NOT NULL AND o.id IS NULL",
+         "Элемент заказа ссылается на несуществующий заказ",
+         joins=["LEFT JOIN orders o ON o.id = t.order_id"]),
+    Rule('orphaned_item_product', 'order_items', "t.product_id IS NOT NULL AND p.id IS NULL",
+         "Элемент заказа ссылается на несуществующий товар",
+         joins=["LEFT JOIN products p ON p.id = t.product_id"]),
+
+    Rule('orphaned_order_user', 'orders', "t.user_id IS NOT NULL AND u.id IS NULL",
+         "Заказ ссылается на несуществующего пользователя",
+         joins=["LEFT JOIN users u ON u.id = t.user_id"]),
+    Rule('non_negative_total', 'orders', "t.total_amount < 0", "Отрицательная сумма заказа"),
+    Rule('total_matches_items', 'orders', "ABS(t.total_amount - COALESCE(items.items_total, 0)) > 0.01",
+         "Сумма заказа не совпадает с суммой его элементов",
+         joins=[ORDER_ITEMS_TOTALS_JOIN]),
+
+    Rule('weekly_null_keys', 'weekly_sales_report',
+         "t.week_start IS NULL OR t.top_category IS NULL OR t.top_category = ''",
+         "Пустая неделя или категория"),
+    Rule('weekly_negative_values', 'weekly_sales_report',
+         "t.orders_in_category < 0 OR t.unique_customers_in_category < 0 OR t.revenue_in_category < 0 "
+         "OR t.items_sold_in_category < 0 OR t.avg_order_value_in_category < 0 "
+         "OR t.unique_products_in_category < 0",
+         "Отрицательные значения в недельном отчете"),
+    Rule('weekly_avg_consistency', 'weekly_sales_report',
+         "t.orders_in_category > 0 AND t.revenue_in_category > 0 AND "
+         "ABS(t.avg_order_value_in_category - t.revenue_in_category / t.orders_in_category) > 1.0",
+         "Средний чек не равен выручке / числу заказов"),
+    Rule('weekly_items_vs_products', 'weekly_sales_report',
+         "t.items_sold_in_category > 0 AND t.items_sold_in_category < t.unique_products_in_category",
+         "Продано меньше товаров, чем уникальных товаров"),
+    Rule('weekly_money_rounding', 'weekly_sales_report',
+         "t.revenue_in_category::text ~ '\\.\\d{3,}' OR t.avg_order_value_in_category::text ~ '\\.\\d{3,}'",
+         "Денежные значения не округлены до копеек"),
+]
+
+# Ожидаемые типы столбцов: проверяются по каталогу, а не построчно в Python
+COLUMN_TYPES = {
+    'weekly_sales_report': {
+        'week_start': ('timestamp without time zone',),
+        'top_category': ('character varying', 'text'),
+        'orders_in_category': ('bigint', 'integer'),
+        'unique_customers_in_category': ('bigint', 'integer'),
+        'revenue_in_category': ('numeric',),
+        'items_sold_in_category': ('numeric', 'bigint'),
+        'avg_order_value_in_category': ('numeric',),
+        'unique_products_in_category': ('bigint', 'integer'),
+    },
+}
+
+
+def compile_table_query(table, rules):
+    """Один запрос, считающий нарушения всех правил таблицы за один проход"""
+    joins = []
+    for rule in rules:
+        for join in rule.joins:
+            if join not in joins:
+                joins.append(join)
+    counters = ",\n    ".join(f"COUNT(*) FILTER (WHERE {rule.condition}) AS {rule.name}" for rule in rules)
+    join_sql = "\n".join(joins)
+    return f"SELECT\n    {counters}\nFROM {table} t\n{join_sql}"
+
+def _sample_query(rule, sample_size):
+    join_sql = "\n".join(rule.joins)
+    return f"SELECT t.* FROM {rule.table} t\n{join_sql}\nWHERE {rule.condition}\nLIMIT {int(sample_size)}"
+
+def check_rules(cursor, rules=None, sample_size=5, tables=None):
+    """Проверяет правила и возвращает {имя правила: результат}.
+
+    Результат содержит таблицу, описание, число нарушений и до sample_size
+    примеров нарушающих строк.
+    """
+    rules = rules or RULES
+    by_table = {}
+    for rule in rules:
+        if tables and rule.table not in tables:
+            continue
+        by_table.setdefault(rule.table, []).append(rule)
+
+    results = {}
+    for table, table_rules in by_table.items():
+        cursor.execute(compile_table_query(table, table_rules))
+        counts = cursor.fetchone()
+        for rule, violations in zip(table_rules, counts):
+            samples = []
+            if violations and sample_size:
+                cursor.execute(_sample_query(rule, sample_size))
+                columns = [column[0] for column in cursor.description]
+                samples = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            results[rule.name] = {
+                'table': table,
+                'description': rule.description,
+                'violations': violations,
+                'samples': samples,
+            }
+    return results
+
+def check_column_types(cursor, expected=None):
+    """Столбцы, тип которых не совпадает с ожидаемым: [(таблица, столбец, тип)]"""
+    expected = expected or COLUMN_TYPES
+    mismatches = []
+    for table, columns in expected.items():
+        cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, NULL)
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        """, [table])
+        actual = dict(cursor.fetchall())
+        for column, allowed in columns.items():
+            if actual.get(column) not in allowed:
+                mismatches.append((table, column, actual.get(column)))
+    return mismatches
+
+def print_rule_results(results, indent="   "):
+    for name, result in results.items():
+        if result['violations']:
+            print(f"{indent}❌ {result['table']}.{name}: {result['description']} — {result['violations']}")
+            for sample in result['samples'][:3]:
+                print(f"{indent}   {sample}")
+        else:
+            print(f"{indent}✅ {result['table']}.{name}: нарушений нет")
+
+def run_data_quality(tables=None, sample_size=5):
+    """Проверка качества данных как отдельное задание: (результаты правил, несовпадения типов)"""
+    conn = get_connection(label='data_quality')
+    conn.set_session(readonly=True, autocommit=True)
+    cursor = conn.cursor()
+    try:
+        print("🔍 ПРОВЕРКА КАЧЕСТВА ДАННЫХ:")
+        results = check_rules(cursor, sample_size=sample_size, tables=tables)
+        print_rule_results(results)
+        mismatches = check_column_types(cursor)
+        for table, column, actual in mismatches:
+            print(f"   ❌ {table}.{column}: неожиданный тип {actual}")
+        return results, mismatches
+    finally:
+        cursor.close()
+        conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка качества данных набором SQL-правил")
+    parser.add_argument('--table', action='append', help="проверять только эти таблицы")
+    parser.add_argument('--samples', type=int, default=5, help="примеров нарушающих строк на правило")
+    parser.add_argument('--json', help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    results, mismatches = run_data_quality(args.table, args.samples)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rules': results, 'column_types': mismatches}, f,
+                      ensure_ascii=False, indent=2, default=str)
+    failed = sum(1 for result in results.values() if result['violations']) + len(mismatches)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,36 @@
-import psycopg2
-from faker import Faker
 import random
 import traceback
 from datetime import datetime, timedelta
-from database.config import get_connection_string
+from database.connection import get_connection
+from database.ingestion import insert_orders
+from scripts.archive import RESET_ARCHIVE_SQL
+from scripts.data_quality import check_rules
+from scripts.health import health_snapshot
 
-fake = Faker()
+_fake = None
 
-def generate_sample_data():
-    """Генерация тестовых данных"""
+def get_faker():
+    """Faker создается при первом использовании: его импорт и инициализация
+    заметно замедляют запуск, а нужны только для генерации данных"""
+    global _fake
+    if _fake is None:
+        from faker import Faker
+        _fake = Faker()
+    return _fake
+
+def generate_sample_data(seed=None, reference_date=None):
+    """Генерация тестовых данных (при заданном seed — воспроизводимых).
+
+    Заказы распределяются по 90 дням до reference_date (по умолчанию — до
+    текущего момента); с одинаковыми seed и reference_date данные совпадают.
+    """
     
-    conn = psycopg2.connect(get_connection_string())
+    fake = get_faker()
+    if seed is not None:
+        random.seed(seed)
+        fake.seed_instance(seed)
+        fake.unique.clear()
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -56,63 +76,55 @@ def generate_sample_data():
 
         print("🛒 Генерация заказов...")
 
-        end_date = datetime.now()
+        end_date = reference_date or datetime.now()
         start_date = end_date - timedelta(days=90)
 
         cursor.execute("SELECT id, price FROM products")
         product_prices = {row[0]: row[1] for row in cursor.fetchall()}
         
-        for order_counter in range(1, 201):
+        # Заказы пишутся одной пачкой: id и итоговые суммы считает сервер
+        orders = []
+        for _ in range(200):
             user_id = random.choice(user_ids)
             order_date = fake.date_time_between(start_date=start_date, end_date=end_date)
+            order_status = random.choice(['completed', 'completed', 'processing', 'cancelled'])
             
-            cursor.execute(
-                "INSERT INTO orders (user_id, order_date, total_amount, order_status) VALUES (%s, %s, %s, %s) RETURNING id",
-                (user_id, order_date, 0, random.choice(['completed', 'completed', 'processing', 'cancelled']))
-            )
-            order_id = cursor.fetchone()[0]
-            
-            order_total = 0
+            items = []
             num_items = random.randint(1, 4)
             
             for _ in range(num_items):
                 product_id = random.choice(product_ids)
                 quantity = random.randint(1, 3)
-                
-                unit_price = product_prices[product_id]
-                
-                cursor.execute(
-                    "INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (%s, %s, %s, %s)",
-                    (order_id, product_id, quantity, unit_price)
-                )
-                
-                order_total += quantity * unit_price
+                items.append({
+                    'product_id': product_id,
+                    'quantity': quantity,
+                    'unit_price': product_prices[product_id],
+                })
             
-            cursor.execute(
-                "UPDATE orders SET total_amount = %s WHERE id = %s",
-                (round(order_total, 2), order_id)
-            )
-            
-            if order_counter % 50 == 0:
-                print(f"   Создано заказов: {order_counter}/200")
+            orders.append({
+                'user_id': user_id,
+                'order_date': order_date,
+                'order_status': order_status,
+                'items': items,
+            })
+        
+        results = insert_orders(cursor, orders)
+        errors = [result.error for result in results if not result.ok]
+        if errors:
+            raise RuntimeError(f"не записано заказов: {len(errors)}, например: {errors[0]}")
+        print(f"   Создано заказов: {len(results)}/200")
         
         print("🔍 Проверка целостности данных...")
-        cursor.execute("""
-            SELECT COUNT(*) FROM orders o 
-            WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = o.user_id)
-        """)
-        orphaned_orders = cursor.fetchone()[0]
-        
-        cursor.execute("""
-            SELECT COUNT(*) FROM order_items oi 
-            WHERE NOT EXISTS (SELECT 1 FROM orders o WHERE o.id = oi.order_id)
-            OR NOT EXISTS (SELECT 1 FROM products p WHERE p.id = oi.product_id)
-        """)
-        orphaned_items = cursor.fetchone()[0]
+        integrity = check_rules(cursor, tables=['orders', 'order_items'], sample_size=0)
+        orphaned_orders = integrity['orphaned_order_user']['violations']
+        orphaned_items = (integrity['orphaned_item_order']['violations'] +
+                          integrity['orphaned_item_product']['violations'])
         
         print(f"   Найдено orphaned orders: {orphaned_orders}")
         print(f"   Найдено orphaned order_items: {orphaned_items}")
         
+        # Свежая статистика нужна планировщику и оценкам числа строк (scripts.health)
+        cursor.execute("ANALYZE users, products, orders, order_items")
         conn.commit()
         print("✅ Тестовые данные успешно сгенерированы!")
         
@@ -124,37 +136,103 @@ def generate_sample_data():
         cursor.close()
         conn.close()
 
+def generate_scaled_data(orders_count, users_count=None, products_count=None, seed=0.42):
+    """Быстрая генерация данных заданного масштаба средствами SQL.
+
+    Все строки создаются на стороне сервера через generate_series, поэтому
+    загрузка миллионов заказов не требует построчных запросов из Python.
+    Существующие данные удаляются. При одинаковом seed набор данных повторяется.
+    """
+    users_count = users_count or max(100, orders_count // 20)
+    products_count = products_count or min(max(50, orders_count // 1000), 5000)
+    categories = ['Electronics', 'Books', 'Clothing', 'Home & Garden', 'Sports']
+
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        print(f"📦 Загрузка данных: {orders_count} заказов, {users_count} пользователей, {products_count} продуктов...")
+        cursor.execute("TRUNCATE order_items, orders, products, users RESTART IDENTITY CASCADE")
+        cursor.execute(RESET_ARCHIVE_SQL)
+        cursor.execute("SELECT setseed(%s)", [seed])
+
+        cursor.execute("""
+        INSERT INTO users (first_name, last_name, email, country, city)
+        SELECT 'First' || g, 'Last' || g, 'user' || g || '@example.com',
+               'Country ' || (g %% 40), 'City ' || (g %% 400)
+        FROM generate_series(1, %s) g
+        """, [users_count])
+
+        cursor.execute("""
+        INSERT INTO products (title, price, category)
+        SELECT 'Product ' || g,
+               ROUND((10 + random() * 990)::numeric, 2),
+               (%s::text[])[1 + (g %% %s)]
+        FROM generate_series(1, %s) g
+        """, [categories, len(categories), products_count])
+
+        cursor.execute("""
+        INSERT INTO orders (user_id, order_date, total_amount, order_status)
+        SELECT 1 + floor(random() * %s)::int,
+               NOW() - random() * INTERVAL '365 days',
+               0,
+               (ARRAY['completed', 'completed', 'processing', 'cancelled'])[1 + floor(random() * 4)::int]
+        FROM generate_series(1, %s) g
+        """, [users_count, orders_count])
+
+        cursor.execute("""
+        INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+        SELECT i.order_id, p.id, i.quantity, p.price
+        FROM (
+            SELECT o.id AS order_id,
+                   1 + floor(random() * %s)::int AS product_id,
+                   1 + floor(random() * 3)::int AS quantity
+            FROM orders o
+            CROSS JOIN LATERAL generate_series(1, 1 + (o.id %% 4)) item
+        ) i
+        JOIN products p ON p.id = i.product_id
+        """, [products_count])
+
+        cursor.execute("""
+        UPDATE orders o SET total_amount = t.total
+        FROM (
+            SELECT order_id, ROUND(SUM(subtotal), 2) AS total
+            FROM order_items
+            GROUP BY order_id
+        ) t
+        WHERE t.order_id = o.id
+        """)
+
+        cursor.execute("ANALYZE users, products, orders, order_items")
+        conn.commit()
+        print("✅ Данные загружены")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при загрузке данных: {e}")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
 def verify_data_integrity():
     """Дополнительная проверка целостности данных"""
     try:
-        conn = psycopg2.connect(get_connection_string())
+        conn = get_connection()
         cursor = conn.cursor()
         
         print("\n🔍 ДЕТАЛЬНАЯ ПРОВЕРКА ЦЕЛОСТНОСТИ:")
         
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM products") 
-        product_count = cursor.fetchone()[0]
+        # Число строк — оценка из каталога: точный COUNT(*) здесь не нужен
+        tables = health_snapshot(cursor)['tables']
         
-        cursor.execute("SELECT COUNT(*) FROM orders")
-        order_count = cursor.fetchone()[0]
+        print(f"   👥 Пользователей: ≈{tables['users']['estimated_rows']}")
+        print(f"   📦 Продуктов: ≈{tables['products']['estimated_rows']}")
+        print(f"   🛒 Заказов: ≈{tables['orders']['estimated_rows']}")
+        print(f"   📋 Элементов заказов: ≈{tables['order_items']['estimated_rows']}")
         
-        cursor.execute("SELECT COUNT(*) FROM order_items")
-        order_items_count = cursor.fetchone()[0]
-        
-        print(f"   👥 Пользователей: {user_count}")
-        print(f"   📦 Продуктов: {product_count}")
-        print(f"   🛒 Заказов: {order_count}")
-        print(f"   📋 Элементов заказов: {order_items_count}")
-        
-        cursor.execute("""
-        SELECT COUNT(*) FROM order_items 
-        WHERE subtotal != (quantity * unit_price)
-        """)
-        incorrect_subtotals = cursor.fetchone()[0]
-        print(f"   ✅ Корректных subtotal: {order_items_count - incorrect_subtotals}")
+        results = check_rules(cursor, tables=['order_items'], sample_size=0)
+        incorrect_subtotals = results['subtotal_consistency']['violations']
         print(f"   ❌ Некорректных subtotal: {incorrect_subtotals}")
         
         cursor.close()
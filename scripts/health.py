@@ -0,0 +1,197 @@
+"""Снимок состояния базы по системному каталогу.
+
+Вместо COUNT(*) по каждой таблице используются оценки планировщика
+(pg_class.reltuples) и накопительная статистика (pg_stat_user_tables,
+pg_stat_user_indexes): снимок читает только каталог, поэтому его стоимость
+не зависит от объема данных. Там, где нужен ответ «есть ли хотя бы N строк»,
+используется EXISTS с OFFSET, который останавливается на (N+1)-й строке.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+
+from database.connection import get_connection
+from database.routing import router
+from scripts.create_views import REFRESHED_AT_PREFIX
+
+# reltuples = -1, пока таблица ни разу не анализировалась: тогда берется n_live_tup
+TABLES_SQL = """
+SELECT
+    c.relname,
+    c.relkind,
+    CASE WHEN c.reltuples >= 0 THEN c.reltuples::bigint ELSE s.n_live_tup END AS estimated_rows,
+    pg_table_size(c.oid) AS table_bytes,
+    pg_indexes_size(c.oid) AS index_bytes,
+    s.n_dead_tup,
+    GREATEST(s.last_analyze, s.last_autoanalyze) AS last_analyze,
+    GREATEST(s.last_vacuum, s.last_autovacuum) AS last_vacuum,
+    s.seq_scan,
+    s.idx_scan
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'm')
+ORDER BY c.relname
+"""
+
+# Индексы, по которым не было ни одного сканирования; уникальные и первичные
+# ключи не считаются неиспользуемыми — они обеспечивают ограничения
+UNUSED_INDEXES_SQL = """
+SELECT s.relname, s.indexrelname, pg_relation_size(s.indexrelid) AS index_bytes
+FROM pg_stat_user_indexes s
+JOIN pg_index i ON i.indexrelid = s.indexrelid
+WHERE s.schemaname = 'public' AND s.idx_scan = 0 AND NOT i.indisunique
+ORDER BY pg_relation_size(s.indexrelid) DESC, s.indexrelname
+"""
+
+MATVIEWS_SQL = """
+SELECT m.matviewname, m.ispopulated, obj_description(c.oid, 'pg_class')
+FROM pg_matviews m
+JOIN pg_namespace n ON n.nspname = m.schemaname
+JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = m.matviewname
+WHERE m.schemaname = 'public'
+ORDER BY m.matviewname
+"""
+
+
+def has_rows(cursor, table, more_than=0):
+    """True, если в таблице больше more_than строк; читает не более more_than + 1 строк"""
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table} OFFSET %s)", [int(more_than)])
+    return cursor.fetchone()[0]
+
+def parse_refreshed_at(comment):
+    """Время обновления MV из комментария, который ставит mark_refreshed"""
+    if not comment or not comment.startswith(REFRESHED_AT_PREFIX):
+        return None
+    try:
+        return datetime.fromisoformat(comment[len(REFRESHED_AT_PREFIX):])
+    except ValueError:
+        return None
+
+def health_snapshot(cursor):
+    """Состояние таблиц, индексов и материализованных представлений без чтения данных"""
+    now = datetime.now(timezone.utc)
+
+    cursor.execute(TABLES_SQL)
+    tables = {}
+    for (name, kind, rows, table_bytes, index_bytes, dead, analyzed,
+         vacuumed, seq_scan, idx_scan) in cursor.fetchall():
+        tables[name] = {
+            'kind': 'matview' if kind == 'm' else 'table',
+            'estimated_rows': rows or 0,
+            'table_bytes': table_bytes,
+            'index_bytes': index_bytes,
+            'dead_tuples': dead or 0,
+            'last_analyze': analyzed,
+            'last_vacuum': vacuumed,
+            'seq_scan': seq_scan or 0,
+            'idx_scan': idx_scan or 0,
+        }
+
+    cursor.execute(UNUSED_INDEXES_SQL)
+    unused_indexes = [
+        {'table': table, 'index': index, 'bytes': size}
+        for table, index, size in cursor.fetchall()
+    ]
+
+    cursor.execute(MATVIEWS_SQL)
+    matviews = {}
+    for name, populated, comment in cursor.fetchall():
+        refreshed_at = parse_refreshed_at(comment)
+        matviews[name] = {
+            'populated': populated,
+            'refreshed_at': refreshed_at,
+            'age_seconds': (now - refreshed_at).total_seconds() if refreshed_at else None,
+            'estimated_rows': tables.get(name, {}).get('estimated_rows', 0),
+        }
+
+    return {
+        'taken_at': now,
+        'tables': tables,
+        'unused_indexes': unused_indexes,
+        'matviews': matviews,
+    }
+
+def get_health_snapshot():
+    conn = get_connection(label='health')
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        snapshot = health_snapshot(cursor)
+        snapshot['replicas'] = router.status()
+        return snapshot
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def format_bytes(size):
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024 or unit == 'ГБ':
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_age(seconds):
+    if seconds is None:
+        return "неизвестно"
+    if seconds < 120:
+        return f"{seconds:.0f} с"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f} мин"
+    if seconds < 172800:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
+
+def print_health_snapshot(snapshot):
+    print("🩺 СОСТОЯНИЕ БАЗЫ ДАННЫХ:")
+    print(f"   {'Таблица':<28} {'≈ строк':>10} {'данные':>10} {'индексы':>10} {'мертвых':>8}  анализ / очистка")
+    for name, table in snapshot['tables'].items():
+        analyzed = table['last_analyze'].strftime('%Y-%m-%d %H:%M') if table['last_analyze'] else 'никогда'
+        vacuumed = table['last_vacuum'].strftime('%Y-%m-%d %H:%M') if table['last_vacuum'] else 'никогда'
+        marker = "💾" if table['kind'] == 'matview' else "📋"
+        print(f"   {marker} {name:<26} {table['estimated_rows']:>10,} {format_bytes(table['table_bytes']):>10} "
+              f"{format_bytes(table['index_bytes']):>10} {table['dead_tuples']:>8,}  {analyzed} / {vacuumed}")
+
+    if snapshot['matviews']:
+        print("\n💾 МАТЕРИАЛИЗОВАННЫЕ ПРЕДСТАВЛЕНИЯ:")
+        for name, matview in snapshot['matviews'].items():
+            if not matview['populated']:
+                print(f"   ❌ {name}: не заполнено")
+            else:
+                print(f"   ✅ {name}: ≈{matview['estimated_rows']:,} строк, "
+                      f"обновлено {format_age(matview['age_seconds'])} назад")
+
+    if snapshot.get('replicas'):
+        print("\n🔁 РЕПЛИКИ:")
+        for replica in snapshot['replicas']:
+            if replica['lag'] is None:
+                print(f"   ❌ {replica['endpoint']}: недоступна или не в режиме реплики")
+            else:
+                marker = "✅" if replica['healthy'] else "⚠️ "
+                print(f"   {marker} {replica['endpoint']}: отставание {replica['lag']:.1f} с")
+
+    if snapshot['unused_indexes']:
+        print("\n⚠️  НЕИСПОЛЬЗУЕМЫЕ ИНДЕКСЫ (idx_scan = 0 с последнего сброса статистики):")
+        for index in snapshot['unused_indexes']:
+            print(f"   • {index['table']}.{index['index']} ({format_bytes(index['bytes'])})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Снимок состояния базы по системному каталогу")
+    parser.add_argument('--json', help="сохранить снимок в JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        snapshot = get_health_snapshot()
+    except Exception as e:
+        print(f"❌ Ошибка при получении состояния базы: {e}")
+        return 1
+    print_health_snapshot(snapshot)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2, default=str)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
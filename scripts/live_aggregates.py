@@ -0,0 +1,414 @@
+"""Живые итоги продаж за сегодня и текущую неделю по LISTEN/NOTIFY.
+
+daily_sales считается при каждом чтении, а weekly_sales_report видит новые
+заказы только после обновления MV, и дашбордам приходится опрашивать базу.
+Здесь итоги держит в памяти процесс-слушатель:
+
+1. отложенные до COMMIT триггеры на orders (database.init_database) шлют в
+   канал order_events короткое уведомление, когда заказ текущей недели
+   становится выполненным или перестает им быть (отмена): id, транзакция,
+   клиент, дата, сумма, знак и выручка по категориям;
+2. слушатель ждет уведомлений на сокете соединения (select, без запросов к
+   базе) и сразу применяет их к итогам: выручка, заказы, выручка и заказы по
+   категориям, уникальные клиенты — приближенно, HyperLogLog;
+3. раз в LIVE_RECONCILE_INTERVAL секунд, при смене дня и после переподключения
+   итоги сверяются с базой: один снимок REPEATABLE READ заменяет их целиком,
+   а расхождение сохраняется в состоянии. Уведомления транзакций, которые
+   снимок уже видит, пропускаются — заказ не учитывается дважды.
+
+После каждой пачки уведомлений (не чаще LIVE_STATUS_INTERVAL) итоги пишутся
+в LIVE_STATUS_PATH: дашборды читают файл, а не базу. Отмена не убирает
+клиента из HyperLogLog до ближайшей сверки. Заказы, измененные без смены
+статуса, и удаленные заказы учитываются тоже только при сверке.
+
+    python -m scripts.live_aggregates run
+    python -m scripts.live_aggregates status
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import psycopg2
+
+from database.connection import get_connection
+from database.instrumentation import metrics
+
+# Канал уведомлений: тот же, что в notify_order_event() (database.init_database)
+LIVE_CHANNEL = 'order_events'
+LIVE_STATUS_PATH = os.getenv('LIVE_STATUS_PATH', 'live_status.json')
+LIVE_RECONCILE_INTERVAL = float(os.getenv('LIVE_RECONCILE_INTERVAL', '300'))
+# Файл состояния пишется не чаще, чем раз в столько секунд
+LIVE_STATUS_INTERVAL = float(os.getenv('LIVE_STATUS_INTERVAL', '0.2'))
+# Пауза перед переподключением после обрыва соединения
+LIVE_RETRY_SECONDS = float(os.getenv('LIVE_RETRY_SECONDS', '5'))
+
+# Снимок сверки: по нему видно, какие транзакции уже вошли в итоги из базы
+SNAPSHOT_SQL = """
+SELECT pg_snapshot_xmin(s)::text, pg_snapshot_xmax(s)::text, ARRAY(SELECT pg_snapshot_xip(s)::text)
+FROM pg_current_snapshot() s
+"""
+
+# По клиенту: из строк складываются заказы и выручка, и заполняется HyperLogLog
+RECONCILE_CUSTOMERS_SQL = """
+SELECT
+    user_id,
+    order_date >= %(day_start)s AND order_date < %(day_end)s AS today,
+    COUNT(*),
+    SUM(total_amount)
+FROM orders
+WHERE order_status = 'completed'
+  AND order_date >= %(week_start)s
+  AND order_date < %(week_end)s
+GROUP BY 1, 2
+"""
+
+RECONCILE_CATEGORIES_SQL = """
+SELECT
+    o.order_date >= %(day_start)s AND o.order_date < %(day_end)s AS today,
+    COALESCE(p.category, ''),
+    COUNT(DISTINCT o.id),
+    SUM(oi.subtotal)
+FROM orders o
+JOIN order_items oi ON o.id = oi.order_id
+JOIN products p ON oi.product_id = p.id
+WHERE o.order_status = 'completed'
+  AND o.order_date >= %(week_start)s
+  AND o.order_date < %(week_end)s
+GROUP BY 1, 2
+"""
+
+
+class HyperLogLog:
+    """Приближенное число уникальных значений: 2**precision байт, ошибка около 1.04 / sqrt(2**precision)"""
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        digest = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index = digest >> (64 - self.precision)
+        rest = digest & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # На малых числах точнее линейный подсчет по пустым регистрам
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+
+class PeriodTotals:
+    """Итоги выполненных заказов за период [start, end)"""
+
+    __slots__ = ('start', 'end', 'orders', 'revenue', 'customers', 'categories')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.orders = 0
+        self.revenue = Decimal('0')
+        self.customers = HyperLogLog()
+        # категория -> [заказы, выручка по позициям]
+        self.categories = {}
+
+    def contains(self, moment):
+        return self.start <= moment < self.end
+
+    def add_category(self, category, orders, revenue):
+        totals = self.categories.setdefault(category, [0, Decimal('0')])
+        totals[0] += orders
+        totals[1] += revenue
+
+    def to_dict(self):
+        categories = {
+            category: {'orders': orders, 'revenue': float(revenue)}
+            for category, (orders, revenue) in sorted(self.categories.items(), key=lambda item: -item[1][1])
+            if orders or revenue
+        }
+        return {
+            'start': self.start.isoformat(),
+            'orders': self.orders,
+            'revenue': float(self.revenue),
+            'avg_order_value': round(float(self.revenue) / self.orders, 2) if self.orders else None,
+            'customers': self.customers.estimate(),
+            'categories': categories,
+        }
+
+
+def current_periods(now=None):
+    """Итоги за сегодня и за текущую неделю (с понедельника), пустые"""
+    now = now or datetime.now()
+    day_start = datetime(now.year, now.month, now.day)
+    week_start = day_start - timedelta(days=day_start.weekday())
+    return {
+        'today': PeriodTotals(day_start, day_start + timedelta(days=1)),
+        'week': PeriodTotals(week_start, week_start + timedelta(days=7)),
+    }
+
+def parse_event(payload):
+    """Уведомление order_events -> словарь; суммы — Decimal без потери копеек"""
+    event = json.loads(payload, parse_float=Decimal)
+    event['x'] = int(event['x'])
+    event['d'] = datetime.fromisoformat(event['d'])
+    event['a'] = Decimal(event['a'])
+    event['c'] = {category: Decimal(revenue) for category, revenue in (event.get('c') or {}).items()}
+    return event
+
+
+class LiveAggregates:
+    """Слушатель order_events с итогами за сегодня и неделю в памяти"""
+
+    def __init__(self, status_path=None, reconcile_interval=None, node=None):
+        self.status_path = LIVE_STATUS_PATH if status_path is None else status_path
+        self.reconcile_interval = LIVE_RECONCILE_INTERVAL if reconcile_interval is None else reconcile_interval
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self.periods = current_periods()
+        # (xmin, xmax, xip) снимка последней сверки
+        self.snapshot = None
+        self.events = 0
+        self.skipped = 0
+        self.last_latency = None
+        self.max_latency = None
+        self.reconciled_at = None
+        self.reconciliations = 0
+        self.drift = {}
+        self.next_reconcile = 0.0
+        self._conn = None
+        self._stop = threading.Event()
+        self._status_written = 0.0
+        self._dirty = False
+
+    def connect(self):
+        """Соединение для LISTEN: autocommit, иначе уведомления ждут конца транзакции"""
+        self.close()
+        self._conn = get_connection(label='live_aggregates', application_name=f"live_aggregates {self.node}")
+        self._conn.autocommit = True
+        self._conn.cursor().execute(f"LISTEN {LIVE_CHANNEL}")
+
+    def close(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
+
+    @staticmethod
+    def _visible(xid, snapshot):
+        """Транзакция уже зафиксирована к моменту снимка (и учтена в итогах по нему)"""
+        if snapshot is None:
+            return False
+        xmin, xmax, xip = snapshot
+        return xid < xmin or (xid < xmax and xid not in xip)
+
+    def _receive(self):
+        self._conn.poll()
+        events = [parse_event(notify.payload) for notify in self._conn.notifies]
+        self._conn.notifies.clear()
+        return events
+
+    def _apply(self, event):
+        sign = event['s']
+        for period in self.periods.values():
+            if not period.contains(event['d']):
+                continue
+            period.orders += sign
+            period.revenue += sign * event['a']
+            if sign > 0 and event['u'] is not None:
+                period.customers.add(event['u'])
+            for category, revenue in event['c'].items():
+                period.add_category(category, sign, sign * revenue)
+
+    def apply(self, event):
+        """Применяет уведомление; False — его транзакцию уже учла сверка"""
+        if self._visible(event['x'], self.snapshot):
+            self.skipped += 1
+            return False
+        self._apply(event)
+        self.events += 1
+        self._dirty = True
+        self.last_latency = max(0.0, time.time() - float(event['t']))
+        self.max_latency = max(self.max_latency or 0.0, self.last_latency)
+        metrics.observe('live_aggregates.latency', self.last_latency)
+        return True
+
+    def poll(self, timeout):
+        """Ждет уведомлений до timeout секунд и применяет их; число примененных"""
+        if select.select([self._conn], [], [], timeout) == ([], [], []):
+            return 0
+        applied = sum(self.apply(event) for event in self._receive())
+        self.write_status()
+        return applied
+
+    def reconcile(self):
+        """Заменяет итоги посчитанными по базе; расхождение сохраняется в self.drift"""
+        periods = current_periods()
+        params = {
+            'day_start': periods['today'].start, 'day_end': periods['today'].end,
+            'week_start': periods['week'].start, 'week_end': periods['week'].end,
+        }
+        conn = get_connection(label='live_aggregates.reconcile')
+        try:
+            conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            cursor = conn.cursor()
+            cursor.execute(SNAPSHOT_SQL)
+            xmin, xmax, xip = cursor.fetchone()
+            snapshot = (int(xmin), int(xmax), frozenset(int(xid) for xid in xip))
+            cursor.execute(RECONCILE_CUSTOMERS_SQL, params)
+            for user_id, today, orders, revenue in cursor.fetchall():
+                for period in (periods['week'], periods['today']) if today else (periods['week'],):
+                    period.orders += orders
+                    period.revenue += revenue
+                    if user_id is not None:
+                        period.customers.add(user_id)
+            cursor.execute(RECONCILE_CATEGORIES_SQL, params)
+            for today, category, orders, revenue in cursor.fetchall():
+                periods['week'].add_category(category, orders, revenue)
+                if today:
+                    periods['today'].add_category(category, orders, revenue)
+            conn.rollback()
+        finally:
+            conn.close()
+
+        # Уведомления, пришедшие до снимка, сначала догоняют прежние итоги —
+        # иначе они выглядели бы расхождением; остальные применяются к новым
+        pending = self._receive() if self._conn is not None else []
+        for event in pending:
+            if self._visible(event['x'], snapshot) and not self._visible(event['x'], self.snapshot):
+                self._apply(event)
+                self.events += 1
+        self.drift = {
+            name: {'orders': period.orders - self.periods[name].orders,
+                   'revenue': float(period.revenue - self.periods[name].revenue)}
+            for name, period in periods.items()
+            # Первая сверка и новый день сравнивать не с чем
+            if self.snapshot is not None and period.start == self.periods[name].start
+        }
+        self.periods = periods
+        self.snapshot = snapshot
+        for event in pending:
+            self.apply(event)
+
+        self.reconciled_at = datetime.now(timezone.utc)
+        self.reconciliations += 1
+        self.next_reconcile = time.time() + self.reconcile_interval
+        metrics.increment('live_aggregates.reconcile')
+        self.write_status(force=True)
+        return self.drift
+
+    def status(self):
+        return {
+            'node': self.node,
+            'updated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'events': self.events,
+            'skipped': self.skipped,
+            'last_latency_ms': round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            'max_latency_ms': round(self.max_latency * 1000, 1) if self.max_latency is not None else None,
+            'reconciled_at': self.reconciled_at.isoformat(timespec='seconds') if self.reconciled_at else None,
+            'reconciliations': self.reconciliations,
+            'drift': self.drift,
+            **{name: period.to_dict() for name, period in self.periods.items()},
+        }
+
+    def write_status(self, force=False):
+        if not self.status_path:
+            return
+        now = time.time()
+        if not force and (not self._dirty or now - self._status_written < LIVE_STATUS_INTERVAL):
+            return
+        self._status_written = now
+        self._dirty = False
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.status(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def run(self):
+        """Слушает уведомления до stop(); при обрыве соединения переподключается и сверяется"""
+        try:
+            while not self._stop.is_set():
+                try:
+                    if self._conn is None:
+                        self.connect()
+                        self.reconcile()
+                    day_start = self.periods['today'].start
+                    now = datetime.now()
+                    if time.time() >= self.next_reconcile or now >= day_start + timedelta(days=1):
+                        self.reconcile()
+                        continue
+                    timeout = min(self.next_reconcile - time.time(),
+                                  (day_start + timedelta(days=1) - now).total_seconds())
+                    if self._dirty:
+                        # Отложенная запись состояния не ждет следующего уведомления
+                        timeout = min(timeout, LIVE_STATUS_INTERVAL)
+                    self.poll(max(0.0, timeout))
+                    self.write_status()
+                except psycopg2.OperationalError as e:
+                    print(f"⚠️  Соединение потеряно, переподключение через {LIVE_RETRY_SECONDS:g} с: {e}")
+                    metrics.increment('live_aggregates.reconnect')
+                    self.close()
+                    self._stop.wait(LIVE_RETRY_SECONDS)
+        finally:
+            self.close()
+
+    def stop(self):
+        self._stop.set()
+
+
+def print_status(status):
+    print(f"⚡ Живые итоги узла {status['node']} на {status['updated_at']} "
+          f"(сверка {status['reconciled_at'] or '—'}, задержка {status['last_latency_ms'] or '—'} мс)")
+    for name, title in (('today', 'Сегодня'), ('week', 'Неделя')):
+        period = status[name]
+        print(f"   📊 {title} с {period['start'][:10]}: {period['orders']} заказов, "
+              f"{period['revenue']:,.2f} выручки, ~{period['customers']} клиентов")
+        for category, totals in period['categories'].items():
+            print(f"      {category or '—'}: {totals['orders']} заказов, {totals['revenue']:,.2f}")
+    drift = {name: value for name, value in status['drift'].items() if value['orders'] or value['revenue']}
+    if drift:
+        print(f"   ⚠️  Расхождение при последней сверке: {drift}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Живые итоги продаж за сегодня и неделю (LISTEN/NOTIFY)")
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--reconcile-interval', type=float, help="секунд между сверками (LIVE_RECONCILE_INTERVAL)")
+    parser.add_argument('--status-path', default=LIVE_STATUS_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        try:
+            with open(args.status_path) as f:
+                print_status(json.load(f))
+        except FileNotFoundError:
+            print(f"❌ Слушатель еще не запускался ({args.status_path} нет)")
+            return 1
+        return 0
+
+    live = LiveAggregates(args.status_path, args.reconcile_interval)
+    signal.signal(signal.SIGTERM, lambda *_: live.stop())
+    print(f"⚡ Слушатель {LIVE_CHANNEL} запущен на {live.node}, итоги в {live.status_path}")
+    try:
+        live.run()
+    except KeyboardInterrupt:
+        live.stop()
+    print("✅ Слушатель остановлен")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""Смешанная нагрузка: оформление заказов вместе с отчетами и обновлением MV.
+
+Параллельно работают писатели (новые заказы, добавление товаров, смена
+статусов), читатели отчетов и периодическое обновление материализованных
+представлений. По итогам печатается пропускная способность писателей,
+перцентили задержек читателей, ожидания блокировок из pg_locks и
+длительность обновлений под нагрузкой.
+"""
+
+import argparse
+import random
+import threading
+import time
+from collections import defaultdict
+
+from database.config import DB_CONFIG
+from database.connection import get_connection
+from scripts.benchmark import BENCH_DATABASE, REPORT_CASES, summarize
+from scripts.create_views import MATERIALIZED_VIEW_QUERIES, refresh_view
+
+LOCK_WAITS_SQL = """
+SELECT
+    l.locktype,
+    COALESCE(c.relname, l.locktype) AS relation,
+    l.mode,
+    EXTRACT(EPOCH FROM (NOW() - a.query_start)) * 1000 AS waiting_ms,
+    LEFT(a.query, 60) AS query
+FROM pg_locks l
+JOIN pg_stat_activity a ON a.pid = l.pid
+LEFT JOIN pg_class c ON c.oid = l.relation
+WHERE NOT l.granted
+  AND a.datname = current_database()
+"""
+
+
+class LoadStats:
+    """Потокобезопасный сбор результатов нагрузочного теста"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.lock_samples = 0
+        self.samples_with_waits = 0
+        self.lock_waits = []
+        self.max_waiting = 0
+
+    def record(self, kind, name, elapsed_ms):
+        with self._lock:
+            self.operations[f"{kind}.{name}"] += 1
+            self.latencies[f"{kind}.{name}"].append(elapsed_ms)
+
+    def record_error(self, kind, name, error):
+        with self._lock:
+            self.errors[f"{kind}.{name}: {type(error).__name__}"] += 1
+
+    def record_locks(self, waits):
+        with self._lock:
+            self.lock_samples += 1
+            if waits:
+                self.samples_with_waits += 1
+            self.max_waiting = max(self.max_waiting, len(waits))
+            self.lock_waits.extend(waits)
+
+
+class LoadTest:
+    def __init__(self, writers=4, readers=4, duration=30, refresh_interval=5.0,
+                 refresh_mode='fallback', lock_sample_interval=0.2):
+        self.writers = writers
+        self.readers = readers
+        self.duration = duration
+        self.refresh_interval = refresh_interval
+        self.refresh_mode = refresh_mode
+        self.lock_sample_interval = lock_sample_interval
+        self.stats = LoadStats()
+        self._stop = threading.Event()
+
+    def _load_ids(self):
+        conn = get_connection(label='load_test')
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM users")
+        self.user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT id, price FROM products")
+        self.product_prices = dict(cursor.fetchall())
+        self.product_ids = list(self.product_prices)
+        cursor.close()
+        conn.close()
+        if not self.user_ids or not self.product_ids:
+            raise RuntimeError("Нет пользователей или продуктов для нагрузки")
+
+    # --- Писатели ---
+
+    def _place_order(self, cursor, rng):
+        cursor.execute(
+            "INSERT INTO orders (user_id, total_amount, order_status) VALUES (%s, 0, 'processing') RETURNING id",
+            (rng.choice(self.user_ids),)
+        )
+        order_id = cursor.fetchone()[0]
+        for _ in range(rng.randint(1, 4)):
+            product_id = rng.choice(self.product_ids)
+            cursor.execute(
+                "INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (%s, %s, %s, %s)",
+                (order_id, product_id, rng.randint(1, 3), self.product_prices[product_id])
+            )
+        cursor.execute(
+            "UPDATE orders SET total_amount = (SELECT SUM(subtotal) FROM order_items WHERE order_id = %s) WHERE id = %s",
+            (order_id, order_id)
+        )
+
+    def _add_item(self, cursor, rng):
+        cursor.execute("""
+        SELECT id FROM orders
+        WHERE order_status = 'processing'
+        ORDER BY id DESC
+        LIMIT 1 OFFSET %s
+        FOR UPDATE SKIP LOCKED
+        """, (rng.randint(0, 50),))
+        row = cursor.fetchone()
+        if row is None:
+            return self._place_order(cursor, rng)
+        product_id = rng.choice(self.product_ids)
+        cursor.execute(
+            "INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (%s, %s, %s, %s)",
+            (row[0], product_id, rng.randint(1, 3), self.product_prices[product_id])
+        )
+        cursor.execute(
+            "UPDATE orders SET total_amount = (SELECT SUM(subtotal) FROM order_items WHERE order_id = %s) WHERE id = %s",
+            (row[0], row[0])
+        )
+
+    def _flip_status(self, cursor, rng):
+        cursor.execute("""
+        UPDATE orders SET order_status = %s
+        WHERE id = (
+            SELECT id FROM orders
+            WHERE order_status = 'processing'
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        """, (rng.choice(['completed', 'completed', 'cancelled']),))
+
+    def _writer(self, seed):
+        rng = random.Random(seed)
+        operations = [
+            ('place_order', self._place_order, 5),
+            ('add_item', self._add_item, 2),
+            ('flip_status', self._flip_status, 3),
+        ]
+        names = [op[0] for op in operations]
+        funcs = {op[0]: op[1] for op in operations}
+        weights = [op[2] for op in operations]
+
+        conn = get_connection(label='load_test.writer')
+        cursor = conn.cursor()
+        try:
+            while not self._stop.is_set():
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    funcs[name](cursor, rng)
+                    conn.commit()
+                    self.stats.record('write', name, (time.perf_counter() - started) * 1000)
+                except Exception as e:
+                    conn.rollback()
+                    self.stats.record_error('write', name, e)
+        finally:
+            cursor.close()
+            conn.close()
+
+    # --- Читатели и обновление ---
+
+    def _reader(self, seed):
+        rng = random.Random(seed)
+        names = list(REPORT_CASES)
+        conn = get_connection(label='load_test.reader')
+        conn.autocommit = True
+        cursor = conn.cursor()
+        try:
+            while not self._stop.is_set():
+                name = rng.choice(names)
+                started = time.perf_counter()
+                try:
+                    REPORT_CASES[name](cursor)
+                    self.stats.record('read', name, (time.perf_counter() - started) * 1000)
+                except Exception as e:
+                    self.stats.record_error('read', name, e)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _refresh_once(self, cursor, name):
+        if self.refresh_mode == 'blocking':
+            refresh_view(cursor, name, concurrently=False)
+            return 'refresh'
+        try:
+            refresh_view(cursor, name, concurrently=True)
+            return 'refresh_concurrently'
+        except Exception:
+            # Тот же путь отказа, что и в refresh_materialized_views()
+            if self.refresh_mode != 'fallback':
+                raise
+            refresh_view(cursor, name, concurrently=False)
+            return 'refresh_fallback'
+
+    def _refresher(self):
+        conn = get_connection(label='load_test.refresh')
+        conn.autocommit = True
+        cursor = conn.cursor()
+        try:
+            while not self._stop.wait(self.refresh_interval):
+                for name in MATERIALIZED_VIEW_QUERIES:
+                    started = time.perf_counter()
+                    try:
+                        kind = self._refresh_once(cursor, name)
+                        self.stats.record(kind, name, (time.perf_counter() - started) * 1000)
+                    except Exception as e:
+                        self.stats.record_error('refresh', name, e)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _lock_sampler(self):
+        conn = get_connection(label='load_test.locks')
+        conn.autocommit = True
+        cursor = conn.cursor()
+        try:
+            while not self._stop.wait(self.lock_sample_interval):
+                cursor.execute(LOCK_WAITS_SQL)
+                self.stats.record_locks(cursor.fetchall())
+        finally:
+            cursor.close()
+            conn.close()
+
+    def run(self):
+        self._load_ids()
+        threads = [threading.Thread(target=self._writer, args=(i,), name=f"writer-{i}")
+                   for i in range(self.writers)]
+        threads += [threading.Thread(target=self._reader, args=(1000 + i,), name=f"reader-{i}")
+                    for i in range(self.readers)]
+        if self.refresh_interval > 0:
+            threads.append(threading.Thread(target=self._refresher, name="refresher"))
+        threads.append(threading.Thread(target=self._lock_sampler, name="lock-sampler"))
+
+        print(f"🏋️  Нагрузка: {self.writers} писателей, {self.readers} читателей, "
+              f"обновление MV каждые {self.refresh_interval} с ({self.refresh_mode}), {self.duration} с")
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            self._stop.wait(self.duration)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def report(self):
+        """Итоги нагрузочного теста в виде словаря"""
+        stats = self.stats
+        result = {'elapsed_seconds': round(self.elapsed, 2), 'writers': {}, 'readers': {}, 'refreshes': {}}
+        for name, latencies in sorted(stats.latencies.items()):
+            kind, operation = name.split('.', 1)
+            summary = summarize(latencies)
+            if kind == 'write':
+                summary['per_second'] = round(len(latencies) / self.elapsed, 1)
+                result['writers'][operation] = summary
+            elif kind == 'read':
+                result['readers'][operation] = summary
+            else:
+                result['refreshes'][f"{kind}.{operation}"] = summary
+
+        by_relation = defaultdict(int)
+        for locktype, relation, mode, waiting_ms, query in stats.lock_waits:
+            by_relation[f"{relation} ({mode})"] += 1
+        waits_ms = [float(w[3]) for w in stats.lock_waits if w[3] is not None]
+        result['locks'] = {
+            'samples': stats.lock_samples,
+            'samples_with_waits': stats.samples_with_waits,
+            'max_waiting_at_once': stats.max_waiting,
+            'max_wait_ms': round(max(waits_ms), 1) if waits_ms else 0,
+            'by_relation': dict(by_relation),
+        }
+        result['errors'] = dict(stats.errors)
+        return result
+
+
+def print_load_report(result):
+    print(f"\n📊 ИТОГИ НАГРУЗКИ ({result['elapsed_seconds']} с)")
+    print("=" * 80)
+    print("✍️  ПИСАТЕЛИ:")
+    for name, s in result['writers'].items():
+        print(f"   {name:<25} {s['per_second']:>8.1f} оп/с | p50 {s['p50_ms']:>7.2f}ms | p99 {s['p99_ms']:>8.2f}ms")
+    print("📖 ЧИТАТЕЛИ:")
+    for name, s in result['readers'].items():
+        print(f"   {name:<25} p50 {s['p50_ms']:>8.2f}ms | p95 {s['p95_ms']:>8.2f}ms | p99 {s['p99_ms']:>8.2f}ms")
+    print("🔄 ОБНОВЛЕНИЯ MV:")
+    for name, s in result['refreshes'].items():
+        print(f"   {name:<45} x{s['repetitions']:<3} p50 {s['p50_ms']:>8.2f}ms | max {s['max_ms']:>8.2f}ms")
+    locks = result['locks']
+    print("🔒 ОЖИДАНИЯ БЛОКИРОВОК:")
+    print(f"   Замеров: {locks['samples']} (с ожиданиями: {locks['samples_with_waits']}) | Максимум ожидающих одновременно: {locks['max_waiting_at_once']} | "
+          f"Самое долгое ожидание: {locks['max_wait_ms']}ms")
+    for relation, count in sorted(locks['by_relation'].items(), key=lambda item: -item[1]):
+        print(f"   {relation:<45} {count:>5}")
+    if result['errors']:
+        print("❌ ОШИБКИ:")
+        for name, count in result['errors'].items():
+            print(f"   {name}: {count}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Смешанная нагрузка: заказы + отчеты + обновление MV")
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--refresh-interval', type=float, default=5.0,
+                        help="период обновления MV в секундах (0 — без обновлений)")
+    parser.add_argument('--refresh-mode', choices=['concurrent', 'blocking', 'fallback'], default='fallback',
+                        help="fallback — CONCURRENTLY с откатом на обычное обновление, как refresh_materialized_views()")
+    parser.add_argument('--database', default=BENCH_DATABASE,
+                        help="база с подготовленными данными (например, после scripts.benchmark)")
+    args = parser.parse_args(argv)
+
+    original_database = DB_CONFIG['database']
+    DB_CONFIG['database'] = args.database
+    try:
+        test = LoadTest(args.writers, args.readers, args.duration, args.refresh_interval, args.refresh_mode)
+        print_load_report(test.run())
+    finally:
+        DB_CONFIG['database'] = original_database
+
+if __name__ == "__main__":
+    main()
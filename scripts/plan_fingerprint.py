@@ -0,0 +1,228 @@
+"""Отпечатки планов выполнения аналитических запросов.
+
+Для каждого зарегистрированного запроса (представления и материализованные
+представления из scripts.create_views, запросы отчетов из
+reports.weekly_sales_report) снимается EXPLAIN в JSON, план сводится к
+отпечатку — типы узлов, порядок соединений, использование индексов, сбросы
+на диск — и сохраняется. При следующих запусках отпечатки сравниваются, а
+ухудшения плана считаются регрессией.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+
+from database.connection import get_connection
+from scripts.create_views import VIEW_QUERIES, MATERIALIZED_VIEW_QUERIES
+from reports.weekly_sales_report import REPORT_QUERIES
+
+FINGERPRINTS_FILE = 'plan_fingerprints.json'
+
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+JOIN_NODES = ('Nested Loop', 'Hash Join', 'Merge Join')
+# Соединение вложенными циклами считается ухудшением, если оценка строк
+# внешней стороны больше этого порога
+NESTED_LOOP_ROWS = 1000
+
+
+def registered_queries():
+    """Имя -> (SQL, параметры) для всех зарегистрированных запросов"""
+    queries = {}
+    for name in VIEW_QUERIES:
+        queries[f'view.{name}'] = (f"SELECT * FROM {name}", [])
+    for name, query in MATERIALIZED_VIEW_QUERIES.items():
+        # План обновления MV — это план ее определяющего запроса
+        queries[f'matview.{name}'] = (query, [])
+    for name, (query, params) in REPORT_QUERIES.items():
+        queries[f'report.{name}'] = (query, params())
+    return queries
+
+def capture_plan(cursor, query, params, analyze=False):
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    cursor.execute(f"EXPLAIN ({options}) {query}", params)
+    return cursor.fetchone()[0][0]['Plan']
+
+
+def _node_spills(node):
+    """Признаки сброса узла на диск (видны только в EXPLAIN ANALYZE)"""
+    spills = []
+    if node.get('Sort Space Type') == 'Disk' or 'external' in node.get('Sort Method', ''):
+        spills.append('sort')
+    if node.get('HashAgg Batches', 1) > 1 or node.get('Disk Usage', 0) > 0:
+        spills.append('hash_aggregate')
+    if node.get('Hash Batches', 1) > 1:
+        spills.append('hash')
+    return spills
+
+def fingerprint_plan(plan):
+    """Сводит план EXPLAIN JSON к сравнимому отпечатку"""
+    nodes = []
+    scans = {}
+    join_order = []
+    spills = []
+    nested_loops = []
+
+    def walk(node, depth):
+        node_type = node['Node Type']
+        relation = node.get('Relation Name')
+        descriptor = node_type
+        if node.get('Join Type') and node_type in JOIN_NODES:
+            descriptor += f"({node['Join Type']})"
+        if node.get('Strategy'):
+            descriptor += f"[{node['Strategy']}]"
+        if relation:
+            descriptor += f":{relation}"
+            # Все сканирования отношения; индекс указывается, если используется
+            scan = node_type + (f" using {node['Index Name']}" if node.get('Index Name') else '')
+            scans.setdefault(relation, [])
+            if scan not in scans[relation]:
+                scans[relation].append(scan)
+            join_order.append(relation)
+        elif node.get('Index Name'):
+            descriptor += f":{node['Index Name']}"
+        nodes.append(f"{depth}:{descriptor}")
+
+        for spill in _node_spills(node):
+            spills.append(f"{spill}@{descriptor}")
+
+        children = node.get('Plans', [])
+        if node_type == 'Nested Loop' and children:
+            outer_rows = children[0].get('Plan Rows', 0)
+            if outer_rows > NESTED_LOOP_ROWS:
+                nested_loops.append(f"{descriptor} outer_rows={outer_rows}")
+
+        for child in children:
+            walk(child, depth + 1)
+
+    walk(plan, 0)
+    return {
+        'hash': hashlib.sha1('\n'.join(nodes).encode()).hexdigest()[:16],
+        'nodes': nodes,
+        'scans': scans,
+        'join_order': join_order,
+        'spills': spills,
+        'large_nested_loops': nested_loops,
+        'total_cost': plan.get('Total Cost'),
+        'plan_rows': plan.get('Plan Rows'),
+    }
+
+
+def compare_fingerprints(previous, current):
+    """Изменения и ухудшения между двумя отпечатками одного запроса"""
+    changes = []
+    regressions = []
+    if previous['hash'] == current['hash'] and previous['spills'] == current['spills']:
+        return changes, regressions
+
+    for relation, old_scans in previous['scans'].items():
+        new_scans = current['scans'].get(relation, [])
+        if new_scans != old_scans:
+            changes.append(f"{relation}: {', '.join(old_scans)} → {', '.join(new_scans) or 'нет'}")
+        used_index = any(scan.startswith(INDEX_SCANS) for scan in old_scans)
+        uses_index = any(scan.startswith(INDEX_SCANS) for scan in new_scans)
+        if used_index and not uses_index and any(scan.startswith('Seq Scan') for scan in new_scans):
+            regressions.append(f"{relation}: индексное сканирование заменено последовательным")
+
+    if previous['join_order'] != current['join_order']:
+        changes.append(f"порядок соединений: {' → '.join(previous['join_order'])} "
+                       f"⇒ {' → '.join(current['join_order'])}")
+
+    for spill in current['spills']:
+        if spill not in previous['spills']:
+            regressions.append(f"новый сброс на диск: {spill}")
+
+    for loop in current['large_nested_loops']:
+        if loop not in previous['large_nested_loops']:
+            regressions.append(f"вложенные циклы по большому входу: {loop}")
+
+    if not changes and not regressions:
+        changes.append("изменилась структура плана")
+    return changes, regressions
+
+
+def capture_fingerprints(analyze=False):
+    """Отпечатки планов всех зарегистрированных запросов"""
+    conn = get_connection(label='plan_fingerprint')
+    conn.autocommit = True
+    cursor = conn.cursor()
+    fingerprints = {}
+    try:
+        for name, (query, params) in registered_queries().items():
+            try:
+                fingerprints[name] = fingerprint_plan(capture_plan(cursor, query, params, analyze))
+            except Exception as e:
+                print(f"❌ Не удалось получить план {name}: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    return fingerprints
+
+def load_fingerprints(path=FINGERPRINTS_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_fingerprints(fingerprints, path=FINGERPRINTS_FILE):
+    with open(path, 'w') as f:
+        json.dump(fingerprints, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+def check_plans(path=FINGERPRINTS_FILE, analyze=False, update=False):
+    """Сравнивает текущие планы с сохраненными; True, если ухудшений нет"""
+    stored = load_fingerprints(path)
+    current = capture_fingerprints(analyze)
+
+    print("🧭 ПРОВЕРКА ПЛАНОВ ВЫПОЛНЕНИЯ")
+    print("=" * 60)
+    all_regressions = 0
+    for name, fingerprint in current.items():
+        previous = stored.get(name)
+        if previous is None:
+            print(f"   🆕 {name}: отпечаток сохранен впервые ({fingerprint['hash']})")
+            stored[name] = fingerprint
+            continue
+
+        changes, regressions = compare_fingerprints(previous, fingerprint)
+        if not changes and not regressions:
+            print(f"   ✅ {name}: план не изменился")
+            continue
+
+        marker = "❌" if regressions else "⚠️ "
+        print(f"   {marker} {name}: {previous['hash']} → {fingerprint['hash']}")
+        for change in changes:
+            print(f"      • {change}")
+        for regression in regressions:
+            print(f"      ❌ {regression}")
+        all_regressions += len(regressions)
+        if update or not regressions:
+            stored[name] = fingerprint
+
+    save_fingerprints(stored, path)
+    if all_regressions:
+        print(f"\n❌ Найдено ухудшений планов: {all_regressions}")
+        return False
+    print("\n✅ Ухудшений планов не найдено")
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Отпечатки планов и поиск их регрессий")
+    parser.add_argument('command', choices=['capture', 'check'],
+                        help="capture — сохранить текущие планы, check — сравнить с сохраненными")
+    parser.add_argument('--file', default=FINGERPRINTS_FILE)
+    parser.add_argument('--analyze', action='store_true',
+                        help="EXPLAIN ANALYZE: выполняет запросы, но видит сбросы на диск")
+    parser.add_argument('--update', action='store_true',
+                        help="принять текущие планы даже при ухудшениях")
+    args = parser.parse_args(argv)
+
+    if args.command == 'capture':
+        fingerprints = capture_fingerprints(args.analyze)
+        save_fingerprints(fingerprints, args.file)
+        print(f"💾 Сохранено отпечатков: {len(fingerprints)} в {args.file}")
+        return 0
+    return 0 if check_plans(args.file, args.analyze, args.update) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""Фоновое обновление материализованных представлений на нескольких узлах.
+
+Каждый узел приложения запускает один процесс-планировщик вместо своих
+вызовов refresh_materialized_views(). У каждого MV свой интервал обновления
+со случайным разбросом (jitter), чтобы узлы не приходили одновременно.
+Когда подходит срок:
+
+1. проверяется нагрузка на базу (активные сеансы и ожидания блокировок в
+   pg_stat_activity) — под нагрузкой обновление откладывается с
+   экспоненциальной задержкой;
+2. берется pg_try_advisory_xact_lock по имени MV: если его держит другой
+   узел, значит он уже обновляет это MV, и этот узел ничего не делает;
+3. под блокировкой проверяется время последнего обновления (комментарий
+   MV, его ставит mark_refreshed): если другой узел недавно обновил MV,
+   работа не повторяется;
+4. MV обновляется CONCURRENTLY, при ошибке — обычным REFRESH, как в
+   refresh_materialized_views(); lock_timeout не дает REFRESH стоять в
+   очереди за чужими блокировками.
+
+Блокировка транзакционная и снимается при COMMIT или ROLLBACK, в том числе
+при обрыве соединения. По каждому MV копятся время последнего успешного
+обновления, длительность, число обновлений, пропусков и ошибок; они
+пишутся в REFRESH_STATUS_PATH и в метрики запросов.
+
+    python -m scripts.refresh_daemon run --interval weekly_sales_report=300
+    python -m scripts.refresh_daemon status
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.errorcodes
+
+from database.connection import get_connection
+from database.instrumentation import metrics
+from scripts.create_views import MATERIALIZED_VIEW_QUERIES, refresh_view
+from scripts.health import parse_refreshed_at
+
+REFRESH_INTERVAL = float(os.getenv('REFRESH_INTERVAL', '600'))
+# Разброс интервала: доля интервала в обе стороны
+REFRESH_JITTER = float(os.getenv('REFRESH_JITTER', '0.1'))
+# Первая задержка после ошибки или при нагрузке, далее удваивается (не дольше интервала)
+REFRESH_RETRY_SECONDS = float(os.getenv('REFRESH_RETRY_SECONDS', '30'))
+# Нагрузка: больше стольких активных сеансов или хотя бы одно ожидание блокировки
+REFRESH_MAX_ACTIVE = int(os.getenv('REFRESH_MAX_ACTIVE', '8'))
+REFRESH_LOCK_TIMEOUT_MS = int(os.getenv('REFRESH_LOCK_TIMEOUT_MS', '5000'))
+REFRESH_STATUS_PATH = os.getenv('REFRESH_STATUS_PATH', 'refresh_status.json')
+
+# Первый ключ pg_try_advisory_xact_lock: пространство блокировок обновления MV
+REFRESH_LOCK_NAMESPACE = 4242
+
+LOAD_SQL = """
+SELECT
+    COUNT(*) FILTER (WHERE state = 'active'),
+    COUNT(*) FILTER (WHERE wait_event_type = 'Lock')
+FROM pg_stat_activity
+WHERE datname = current_database()
+  AND backend_type = 'client backend'
+  AND pid <> pg_backend_pid()
+"""
+
+TRY_LOCK_SQL = "SELECT pg_try_advisory_xact_lock(%s, hashtext(%s))"
+
+REFRESHED_AT_SQL = "SELECT obj_description(%s::regclass, 'pg_class')"
+
+
+class ViewSchedule:
+    """Расписание и статистика обновления одного MV"""
+
+    __slots__ = ('name', 'interval', 'next_run', 'backoff', 'last_success', 'last_duration',
+                 'last_error', 'last_outcome', 'refreshes', 'failures', 'consecutive_failures',
+                 'skipped_locked', 'skipped_fresh', 'deferred')
+
+    def __init__(self, name, interval, next_run):
+        self.name = name
+        self.interval = interval
+        self.next_run = next_run
+        self.backoff = 0
+        self.last_success = None
+        self.last_duration = None
+        self.last_error = None
+        self.last_outcome = None
+        self.refreshes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.skipped_locked = 0
+        self.skipped_fresh = 0
+        self.deferred = 0
+
+    def to_dict(self):
+        return {
+            'interval': self.interval,
+            'next_run': datetime.fromtimestamp(self.next_run, timezone.utc).isoformat(timespec='seconds'),
+            'last_success': self.last_success.isoformat(timespec='seconds') if self.last_success else None,
+            'last_duration': round(self.last_duration, 3) if self.last_duration is not None else None,
+            'last_error': self.last_error,
+            'last_outcome': self.last_outcome,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'skipped_locked': self.skipped_locked,
+            'skipped_fresh': self.skipped_fresh,
+            'deferred': self.deferred,
+        }
+
+
+class RefreshDaemon:
+    """Планировщик обновления MV с координацией узлов через advisory lock.
+
+    intervals — {имя MV: интервал в секундах}, по умолчанию все MV с
+    REFRESH_INTERVAL. Первое обновление каждого MV — через случайную долю
+    интервала, чтобы одновременно запущенные узлы разошлись.
+    """
+
+    def __init__(self, intervals=None, jitter=None, max_active=None, status_path=None,
+                 node=None, seed=None):
+        self.jitter = REFRESH_JITTER if jitter is None else jitter
+        self.max_active = REFRESH_MAX_ACTIVE if max_active is None else max_active
+        self.status_path = REFRESH_STATUS_PATH if status_path is None else status_path
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self._rng = random.Random(seed)
+        self._stop = threading.Event()
+        self._conn = None
+        now = time.time()
+        intervals = intervals or {name: REFRESH_INTERVAL for name in MATERIALIZED_VIEW_QUERIES}
+        self.views = {
+            name: ViewSchedule(name, interval, now + self._rng.uniform(0, self.jitter) * interval)
+            for name, interval in intervals.items()
+        }
+
+    def _jittered(self, seconds):
+        return seconds * (1 + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = get_connection(label='refresh_daemon', application_name=f"refresh_daemon {self.node}")
+        return self._conn
+
+    def _is_busy(self, cursor):
+        cursor.execute(LOAD_SQL)
+        active, lock_waits = cursor.fetchone()
+        return active > self.max_active or lock_waits > 0
+
+    def _refresh(self, cursor, name):
+        """CONCURRENTLY, при ошибке — обычный REFRESH в той же транзакции (под той же блокировкой)"""
+        cursor.execute("SET LOCAL lock_timeout = %s", [f"{REFRESH_LOCK_TIMEOUT_MS}ms"])
+        cursor.execute("SAVEPOINT refresh_concurrently")
+        try:
+            refresh_view(cursor, name, concurrently=True)
+        except psycopg2.Error as e:
+            if e.pgcode == psycopg2.errorcodes.LOCK_NOT_AVAILABLE:
+                raise
+            cursor.execute("ROLLBACK TO SAVEPOINT refresh_concurrently")
+            refresh_view(cursor, name, concurrently=False)
+
+    def run_view(self, name):
+        """Одна попытка обновить MV; исход: refreshed, locked, fresh, busy или failed"""
+        view = self.views[name]
+        started = time.time()
+        conn = None
+        try:
+            conn = self._connection()
+            cursor = conn.cursor()
+            try:
+                if self._is_busy(cursor):
+                    outcome = 'busy'
+                else:
+                    cursor.execute(TRY_LOCK_SQL, [REFRESH_LOCK_NAMESPACE, name])
+                    if not cursor.fetchone()[0]:
+                        outcome = 'locked'
+                    else:
+                        cursor.execute(REFRESHED_AT_SQL, [name])
+                        refreshed_at = parse_refreshed_at(cursor.fetchone()[0])
+                        age = (datetime.now(timezone.utc) - refreshed_at).total_seconds() if refreshed_at else None
+                        if age is not None and age < view.interval * (1 - self.jitter):
+                            outcome = 'fresh'
+                        else:
+                            self._refresh(cursor, name)
+                            outcome = 'refreshed'
+                if outcome == 'refreshed':
+                    conn.commit()
+                else:
+                    conn.rollback()
+            finally:
+                cursor.close()
+        except psycopg2.Error as e:
+            if conn is not None and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+            outcome = 'busy' if e.pgcode == psycopg2.errorcodes.LOCK_NOT_AVAILABLE else 'failed'
+            error = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+        except Exception as e:
+            outcome, error = 'failed', str(e) or type(e).__name__
+
+        finished = time.time()
+        view.last_outcome = outcome
+        metrics.increment(f"refresh_daemon.{name}.{outcome}")
+        if outcome == 'refreshed':
+            view.refreshes += 1
+            view.last_success = datetime.now(timezone.utc)
+            view.last_duration = finished - started
+            view.consecutive_failures = 0
+            view.backoff = 0
+            view.next_run = finished + self._jittered(view.interval)
+            metrics.observe(f"refresh_daemon.{name}", view.last_duration)
+        elif outcome == 'locked':
+            # Другой узел обновляет MV прямо сейчас
+            view.skipped_locked += 1
+            view.next_run = finished + self._jittered(view.interval)
+        elif outcome == 'fresh':
+            view.skipped_fresh += 1
+            view.next_run = finished + self._jittered(view.interval - age)
+        else:
+            if outcome == 'busy':
+                view.deferred += 1
+            else:
+                view.failures += 1
+                view.consecutive_failures += 1
+                view.last_error = error
+            view.next_run = finished + self._jittered(min(view.interval, REFRESH_RETRY_SECONDS * 2 ** view.backoff))
+            view.backoff += 1
+        self.write_status()
+        return outcome
+
+    def status(self):
+        return {
+            'node': self.node,
+            'updated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'views': {name: view.to_dict() for name, view in self.views.items()},
+        }
+
+    def write_status(self):
+        if not self.status_path:
+            return
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.status(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def run(self, once=False):
+        """Обновляет MV по расписанию до stop(); once=True — один проход по всем MV"""
+        try:
+            if once:
+                return {name: self.run_view(name) for name in self.views}
+            while not self._stop.is_set():
+                view = min(self.views.values(), key=lambda view: view.next_run)
+                if self._stop.wait(max(0.0, view.next_run - time.time())):
+                    break
+                outcome = self.run_view(view.name)
+                if outcome != 'fresh':
+                    print(f"🔄 {view.name}: {outcome}")
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _parse_interval(text):
+    name, sep, seconds = text.partition('=')
+    if not sep or name not in MATERIALIZED_VIEW_QUERIES:
+        raise argparse.ArgumentTypeError(
+            f"ожидается <MV>=<секунды>, MV: {', '.join(MATERIALIZED_VIEW_QUERIES)}")
+    return name, float(seconds)
+
+def print_status(status):
+    print(f"🔄 Узел {status['node']}, состояние на {status['updated_at']}")
+    for name, view in status['views'].items():
+        duration = f"{view['last_duration']:.2f} с" if view['last_duration'] is not None else "—"
+        print(f"   📊 {name}: последнее обновление {view['last_success'] or '—'} ({duration}), "
+              f"следующее {view['next_run']}")
+        print(f"      ✅ {view['refreshes']} | ❌ {view['failures']} (подряд {view['consecutive_failures']}) | "
+              f"🔒 {view['skipped_locked']} | ⏭️  {view['skipped_fresh']} | ⏳ {view['deferred']}")
+        if view['last_error']:
+            print(f"      ⚠️  {view['last_error']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Фоновое обновление материализованных представлений")
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--interval', action='append', type=_parse_interval, default=[],
+                        help="интервал обновления MV: <MV>=<секунды> (по умолчанию REFRESH_INTERVAL)")
+    parser.add_argument('--jitter', type=float, help="разброс интервала, доля (по умолчанию REFRESH_JITTER)")
+    parser.add_argument('--once', action='store_true', help="один проход по всем MV и выход")
+    parser.add_argument('--status-path', default=REFRESH_STATUS_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        try:
+            with open(args.status_path) as f:
+                print_status(json.load(f))
+        except FileNotFoundError:
+            print(f"❌ Планировщик еще не запускался ({args.status_path} нет)")
+            return 1
+        return 0
+
+    intervals = {name: REFRESH_INTERVAL for name in MATERIALIZED_VIEW_QUERIES}
+    intervals.update(args.interval)
+    daemon = RefreshDaemon(intervals, jitter=args.jitter, status_path=args.status_path)
+    if args.once:
+        for name, outcome in daemon.run(once=True).items():
+            print(f"   {'✅' if outcome == 'refreshed' else '⏭️ '} {name}: {outcome}")
+        return 0
+
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    print(f"🔄 Планировщик обновления MV запущен на {daemon.node}: "
+          + ", ".join(f"{name} каждые {interval:g} с" for name, interval in intervals.items()))
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    print("✅ Планировщик остановлен")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Перезагрузка набора данных без простоя.
+
+Новый набор данных загружается в теневую схему: сначала голые таблицы,
+потом данные, и только после загрузки — индексы, триггеры, представления и
+MV. Затем одна короткая транзакция переносит текущие объекты из public в
+схему списанного поколения, а теневые — в public. До переноса отчеты читают
+старые данные, после — новые; пустых или наполовину загруженных таблиц они
+не видят. Старое поколение удаляется в фоне.
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from psycopg2 import errors, sql
+
+from database.config import DB_CONFIG
+from database.connection import get_connection
+from database.init_database import SCHEMA_SQL, INDEXES_SQL, TRIGGERS_SQL, enable_trigram_search
+from database.session_profiles import apply_profile
+from scripts.create_views import (
+    VIEW_QUERIES, MATERIALIZED_VIEW_QUERIES, REGULAR_VIEWS_SQL,
+    MATERIALIZED_VIEWS_SQL, MATERIALIZED_VIEW_INDEXES_SQL, mark_refreshed, refresh_bound,
+)
+from scripts.archive import ARCHIVE_TABLES
+from scripts.health import has_rows
+
+SHADOW_SCHEMA = 'sales_shadow'
+RETIRED_SCHEMA = 'sales_retired'
+LIVE_SCHEMA = 'public'
+
+# Переносимые отношения: (вид для ALTER, имя). Последовательности SERIAL,
+# индексы, ограничения и триггеры переносятся вместе со своими таблицами.
+# Представления идут раньше таблиц: запрос к представлению блокирует сначала
+# его, потом базовые таблицы, и тот же порядок у переноса исключает взаимоблокировку.
+RELATIONS = (
+    [('VIEW', name) for name in VIEW_QUERIES] +
+    [('MATERIALIZED VIEW', name) for name in MATERIALIZED_VIEW_QUERIES] +
+    [('TABLE', name) for name in ('users', 'products', 'orders', 'order_items') + ARCHIVE_TABLES]
+)
+
+SWAP_LOCK_TIMEOUT = '2s'
+SWAP_ATTEMPTS = 5
+
+
+def _admin_connection(search_path=None):
+    conn = get_connection(label='reload', search_path=search_path)
+    conn.autocommit = True
+    return conn
+
+def prepare_shadow_schema():
+    """Пустая теневая схема с таблицами без вторичных индексов"""
+    conn = _admin_connection(search_path=SHADOW_SCHEMA)
+    cursor = conn.cursor()
+    try:
+        for schema in (SHADOW_SCHEMA, RETIRED_SCHEMA):
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+        cursor.execute(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(SHADOW_SCHEMA)))
+        cursor.execute(SCHEMA_SQL)
+    finally:
+        cursor.close()
+        conn.close()
+
+def load_shadow_data(generate):
+    """Выполняет generate() так, что все его соединения пишут в теневую схему"""
+    original_search_path = DB_CONFIG['search_path']
+    DB_CONFIG['search_path'] = SHADOW_SCHEMA
+    try:
+        generate()
+    finally:
+        DB_CONFIG['search_path'] = original_search_path
+
+def build_shadow_objects():
+    """Индексы, триггеры, представления и MV поверх уже загруженных данных"""
+    # Только теневая схема в пути: иначе DROP ... IF EXISTS из DDL представлений
+    # нашел бы и удалил рабочие объекты в public
+    conn = get_connection(label='reload', search_path=SHADOW_SCHEMA)
+    cursor = conn.cursor()
+    try:
+        if not has_rows(cursor, 'orders'):
+            raise RuntimeError("теневая схема пуста: загрузка данных не удалась")
+        cursor.execute(INDEXES_SQL)
+        # Триггерам нужна общая функция set_updated_at() из public, триграммным
+        # индексам — классы операторов pg_trgm, установленного в public
+        cursor.execute(f"SET LOCAL search_path = {SHADOW_SCHEMA}, {LIVE_SCHEMA}")
+        cursor.execute(TRIGGERS_SQL)
+        enable_trigram_search(cursor)
+        cursor.execute(f"SET LOCAL search_path = {SHADOW_SCHEMA}")
+        cursor.execute(REGULAR_VIEWS_SQL)
+        apply_profile(cursor, 'refresh')
+        bound = refresh_bound(cursor)
+        cursor.execute(MATERIALIZED_VIEWS_SQL)
+        cursor.execute(MATERIALIZED_VIEW_INDEXES_SQL)
+        for name in MATERIALIZED_VIEW_QUERIES:
+            mark_refreshed(cursor, name, bound)
+            cursor.execute(f"ANALYZE {name}")
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def _move_statements(cursor, source, target):
+    statements = []
+    for kind, name in RELATIONS:
+        cursor.execute("SELECT to_regclass(%s)", [f"{source}.{name}"])
+        if cursor.fetchone()[0] is not None:
+            statements.append(sql.SQL("ALTER {} {}.{} SET SCHEMA {}").format(
+                sql.SQL(kind), sql.Identifier(source), sql.Identifier(name), sql.Identifier(target)))
+    return statements
+
+def swap_generations():
+    """Меняет поколения местами одной короткой транзакцией.
+
+    ALTER ... SET SCHEMA берет эксклюзивную блокировку, поэтому ожидание
+    ограничено lock_timeout: если долгий отчет держит таблицу, попытка
+    откатывается и повторяется, а не выстраивает очередь из новых читателей.
+    """
+    conn = get_connection(label='reload.swap')
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(RETIRED_SCHEMA)))
+        conn.commit()
+        for attempt in range(1, SWAP_ATTEMPTS + 1):
+            try:
+                started = time.perf_counter()
+                cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+                for statement in _move_statements(cursor, LIVE_SCHEMA, RETIRED_SCHEMA):
+                    cursor.execute(statement)
+                for statement in _move_statements(cursor, SHADOW_SCHEMA, LIVE_SCHEMA):
+                    cursor.execute(statement)
+                conn.commit()
+                return time.perf_counter() - started
+            except (errors.LockNotAvailable, errors.DeadlockDetected):
+                conn.rollback()
+                print(f"   ⏳ Таблицы заняты, повтор переключения ({attempt}/{SWAP_ATTEMPTS})")
+                time.sleep(attempt * 0.5)
+        raise RuntimeError("не удалось получить блокировки для переключения поколений")
+    finally:
+        cursor.close()
+        conn.close()
+
+def drop_retired_generation():
+    """Удаляет списанное поколение и пустую теневую схему"""
+    conn = _admin_connection()
+    cursor = conn.cursor()
+    try:
+        for schema in (RETIRED_SCHEMA, SHADOW_SCHEMA):
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+    finally:
+        cursor.close()
+        conn.close()
+
+def _drop_in_background():
+    def worker():
+        try:
+            drop_retired_generation()
+            print("   🗑️  Старое поколение данных удалено")
+        except Exception as e:
+            print(f"❌ Ошибка при удалении старого поколения: {e}")
+
+    # Не daemon: процесс дождется удаления перед выходом, но переключение уже сделано
+    thread = threading.Thread(target=worker, name='drop-retired-generation')
+    thread.start()
+    return thread
+
+def reload_dataset(generate, background_drop=True):
+    """Загружает новый набор данных через теневую схему; True при успехе.
+
+    generate — функция без аргументов, загружающая данные в таблицы текущего
+    search_path (например, generate_sample_data). Пока она выполняется,
+    отчеты продолжают читать прежние данные.
+    """
+    try:
+        print(f"🌓 Загрузка нового поколения данных в схему {SHADOW_SCHEMA}...")
+        started = time.perf_counter()
+        prepare_shadow_schema()
+        load_shadow_data(generate)
+        build_shadow_objects()
+        print(f"   ✅ Новое поколение готово за {time.perf_counter() - started:.1f} с")
+
+        swap_seconds = swap_generations()
+        print(f"   🔀 Поколения переключены за {swap_seconds * 1000:.0f} мс")
+    except Exception as e:
+        print(f"❌ Ошибка при перезагрузке данных: {e}")
+        try:
+            drop_retired_generation()
+        except Exception:
+            pass
+        return False
+
+    if background_drop:
+        _drop_in_background()
+    else:
+        drop_retired_generation()
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Перезагрузка данных через теневую схему без простоя")
+    parser.add_argument('--orders', type=int,
+                        help="загрузить столько заказов средствами SQL (иначе — тестовые данные Faker)")
+    parser.add_argument('--seed', type=int, help="seed для воспроизводимых тестовых данных")
+    args = parser.parse_args(argv)
+
+    if args.orders:
+        from scripts.generate_data import generate_scaled_data
+        generate = lambda: generate_scaled_data(args.orders)
+    else:
+        from scripts.generate_data import generate_sample_data
+        generate = lambda: generate_sample_data(seed=args.seed)
+    return 0 if reload_dataset(generate) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Подготовка шардов заказов и проверка отчетов scatter-gather.
+
+    python -m scripts.sharding init         # базы и схема на каждом шарде
+    python -m scripts.sharding distribute   # раскладка данных основного сервера по шардам
+    python -m scripts.sharding check        # отчеты по шардам совпадают с MV основного сервера
+
+Шарды задаются DB_SHARDS (host:port/база через запятую) или --shards.
+
+Шарды — снимок основного сервера, а не место хранения истории: основной
+сервер хранит все заказы и принимает все записи (ingestion, generate), а
+distribute заменяет данные шардов его копией (TRUNCATE + COPY). Отчеты по
+шардам отстают от основного сервера до следующей раскладки. Строки, записанные
+прямо на шард после раскладки, она удалила бы, поэтому distribute отказывается
+раскладывать, пока они есть (--force — удалить их).
+"""
+
+import argparse
+import sys
+import tempfile
+
+from psycopg2 import sql
+
+from database.config import DB_CONFIG, parse_endpoint
+from database.connection import get_connection
+from database.init_database import (
+    ensure_database, enable_trigram_search, SCHEMA_SQL, INDEXES_SQL, FUNCTIONS_SQL, TRIGGERS_SQL,
+)
+from database.routing import endpoint_name
+from database.sharding import SHARDS, get_shard_connection, shard_filter_sql
+from reports import sharded_reports
+from scripts.archive import ARCHIVE_TABLES
+
+# Столбцы для COPY: subtotal у order_items вычисляемый и не копируется
+COPY_COLUMNS = {
+    'products': "id, title, price, category, created_at, updated_at",
+    'users': "id, first_name, last_name, email, country, city, created_at, updated_at",
+    'orders': "id, user_id, order_date, total_amount, order_status, created_at, updated_at",
+    'order_items': "id, order_id, product_id, quantity, unit_price, created_at, updated_at",
+}
+
+# Таблицы архива закрытых месяцев (scripts.archive). Агрегаты по клиентам и
+# позиции граничной недели делятся по user_id, как заказы: уникальные клиенты
+# шардов не пересекаются и складываются. Агрегаты закрытых недель, месяцев и
+# дней живых строк не имеют ни на одном шарде, поэтому лежат целиком на шарде 0.
+# Граница архива нужна каждому шарду
+ARCHIVE_USER_TABLES = ('archive_boundary_items', 'archive_category_sales', 'archive_customer_sales')
+ARCHIVE_FIRST_SHARD_TABLES = ('archive_weekly_sales', 'archive_monthly_sales', 'archive_daily_sales')
+ARCHIVE_SHARED_TABLES = ('archive_state',)
+
+# Буфер COPY держится в памяти до этого размера, дальше — во временном файле
+COPY_BUFFER_BYTES = 64 * 1024 * 1024
+
+# Таблицы, в которые можно писать прямо на шарде: их последовательности переставляет раскладка
+SEQUENCE_TABLES = ('users', 'orders', 'order_items')
+
+# Первое значение последовательности после раскладки (START WITH) и последнее
+# выданное (NULL, если с раскладки nextval не вызывался)
+SEQUENCE_STATE_SQL = """
+SELECT seqstart, pg_sequence_last_value(seqrelid)
+FROM pg_sequence
+WHERE seqrelid = pg_get_serial_sequence(%s, 'id')::regclass
+"""
+
+
+def init_shards(shards=None):
+    """Создает базы шардов (если их нет) и таблицы с индексами и триггерами"""
+    shards = SHARDS if shards is None else shards
+    for endpoint in shards:
+        ensure_database(endpoint.get('database') or DB_CONFIG['database'], endpoint=endpoint)
+        conn = get_shard_connection(endpoint, label='sharding.init')
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SCHEMA_SQL)
+            cursor.execute(INDEXES_SQL)
+            cursor.execute(FUNCTIONS_SQL)
+            cursor.execute(TRIGGERS_SQL)
+            enable_trigram_search(cursor)
+            conn.commit()
+            print(f"   ✅ Шард {endpoint_name(endpoint)} готов")
+        finally:
+            cursor.close()
+            conn.close()
+
+def _shard_select(table, shard_index, shard_count):
+    if table in ARCHIVE_USER_TABLES:
+        return f"SELECT * FROM {table} WHERE {shard_filter_sql('user_id', shard_index, shard_count)}"
+    if table in ARCHIVE_FIRST_SHARD_TABLES:
+        return f"SELECT * FROM {table}" + ("" if shard_index == 0 else " WHERE FALSE")
+    if table in ARCHIVE_SHARED_TABLES:
+        return f"SELECT * FROM {table}"
+    columns = COPY_COLUMNS[table]
+    if table == 'products':
+        return f"SELECT {columns} FROM products"
+    if table == 'users':
+        return f"SELECT {columns} FROM users WHERE {shard_filter_sql('id', shard_index, shard_count)}"
+    if table == 'orders':
+        return f"SELECT {columns} FROM orders WHERE {shard_filter_sql('user_id', shard_index, shard_count)}"
+    prefixed = ", ".join(f"oi.{column.strip()}" for column in columns.split(","))
+    return (f"SELECT {prefixed} FROM order_items oi JOIN orders o ON o.id = oi.order_id "
+            f"WHERE {shard_filter_sql('o.user_id', shard_index, shard_count)}")
+
+def _interleave_sequences(cursor, source_cursor, shard_index, shard_count):
+    """Последовательности шарда i выдают id ≡ i (mod N) больше текущего максимума.
+    START WITH запоминает границу скопированных id для _local_writes"""
+    for table in SEQUENCE_TABLES:
+        source_cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        next_id = source_cursor.fetchone()[0] + 1
+        start = next_id + (shard_index - next_id) % shard_count
+        cursor.execute(f"SELECT pg_get_serial_sequence('{table}', 'id')")
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY {int(shard_count)} "
+                       f"START WITH {int(start)} RESTART")
+
+def _local_writes(cursor):
+    """{таблица: строк} записанных прямо на шард после прошлой раскладки: последовательность
+    с тех пор выдавала id или есть строки с id не меньше ее начала"""
+    writes = {}
+    for table in SEQUENCE_TABLES:
+        cursor.execute(SEQUENCE_STATE_SQL, [table])
+        start, last_value = cursor.fetchone()
+        if last_value is None and start <= 1:
+            # Раскладки еще не было (или она была до START WITH): граница неизвестна
+            continue
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE id >= %s", [start])
+        rows = cursor.fetchone()[0]
+        if rows or last_value is not None:
+            writes[table] = rows
+    return writes
+
+def _check_local_writes(shards):
+    """Отказ до TRUNCATE любого шарда, если раскладка удалила бы строки, которых нет на основном сервере"""
+    problems = []
+    for endpoint in shards:
+        conn = get_shard_connection(endpoint, label='sharding.distribute')
+        try:
+            cursor = conn.cursor()
+            writes = _local_writes(cursor)
+            cursor.close()
+        finally:
+            conn.close()
+        if writes:
+            problems.append(f"{endpoint_name(endpoint)} ("
+                            + ", ".join(f"{table}: {rows}" for table, rows in writes.items()) + ")")
+    if problems:
+        raise RuntimeError("на шардах есть строки, записанные после прошлой раскладки, и она их удалит: "
+                           + "; ".join(problems) + ". Перенесите их на основной сервер или запустите с --force")
+
+def _freeze_archived_months(cursor, source_cursor):
+    """Закрытые месяцы заморожены и на шарде: заказ задним числом в них не попадет.
+    До COPY: после вставки строк ALTER TABLE мешают отложенные проверки внешних ключей"""
+    cursor.execute("ALTER TABLE orders DROP CONSTRAINT IF EXISTS orders_not_archived")
+    source_cursor.execute("SELECT archived_before FROM archive_state")
+    row = source_cursor.fetchone()
+    if row is not None:
+        cursor.execute(sql.SQL("ALTER TABLE orders ADD CONSTRAINT orders_not_archived "
+                               "CHECK (order_date >= {}) NOT VALID").format(sql.Literal(row[0])))
+
+def distribute_data(shards=None, force=False):
+    """Раскладывает данные основного сервера, включая архив закрытых месяцев, по шардам
+    (существующие данные шардов заменяются).
+
+    Если на каком-то шарде есть строки, записанные после прошлой раскладки,
+    RuntimeError до изменения любого шарда; force=True удаляет их вместе с остальными.
+    """
+    shards = SHARDS if shards is None else shards
+    if not force:
+        _check_local_writes(shards)
+    source = get_connection(label='sharding.distribute')
+    source.set_session(readonly=True)
+    source_cursor = source.cursor()
+    try:
+        for shard_index, endpoint in enumerate(shards):
+            conn = get_shard_connection(endpoint, label='sharding.distribute')
+            cursor = conn.cursor()
+            try:
+                cursor.execute("TRUNCATE order_items, orders, users, products, "
+                               f"{', '.join(ARCHIVE_TABLES)} RESTART IDENTITY CASCADE")
+                _freeze_archived_months(cursor, source_cursor)
+                copied = {}
+                for table in ('products', 'users', 'orders', 'order_items') + ARCHIVE_TABLES:
+                    # Схема архива на шарде та же (SCHEMA_SQL), поэтому его таблицы копируются всеми столбцами
+                    columns = f" ({COPY_COLUMNS[table]})" if table in COPY_COLUMNS else ""
+                    with tempfile.SpooledTemporaryFile(max_size=COPY_BUFFER_BYTES, mode='w+b') as buffer:
+                        source_cursor.copy_expert(
+                            f"COPY ({_shard_select(table, shard_index, len(shards))}) TO STDOUT", buffer)
+                        buffer.seek(0)
+                        cursor.copy_expert(f"COPY {table}{columns} FROM STDIN", buffer)
+                        copied[table] = cursor.rowcount
+                _interleave_sequences(cursor, source_cursor, shard_index, len(shards))
+                cursor.execute("ANALYZE users, products, orders, order_items")
+                conn.commit()
+                print(f"   ✅ Шард {endpoint_name(endpoint)}: пользователей {copied['users']}, "
+                      f"заказов {copied['orders']}, элементов {copied['order_items']}")
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                conn.close()
+    finally:
+        source_cursor.close()
+        source.close()
+
+
+def _normalize(rows):
+    # Порядок строк с одинаковой выручкой не определен ни в MV, ни при слиянии
+    return sorted(tuple(row) for row in rows)
+
+def compare_with_primary(shards=None):
+    """Сравнивает отчеты по шардам с MV и представлением основного сервера: {отчет: совпадает}"""
+    checks = {
+        'weekly_sales_report': (sharded_reports.weekly_sales_report,
+                                "SELECT * FROM weekly_sales_report"),
+        'monthly_sales_summary': (sharded_reports.monthly_sales_summary,
+                                  "SELECT * FROM monthly_sales_summary"),
+        'category_analysis': (sharded_reports.category_analysis,
+                              "SELECT * FROM category_analysis"),
+    }
+    conn = get_connection(label='sharding.check')
+    conn.set_session(readonly=True, autocommit=True)
+    cursor = conn.cursor()
+    results = {}
+    try:
+        for name, (sharded, query) in checks.items():
+            cursor.execute(query)
+            expected = _normalize(cursor.fetchall())
+            actual = _normalize(sharded(shards))
+            results[name] = expected == actual
+            if expected == actual:
+                print(f"   ✅ {name}: {len(actual)} строк совпадают")
+            else:
+                missing = [row for row in expected if row not in actual]
+                print(f"   ❌ {name}: расхождения ({len(missing)} строк), например: {missing[:1]}")
+    finally:
+        cursor.close()
+        conn.close()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Шарды заказов по user_id и отчеты scatter-gather")
+    parser.add_argument('command', choices=['init', 'distribute', 'check'])
+    parser.add_argument('--shards', help="host:port/база через запятую (по умолчанию DB_SHARDS)")
+    parser.add_argument('--force', action='store_true',
+                        help="distribute: заменить данные шардов, даже если на них писали после раскладки")
+    args = parser.parse_args(argv)
+
+    shards = [parse_endpoint(item) for item in args.shards.split(',')] if args.shards else SHARDS
+    if not shards:
+        print("❌ Шарды не заданы: укажите DB_SHARDS или --shards")
+        return 1
+
+    try:
+        if args.command == 'init':
+            print(f"🧩 Подготовка шардов: {len(shards)}")
+            init_shards(shards)
+        elif args.command == 'distribute':
+            print(f"🧩 Раскладка данных по {len(shards)} шардам...")
+            distribute_data(shards, force=args.force)
+        else:
+            print("🧩 Сравнение отчетов по шардам с основным сервером:")
+            if not all(compare_with_primary(shards).values()):
+                return 1
+    except Exception as e:
+        print(f"❌ Ошибка шардирования: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
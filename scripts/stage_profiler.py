@@ -0,0 +1,242 @@
+"""Профилирование этапов конвейера (python main.py --profile-stages ...).
+
+Для каждого этапа (инициализация, генерация, проверка, представления,
+обновление MV, разделы отчета) записываются:
+
+- время этапа по часам;
+- ожидание базы — время запросов по метрикам InstrumentedCursor
+  (database.instrumentation), то есть сервер, сеть и прием результата;
+- процессорное время Python (time.process_time) — Faker, преобразование строк
+  psycopg2, форматирование отчетов;
+- прочее ожидание: время по часам минус база и процессор (COMMIT, файлы, паузы);
+- пик памяти Python сверх начала этапа (tracemalloc).
+
+Собственное время функций этапа разбивается по пакетам (faker, psycopg2,
+reports, ожидание базы, ...) по данным cProfile, а сами данные сохраняются в
+STAGE_PROFILE_DIR/<номер>_<этап>.prof для pstats/snakeviz. Итоговая таблица
+выводится в конце и сохраняется в summary.txt и summary.json.
+
+Вложенный этап измеряется отдельно и показывается с отступом; время по
+часам внешнего этапа его включает, а cProfile внешнего этапа — нет.
+cProfile и tracemalloc замедляют Python-код, поэтому процессорное время в
+режиме профилирования завышено; сравнивать стоит доли, а не абсолютные числа.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from database.instrumentation import metrics
+
+STAGE_PROFILE_DIR = os.getenv('STAGE_PROFILE_DIR', 'stage_profiles')
+# Сколько самых затратных функций этапа выводить в summary.txt
+STAGE_PROFILE_TOP = int(os.getenv('STAGE_PROFILE_TOP', '15'))
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Встроенные функции psycopg2, внутри которых клиент ждет сервер
+DB_WAIT_FUNCTIONS = ('execute', 'executemany', 'commit', 'rollback', 'copy_expert', 'copy_from', 'poll')
+
+
+def package_of(filename, function):
+    """Пакет, к которому относится функция из статистики cProfile"""
+    if filename == '~':
+        # Встроенные функции: "<method 'fetchall' of 'psycopg2.extensions.cursor' objects>",
+        # а метод C, вызванный через super() из InstrumentedCursor, — "<function InstrumentedCursor.execute ...>"
+        if 'psycopg2' in function or 'Instrumented' in function:
+            method = re.search(r"(?:method '|function \w+\.)(\w+)", function)
+            return 'ожидание базы' if method and method.group(1) in DB_WAIT_FUNCTIONS else 'psycopg2'
+        return 'встроенные'
+    if filename.startswith('<'):
+        # <frozen importlib._bootstrap> и подобные
+        return 'stdlib'
+    path = os.path.abspath(filename)
+    parts = path.split(os.sep)
+    for marker in ('site-packages', 'dist-packages'):
+        if marker in parts:
+            package = parts[parts.index(marker) + 1]
+            return os.path.splitext(package)[0]
+    if path.startswith(PROJECT_ROOT + os.sep):
+        relative = os.path.relpath(path, PROJECT_ROOT).split(os.sep)
+        return relative[0] if len(relative) > 1 else os.path.splitext(relative[0])[0]
+    return 'stdlib'
+
+
+class Stage:
+    """Измерения одного этапа"""
+
+    __slots__ = ('name', 'depth', 'wall', 'cpu', 'db', 'peak_bytes', 'packages', 'profile_path',
+                 '_profile', '_started', '_memory_start', '_peak')
+
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.wall = self.cpu = self.db = 0.0
+        self.peak_bytes = 0
+        self.packages = {}
+        self.profile_path = None
+        self._profile = cProfile.Profile()
+        self._started = None
+        self._memory_start = 0
+        self._peak = 0
+
+    @property
+    def other(self):
+        return max(0.0, self.wall - self.db - self.cpu)
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'depth': self.depth,
+            'wall_seconds': round(self.wall, 4),
+            'db_seconds': round(self.db, 4),
+            'cpu_seconds': round(self.cpu, 4),
+            'other_seconds': round(self.other, 4),
+            'peak_memory_bytes': self.peak_bytes,
+            'own_time_by_package': {name: round(value, 4) for name, value in self.packages.items()},
+            'profile': self.profile_path,
+        }
+
+
+class StageProfiler:
+    """Профилировщик этапов; пока не включен (enable), stage() ничего не делает"""
+
+    def __init__(self):
+        self.enabled = False
+        self.output_dir = None
+        self.stages = []
+        self._stack = []
+
+    def enable(self, output_dir=None):
+        self.enabled = True
+        self.output_dir = output_dir or STAGE_PROFILE_DIR
+        self.stages = []
+        self._stack = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name):
+        """Измеряет блок кода как этап name"""
+        if not self.enabled:
+            yield
+            return
+
+        parent = self._stack[-1] if self._stack else None
+        stage = Stage(name, len(self._stack))
+        self.stages.append(stage)
+        if parent is not None:
+            # cProfile внешнего этапа приостанавливается, пик его памяти сохраняется
+            parent._profile.disable()
+            parent._peak = max(parent._peak, tracemalloc.get_traced_memory()[1])
+        self._stack.append(stage)
+
+        tracemalloc.reset_peak()
+        stage._memory_start = tracemalloc.get_traced_memory()[0]
+        db_started = metrics.total_seconds()
+        cpu_started = time.process_time()
+        stage._started = time.perf_counter()
+        stage._profile.enable()
+        try:
+            yield stage
+        finally:
+            stage._profile.disable()
+            stage.wall = time.perf_counter() - stage._started
+            stage.cpu = time.process_time() - cpu_started
+            stage.db = metrics.total_seconds() - db_started
+            peak = max(stage._peak, tracemalloc.get_traced_memory()[1])
+            stage.peak_bytes = max(0, peak - stage._memory_start)
+            self._stack.pop()
+            self._finish(stage)
+            if parent is not None:
+                parent._peak = max(parent._peak, peak)
+                parent._profile.enable()
+
+    def _finish(self, stage):
+        stats = pstats.Stats(stage._profile)
+        for (filename, _, function), (_, _, own_seconds, _, _) in stats.stats.items():
+            package = package_of(filename, function)
+            stage.packages[package] = stage.packages.get(package, 0.0) + own_seconds
+        stage.packages = dict(sorted(stage.packages.items(), key=lambda item: -item[1]))
+
+        index = self.stages.index(stage) + 1
+        safe_name = re.sub(r'[^\w.-]+', '_', stage.name)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stage.profile_path = os.path.join(self.output_dir, f"{index:02d}_{safe_name}.prof")
+            stats.dump_stats(stage.profile_path)
+        except OSError as e:
+            stage.profile_path = None
+            print(f"⚠️  Не удалось сохранить профиль этапа {stage.name}: {e}")
+
+    def summary_lines(self):
+        total = sum(stage.wall for stage in self.stages if stage.depth == 0) or 1.0
+        lines = [
+            f"{'Этап':<28} {'Время, с':>9} {'Доля':>6} {'База, с':>8} {'CPU, с':>8} {'Прочее, с':>10} "
+            f"{'Пик, МБ':>8}  Время функций по пакетам",
+            "-" * 120,
+        ]
+        for stage in self.stages:
+            name = "  " * stage.depth + stage.name
+            packages = ", ".join(f"{package} {seconds:.2f}" for package, seconds
+                                 in list(stage.packages.items())[:3] if seconds >= 0.005)
+            lines.append(
+                f"{name:<28} {stage.wall:>9.2f} {stage.wall / total:>6.0%} {stage.db:>8.2f} {stage.cpu:>8.2f} "
+                f"{stage.other:>10.2f} {stage.peak_bytes / 1024 / 1024:>8.1f}  {packages}"
+            )
+        return lines
+
+    def report(self):
+        """Выводит итоговую таблицу и сохраняет summary.txt/summary.json; возвращает список этапов"""
+        if not self.stages:
+            return []
+
+        lines = self.summary_lines()
+        print("\n⏱️  ПРОФИЛЬ ЭТАПОВ")
+        print("=" * 120)
+        for line in lines:
+            print(line)
+
+        # Среди этапов без вложенных: время внешнего этапа уже разложено по ним
+        slowest = max((stage for stage in self.stages if not self._children(stage)), key=lambda stage: stage.wall)
+        bottleneck = 'ожидание базы' if slowest.db >= max(slowest.cpu, slowest.other) else \
+            'процессор Python' if slowest.cpu >= slowest.other else 'прочее ожидание'
+        print(f"\n🎯 Дольше всего: {slowest.name} ({slowest.wall:.2f} с, больше всего — {bottleneck})")
+
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(os.path.join(self.output_dir, 'summary.txt'), 'w') as f:
+                f.write("\n".join(lines) + "\n")
+                for stage in self.stages:
+                    if stage.profile_path:
+                        f.write(f"\n=== {stage.name}: {STAGE_PROFILE_TOP} функций с наибольшим собственным временем\n")
+                        stats = pstats.Stats(stage.profile_path, stream=f)
+                        stats.sort_stats('tottime').print_stats(STAGE_PROFILE_TOP)
+            with open(os.path.join(self.output_dir, 'summary.json'), 'w') as f:
+                json.dump([stage.to_dict() for stage in self.stages], f, ensure_ascii=False, indent=2)
+            print(f"📁 Профили этапов (pstats) и сводка: {self.output_dir}/")
+        except OSError as e:
+            print(f"❌ Ошибка при сохранении профиля этапов: {e}")
+        return [stage.to_dict() for stage in self.stages]
+
+    def _children(self, stage):
+        """Этапы, вложенные в stage (идут за ним с большей глубиной)"""
+        position = self.stages.index(stage)
+        children = []
+        for other in self.stages[position + 1:]:
+            if other.depth <= stage.depth:
+                break
+            children.append(other)
+        return children
+
+
+profiler = StageProfiler()
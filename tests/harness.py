@@ -0,0 +1,191 @@
+"""Изолированный параллельный запуск тестов.
+
+Один раз строится шаблонная база с воспроизводимыми тестовыми данными,
+представлениями и обновленными MV. Каждый тест получает собственную копию
+(CREATE DATABASE ... TEMPLATE), поэтому тесты не зависят от состояния рабочей
+базы и друг от друга и могут выполняться параллельно в разных процессах.
+"""
+
+import sys
+import os
+import io
+import ast
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from psycopg2 import sql
+from database.config import DB_CONFIG
+from database.connection import get_connection
+
+TEMPLATE_DATABASE = 'sales_analytics_test_template'
+TEST_SEED = 42
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которыми строится шаблон; вместе со всеми модулями проекта, которые
+# они импортируют, определяют его содержимое: при их изменении шаблон пересобирается
+TEMPLATE_ENTRY_POINTS = [
+    'database/init_database.py',
+    'scripts/generate_data.py',
+    'scripts/create_views.py',
+]
+
+
+def _project_module_path(module):
+    base = os.path.join(PROJECT_ROOT, *module.split('.'))
+    for path in (base + '.py', os.path.join(base, '__init__.py')):
+        if os.path.isfile(path):
+            return os.path.relpath(path, PROJECT_ROOT)
+    return None
+
+def template_sources():
+    """Точки входа шаблона и все модули проекта, импортируемые ими (в том числе косвенно)"""
+    pending = list(TEMPLATE_ENTRY_POINTS)
+    sources = set()
+    while pending:
+        path = pending.pop()
+        if path in sources:
+            continue
+        sources.add(path)
+        with open(os.path.join(PROJECT_ROOT, path), 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                # from пакет import модуль: имя может быть и модулем, и объектом пакета
+                modules = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+            else:
+                continue
+            for module in modules:
+                module_path = _project_module_path(module)
+                if module_path:
+                    pending.append(module_path)
+    return sorted(sources)
+
+def data_reference_date():
+    """Конец периода тестовых заказов: начало текущих суток.
+
+    Отчеты считают окна от текущего момента (weeks_back и т. п.), поэтому
+    данные привязаны к дате сборки, а дата входит в отпечаток шаблона: в течение
+    суток тесты видят одни и те же данные, а шаблон не стареет — на следующий
+    день он пересобирается.
+    """
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+def template_fingerprint(reference_date=None):
+    reference_date = reference_date or data_reference_date()
+    digest = hashlib.sha1(f"{TEST_SEED}:{reference_date.isoformat()}".encode())
+    for path in template_sources():
+        digest.update(path.encode())
+        with open(os.path.join(PROJECT_ROOT, path), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def _admin_connection():
+    conn = get_connection(label='tests.harness', database='postgres')
+    conn.autocommit = True
+    return conn
+
+def _template_is_current(cursor, fingerprint):
+    cursor.execute("""
+    SELECT shobj_description(oid, 'pg_database')
+    FROM pg_database
+    WHERE datname = %s
+    """, [TEMPLATE_DATABASE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == fingerprint
+
+def drop_database(cursor, name):
+    cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(name)))
+
+def build_template(force=False):
+    """Создает шаблонную базу, если ее нет или изменились исходники схемы"""
+    from database.init_database import init_database
+    from scripts.generate_data import generate_sample_data
+    from scripts.create_views import create_analytical_views, refresh_materialized_views
+
+    reference_date = data_reference_date()
+    fingerprint = template_fingerprint(reference_date)
+    conn = _admin_connection()
+    cursor = conn.cursor()
+    try:
+        if not force and _template_is_current(cursor, fingerprint):
+            print(f"♻️  Шаблонная база {TEMPLATE_DATABASE} актуальна")
+            return
+
+        print(f"🏗️  Сборка шаблонной базы {TEMPLATE_DATABASE}...")
+        started = time.perf_counter()
+        drop_database(cursor, TEMPLATE_DATABASE)
+        cursor.execute(sql.SQL("CREATE DATABASE {} ENCODING 'UTF8' TEMPLATE template0").format(
+            sql.Identifier(TEMPLATE_DATABASE)))
+
+        original_database = DB_CONFIG['database']
+        DB_CONFIG['database'] = TEMPLATE_DATABASE
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output):
+                init_database()
+                generate_sample_data(seed=TEST_SEED, reference_date=reference_date)
+                create_analytical_views()
+                refresh_materialized_views()
+        finally:
+            DB_CONFIG['database'] = original_database
+
+        if '❌' in output.getvalue():
+            print(output.getvalue())
+            raise RuntimeError("Не удалось собрать шаблонную базу")
+
+        cursor.execute(sql.SQL("COMMENT ON DATABASE {} IS {}").format(
+            sql.Identifier(TEMPLATE_DATABASE), sql.Literal(fingerprint)))
+        print(f"✅ Шаблонная база собрана за {time.perf_counter() - started:.1f} с")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def run_isolated(test_func):
+    """Выполняет тест на собственной копии шаблонной базы (в процессе-исполнителе)"""
+    clone = f"sales_test_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    conn = _admin_connection()
+    cursor = conn.cursor()
+    output = io.StringIO()
+    started = time.perf_counter()
+    original_database = DB_CONFIG['database']
+    try:
+        cursor.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(
+            sql.Identifier(clone), sql.Identifier(TEMPLATE_DATABASE)))
+        DB_CONFIG['database'] = clone
+        with redirect_stdout(output):
+            try:
+                passed = bool(test_func())
+            except Exception as e:
+                print(f"❌ Необработанное исключение: {e}")
+                passed = False
+    finally:
+        DB_CONFIG['database'] = original_database
+        drop_database(cursor, clone)
+        cursor.close()
+        conn.close()
+    return passed, output.getvalue(), time.perf_counter() - started
+
+def run_parallel(tests, workers=None):
+    """Запускает тесты [(название, функция)] параллельно, каждый на своей копии базы"""
+    build_template()
+    workers = workers or min(len(tests), os.cpu_count() or 2)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(name, executor.submit(run_isolated, func)) for name, func in tests]
+        for name, future in futures:
+            try:
+                passed, output, duration = future.result()
+            except Exception as e:
+                passed, output, duration = False, f"❌ Ошибка запуска теста: {e}\n", 0.0
+            results.append((name, passed, output, duration))
+    return results
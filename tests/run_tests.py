@@ -1,34 +1,89 @@
 import sys
 import os
+import argparse
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from tests.test_relationships import test_table_relationships
 from tests.test_data_types import test_data_types_and_constraints
 from tests.test_reports_correctness import test_weekly_report_correctness, test_report_data_consistency
+from tests.test_report_service import test_report_service_coalescing, test_report_service_cancellation
+from tests.test_plan_fingerprint import test_plan_regression_detection
+from tests.test_reload import test_reload_without_downtime
+from tests.test_sharding import test_sharded_reports_match_single_node
+from tests.test_routing import test_replica_routing
+from tests.test_session_profiles import test_session_profiles
+from tests.test_cdc import test_cdc_extraction
+from tests.test_ingestion import test_order_ingestion
+from tests.test_money import test_cents_records
+from tests.test_approximate_reports import test_approximate_reports
+from tests.test_refresh_daemon import test_refresh_daemon
+from tests.test_search import test_search
+from tests.test_segmented_reports import test_segmented_reports
+from tests.test_archive import test_archive
+from tests.test_live_aggregates import test_live_aggregates
+from tests.test_budgets import test_report_budgets
+from tests.test_stage_profiler import test_stage_profiler
+from tests.test_source_router import test_source_router
 
-def run_all_tests():
-    """Запускает все тесты"""
+TESTS = [
+    ("Связи между таблицами", test_table_relationships),
+    ("Типы данных и ограничения", test_data_types_and_constraints),
+    ("Корректность недельного отчета", test_weekly_report_correctness),
+    ("Согласованность данных отчетов", test_report_data_consistency),
+    ("HTTP сервис отчетов", test_report_service_coalescing),
+    ("Отмена запросов сервиса отчетов", test_report_service_cancellation),
+    ("Регрессии планов выполнения", test_plan_regression_detection),
+    ("Перезагрузка данных без простоя", test_reload_without_downtime),
+    ("Маршрутизация чтения на реплики", test_replica_routing),
+    ("Отчеты по шардам", test_sharded_reports_match_single_node),
+    ("Профили сессии", test_session_profiles),
+    ("Выгрузка изменений", test_cdc_extraction),
+    ("Пакетная запись заказов", test_order_ingestion),
+    ("Деньги в копейках", test_cents_records),
+    ("Приближенные отчеты", test_approximate_reports),
+    ("Планировщик обновления MV", test_refresh_daemon),
+    ("Поиск товаров и клиентов", test_search),
+    ("Сегментированные отчеты", test_segmented_reports),
+    ("Архив закрытых месяцев", test_archive),
+    ("Живые итоги продаж", test_live_aggregates),
+    ("Бюджеты времени отчетов", test_report_budgets),
+    ("Профиль этапов конвейера", test_stage_profiler),
+    ("Выбор источника отчетов", test_source_router),
+]
+
+def run_all_tests(shared=False, workers=None):
+    """Запускает все тесты.
+
+    По умолчанию каждый тест выполняется на собственной копии шаблонной базы,
+    параллельно в нескольких процессах. С shared=True тесты выполняются
+    последовательно на общей базе из DB_CONFIG.
+    """
     print("🧪 ЗАПУСК ТЕСТОВ ПРОЕКТА АНАЛИТИКИ")
     print("=" * 50)
     
-    tests = [
-        ("Связи между таблицами", test_table_relationships),
-        ("Типы данных и ограничения", test_data_types_and_constraints),
-        ("Корректность недельного отчета", test_weekly_report_correctness),
-        ("Согласованность данных отчетов", test_report_data_consistency),
-    ]
-    
     passed = 0
-    total = len(tests)
+    total = len(TESTS)
     
-    for test_name, test_func in tests:
-        print(f"\n🔍 Запуск теста: {test_name}")
-        if test_func():
-            passed += 1
-            print(f"✅ Тест '{test_name}' пройден")
-        else:
-            print(f"❌ Тест '{test_name}' не пройден")
+    if shared:
+        for test_name, test_func in TESTS:
+            print(f"\n🔍 Запуск теста: {test_name}")
+            if test_func():
+                passed += 1
+                print(f"✅ Тест '{test_name}' пройден")
+            else:
+                print(f"❌ Тест '{test_name}' не пройден")
+    else:
+        from tests.harness import run_parallel
+
+        for test_name, ok, output, duration in run_parallel(TESTS, workers):
+            print(f"\n🔍 Тест: {test_name} ({duration:.2f} с)")
+            print(output, end="")
+            if ok:
+                passed += 1
+                print(f"✅ Тест '{test_name}' пройден")
+            else:
+                print(f"❌ Тест '{test_name}' не пройден")
     
     print(f"\n📊 ИТОГ: {passed}/{total} тестов пройдено")
     
@@ -40,4 +95,9 @@ def run_all_tests():
     return passed == total
 
 if __name__ == "__main__":
-    run_all_tests()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Запуск тестов проекта аналитики")
+    parser.add_argument('--shared', action='store_true',
+                        help="последовательно на общей базе вместо изолированных копий")
+    parser.add_argument('--workers', type=int, help="число параллельных процессов")
+    args = parser.parse_args()
+    sys.exit(0 if run_all_tests(shared=args.shared, workers=args.workers) else 1)
\ No newline at end of file
@@ -0,0 +1,143 @@
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from database.connection import get_connection
+from reports.approximate_reports import Sampling, Estimate, ApproximateRow, fetch_approximate, choose_percent
+from reports.weekly_sales_report import (
+    fetch_category_analysis, fetch_daily_sales, fetch_monthly_report, fetch_weekly_report,
+)
+from scripts.archive import archive_closed_months, archive_cutoff
+from scripts.create_views import MATERIALIZED_VIEW_QUERIES, refresh_view
+
+def _close(estimate, exact):
+    """Среднее из float сравнивается с ROUND(..., 2): расхождение не больше полкопейки"""
+    return abs(Decimal(estimate) - exact) <= Decimal('0.0051')
+
+def _check_full_sample(cursor, method):
+    """Оценки по выборке 100% совпадают с точными отчетами, интервалы нулевые"""
+    full = Sampling(percent=100, method=method)
+    _, rows, total = fetch_approximate(cursor, 'categories', full)
+    estimates = {row.key[0]: row for row in rows}
+    exact = fetch_category_analysis(cursor)
+    assert len(estimates) == len(exact), "Не все категории попали в полную выборку"
+    for category, orders, items, revenue, avg_price, _, _ in exact:
+        row = estimates[category]
+        assert round(row.revenue.value, 2) == float(revenue), f"{category}: выручка {row.revenue.value} != {revenue}"
+        assert row.orders.value == orders and row.items.value == items, f"{category}: заказы или товары"
+        assert _close(row.average.value, avg_price), f"{category}: средняя цена"
+        assert row.revenue.margin == 0 and row.average.margin == 0, f"{category}: интервал не нулевой"
+    assert round(total.revenue.value, 2) == float(sum(row[3] for row in exact)), "Итог по категориям"
+
+    _, rows, _ = fetch_approximate(cursor, 'daily', full, since=datetime.now() - timedelta(days=90))
+    daily = {row.key[0]: row for row in rows}
+    for sale_date, orders, revenue, avg_order_value, _ in fetch_daily_sales(cursor, 90):
+        row = daily[sale_date]
+        assert row.orders.value == orders and round(row.revenue.value, 2) == float(revenue), f"День {sale_date}"
+        assert _close(row.average.value, avg_order_value), f"День {sale_date}: средний чек"
+
+    since = (datetime.now() - timedelta(days=180)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    _, rows, _ = fetch_approximate(cursor, 'monthly', full, since=since)
+    monthly = {row.key[0]: row for row in rows}
+    for month in fetch_monthly_report(cursor, 6):
+        row = monthly[month[0]]
+        assert row.orders.value == month[3] and round(row.revenue.value, 2) == float(month[5]), \
+            f"Месяц {month[0]}"
+        assert row.items.value == month[6] and _close(row.average.value, month[7]), f"Месяц {month[0]}"
+
+    _, rows, _ = fetch_approximate(cursor, 'weekly', full, since=datetime.now() - timedelta(weeks=26))
+    weekly = {row.key: row for row in rows}
+    for week_start, category, orders, _, revenue, items, avg_order_value, _ in fetch_weekly_report(cursor, 26):
+        row = weekly[(week_start, category)]
+        assert row.orders.value == orders and round(row.revenue.value, 2) == float(revenue), \
+            f"Неделя {week_start:%Y-%m-%d}, {category}"
+        assert row.items.value == items and _close(row.average.value, avg_order_value), \
+            f"Неделя {week_start:%Y-%m-%d}, {category}: товары или средний чек"
+
+def test_approximate_reports():
+    """Проверяем приближенные отчеты: точность на полной выборке, покрытие интервалов, выбор доли"""
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ПРИБЛИЖЕННЫХ ОТЧЕТОВ:")
+
+        # Выборка 100% — те же числа, что у точного отчета, и нулевые интервалы
+        for method in ('bernoulli', 'system'):
+            _check_full_sample(cursor, method)
+            conn.rollback()
+        print("   ✅ На полной выборке оценки совпадают с точными отчетами")
+
+        # Интервалы на частичной выборке должны накрывать точное значение примерно в 95% случаев
+        exact_total = float(sum(row[3] for row in fetch_category_analysis(cursor)))
+        covered = 0
+        for seed in range(40):
+            percent, _, total = fetch_approximate(cursor, 'categories', Sampling(percent=30, seed=seed))
+            assert percent == 30 and total.revenue.margin > 0, "Интервал на частичной выборке не оценен"
+            covered += abs(total.revenue.value - exact_total) <= total.revenue.margin
+            conn.rollback()
+        assert covered >= 32, f"Интервал накрыл точную выручку только в {covered} из 40 выборок"
+        print(f"   ✅ Интервал 95% накрыл точную выручку в {covered} из 40 выборок")
+
+        # Выбор доли под целевую ошибку: дисперсия пропорциональна (1 - p)/p
+        pilot = [ApproximateRow(('A',), 100, Estimate(1000.0, 100.0), None, None, None),
+                 ApproximateRow(('B',), 100, Estimate(1000.0, 50.0), None, None, None)]
+        assert abs(choose_percent(pilot, 1, 0.05) - 100 / (1 + 0.25 * 99)) < 1e-9, "Доля для худшей группы"
+        assert choose_percent(pilot, 1, 0.2) == 1, "Достаточно точная пробная выборка не используется"
+        assert choose_percent([], 1, 0.05) == 100, "Пустая пробная выборка должна вести к полному чтению"
+        for bad in ({}, {'percent': 0}, {'percent': 5, 'target_error': 0.1}, {'target_error': 1.5},
+                    {'percent': 5, 'method': 'random'}):
+            try:
+                Sampling(**bad)
+                raise AssertionError(f"Неверные параметры выборки приняты: {bad}")
+            except ValueError:
+                pass
+        print("   ✅ Доля выборки подбирается под целевую ошибку")
+
+        # После архивирования заказов в orders нет: итоги архива входят в оценку без ошибки
+        cursor.execute("SELECT MAX(order_date) FROM orders")
+        before = archive_cutoff(2, now=cursor.fetchone()[0])
+        conn.rollback()
+        archived = archive_closed_months(before, output_dir=tempfile.mkdtemp(), vacuum=False)
+        assert archived and archived['orders'] > 0, f"Архивирование до {before:%Y-%m-%d} ничего не перенесло"
+        refresh_conn = get_connection()
+        refresh_cursor = refresh_conn.cursor()
+        for name in MATERIALIZED_VIEW_QUERIES:
+            refresh_view(refresh_cursor, name, concurrently=False)
+        refresh_conn.commit()
+        refresh_conn.close()
+        for method in ('bernoulli', 'system'):
+            _check_full_sample(cursor, method)
+            conn.rollback()
+        exact_total = float(sum(row[3] for row in fetch_category_analysis(cursor)))
+        covered = 0
+        for seed in range(40):
+            _, _, total = fetch_approximate(cursor, 'categories', Sampling(percent=30, seed=seed))
+            covered += abs(total.revenue.value - exact_total) <= total.revenue.margin
+            conn.rollback()
+        assert covered >= 32, f"После архивирования интервал накрыл выручку только в {covered} из 40 выборок"
+        _, rows, _ = fetch_approximate(cursor, 'monthly', Sampling(percent=30, seed=1), since=datetime(2000, 1, 1))
+        closed = [row for row in rows if row.key[0] < before]
+        assert closed and all(row.units == 0 and row.revenue.margin == 0 and row.average.margin == 0
+                              for row in closed), "Закрытые месяцы оценены с ошибкой"
+        conn.rollback()
+        print(f"   ✅ После архивирования до {before:%Y-%m-%d} ({archived['orders']} заказов) "
+              f"оценки включают архив: {len(closed)} закрытых месяцев точно, интервал накрыл выручку в {covered} из 40")
+
+        cursor.close()
+        conn.close()
+        print("✅ Приближенные отчеты работают корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте приближенных отчетов: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_approximate_reports()
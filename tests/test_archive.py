@@ -0,0 +1,158 @@
+import sys
+import os
+import csv
+import errno
+import gzip
+import shutil
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from database.connection import get_connection
+from scripts import archive
+from scripts.archive import archive_closed_months, archive_cutoff, archive_status, export_month
+from scripts.create_views import MATERIALIZED_VIEW_QUERIES, refresh_view
+
+# Все, что отчеты читают из живых и архивных данных вместе
+SNAPSHOT_QUERIES = {
+    'weekly_sales_report': "SELECT * FROM weekly_sales_report ORDER BY week_start, top_category",
+    'monthly_sales_summary': "SELECT * FROM monthly_sales_summary ORDER BY month_start",
+    'daily_sales': "SELECT * FROM daily_sales ORDER BY sale_date",
+    'category_analysis': "SELECT * FROM category_analysis ORDER BY category",
+    'customer_analytics': "SELECT * FROM customer_analytics ORDER BY user_id",
+}
+
+CONSTRAINT_SQL = ("SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+                  "WHERE conrelid = 'orders'::regclass AND conname = 'orders_not_archived'")
+
+def _snapshot():
+    conn = get_connection()
+    cursor = conn.cursor()
+    for name in MATERIALIZED_VIEW_QUERIES:
+        refresh_view(cursor, name, concurrently=False)
+    conn.commit()
+    snapshot = {}
+    for name, query in SNAPSHOT_QUERIES.items():
+        cursor.execute(query)
+        snapshot[name] = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return snapshot
+
+def _assert_same(expected, actual, stage):
+    for name in SNAPSHOT_QUERIES:
+        assert actual[name] == expected[name], f"{stage}: {name} изменилось после архивирования"
+
+def _file_rows(files, table):
+    rows = 0
+    for path in files:
+        if os.path.basename(path) == f"{table}.csv.gz":
+            with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+                rows += sum(1 for _ in csv.reader(f)) - 1
+    return rows
+
+def test_archive():
+    """Проверяем архив закрытых месяцев: те же отчеты, файлы строк, закрытые месяцы и повторный запуск"""
+    output_dir = tempfile.mkdtemp()
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ АРХИВА ЗАКРЫТЫХ МЕСЯЦЕВ:")
+
+        expected = _snapshot()
+        cursor.execute("SELECT MIN(order_date) FROM orders")
+        first = archive_cutoff(-1, cursor.fetchone()[0])
+        cursor.execute("SELECT COUNT(*) FROM orders o JOIN order_items oi ON o.id = oi.order_id "
+                       "WHERE o.order_date < %s", [archive_cutoff(-1, first)])
+        items_to_archive = cursor.fetchone()[0]
+
+        # Первый месяц, затем второй: граница обычно проходит посреди недели, и
+        # архивная часть прежней граничной недели сворачивается в итоги недель
+        for before in (first, archive_cutoff(-1, first)):
+            cursor.execute("SELECT COUNT(*) FROM orders WHERE order_date < %s", [before])
+            archived = cursor.fetchone()[0]
+            result = archive_closed_months(before, output_dir=output_dir)
+            assert result['orders'] == archived > 0, f"Перенесено {result['orders']} заказов из {archived}"
+            assert _file_rows(result['files'], 'orders') == archived, "Строки файлов не совпадают с заказами"
+            cursor.execute("SELECT COUNT(*) FROM orders WHERE order_date < %s", [before])
+            assert cursor.fetchone()[0] == 0, "Заказы до границы остались в живых таблицах"
+            _assert_same(expected, _snapshot(), f"Граница {before:%Y-%m-%d}")
+            print(f"   ✅ Граница {before:%Y-%m-%d}: {archived} заказов в архиве, отчеты не изменились")
+
+        cursor.execute("SELECT COUNT(*) FROM archive_boundary_items")
+        assert (cursor.fetchone()[0] > 0) == (before.weekday() != 0), "Позиции граничной недели"
+        files = [os.path.join(root, name) for root, _, names in os.walk(output_dir) for name in names]
+        assert len(files) == 4 and not any(path.endswith('.tmp') for path in files), f"Файлы архива: {files}"
+        assert _file_rows(files, 'order_items') == items_to_archive, "Строки позиций в файлах"
+        print(f"   ✅ Позиции в {len(files)} сжатых файлах, граничная неделя в archive_boundary_items")
+
+        # Закрытые месяцы заморожены
+        cursor.execute("SELECT id FROM users LIMIT 1")
+        user_id = cursor.fetchone()[0]
+        try:
+            cursor.execute("INSERT INTO orders (user_id, order_date, total_amount, order_status) "
+                           "VALUES (%s, %s, 10, 'completed')", [user_id, first])
+            raise AssertionError("Заказ в закрытый месяц принят")
+        except psycopg2.errors.CheckViolation:
+            pass
+        print("   ✅ Заказ задним числом в закрытый месяц отклоняется")
+
+        # Сбой переноса (например, нет места для файлов) возвращает ограничение к прежней границе
+        closed = archive_cutoff(-1, first)
+        failing = archive_cutoff(-1, closed)
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE order_date < %s", [failing])
+        live_before_failing = cursor.fetchone()[0]
+        assert live_before_failing > 0, f"Нет заказов до {failing:%Y-%m-%d} для проверки сбоя"
+        cursor.execute(CONSTRAINT_SQL)
+        constraint = cursor.fetchone()
+
+        def no_space(*args, **kwargs):
+            raise OSError(errno.ENOSPC, "No space left on device")
+        archive.export_month = no_space
+        try:
+            archive_closed_months(failing, output_dir=output_dir)
+            raise AssertionError("Сбой выгрузки не остановил архивирование")
+        except OSError:
+            pass
+        finally:
+            archive.export_month = export_month
+        cursor.execute(CONSTRAINT_SQL)
+        assert cursor.fetchone() == constraint, "Ограничение не возвращено к прежней границе"
+        assert archive_status(cursor)[0] == closed, "Граница архива изменилась после сбоя"
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE order_date < %s", [failing])
+        assert cursor.fetchone()[0] == live_before_failing, "Заказы удалены при сбое"
+        cursor.execute("INSERT INTO orders (user_id, order_date, total_amount, order_status) "
+                       "VALUES (%s, %s, 10, 'completed') RETURNING id", [user_id, closed])
+        cursor.execute("DELETE FROM orders WHERE id = %s", [cursor.fetchone()[0]])
+        print(f"   ✅ Сбой переноса до {failing:%Y-%m-%d} возвращает границу {closed:%Y-%m-%d}: "
+              "заказы живых месяцев принимаются")
+
+        # Повтор и неверная граница
+        assert archive_closed_months(first, output_dir=output_dir)['orders'] == 0, "Повторное архивирование"
+        assert archive_status(cursor)[0] == archive_cutoff(-1, first), "Граница архива в archive_state"
+        try:
+            archive_closed_months(datetime(2026, 8, 15), output_dir=output_dir)
+            raise AssertionError("Граница не с начала месяца принята")
+        except ValueError:
+            pass
+        assert archive_cutoff(12, datetime(2026, 1, 20)) == datetime(2025, 1, 1), "Граница по горизонту"
+        print("   ✅ Повторный запуск ничего не переносит, граница проверяется")
+
+        cursor.close()
+        conn.close()
+        print("✅ Архив закрытых месяцев работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте архива: {e}")
+        return False
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_archive()
@@ -0,0 +1,126 @@
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.connection import get_connection
+from reports.budgets import ReportCache, ReportTimeout, run_budgeted, budget_counters
+from reports.weekly_sales_report import fetch_category_records
+
+def _sleep(cursor, seconds, value):
+    cursor.execute("SELECT pg_sleep(%s), %s", [seconds, value])
+    return cursor.fetchone()[1]
+
+def _many_sleeps(cursor, count, seconds):
+    # Каждый запрос укладывается в statement_timeout, вместе — нет: отменяет таймер клиента
+    for _ in range(count):
+        cursor.execute("SELECT pg_sleep(%s)", [seconds])
+    return 'done'
+
+def _sleeping_backends(cursor):
+    cursor.execute("""
+        SELECT COUNT(*) FROM pg_stat_activity
+        WHERE state = 'active' AND query LIKE 'SELECT pg_sleep%%' AND pid <> pg_backend_pid()
+    """)
+    return cursor.fetchone()[0]
+
+def _counter(name, kind):
+    return budget_counters().get(name, {}).get(kind, 0)
+
+def test_report_budgets():
+    """Проверяем бюджеты отчетов: отмена запроса, откат на сохраненный результат, пауза после превышения"""
+    cache_dir = tempfile.mkdtemp()
+    try:
+        report_cache = ReportCache(cache_dir)
+        conn = get_connection()
+        monitor = get_connection()
+        monitor.autocommit = True
+        monitor_cursor = monitor.cursor()
+
+        print("✅ ТЕСТ БЮДЖЕТОВ ОТЧЕТОВ:")
+
+        # Уложился в бюджет — результат сохранен
+        value, stale = run_budgeted(conn, 'test_sleep', _sleep, 0, 'fresh', key='test_sleep',
+                                    budget_ms=2000, report_cache=report_cache)
+        conn.commit()
+        assert value == 'fresh' and stale is None, f"Результат в пределах бюджета: {value}, {stale}"
+        assert report_cache.get('test_sleep')[0] == 'fresh', "Результат не сохранен"
+        print("   ✅ Результат в пределах бюджета сохранен")
+
+        # Превысил бюджет — запрос отменен на сервере, отдан сохраненный результат
+        timeouts, fallbacks = _counter('test_sleep', 'timeouts'), _counter('test_sleep', 'fallbacks')
+        started = time.time()
+        value, stale = run_budgeted(conn, 'test_sleep', _sleep, 5, 'late', key='test_sleep',
+                                    budget_ms=100, report_cache=report_cache)
+        elapsed = time.time() - started
+        assert value == 'fresh' and stale is not None, f"Откат на сохраненный результат: {value}, {stale}"
+        assert elapsed < 1, f"Отчет ждал {elapsed:.2f} с при бюджете 100 мс"
+        assert _counter('test_sleep', 'timeouts') == timeouts + 1, "Счетчик превышений"
+        assert _counter('test_sleep', 'fallbacks') == fallbacks + 1, "Счетчик откатов"
+        assert _sleeping_backends(monitor_cursor) == 0, "Запрос продолжает выполняться на сервере"
+        assert 'устарели' in stale.describe() and 'cached_at' in stale.to_dict(), "Пометка об устаревании"
+        print(f"   ✅ Превышение бюджета: сохраненный результат через {elapsed * 1000:.0f} мс, запрос отменен")
+
+        # Пока действует пауза, отчет не выполняется вовсе
+        calls = []
+        def counted(cursor):
+            calls.append(1)
+            return 'new'
+        value, stale = run_budgeted(conn, 'test_sleep', counted, key='test_sleep',
+                                    budget_ms=100, report_cache=report_cache)
+        assert value == 'fresh' and stale is not None and not calls, "Пауза после превышения бюджета"
+        report_cache.close_circuit('test_sleep')
+        value, stale = run_budgeted(conn, 'test_sleep', counted, key='test_sleep',
+                                    budget_ms=100, report_cache=report_cache)
+        conn.commit()
+        assert value == 'new' and stale is None and calls, "Отчет после паузы"
+        print("   ✅ После превышения отчет отдается из сохраненного без запросов к базе")
+
+        # Бюджет на все запросы отчета: каждый короче statement_timeout, но вместе дольше
+        report_cache.put('test_many', 'saved')
+        started = time.time()
+        value, stale = run_budgeted(conn, 'test_many', _many_sleeps, 10, 0.05, key='test_many',
+                                    budget_ms=200, report_cache=report_cache)
+        elapsed = time.time() - started
+        assert value == 'saved' and stale is not None and elapsed < 0.4, \
+            f"Отмена таймером клиента: {value}, {elapsed:.2f} с"
+        print(f"   ✅ Несколько запросов отчета отменены таймером клиента через {elapsed * 1000:.0f} мс")
+
+        # Нечего отдать — ReportTimeout; соединение остается рабочим
+        try:
+            run_budgeted(conn, 'test_empty', _sleep, 5, 'late', budget_ms=100, report_cache=report_cache)
+            raise AssertionError("Превышение без сохраненного результата не обнаружено")
+        except ReportTimeout as e:
+            assert e.name == 'test_empty' and e.budget_ms == 100, f"ReportTimeout: {e}"
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        assert cursor.fetchone()[0] == 1, "Соединение после отмены"
+        cursor.close()
+        conn.rollback()
+        print("   ✅ Без сохраненного результата — ReportTimeout, соединение рабочее")
+
+        # Сохраненный результат переживает перезапуск: компактные строки, копейки и Decimal
+        records, _ = run_budgeted(conn, 'category_analysis', fetch_category_records,
+                                  budget_ms=10000, report_cache=report_cache)
+        conn.commit()
+        restored, _ = ReportCache(cache_dir).get('category_analysis')
+        assert records and repr(restored) == repr(records), "Строки отчета после чтения с диска"
+        print(f"   ✅ Сохраненный отчет ({len(records)} строк) читается с диска теми же типами")
+
+        monitor_cursor.close()
+        monitor.close()
+        conn.close()
+        print("✅ Бюджеты отчетов работают корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте бюджетов отчетов: {e}")
+        return False
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_report_budgets()
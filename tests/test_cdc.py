@@ -0,0 +1,82 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from scripts.cdc import extract_changes, CDC_TABLES
+
+class ListSink:
+    """Получатель, запоминающий выгруженные строки"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def __call__(self, table, rows):
+        self.rows.setdefault(table, []).extend(rows)
+
+    def ids(self, table):
+        return [row['id'] for row in self.rows.get(table, [])]
+
+def test_cdc_extraction():
+    """Проверяем полную и инкрементальную выгрузку и то, что поздно зафиксированные изменения не теряются"""
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ВЫГРУЗКИ ИЗМЕНЕНИЙ:")
+
+        # Первая синхронизация выгружает все строки, пачками
+        sink = ListSink()
+        extracted = extract_changes('test', sink, batch_size=7)
+        for table in CDC_TABLES:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            expected = cursor.fetchone()[0]
+            assert extracted[table] == expected, f"{table}: выгружено {extracted[table]} из {expected}"
+            assert len(set(sink.ids(table))) == expected, f"{table}: строки повторяются"
+        print(f"   ✅ Первая выгрузка: {extracted}")
+
+        sink = ListSink()
+        extracted = extract_changes('test', sink)
+        assert sum(extracted.values()) == 0, f"Повторная выгрузка без изменений: {extracted}"
+        print("   ✅ Без изменений выгружать нечего")
+
+        cursor.execute("SELECT id FROM orders ORDER BY id LIMIT 2")
+        early_id, late_id = [row[0] for row in cursor.fetchall()]
+
+        # Транзакция начинается раньше, а фиксируется позже другой: ее updated_at
+        # меньше, и без безопасной границы ее изменение было бы пропущено
+        early = psycopg2.connect(get_connection_string())
+        early_cursor = early.cursor()
+        early_cursor.execute("UPDATE orders SET order_status = order_status WHERE id = %s", [early_id])
+        cursor.execute("UPDATE orders SET order_status = order_status WHERE id = %s", [late_id])
+
+        sink = ListSink()
+        extract_changes('test', sink, tables=['orders'])
+        assert sink.ids('orders') == [], \
+            f"Выгружены строки после начала открытой транзакции: {sink.ids('orders')}"
+        print("   ✅ Пока старая транзакция открыта, граница выгрузки не сдвигается")
+
+        early.commit()
+        early_cursor.close()
+        early.close()
+
+        sink = ListSink()
+        extract_changes('test', sink, tables=['orders'])
+        assert sink.ids('orders') == [early_id, late_id], \
+            f"Ожидались заказы {[early_id, late_id]} в порядке фиксации изменений, получено {sink.ids('orders')}"
+        print("   ✅ Поздно зафиксированное изменение выгружено вместе с более ранним")
+
+        cursor.close()
+        conn.close()
+        print("✅ Выгрузка изменений работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте выгрузки изменений: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_cdc_extraction()
@@ -5,6 +5,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import psycopg2
 from database.config import get_connection_string
+from scripts.data_quality import check_rules
 
 def test_data_types_and_constraints():
     """Проверяем типы данных и ограничения"""
@@ -14,24 +15,18 @@ def test_data_types_and_constraints():
         
         print("✅ ТЕСТ ТИПОВ ДАННЫХ И ОГРАНИЧЕНИЙ:")
         
-        # 1. Проверка отрицательных цен
-        cursor.execute("SELECT COUNT(*) FROM products WHERE price < 0")
-        negative_prices = cursor.fetchone()[0]
+        # 1-3. Цены, количества и subtotal — по одному проходу на таблицу
+        results = check_rules(cursor, tables=['products', 'order_items'])
+        
+        negative_prices = results['non_negative_price']['violations']
         assert negative_prices == 0, f"Найдены товары с отрицательной ценой: {negative_prices}"
         print("   ✅ Нет товаров с отрицательной ценой")
         
-        # 2. Проверка отрицательных количеств
-        cursor.execute("SELECT COUNT(*) FROM order_items WHERE quantity < 0")
-        negative_quantities = cursor.fetchone()[0]
+        negative_quantities = results['positive_quantity']['violations']
         assert negative_quantities == 0, f"Найдены отрицательные количества: {negative_quantities}"
         print("   ✅ Нет отрицательных количеств товаров")
         
-        # 3. Проверка корректности calculated subtotal
-        cursor.execute("""
-        SELECT COUNT(*) FROM order_items 
-        WHERE ABS(subtotal - (quantity * unit_price)) > 0.01
-        """)
-        incorrect_subtotals = cursor.fetchone()[0]
+        incorrect_subtotals = results['subtotal_consistency']['violations']
         assert incorrect_subtotals == 0, f"Найдены некорректные subtotal: {incorrect_subtotals}"
         print("   ✅ Все subtotal рассчитаны корректно")
         
@@ -0,0 +1,126 @@
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from database.connection import get_connection
+from database.ingestion import OrderIngestor
+from database import instrumentation
+from database.instrumentation import metrics
+
+def test_order_ingestion():
+    """Проверяем групповую запись заказов из многих потоков: id, ошибки по заказам, суммы"""
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ПАКЕТНОЙ ЗАПИСИ ЗАКАЗОВ:")
+
+        cursor.execute("SELECT id FROM users ORDER BY id LIMIT 5")
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM products ORDER BY id LIMIT 5")
+        product_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        orders_before = cursor.fetchone()[0]
+
+        def make_order(n):
+            if n % 10 == 3:
+                return {'user_id': -n, 'items': [{'product_id': product_ids[0], 'quantity': 1}]}
+            if n % 10 == 7:
+                return {'user_id': user_ids[0], 'items': [{'product_id': product_ids[0], 'quantity': 0}]}
+            return {
+                'user_id': user_ids[n % len(user_ids)],
+                'order_status': 'completed' if n % 2 else 'processing',
+                'items': [{'product_id': product_ids[(n + k) % len(product_ids)], 'quantity': k + 1}
+                          for k in range(1 + n % 3)],
+            }
+
+        orders = [make_order(n) for n in range(200)]
+        with OrderIngestor(batch_size=50, max_delay_ms=20, label='ingest_test') as ingestor:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(ingestor.ingest, orders))
+
+        for n, result in enumerate(results):
+            if n % 10 == 3:
+                assert not result.ok and 'пользователь' in result.error, f"Заказ {n}: {result}"
+            elif n % 10 == 7:
+                assert not result.ok and 'количество' in result.error, f"Заказ {n}: {result}"
+            else:
+                assert result.ok and result.order_id, f"Заказ {n} не записан: {result}"
+        written = [result.order_id for result in results if result.ok]
+        assert len(set(written)) == 160, f"Ожидалось 160 разных id, получено {len(set(written))}"
+        print(f"   ✅ Записано {len(written)} заказов, {len(results) - len(written)} отклонены с причиной")
+
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        assert cursor.fetchone()[0] == orders_before + 160, "Отклоненные заказы попали в базу"
+
+        cursor.execute("""
+        SELECT COUNT(*)
+        FROM orders o
+        WHERE o.id = ANY(%s)
+          AND o.total_amount <> (SELECT SUM(subtotal) FROM order_items WHERE order_id = o.id)
+        """, [written])
+        assert cursor.fetchone()[0] == 0, "Сумма заказа не совпадает с суммой товаров"
+        cursor.execute("SELECT user_id, order_status FROM orders WHERE id = %s", [results[1].order_id])
+        assert cursor.fetchone() == (user_ids[1], 'completed'), "Заказ записан не с теми данными"
+        print("   ✅ Суммы заказов посчитаны на сервере и совпадают с товарами")
+
+        batches = metrics.snapshot()['queries']['ingest_test.batch']['count']
+        assert batches < len(orders) / 2, f"Пачек {batches} на {len(orders)} заказов — группировки нет"
+        print(f"   ✅ {len(orders)} заказов записаны {batches} пачками")
+
+        # Медленная пачка попадает в журнал медленных запросов, но не выполняется повторно
+        slow_query_ms, slow_query_log = instrumentation.SLOW_QUERY_MS, instrumentation.SLOW_QUERY_LOG
+        instrumentation.SLOW_QUERY_MS, instrumentation.SLOW_QUERY_LOG = 0, None
+        try:
+            cursor.execute("SELECT COUNT(*) FROM order_items")
+            items_before = cursor.fetchone()[0]
+            slow_orders = [make_order(n) for n in range(0, 60, 2)]
+            with OrderIngestor(batch_size=100, max_delay_ms=50, label='ingest_slow_test') as ingestor:
+                slow_results = ingestor.ingest_many(slow_orders)
+            slow_ids = sorted(result.order_id for result in slow_results)
+            assert all(result.ok for result in slow_results), f"Медленная пачка: {slow_results}"
+            cursor.execute("SELECT COUNT(*) FROM orders WHERE id = ANY(%s)", [slow_ids])
+            assert cursor.fetchone()[0] == len(slow_orders), "Заказы медленной пачки записаны не один раз"
+            cursor.execute("SELECT COUNT(*) FROM order_items")
+            expected_items = sum(len(order['items']) for order in slow_orders)
+            assert cursor.fetchone()[0] == items_before + expected_items, "Товары медленной пачки задвоены"
+            assert slow_ids == list(range(slow_ids[0], slow_ids[0] + len(slow_ids))), \
+                "Повторный запрос пачки израсходовал значения последовательности"
+            entries = [entry for entry in metrics.slow_queries
+                       if entry['label'].startswith('ingest_slow_test:') and entry['query'].startswith('WITH')]
+            assert entries and all(entry['plan'] is None for entry in entries), "EXPLAIN ANALYZE пачки заказов"
+
+            # Чтение объясняется, а все, что сделал повторный запрос, откатывается
+            probe_sql = ("SELECT set_config('ingest_test.runs', "
+                         "(COALESCE(NULLIF(current_setting('ingest_test.runs', true), ''), '0')::int + 1)::text, false)")
+            for autocommit in (False, True):
+                probe_conn = get_connection()
+                probe_conn.autocommit = autocommit
+                probe_cursor = probe_conn.cursor()
+                label = f"ingest_test.explain_probe.{autocommit}"
+                probe_cursor.execute(probe_sql, label=label)
+                probe_cursor.execute("SHOW ingest_test.runs")
+                assert probe_cursor.fetchone()[0] == '1', f"Запрос под EXPLAIN не откатился (autocommit={autocommit})"
+                entry = next(entry for entry in metrics.slow_queries if entry['label'] == label)
+                assert entry['plan'] is not None, f"Нет плана медленного чтения: {entry}"
+                probe_conn.close()
+        finally:
+            instrumentation.SLOW_QUERY_MS, instrumentation.SLOW_QUERY_LOG = slow_query_ms, slow_query_log
+        print(f"   ✅ Медленная пачка из {len(slow_orders)} заказов записана один раз, EXPLAIN чтения откатывается")
+
+        cursor.close()
+        conn.close()
+        print("✅ Пакетная запись заказов работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте пакетной записи заказов: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_order_ingestion()
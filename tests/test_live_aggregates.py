@@ -0,0 +1,137 @@
+import sys
+import os
+import json
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from scripts.live_aggregates import LiveAggregates, HyperLogLog
+
+def _wait_events(live, count, timeout=5.0):
+    deadline = time.time() + timeout
+    applied = 0
+    while applied < count and time.time() < deadline:
+        applied += live.poll(deadline - time.time())
+    return applied
+
+def _place_order(cursor, user_id, product_id, status='completed', order_date=None):
+    cursor.execute("""
+        INSERT INTO orders (user_id, order_date, total_amount, order_status)
+        VALUES (%s, COALESCE(%s, LOCALTIMESTAMP), 0, %s) RETURNING id
+    """, [user_id, order_date, status])
+    order_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (%s, %s, 2, 12.50)",
+                   [order_id, product_id])
+    # Сумма проставляется после позиций, как в scripts.load_test: в уведомлении — итоговая
+    cursor.execute("UPDATE orders SET total_amount = 25.00 WHERE id = %s", [order_id])
+    return order_id
+
+def _state(live):
+    return {name: (period.orders, period.revenue, {category: tuple(totals) for category, totals
+                                                   in period.categories.items() if totals[0] or totals[1]})
+            for name, period in live.periods.items()}
+
+def test_live_aggregates():
+    """Проверяем живые итоги: уведомления о выполнении и отмене, задержка, сверка без двойного учета"""
+    status_path = os.path.join(tempfile.mkdtemp(), 'live_status.json')
+    live = LiveAggregates(status_path=status_path)
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ЖИВЫХ ИТОГОВ:")
+
+        live.connect()
+        live.reconcile()
+        before = _state(live)
+        cursor.execute("SELECT id, category FROM products WHERE category IS NOT NULL LIMIT 1")
+        product_id, category = cursor.fetchone()
+        cursor.execute("""
+            INSERT INTO users (first_name, last_name, email, country, city)
+            VALUES ('Live', 'Buyer', 'live.buyer@example.com', 'Russia', 'Kazan') RETURNING id
+        """)
+        user_id = cursor.fetchone()[0]
+        conn.commit()
+        customers = live.periods['week'].customers.estimate()
+
+        # Выполненный заказ виден сразу после COMMIT, с итоговой суммой и категорией
+        started = time.time()
+        completed = _place_order(cursor, user_id, product_id)
+        conn.commit()
+        assert _wait_events(live, 1) == 1, "Уведомление о выполненном заказе не пришло"
+        latency = time.time() - started
+        for name in ('today', 'week'):
+            period = live.periods[name]
+            assert period.orders == before[name][0] + 1, f"{name}: заказы"
+            assert period.revenue == before[name][1] + 25, f"{name}: выручка"
+            assert tuple(period.categories[category]) == tuple(
+                a + b for a, b in zip(before[name][2].get(category, (0, 0)), (1, 25))), f"{name}: категория"
+        assert live.periods['week'].customers.estimate() >= customers, "Оценка клиентов уменьшилась"
+        assert latency < 1 and live.last_latency < 1, f"Задержка {latency:.3f} с"
+        print(f"   ✅ Заказ учтен через {latency * 1000:.0f} мс после COMMIT")
+
+        # В обработке, откат и старые заказы уведомлений не шлют; выполнение и отмена — шлют
+        processing = _place_order(cursor, user_id, product_id, status='processing')
+        _place_order(cursor, user_id, product_id, order_date=datetime.now() - timedelta(days=30))
+        conn.commit()
+        _place_order(cursor, user_id, product_id)
+        conn.rollback()
+        assert _wait_events(live, 1, timeout=0.5) == 0, "Лишнее уведомление"
+        cursor.execute("UPDATE orders SET order_status = 'completed' WHERE id = %s", [processing])
+        cursor.execute("UPDATE orders SET order_status = 'cancelled' WHERE id = %s", [completed])
+        conn.commit()
+        assert _wait_events(live, 2) == 2, "Уведомления о смене статуса не пришли"
+        assert live.periods['today'].orders == before['today'][0] + 1, "Отмена не вычтена"
+        print("   ✅ Отмена вычитается; откат, незавершенные и старые заказы не учитываются")
+
+        # Сверка с базой: без расхождений, и заказ, уже учтенный снимком, не считается дважды
+        _place_order(cursor, user_id, product_id)
+        conn.commit()
+        time.sleep(0.2)
+        drift = live.reconcile()
+        assert not any(value['orders'] or value['revenue'] for value in drift.values()), f"Расхождение: {drift}"
+        _place_order(cursor, user_id, product_id)
+        conn.commit()
+        live.reconcile()
+        assert _wait_events(live, 1, timeout=0.5) == 0 and live.skipped >= 1, "Заказ учтен дважды"
+        fresh = LiveAggregates(status_path='')
+        fresh.reconcile()
+        assert _state(fresh) == _state(live), "Итоги после сверки не совпадают с базой"
+        assert live.periods['today'].orders == before['today'][0] + 3, "Итог дня после сверки"
+        print(f"   ✅ Сверка без расхождений, пропущено уже учтенных уведомлений: {live.skipped}")
+
+        with open(status_path) as f:
+            status = json.load(f)
+        assert status['today']['orders'] == live.periods['today'].orders and status['reconciliations'] == 3, \
+            f"Файл состояния: {status}"
+        print("   ✅ Итоги записаны в файл состояния")
+
+        # Приближенный подсчет клиентов
+        sketch = HyperLogLog()
+        for value in range(20000):
+            sketch.add(value)
+        assert abs(sketch.estimate() - 20000) < 20000 * 0.05, f"Оценка HyperLogLog: {sketch.estimate()}"
+        small = HyperLogLog()
+        for value in range(100):
+            small.add(value)
+            small.add(value)
+        assert abs(small.estimate() - 100) <= 2, f"Оценка HyperLogLog на малых числах: {small.estimate()}"
+        print(f"   ✅ HyperLogLog: 20000 -> {sketch.estimate()}, 100 -> {small.estimate()}")
+
+        cursor.close()
+        conn.close()
+        print("✅ Живые итоги работают корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте живых итогов: {e}")
+        return False
+    finally:
+        live.close()
+
+if __name__ == "__main__":
+    test_live_aggregates()
@@ -0,0 +1,83 @@
+import sys
+import os
+import random
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from database.money import register_cents, format_cents, format_tenths, divide_half_even
+from reports.records import CategoryRecord
+from reports.weekly_sales_report import (
+    fetch_category_analysis, fetch_category_records,
+    fetch_daily_sales, fetch_daily_sales_records,
+    fetch_top_customers, fetch_top_customer_records,
+)
+
+def test_cents_records():
+    """Проверяем, что строки в копейках совпадают с Decimal и печатаются так же"""
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ДЕНЕГ В КОПЕЙКАХ:")
+
+        cases = [
+            ('category_analysis', fetch_category_analysis(cursor), fetch_category_records(cursor)),
+            ('daily_sales', fetch_daily_sales(cursor, 90), fetch_daily_sales_records(cursor, 90)),
+            ('top_customers', fetch_top_customers(cursor, 50), fetch_top_customer_records(cursor, 50)),
+        ]
+        for name, rows, records in cases:
+            assert rows and len(rows) == len(records), f"{name}: {len(rows)} строк и {len(records)} записей"
+            for row, record in zip(rows, records):
+                for position, field in enumerate(record.__slots__):
+                    value = getattr(record, field)
+                    if field in record.HUNDREDTHS:
+                        assert isinstance(value, int), f"{name}.{field}: {value!r} не int"
+                        assert Decimal(value) / 100 == row[position], f"{name}.{field}: {value} != {row[position]}"
+                        assert format_cents(value) == f"{row[position]:,.2f}", f"{name}.{field}: формат"
+                        assert format_cents(value, grouping=False) == f"{row[position]:.2f}"
+                    else:
+                        assert value == row[position], f"{name}.{field}: {value!r} != {row[position]!r}"
+            print(f"   ✅ {name}: {len(records)} строк совпадают с Decimal")
+
+        for row, record in zip(cases[0][1], cases[0][2]):
+            assert format_tenths(record.revenue_share) == str(row[6]), "Доля выручки печатается иначе"
+        assert CategoryRecord.from_decimal_rows(cases[0][1])[0].revenue == cases[0][2][0].revenue, \
+            "Записи из Decimal и из курсора с копейками различаются"
+
+        # Приведение действует только на свой курсор
+        cursor.execute("SELECT 12.34::numeric")
+        assert cursor.fetchone()[0] == Decimal('12.34'), "Приведение к копейкам протекло в курсор вызывающего"
+        cents_cursor = register_cents(conn.cursor())
+        cents_cursor.execute("SELECT 12.34::numeric, -0.05::numeric, NULL::numeric, 7::numeric")
+        assert cents_cursor.fetchone() == (1234, -5, None, 700), "Неверное приведение NUMERIC"
+        try:
+            cents_cursor.execute("SELECT 1.005::numeric")
+            cents_cursor.fetchone()
+            raise AssertionError("Значение с тремя знаками после запятой молча округлено")
+        except ValueError:
+            pass
+        cents_cursor.close()
+        print("   ✅ Приведение только для своего курсора и без потери точности")
+
+        rng = random.Random(7)
+        for _ in range(2000):
+            total, count = rng.randint(0, 10 ** 9), rng.randint(1, 400)
+            assert format_cents(divide_half_even(total, count)) == f"{Decimal(total) / 100 / count:,.2f}", \
+                f"Среднее {total}/{count} округляется иначе"
+        print("   ✅ Средние в копейках округляются так же, как Decimal")
+
+        conn.rollback()
+        cursor.close()
+        conn.close()
+        print("✅ Деньги в копейках работают корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте денег в копейках: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_cents_records()
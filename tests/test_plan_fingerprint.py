@@ -0,0 +1,55 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from scripts.plan_fingerprint import capture_plan, fingerprint_plan, compare_fingerprints
+
+def test_plan_regression_detection():
+    """Проверяем, что замена индексного сканирования последовательным считается регрессией"""
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ОТПЕЧАТКОВ ПЛАНОВ:")
+
+        query = "SELECT * FROM orders WHERE user_id = %s"
+
+        cursor.execute("SET enable_seqscan = off")
+        indexed = fingerprint_plan(capture_plan(cursor, query, [1]))
+        cursor.execute("SET enable_seqscan = on")
+        cursor.execute("SET enable_indexscan = off")
+        cursor.execute("SET enable_bitmapscan = off")
+        sequential = fingerprint_plan(capture_plan(cursor, query, [1]))
+
+        assert any(scan.startswith(('Index', 'Bitmap')) for scan in indexed['scans']['orders']), \
+            f"Ожидался индексный план: {indexed['scans']}"
+        assert sequential['scans']['orders'] == ['Seq Scan'], \
+            f"Ожидался последовательный план: {sequential['scans']}"
+
+        changes, regressions = compare_fingerprints(indexed, indexed)
+        assert not changes and not regressions, "Одинаковые планы не должны отличаться"
+        print("   ✅ Одинаковые планы совпадают")
+
+        changes, regressions = compare_fingerprints(indexed, sequential)
+        assert regressions, "Переход на Seq Scan не распознан как регрессия"
+        print(f"   ✅ Регрессия найдена: {regressions[0]}")
+
+        changes, regressions = compare_fingerprints(sequential, indexed)
+        assert changes and not regressions, "Переход на индекс не должен быть регрессией"
+        print("   ✅ Улучшение плана не считается регрессией")
+
+        cursor.close()
+        conn.close()
+        print("✅ Отпечатки планов работают корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте отпечатков планов: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_plan_regression_detection()
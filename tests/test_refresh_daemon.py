@@ -0,0 +1,114 @@
+import sys
+import os
+import json
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from scripts.health import parse_refreshed_at
+from scripts.refresh_daemon import RefreshDaemon, REFRESH_LOCK_NAMESPACE
+
+VIEW = 'weekly_sales_report'
+
+def _refreshed_at(cursor):
+    cursor.execute("SELECT obj_description(%s::regclass, 'pg_class')", [VIEW])
+    return parse_refreshed_at(cursor.fetchone()[0])
+
+def test_refresh_daemon():
+    """Проверяем планировщик обновления MV: одна блокировка на узлы, пропуск свежих MV, отсрочки и ошибки"""
+    status_dir = tempfile.mkdtemp()
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ПЛАНИРОВЩИКА ОБНОВЛЕНИЯ MV:")
+
+        def daemon(node, interval=0.5, **kwargs):
+            return RefreshDaemon({VIEW: interval}, jitter=0, node=node, seed=1,
+                                 status_path=os.path.join(status_dir, f"{node}.json"), **kwargs)
+
+        # Блокировку держит другой узел — MV не трогаем
+        cursor.execute("SELECT pg_advisory_lock(%s, hashtext(%s))", [REFRESH_LOCK_NAMESPACE, VIEW])
+        before = _refreshed_at(cursor)
+        first = daemon('node-a')
+        assert first.run_view(VIEW) == 'locked', "Обновление при чужой блокировке"
+        assert _refreshed_at(cursor) == before, "MV обновлено при чужой блокировке"
+        cursor.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", [REFRESH_LOCK_NAMESPACE, VIEW])
+        print("   ✅ Пока блокировку держит другой узел, MV не обновляется")
+
+        time.sleep(0.6)
+        assert first.run_view(VIEW) == 'refreshed', "MV не обновлено после снятия блокировки"
+        stats = first.views[VIEW]
+        assert stats.refreshes == 1 and stats.last_success and stats.last_duration > 0, "Нет статистики обновления"
+        assert _refreshed_at(cursor) not in (None, before), "Время обновления не записано"
+        with open(os.path.join(status_dir, 'node-a.json')) as f:
+            status = json.load(f)
+        assert status['node'] == 'node-a' and status['views'][VIEW]['refreshes'] == 1, "Файл состояния не записан"
+
+        # Другой узел сразу после — MV свежее, работа не повторяется
+        second = daemon('node-b', interval=60)
+        assert second.run_view(VIEW) == 'fresh', "Свежее MV обновлено повторно"
+        assert second.views[VIEW].next_run > time.time() + 30, "Следующая попытка не отложена до конца интервала"
+        print("   ✅ Обновление видно другим узлам, свежее MV не обновляется повторно")
+
+        # Одновременный запуск на нескольких узлах: ровно одно обновление
+        time.sleep(0.6)
+        nodes = [daemon(f"node-{i}") for i in range(4)]
+        barrier = threading.Barrier(len(nodes))
+        outcomes = []
+
+        def run(node):
+            barrier.wait()
+            outcomes.append(node.run_view(VIEW))
+
+        threads = [threading.Thread(target=run, args=(node,)) for node in nodes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert outcomes.count('refreshed') == 1, f"Одновременные узлы: {sorted(outcomes)}"
+        assert set(outcomes) <= {'refreshed', 'locked', 'fresh'}, f"Одновременные узлы: {sorted(outcomes)}"
+        print(f"   ✅ Из {len(nodes)} одновременных узлов обновил один: {sorted(outcomes)}")
+
+        # Под нагрузкой — отсрочка с растущей задержкой
+        busy = daemon('node-busy', interval=3600, max_active=-1)
+        delays = []
+        for _ in range(3):
+            started = time.time()
+            assert busy.run_view(VIEW) == 'busy', "Под нагрузкой обновление не отложено"
+            delays.append(busy.views[VIEW].next_run - started)
+        assert busy.views[VIEW].deferred == 3 and delays[0] < delays[1] < delays[2], f"Задержки {delays}"
+        print("   ✅ Под нагрузкой обновление откладывается с растущей задержкой")
+
+        # Ошибка обновления учитывается и не останавливает планировщик
+        broken = RefreshDaemon({'missing_view': 60}, jitter=0, node='node-broken',
+                               status_path=os.path.join(status_dir, 'broken.json'))
+        assert broken.run_view('missing_view') == 'failed', "Ошибка не распознана"
+        assert broken.run_view('missing_view') == 'failed'
+        stats = broken.views['missing_view']
+        assert stats.failures == 2 and stats.consecutive_failures == 2 and stats.last_error, "Ошибки не посчитаны"
+        print("   ✅ Ошибки считаются, последняя сохраняется в состоянии")
+
+        for node in [first, second, busy, broken] + nodes:
+            if node._conn is not None:
+                node._conn.close()
+        cursor.close()
+        conn.close()
+        print("✅ Планировщик обновления MV работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте планировщика обновления MV: {e}")
+        return False
+    finally:
+        for name in os.listdir(status_dir):
+            os.remove(os.path.join(status_dir, name))
+        os.rmdir(status_dir)
+
+if __name__ == "__main__":
+    test_refresh_daemon()
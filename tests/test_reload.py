@@ -0,0 +1,78 @@
+import sys
+import os
+import io
+import threading
+from contextlib import redirect_stdout
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from scripts.generate_data import generate_sample_data
+from scripts.reload import reload_dataset, SHADOW_SCHEMA, RETIRED_SCHEMA
+
+def _read_reports(stop, observations, errors):
+    conn = psycopg2.connect(get_connection_string())
+    conn.autocommit = True
+    cursor = conn.cursor()
+    while not stop.is_set():
+        try:
+            cursor.execute("SELECT COUNT(*) FROM weekly_sales_report")
+            weekly_rows = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM order_details")
+            observations.append((weekly_rows, cursor.fetchone()[0]))
+        except Exception as e:
+            errors.append(str(e))
+    cursor.close()
+    conn.close()
+
+def test_reload_without_downtime():
+    """Проверяем, что отчеты не видят пустых данных и ошибок во время перезагрузки"""
+    try:
+        print("✅ ТЕСТ ПЕРЕЗАГРУЗКИ ДАННЫХ БЕЗ ПРОСТОЯ:")
+
+        stop = threading.Event()
+        observations, errors = [], []
+        readers = [threading.Thread(target=_read_reports, args=(stop, observations, errors)) for _ in range(3)]
+        for reader in readers:
+            reader.start()
+        try:
+            with redirect_stdout(io.StringIO()):
+                reloaded = reload_dataset(lambda: generate_sample_data(seed=7), background_drop=False)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+
+        assert reloaded, "Перезагрузка не выполнена"
+        assert not errors, f"Ошибки чтения во время перезагрузки: {errors[:3]}"
+        assert observations, "Читатели не выполнили ни одного запроса"
+        empty = [observation for observation in observations if 0 in observation]
+        assert not empty, f"Читатели видели пустые отчеты: {len(empty)} раз"
+        print(f"   ✅ {len(observations)} чтений во время перезагрузки без ошибок и пустых отчетов")
+
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM pg_namespace WHERE nspname IN (%s, %s)",
+                       [SHADOW_SCHEMA, RETIRED_SCHEMA])
+        assert cursor.fetchone()[0] == 0, "Служебные схемы не удалены"
+        cursor.execute("""
+        SELECT tgname FROM pg_trigger
+        WHERE NOT tgisinternal AND tgrelid = 'public.orders'::regclass
+        """)
+        triggers = {row[0] for row in cursor.fetchall()}
+        assert triggers == {'trigger_orders_updated_at', 'trigger_orders_completed_notify',
+                            'trigger_orders_status_notify'}, f"Триггеры orders не перенесены: {triggers}"
+        cursor.close()
+        conn.close()
+        print("   ✅ Новое поколение на месте, старое удалено")
+
+        print("✅ Перезагрузка данных работает без простоя")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте перезагрузки: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_reload_without_downtime()
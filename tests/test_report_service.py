@@ -0,0 +1,122 @@
+import sys
+import os
+import asyncio
+import json
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reports import report_service
+from reports.report_service import ReportService, HTTPError
+
+async def _fetch(port, target):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = int(head.split(b" ")[1])
+    return status, json.loads(body)
+
+async def _run_coalescing_check():
+    service = ReportService(port=0, max_workers=2)
+    await service.start()
+    try:
+        requests = [_fetch(service.port, "/weekly?weeks_back=12") for _ in range(100)]
+        requests += [_fetch(service.port, "/top-customers?limit=5") for _ in range(100)]
+        responses = await asyncio.gather(*requests)
+
+        bad_status, _ = await _fetch(service.port, "/top-customers?limit=abc")
+        missing_status, _ = await _fetch(service.port, "/unknown")
+        return responses, bad_status, missing_status, dict(service.stats)
+    finally:
+        await service.stop()
+
+def test_report_service_coalescing():
+    """Проверяем HTTP сервис отчетов и объединение одинаковых запросов"""
+    try:
+        print("✅ ТЕСТ СЕРВИСА ОТЧЕТОВ:")
+        responses, bad_status, missing_status, stats = asyncio.run(_run_coalescing_check())
+
+        assert all(status == 200 for status, _ in responses), "Не все запросы выполнены успешно"
+        weekly_bodies = {json.dumps(body, sort_keys=True) for _, body in responses[:100]}
+        assert len(weekly_bodies) == 1, "Объединенные запросы вернули разные ответы"
+        print(f"   ✅ 200 запросов обслужены, запросов к базе: {stats['db_queries']}")
+
+        assert stats["db_queries"] < 200, "Одинаковые запросы не объединяются"
+        assert stats["coalesced"] + stats["db_queries"] == 200, "Статистика запросов не сходится"
+        print(f"   ✅ Объединено запросов: {stats['coalesced']}")
+
+        assert bad_status == 400, f"Некорректный параметр должен давать 400 (получено {bad_status})"
+        assert missing_status == 404, f"Неизвестный отчет должен давать 404 (получено {missing_status})"
+        print("   ✅ Некорректные запросы отклоняются")
+
+        print("✅ Сервис отчетов работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте сервиса отчетов: {e}")
+        return False
+
+def _sleep(cursor, seconds):
+    cursor.execute("SELECT pg_sleep(%s)", [seconds])
+    return {"slept": seconds}
+
+async def _run_cancellation_check():
+    service = ReportService(port=0, max_workers=1, query_timeout=0.5)
+    await service.start()
+    try:
+        # Клиент-лидер отключается, пока присоединившиеся ждут его запрос
+        leader = asyncio.create_task(service.get_report("/test-sleep", {"seconds": 0.3}))
+        await asyncio.sleep(0.05)
+        followers = [asyncio.create_task(service.get_report("/test-sleep", {"seconds": 0.3})) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        follower_results = await asyncio.wait_for(asyncio.gather(*followers), timeout=5)
+        leader_cancelled = leader.cancelled()
+        coalescing_stats = dict(service.stats, inflight=len(service._inflight))
+
+        # По таймауту запрос отменяется на сервере: единственный поток пула сразу свободен
+        started = time.perf_counter()
+        try:
+            await service.get_report("/test-sleep", {"seconds": 30})
+            timeout_status = 200
+        except HTTPError as e:
+            timeout_status = e.status
+        next_result = await asyncio.wait_for(service.get_report("/categories", {}), timeout=5)
+        elapsed = time.perf_counter() - started
+        return follower_results, leader_cancelled, coalescing_stats, timeout_status, next_result, elapsed
+    finally:
+        await service.stop()
+
+def test_report_service_cancellation():
+    """Проверяем отключение клиента-лидера и отмену запроса к базе по таймауту"""
+    report_service.ENDPOINTS["/test-sleep"] = (_sleep, {})
+    try:
+        print("✅ ТЕСТ ОТМЕНЫ ЗАПРОСОВ СЕРВИСА ОТЧЕТОВ:")
+        follower_results, leader_cancelled, stats, timeout_status, next_result, elapsed = \
+            asyncio.run(_run_cancellation_check())
+
+        assert leader_cancelled, "Задача лидера не отменена"
+        assert follower_results == [{"slept": 0.3}] * 3, f"Присоединившиеся запросы: {follower_results}"
+        assert stats["db_queries"] == 1 and stats["coalesced"] == 3, f"Статистика: {stats}"
+        assert stats["inflight"] == 0, "Запрос остался в обработке"
+        print("   ✅ Отключение лидера не оставляет присоединившихся без ответа")
+
+        assert timeout_status == 504, f"Таймаут должен давать 504 (получено {timeout_status})"
+        assert next_result["rows"] and elapsed < 5, f"Поток пула занят брошенным запросом ({elapsed:.1f} с)"
+        print(f"   ✅ Запрос отменен по таймауту, следующий выполнен через {elapsed:.1f} с")
+
+        print("✅ Отмена запросов сервиса отчетов работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте отмены запросов сервиса отчетов: {e}")
+        return False
+    finally:
+        del report_service.ENDPOINTS["/test-sleep"]
+
+if __name__ == "__main__":
+    test_report_service_coalescing()
+    test_report_service_cancellation()
@@ -1,11 +1,11 @@
 import sys
 import os
-from decimal import Decimal
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import psycopg2
 from database.config import get_connection_string
+from scripts.data_quality import check_rules, check_column_types, print_rule_results, COLUMN_TYPES
 
 def test_weekly_report_correctness():
     """Проверка корректности данных в weekly_sales_report"""
@@ -15,92 +15,20 @@ def test_weekly_report_correctness():
         
         print("✅ ТЕСТ КОРРЕКТНОСТИ НЕДЕЛЬНОГО ОТЧЕТА:")
         
-        # Проверка ВСЕХ записей на предмет некорректных значений
-        cursor.execute("""
-        SELECT 
-            week_start,
-            top_category,
-            orders_in_category,
-            unique_customers_in_category,
-            revenue_in_category,
-            items_sold_in_category,
-            avg_order_value_in_category,
-            unique_products_in_category
-        FROM weekly_sales_report
-        ORDER BY week_start DESC, top_category
-        """)
-        all_rows = cursor.fetchall()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM weekly_sales_report)")
+        assert cursor.fetchone()[0], "Нет данных в weekly_sales_report"
         
-        print(f"   📊 Всего записей в отчете: {len(all_rows)}")
+        # Типы столбцов проверяются по каталогу, а не для каждой строки
+        mismatches = check_column_types(cursor, {'weekly_sales_report': COLUMN_TYPES['weekly_sales_report']})
+        assert not mismatches, f"Неожиданные типы столбцов: {mismatches}"
+        print("   ✅ Типы столбцов корректны")
         
-        # Проверка каждой записи индивидуально
-        problematic_rows = []
-        for i, row in enumerate(all_rows):
-            week_start, category, orders_count, customers_count, revenue, items_sold, avg_order, unique_products = row
-            
-            # Проверка каждого поля
-            checks = [
-                (isinstance(week_start, type(row[0])), "week_start должен быть датой"),
-                (isinstance(category, str) and category, "category должен быть непустой строкой"),
-                (isinstance(orders_count, int) and orders_count >= 0, "orders_count должен быть неотрицательным integer"),
-                (isinstance(customers_count, int) and customers_count >= 0, "customers_count должен быть неотрицательным integer"),
-                (isinstance(revenue, (int, float, Decimal)) and revenue >= 0, f"revenue должен быть неотрицательным числом (получено: {revenue})"),
-                (isinstance(items_sold, (int, float, Decimal)) and items_sold >= 0, "items_sold должен быть неотрицательным числом"),
-                (isinstance(avg_order, (int, float, Decimal)) and avg_order >= 0, "avg_order должен быть неотрицательным числом"),
-                (isinstance(unique_products, int) and unique_products >= 0, "unique_products должен быть неотрицательным integer")
-            ]
-            
-            for check_passed, error_msg in checks:
-                if not check_passed:
-                    problematic_rows.append({
-                        'index': i,
-                        'row': row,
-                        'error': error_msg,
-                        'revenue_value': revenue,
-                        'revenue_type': type(revenue)
-                    })
-                    break 
+        # Все правила недельного отчета — за один проход по представлению
+        results = check_rules(cursor, tables=['weekly_sales_report'], sample_size=3)
+        print_rule_results(results)
         
-        if problematic_rows:
-            print(f"   ❌ Найдено проблемных записей: {len(problematic_rows)}")
-            for problem in problematic_rows[:3]: 
-                print(f"      Запись #{problem['index']}: {problem['error']}")
-                print(f"        Данные: Неделя={problem['row'][0]}, Категория='{problem['row'][1]}', Выручка={problem['row'][4]}(тип: {type(problem['row'][4])})")
-            
-            cursor.close()
-            conn.close()
-            return False
-        
-        print("   ✅ Все записи прошли проверку типов")
-        
-        # Остальные проверки (математика, логика, округление)
-        cursor.execute("""
-        SELECT COUNT(*) FROM weekly_sales_report 
-        WHERE ABS(avg_order_value_in_category - (revenue_in_category / NULLIF(orders_in_category, 0))) > 1.0
-        AND orders_in_category > 0
-        AND revenue_in_category > 0
-        """)
-        incorrect_avg = cursor.fetchone()[0]
-        assert incorrect_avg == 0, f"Найдены некорректные средние чеки: {incorrect_avg}"
-        print("   ✅ Средние чеки рассчитаны корректно")
-        
-        cursor.execute("""
-        SELECT COUNT(*) FROM weekly_sales_report 
-        WHERE items_sold_in_category < unique_products_in_category
-        AND items_sold_in_category > 0
-        """)
-        illogical_products = cursor.fetchone()[0]
-        assert illogical_products == 0, f"Найдены illogical product counts: {illogical_products}"
-        print("   ✅ Количества товаров логичны")
-        
-        cursor.execute("""
-        SELECT COUNT(*) FROM weekly_sales_report 
-        WHERE revenue_in_category::text ~ '\.\d{3,}'
-        OR avg_order_value_in_category::text ~ '\.\d{3,}'
-        """)
-        bad_formatting = cursor.fetchone()[0]
-        assert bad_formatting == 0, f"Найдены значения с неправильным округлением: {bad_formatting}"
-        print("   ✅ Денежные значения правильно округлены")
+        failed = {name: result['violations'] for name, result in results.items() if result['violations']}
+        assert not failed, f"Нарушены правила недельного отчета: {failed}"
         
         cursor.close()
         conn.close()
@@ -0,0 +1,136 @@
+import sys
+import os
+import re
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database import routing
+from database.config import DB_CONFIG, parse_endpoint
+from database.instrumentation import metrics
+from database.routing import ReplicaRouter
+
+# Ответ REPLICA_LAG_SQL каждой «реплики»:
+# (в восстановлении, потоковая репликация, все полученное применено, возраст последней транзакции)
+REPLICA_ROWS = {
+    'caught-up': (True, True, True, 600.0),   # простаивающий основной сервер: отставания нет
+    'lagging': (True, False, False, 12.5),
+    'far-behind': (True, False, False, 120.0),
+    'promoted': (False, False, False, 0.0),
+    'no-replay': (True, False, False, None),
+}
+UNREACHABLE = 'unreachable'
+
+
+class _StubCursor:
+    def __init__(self, row):
+        self.row = row
+
+    def execute(self, query):
+        assert query == routing.REPLICA_LAG_SQL, "Реплика проверяется не тем запросом"
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class _StubConnection:
+    def __init__(self, row):
+        self.row = row
+        self.autocommit = False
+
+    def cursor(self):
+        return _StubCursor(self.row)
+
+    def close(self):
+        pass
+
+
+def _stub_connect(checks):
+    """psycopg2.connect, отвечающий строкой REPLICA_ROWS по хосту; checks — счетчик проверок по хостам"""
+    def connect(dsn, connect_timeout=None):
+        host = re.search(r"host=(\S+)", dsn).group(1)
+        checks[host] = checks.get(host, 0) + 1
+        if host == UNREACHABLE:
+            raise psycopg2.OperationalError("could not connect to server")
+        return _StubConnection(REPLICA_ROWS[host])
+    return connect
+
+def _endpoints(*hosts):
+    return [parse_endpoint(f"{host}:5433") for host in hosts]
+
+def test_replica_routing():
+    """Проверяем выбор реплики: отставание, кэш проверок, очередность, исключение и откат на основной сервер"""
+    original_connect = psycopg2.connect
+    try:
+        print("✅ ТЕСТ МАРШРУТИЗАЦИИ ЧТЕНИЯ НА РЕПЛИКИ:")
+
+        # Основной сервер не в режиме восстановления — читать с него как с реплики нельзя
+        primary = {'host': DB_CONFIG['host'], 'port': DB_CONFIG['port'], 'database': DB_CONFIG['database']}
+        assert ReplicaRouter(replicas=[]).check_replica(primary) is None, "Основной сервер принят за реплику"
+        print("   ✅ Основной (или повышенный) сервер репликой не считается")
+
+        checks = {}
+        psycopg2.connect = _stub_connect(checks)
+
+        probe = ReplicaRouter(replicas=[])
+        lags = {host: probe.check_replica(endpoint)
+                for host, endpoint in zip(list(REPLICA_ROWS) + [UNREACHABLE],
+                                          _endpoints(*REPLICA_ROWS, UNREACHABLE))}
+        assert lags == {'caught-up': 0.0, 'lagging': 12.5, 'far-behind': 120.0,
+                        'promoted': None, 'no-replay': None, UNREACHABLE: None}, f"Отставание реплик: {lags}"
+        print("   ✅ Отставание: 0 у догнавшей реплики, None у повышенной, недоступной и без применения WAL")
+
+        # Реплики по очереди; проверка каждой кэшируется на check_interval
+        checks.clear()
+        router = ReplicaRouter(replicas=_endpoints('caught-up', 'lagging'), max_lag=30, check_interval=60)
+        chosen = [router.read_endpoint()['host'] for _ in range(6)]
+        assert chosen == ['caught-up', 'lagging'] * 3, f"Очередность реплик: {chosen}"
+        assert checks == {'caught-up': 1, 'lagging': 1}, f"Проверки не кэшируются: {checks}"
+        uncached = ReplicaRouter(replicas=_endpoints('lagging'), max_lag=30, check_interval=0)
+        for _ in range(3):
+            uncached.read_endpoint()
+        assert checks['lagging'] == 4, f"Без кэша реплика проверяется при каждом чтении: {checks}"
+        print(f"   ✅ Реплики по очереди: {', '.join(chosen[:2])}; проверка кэшируется")
+
+        # Порог отставания: общий max_lag и max_staleness отдельного чтения
+        fallbacks = metrics.snapshot()['counters'].get('routing.primary_fallbacks', 0)
+        router = ReplicaRouter(replicas=_endpoints('far-behind', 'lagging'), max_lag=30, check_interval=60)
+        assert all(router.read_endpoint()['host'] == 'lagging' for _ in range(4)), "Отстающая реплика выбрана"
+        assert router.read_endpoint(max_staleness=10) is None, "Реплика отстает больше max_staleness"
+        assert router.read_endpoint(max_staleness=200)['host'] in ('far-behind', 'lagging'), "max_staleness"
+        assert metrics.snapshot()['counters']['routing.primary_fallbacks'] == fallbacks + 1, "Счетчик откатов"
+        status = {item['endpoint']: (item['lag'], item['healthy']) for item in router.status()}
+        assert status == {'far-behind:5433': (120.0, False), 'lagging:5433': (12.5, True)}, f"Состояние: {status}"
+        print("   ✅ Реплика отстает больше допустимого — чтение с другой реплики или основного сервера")
+
+        # Реплика после ошибки исключается до следующей проверки
+        router = ReplicaRouter(replicas=_endpoints('caught-up', 'lagging'), max_lag=30, check_interval=0.2)
+        router.mark_unhealthy(router.replicas[0])
+        assert all(router.read_endpoint()['host'] == 'lagging' for _ in range(4)), "Исключенная реплика выбрана"
+        time.sleep(0.25)
+        hosts = {router.read_endpoint()['host'] for _ in range(4)}
+        assert hosts == {'caught-up', 'lagging'}, f"Реплика не вернулась после проверки: {hosts}"
+        print("   ✅ Исключенная реплика возвращается после следующей проверки")
+
+        # Подходящих реплик нет — основной сервер
+        router = ReplicaRouter(replicas=_endpoints('promoted', 'no-replay', UNREACHABLE), max_lag=30)
+        assert router.read_endpoint() is None, "Непригодная реплика выбрана"
+        assert ReplicaRouter(replicas=[]).read_endpoint() is None, "Без реплик чтение не с основного сервера"
+        assert not any(item['healthy'] for item in router.status()), "Непригодная реплика считается здоровой"
+        print("   ✅ Без подходящих реплик чтение идет на основной сервер")
+
+        print("✅ Маршрутизация чтения работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте маршрутизации чтения: {e}")
+        return False
+    finally:
+        psycopg2.connect = original_connect
+
+if __name__ == "__main__":
+    test_replica_routing()
@@ -0,0 +1,121 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from reports.report_service import ReportService, HTTPError
+from reports.search import (
+    PRODUCT_ORDERS_SQL, search_params, search_products, search_customers, search_query,
+    fetch_product_orders, fetch_customer_orders, trigram_installed,
+)
+
+def _plan(cursor, query, params):
+    cursor.execute("EXPLAIN " + query, params)
+    return "\n".join(row[0] for row in cursor.fetchall())
+
+def test_search():
+    """Проверяем поиск товаров и клиентов: ранжирование, лимит, спецсимволы, индексы и переход к заказам"""
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ПОИСКА ТОВАРОВ И КЛИЕНТОВ:")
+
+        # Свои товары, клиент и заказ — в транзакции, которая в конце откатывается
+        cursor.execute("""
+            INSERT INTO products (title, price, category) VALUES
+                ('Qzwx Ultra Laptop 50%_off', 999.99, 'Electronics'),
+                ('Mega Qzwx Case', 19.99, 'Electronics'),
+                ('Qzwxy Mouse', 9.99, 'Electronics')
+            RETURNING id
+        """)
+        laptop_id, case_id, mouse_id = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            INSERT INTO users (first_name, last_name, email, country, city)
+            VALUES ('Qzwxina', 'Petrova', 'qzwx.petrova@example.com', 'Russia', 'Kazan')
+            RETURNING id
+        """)
+        user_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO orders (user_id, order_date, total_amount, order_status)
+            VALUES (%s, '2030-01-01', 1019.98, 'completed'), (%s, '2030-02-01', 19.99, 'processing')
+            RETURNING id
+        """, [user_id, user_id])
+        first_order, second_order = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+            VALUES (%s, %s, 1, 999.99), (%s, %s, 1, 19.99), (%s, %s, 1, 19.99)
+        """, [first_order, laptop_id, first_order, case_id, second_order, case_id])
+
+        # Совпадения с начала названия выше совпадений по слову в середине
+        found = [row[0] for row in search_products(cursor, "QZWX")]
+        assert set(found) == {laptop_id, case_id, mouse_id}, f"Найдены не те товары: {found}"
+        assert found[-1] == case_id, f"Совпадение в середине названия не последнее: {found}"
+        assert search_products(cursor, "qzwx ultra")[0][0] == laptop_id, "Поиск по нескольким словам"
+        assert search_products(cursor, "  Ultra   qzwx ")[0][0] == laptop_id, "Слова в другом порядке"
+        assert len(search_products(cursor, "qzwx", limit=2)) == 2, "Лимит не соблюден"
+        print(f"   ✅ Ранжирование и лимит: {found}")
+
+        # Спецсимволы LIKE и tsquery не ломают запрос и не работают как шаблоны
+        params = search_params("50%_off")
+        assert params['prefix'] == '50\\%\\_off%' and params['words'] == '50:* & off:*', f"Параметры: {params}"
+        assert search_products(cursor, "%") == [] and search_products(cursor, "!&|") == [], "Запрос без слов"
+        assert search_products(cursor, "qzwx%") and search_products(cursor, "qzwx') OR 1=1 --") == [], \
+            "Спецсимволы в запросе"
+        print("   ✅ Спецсимволы экранируются")
+
+        customers = search_customers(cursor, "qzwx.petrova@")
+        assert [row[0] for row in customers] == [user_id] and customers[0][-2], "Поиск по префиксу email"
+        assert search_customers(cursor, "petrov")[0][0] == user_id, "Поиск по фамилии"
+        assert search_customers(cursor, "qzwxina petrova")[0][1] == 'Qzwxina Petrova', "Поиск по имени и фамилии"
+        print("   ✅ Клиенты находятся по имени, фамилии и email")
+
+        # Переход к заказам: строки order_details, новые первыми
+        sales = fetch_product_orders(cursor, case_id)
+        assert [row[0] for row in sales] == [second_order, first_order], f"Заказы товара: {sales}"
+        assert sales[1][1] == 'Qzwxina Petrova' and 'Qzwx Ultra Laptop' in sales[1][6], "Строка order_details"
+        assert [row[0] for row in fetch_product_orders(cursor, case_id, limit=1)] == [second_order]
+        assert [row[0] for row in fetch_customer_orders(cursor, user_id)] == [second_order, first_order], \
+            "Заказы клиента"
+        assert fetch_product_orders(cursor, mouse_id) == [], "Заказы у непроданного товара"
+        print("   ✅ Найденные товары и клиенты связываются с их заказами")
+
+        # Каждое условие поиска и переход к заказам читаются по индексам
+        trigram = trigram_installed(cursor)
+        cursor.execute("ANALYZE products; ANALYZE users")
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for kind, text in (('products', 'qzwx ultra'), ('customers', 'qzwx.petrova')):
+            params = search_params(text)
+            plan = _plan(cursor, search_query(kind, params, trigram), params)
+            assert 'Seq Scan' not in plan, f"Поиск {kind} без индекса:\n{plan}"
+        plan = _plan(cursor, PRODUCT_ORDERS_SQL, {'id': case_id, 'limit': 10})
+        assert 'Seq Scan' not in plan and 'Index Cond: (id = ANY' in plan, \
+            f"Условие на заказы не протолкнуто в order_details:\n{plan}"
+        print(f"   ✅ Запросы читают индексы (pg_trgm {'установлен' if trigram else 'недоступен'})")
+
+        # Строковые параметры HTTP-сервиса
+        service = ReportService()
+        path, params = service.parse_request_target("/search/products?q=qzwx%20ultra&limit=5")
+        assert path == "/search/products" and params == {"q": "qzwx ultra", "limit": 5}, f"Параметры: {params}"
+        for target in ("/search/products", "/search/customers?q=" + "x" * 101, "/products/orders?id=abc"):
+            try:
+                service.parse_request_target(target)
+                raise AssertionError(f"Неверный запрос принят: {target}")
+            except HTTPError as e:
+                assert e.status == 400, f"{target}: {e.status}"
+        print("   ✅ Параметры эндпоинтов поиска проверяются")
+
+        conn.rollback()
+        cursor.close()
+        conn.close()
+        print("✅ Поиск товаров и клиентов работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте поиска: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_search()
@@ -0,0 +1,94 @@
+import sys
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from reports import segmented_reports
+from reports.segmented_reports import collect_segments, write_segment_reports, segment_paths
+from reports.weekly_sales_report import fetch_weekly_report, fetch_monthly_report
+
+def _totals(segments, dimension, column):
+    totals = defaultdict(int)
+    for (name, _), rows in segments.items():
+        if name == dimension:
+            for row in rows:
+                totals[row[0]] += row[column]
+    return dict(totals)
+
+def test_segmented_reports():
+    """Проверяем сегментированные отчеты: совпадение с MV, сходимость сегментов, разбиение на диапазоны и файлы"""
+    output_dir = tempfile.mkdtemp()
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ СЕГМЕНТИРОВАННЫХ ОТЧЕТОВ:")
+
+        # Категории за неделю — те же строки, что в weekly_sales_report
+        weekly = collect_segments('weekly', 8)
+        expected = {(row[1], row[0]): tuple(row[2:]) for row in fetch_weekly_report(cursor, 8)}
+        actual = {(key[0], row[0]): tuple(row[1:]) for (dimension, key), rows in weekly.items()
+                  if dimension == 'category' for row in rows}
+        assert actual == expected, "Сегменты по категориям не совпадают с weekly_sales_report"
+        print(f"   ✅ Сегменты по категориям совпадают с weekly_sales_report ({len(actual)} строк)")
+
+        # Каждый заказ — ровно в одной стране и одном городе
+        countries = _totals(weekly, 'country', 1)
+        assert countries == _totals(weekly, 'city', 1), "Заказы городов не сходятся с заказами стран"
+        assert _totals(weekly, 'country', 3) == _totals(weekly, 'category', 3), "Выручка стран и категорий"
+        monthly = collect_segments('monthly', 6, dimensions=('country',))
+        assert {key for key, _ in monthly} == {'country'}, "Посчитаны лишние сегменты"
+        assert _totals(monthly, 'country', 1) == {row[0]: row[3] for row in fetch_monthly_report(cursor, 6)}, \
+            "Заказы стран не сходятся с monthly_sales_summary"
+        print(f"   ✅ Страны и города сходятся с итогами ({len(countries)} недель, "
+              f"{sum(1 for key in weekly if key[0] == 'city')} городов)")
+
+        # Диапазоны по границам недель дают те же сегменты
+        assert collect_segments('weekly', 8, partitions=3) == weekly, "Разбиение на диапазоны меняет результат"
+        print("   ✅ Параллельные диапазоны дают тот же результат")
+
+        # Файлы: по одному на сегмент, пачками в пуле процессов
+        original_batch = segmented_reports.RENDER_BATCH_SIZE
+        segmented_reports.RENDER_BATCH_SIZE = 25
+        try:
+            files = write_segment_reports(weekly, 'weekly', output_dir, workers=2)
+        finally:
+            segmented_reports.RENDER_BATCH_SIZE = original_batch
+        assert len(files) == len(weekly) and all(os.path.exists(path) for path in files), "Не все файлы записаны"
+        category, rows = next((key, rows) for key, rows in weekly.items() if key[0] == 'category')
+        with open(os.path.join(output_dir, segment_paths(weekly, 'weekly')[category]), encoding='utf-8') as f:
+            text = f.read()
+        assert f"категория {category[1][0]}" in text and f"{rows[0][3]:,.2f}" in text, "Содержимое отчета сегмента"
+        with open(os.path.join(output_dir, 'weekly', 'index.tsv'), encoding='utf-8') as f:
+            assert len(f.readlines()) == len(weekly) + 1, "Сводка index.tsv неполная"
+        print(f"   ✅ {len(files)} файлов записано пулом процессов")
+
+        # Неразличимые после очистки имена и пустые значения не перезаписывают друг друга
+        paths = segment_paths({('country', ('A/B',)): [], ('country', ('A B',)): [], ('country', (None,)): []}, 'weekly')
+        assert len(set(paths.values())) == 3, f"Пути сегментов совпали: {paths}"
+        for bad in ({'period': 'daily'}, {'dimensions': ('region',)}, {'dimensions': ()}):
+            try:
+                collect_segments(**bad)
+                raise AssertionError(f"Неверные параметры приняты: {bad}")
+            except ValueError:
+                pass
+        print("   ✅ Имена файлов и параметры проверяются")
+
+        cursor.close()
+        conn.close()
+        print("✅ Сегментированные отчеты работают корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте сегментированных отчетов: {e}")
+        return False
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_segmented_reports()
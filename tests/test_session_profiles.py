@@ -0,0 +1,74 @@
+import sys
+import os
+import io
+import json
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import get_connection_string
+from database import session_profiles
+from database.session_profiles import apply_profile
+from reports.weekly_sales_report import fetch_top_customers
+from scripts.calibrate_profiles import calibrate, CANDIDATES
+
+def test_session_profiles():
+    """Проверяем, что профили действуют только внутри транзакции, а калибровка сохраняет допустимые значения"""
+    original_profiles = {name: dict(settings) for name, settings in session_profiles.PROFILES.items()}
+    output_path = os.path.join(tempfile.mkdtemp(), 'session_profiles.json')
+    try:
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ПРОФИЛЕЙ СЕССИИ:")
+
+        cursor.execute("SHOW work_mem")
+        default_work_mem = cursor.fetchone()[0]
+        conn.rollback()
+
+        session_profiles.PROFILES['heavy_report']['work_mem'] = '48MB'
+        apply_profile(cursor, 'heavy_report')
+        cursor.execute("SHOW work_mem")
+        assert cursor.fetchone()[0] == '48MB', "SET LOCAL не применился"
+        conn.rollback()
+        cursor.execute("SHOW work_mem")
+        assert cursor.fetchone()[0] == default_work_mem, "Профиль пережил конец транзакции"
+        conn.rollback()
+        print("   ✅ Профиль действует до конца транзакции")
+
+        rows = fetch_top_customers(cursor, 5)
+        cursor.execute("SHOW work_mem")
+        assert cursor.fetchone()[0] == '48MB', "Отчет выполнен без своего профиля"
+        assert rows, "Отчет с профилем не вернул строк"
+        conn.rollback()
+        print("   ✅ Отчет применяет свой профиль")
+
+        cursor.close()
+        conn.close()
+
+        with redirect_stdout(io.StringIO()):
+            result = calibrate(['point_lookup'], warmup=0, repetitions=1, path=output_path)
+        with open(output_path) as f:
+            saved = json.load(f)
+        assert saved['profiles'] == result['profiles'], "Сохранены не те профили"
+        for name, value in saved['profiles']['point_lookup'].items():
+            assert str(value) in [str(candidate) for candidate in CANDIDATES[name]], \
+                f"Недопустимое значение {name}={value}"
+        assert session_profiles.PROFILES['point_lookup'] == saved['profiles']['point_lookup'], \
+            "Калибровка не применилась к текущему процессу"
+        print(f"   ✅ Калибровка сохранила профиль: {saved['profiles']['point_lookup']}")
+
+        print("✅ Профили сессии работают корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте профилей сессии: {e}")
+        return False
+    finally:
+        for name, settings in original_profiles.items():
+            session_profiles.PROFILES[name] = settings
+
+if __name__ == "__main__":
+    test_session_profiles()
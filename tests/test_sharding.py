@@ -0,0 +1,138 @@
+import sys
+import os
+import io
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from database.config import DB_CONFIG, get_connection_string
+from database.routing import endpoint_name
+from reports import sharded_reports
+from reports.segmented_reports import collect_segments
+from scripts.archive import archive_closed_months, archive_cutoff
+from scripts.create_views import refresh_materialized_views
+from scripts.sharding import init_shards, distribute_data, compare_with_primary
+from tests.harness import drop_database
+
+SHARD_COUNT = 3
+
+def test_sharded_reports_match_single_node():
+    """Проверяем, что отчеты scatter-gather по шардам совпадают с одним сервером"""
+    # Шарды — отдельные базы на том же сервере, по одной на каждую копию тестовой базы
+    shards = [
+        {'host': DB_CONFIG['host'], 'port': DB_CONFIG['port'], 'database': f"{DB_CONFIG['database']}_shard_{i}"}
+        for i in range(SHARD_COUNT)
+    ]
+    output_dir = tempfile.mkdtemp()
+    try:
+        print("✅ ТЕСТ ШАРДИРОВАНИЯ ЗАКАЗОВ:")
+        with redirect_stdout(io.StringIO()):
+            init_shards(shards)
+            distribute_data(shards)
+
+        conn = psycopg2.connect(get_connection_string())
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        expected_orders = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+
+        sharded_orders = 0
+        for index, shard in enumerate(shards):
+            conn = psycopg2.connect(get_connection_string(endpoint=shard))
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM orders")
+            orders = cursor.fetchone()[0]
+            assert orders > 0, f"Шард {shard['database']} пуст"
+            cursor.execute(f"SELECT COUNT(*) FROM users WHERE id %% {SHARD_COUNT} <> %s", [index])
+            assert cursor.fetchone()[0] == 0, "Пользователь попал не на свой шард"
+            sharded_orders += orders
+            cursor.close()
+            conn.close()
+        assert sharded_orders == expected_orders, \
+            f"Заказов на шардах {sharded_orders}, на основном сервере {expected_orders}"
+        print(f"   ✅ {expected_orders} заказов разложены по {SHARD_COUNT} шардам")
+
+        results = compare_with_primary(shards)
+        assert all(results.values()), f"Отчеты по шардам расходятся: {results}"
+
+        assert collect_segments('weekly', 8, shards=shards) == collect_segments('weekly', 8, shards=[]), \
+            "Сегментированный отчет по шардам расходится с одним сервером"
+        print("   ✅ Сегментированный отчет по шардам совпадает с одним сервером")
+
+        # После архивирования закрытых месяцев шарды получают архив и по-прежнему совпадают
+        conn = psycopg2.connect(get_connection_string())
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(order_date) FROM orders")
+        before = archive_cutoff(1, now=cursor.fetchone()[0])
+        with redirect_stdout(io.StringIO()):
+            archived = archive_closed_months(before, output_dir=output_dir, vacuum=False)
+            refresh_materialized_views()
+            distribute_data(shards)
+        assert archived and archived['orders'] > 0, f"Архивирование до {before:%Y-%m-%d} ничего не перенесло"
+        cursor.execute("SELECT COUNT(*) FROM archive_weekly_sales")
+        archived_weeks = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM archive_boundary_items")
+        boundary_items = cursor.fetchone()[0]
+        assert archived_weeks > 0, "Нет недель, целиком перенесенных в архив"
+        cursor.execute("SELECT * FROM weekly_sales_report WHERE week_start < %s", [before])
+        closed_weeks = cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+        results = compare_with_primary(shards)
+        assert all(results.values()), f"Отчеты по шардам расходятся после архивирования: {results}"
+        sharded_closed = [row for row in sharded_reports.weekly_sales_report(shards) if row[0] < before]
+        assert sorted(sharded_closed) == sorted(closed_weeks) and closed_weeks, \
+            "Закрытые недели в отчете по шардам потеряны"
+        print(f"   ✅ После архивирования до {before:%Y-%m-%d} ({archived['orders']} заказов, "
+              f"{boundary_items} позиций граничной недели) отчеты по шардам совпадают")
+
+        # Заказ, записанный прямо на шард, раскладка без --force не удаляет — и не трогает ни один шард
+        conn = psycopg2.connect(get_connection_string(endpoint=shards[1]))
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO orders (user_id, order_date, total_amount, order_status) "
+                       "SELECT id, LOCALTIMESTAMP, 10, 'processing' FROM users LIMIT 1 RETURNING id")
+        local_order = cursor.fetchone()[0]
+        assert local_order % SHARD_COUNT == 1, f"id {local_order} заказа на шарде 1 не из его последовательности"
+        try:
+            with redirect_stdout(io.StringIO()):
+                distribute_data(shards)
+            raise AssertionError("Раскладка удалила заказ, записанный прямо на шард")
+        except RuntimeError as e:
+            assert endpoint_name(shards[1]) in str(e) and endpoint_name(shards[0]) not in str(e), f"Отказ: {e}"
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE id = %s", [local_order])
+        assert cursor.fetchone()[0] == 1, "Заказ, записанный на шард, удален"
+        with redirect_stdout(io.StringIO()):
+            distribute_data(shards, force=True)
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE id = %s", [local_order])
+        assert cursor.fetchone()[0] == 0, "--force не заменил данные шарда"
+        cursor.close()
+        conn.close()
+        with redirect_stdout(io.StringIO()):
+            distribute_data(shards)
+        print("   ✅ Раскладка отказывается удалять строки, записанные прямо на шард (--force — удалить)")
+
+        print("✅ Отчеты по шардам совпадают с одним сервером")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте шардирования: {e}")
+        return False
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        conn = psycopg2.connect(get_connection_string(database='postgres'))
+        conn.autocommit = True
+        cursor = conn.cursor()
+        for shard in shards:
+            drop_database(cursor, shard['database'])
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    test_sharded_reports_match_single_node()
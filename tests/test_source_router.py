@@ -0,0 +1,179 @@
+import sys
+import os
+import json
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.connection import get_connection
+from database.instrumentation import metrics
+from reports import weekly_sales_report as reports
+from reports.approximate_reports import Sampling, fetch_approximate
+from reports.source_router import SourceRouter, Requirements, REPORT_SOURCES, source_router
+from scripts.archive import archive_closed_months, archive_cutoff
+from scripts.create_views import MATERIALIZED_VIEW_QUERIES, refresh_view
+
+def _refresh_all(conn):
+    cursor = conn.cursor()
+    for name in MATERIALIZED_VIEW_QUERIES:
+        refresh_view(cursor, name, concurrently=False)
+    conn.commit()
+    cursor.close()
+
+def _add_order(cursor, user_id, product_id):
+    cursor.execute("INSERT INTO orders (user_id, order_date, total_amount, order_status) "
+                   "VALUES (%s, LOCALTIMESTAMP, 40, 'completed') RETURNING id", [user_id])
+    order_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (%s, %s, 2, 20)",
+                   [order_id, product_id])
+
+def _choose(router, conn, report, requirements):
+    cutoff = datetime.now() - timedelta(weeks=8)
+    sql, params, extra = {
+        'weekly': (reports.WEEKLY_REPORT_SQL, [cutoff], {'since': cutoff}),
+        'monthly': (reports.MONTHLY_REPORT_SQL, [cutoff], {'since': cutoff}),
+        'categories': (reports.CATEGORY_ANALYSIS_SQL, [], {}),
+        'daily': (reports.DAILY_SALES_SQL, [cutoff], {'since': cutoff}),
+    }[report]
+    decision = router.choose(conn, report, sql, params, requirements, **extra)
+    conn.rollback()
+    return decision
+
+def _candidate(decision, name):
+    return next(candidate for candidate in decision.candidates if candidate.source.name == name)
+
+def test_source_router():
+    """Проверяем выбор источника: свежесть MV, точность, стоимость по EXPLAIN и журнал решений"""
+    log_path = os.path.join(tempfile.mkdtemp(), 'routing.log')
+    router = SourceRouter(log_path=log_path)
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ВЫБОРА ИСТОЧНИКА ОТЧЕТА:")
+
+        # Сразу после обновления MV актуальна и дешевле живого запроса
+        _refresh_all(conn)
+        for report in ('weekly', 'monthly'):
+            decision = _choose(router, conn, report, Requirements(max_staleness=0))
+            assert decision.source.kind == 'materialized' and decision.chosen.staleness == 0, decision.describe()
+            live = next(c for c in decision.candidates if c.source.kind == 'live')
+            assert live.eligible and live.cost > decision.chosen.cost, f"Стоимость живого запроса: {live.to_dict()}"
+        print("   ✅ Обновленная MV актуальна и выбирается как самая дешевая")
+
+        cursor.execute("SELECT id FROM users LIMIT 1")
+        user_id = cursor.fetchone()[0]
+        cursor.execute("SELECT id FROM products WHERE category IS NOT NULL LIMIT 1")
+        product_id = cursor.fetchone()[0]
+        conn.rollback()
+
+        # Заказ транзакции, открытой во время REFRESH и зафиксированной после него, в MV нет:
+        # updated_at — начало транзакции, раньше окончания REFRESH, но не раньше границы снимка
+        writer = get_connection()
+        writer_cursor = writer.cursor()
+        _add_order(writer_cursor, user_id, product_id)
+        time.sleep(0.05)
+        _refresh_all(conn)
+        writer.commit()
+        writer_cursor.close()
+        writer.close()
+        decision = _choose(router, conn, 'weekly', Requirements(max_staleness=0))
+        mv = _candidate(decision, 'weekly_sales_report')
+        assert not mv.eligible and mv.staleness > 0, f"Заказ, зафиксированный после REFRESH, не виден: {mv.to_dict()}"
+        assert reports.fetch_weekly_report(cursor, 8) != reports.fetch_weekly_report(cursor, 8, decision.source), \
+            "MV без заказа открытой транзакции совпадает с живым запросом"
+        conn.rollback()
+        _refresh_all(conn)
+        decision = _choose(router, conn, 'weekly', Requirements(max_staleness=0))
+        assert decision.source.kind == 'materialized' and decision.chosen.staleness == 0, decision.describe()
+        print("   ✅ Заказ транзакции, открытой во время обновления, делает MV устаревшей")
+
+        # После нового заказа MV отстает: при требовании свежести — живой запрос с тем же результатом
+        _add_order(cursor, user_id, product_id)
+        conn.commit()
+        time.sleep(0.05)
+
+        decision = _choose(router, conn, 'weekly', Requirements())
+        assert decision.source.kind == 'materialized' and decision.chosen.staleness > 0, "Без требований — MV"
+        decision = _choose(router, conn, 'weekly', Requirements(max_staleness=0))
+        mv = _candidate(decision, 'weekly_sales_report')
+        assert decision.source.name == 'weekly_sales_report:live' and not mv.eligible, decision.describe()
+        assert 'отстает' in mv.reason, f"Причина отказа: {mv.reason}"
+        live_rows = {report: fetch(cursor, 8, _choose(router, conn, report, Requirements(max_staleness=0)).source)
+                     for report, fetch in (('weekly', reports.fetch_weekly_report),
+                                           ('monthly', reports.fetch_monthly_report))}
+        conn.rollback()
+        _refresh_all(conn)
+        assert live_rows['weekly'] == reports.fetch_weekly_report(cursor, 8), "Живой недельный отчет не совпадает с MV"
+        assert live_rows['monthly'] == reports.fetch_monthly_report(cursor, 8), "Живой месячный отчет не совпадает с MV"
+        conn.rollback()
+        print("   ✅ Отстающая MV отклоняется, живой запрос дает тот же результат, что MV после обновления")
+
+        # Точность: выборка только при допустимой ошибке, выбор — по минимальной стоимости
+        decision = _choose(router, conn, 'daily', Requirements())
+        samples = [c for c in decision.candidates if c.source.kind == 'sample']
+        assert samples and all(c.reason == "нужен точный результат" for c in samples), "Выборка без допуска ошибки"
+        for report in REPORT_SOURCES:
+            decision = _choose(router, conn, report, Requirements(max_staleness=0, max_error=0.5))
+            eligible = [c for c in decision.candidates if c.eligible]
+            assert all(c.cost is not None for c in eligible), f"{report}: кандидаты без стоимости"
+            assert decision.chosen.cost == min(c.cost for c in eligible), f"{report}: выбран не самый дешевый"
+            assert all(0 < c.percent <= 100 for c in decision.candidates if c.source.kind == 'sample'), \
+                f"{report}: доля выборки"
+        print("   ✅ Выборка рассматривается только при допустимой ошибке, выбран самый дешевый источник")
+
+        # Журнал: каждое решение со всеми кандидатами и счетчики по источникам
+        with open(log_path) as f:
+            entries = [json.loads(line) for line in f]
+        assert len(entries) == 13 and all(len(entry['candidates']) >= 3 for entry in entries), "Журнал решений"
+        assert entries[-1]['chosen'] == router.decisions[-1]['chosen'], "Последнее решение"
+        counters = metrics.snapshot()['counters']
+        assert counters.get('source_router.weekly.weekly_sales_report:live', 0) >= 2, "Счетчик решений"
+        print(f"   ✅ В журнале {len(entries)} решений с кандидатами и причинами")
+
+        # После архивирования выборка, как и точные источники, охватывает закрытые месяцы
+        cursor.execute("SELECT MAX(order_date) FROM orders")
+        before = archive_cutoff(2, now=cursor.fetchone()[0])
+        conn.rollback()
+        assert archive_closed_months(before, output_dir=tempfile.mkdtemp(), vacuum=False)['orders'] > 0, \
+            "Архивирование ничего не перенесло"
+        decision = _choose(router, conn, 'categories', Requirements(max_error=0.5))
+        samples = [c for c in decision.candidates if c.source.kind == 'sample']
+        assert samples and all(c.eligible for c in samples), decision.describe()
+        exact = reports.fetch_category_analysis(cursor)
+        for candidate in samples:
+            _, rows, total = fetch_approximate(cursor, 'categories', Sampling(percent=100, method=candidate.source.method))
+            assert round(total.revenue.value, 2) == float(sum(row[3] for row in exact)), \
+                f"{candidate.source.name}: итог без архива"
+            assert {row.key[0]: int(row.orders.value) for row in rows} == {row[0]: row[1] for row in exact}, \
+                f"{candidate.source.name}: заказы категорий без архива"
+        conn.rollback()
+        print(f"   ✅ После архивирования до {before:%Y-%m-%d} выборка дает те же итоги категорий, что и точный источник")
+
+        # Время обновления неизвестно или MV нет — отчет идет из живого запроса
+        cursor.execute("COMMENT ON MATERIALIZED VIEW weekly_sales_report IS NULL")
+        conn.commit()
+        decision = _choose(router, conn, 'weekly', Requirements())
+        assert decision.source.kind == 'live' and 'неизвестно' in _candidate(decision, 'weekly_sales_report').reason, \
+            decision.describe()
+        cursor.execute("DROP MATERIALIZED VIEW weekly_sales_report")
+        conn.commit()
+        decision = _choose(router, conn, 'weekly', Requirements())
+        assert decision.source.kind == 'live', decision.describe()
+        reports.show_weekly_report(weeks_back=8)
+        assert source_router.decisions[-1]['chosen'] == 'weekly_sales_report:live', "Отчет без MV"
+        print("   ✅ Без MV или времени ее обновления отчет читается живым запросом")
+
+        cursor.close()
+        conn.close()
+        print("✅ Выбор источника отчета работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте выбора источника: {e}")
+        return False
+
+if __name__ == "__main__":
+    test_source_router()
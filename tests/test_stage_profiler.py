@@ -0,0 +1,93 @@
+import sys
+import os
+import json
+import pstats
+import shutil
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from database.connection import get_connection
+from scripts.stage_profiler import StageProfiler
+
+def _busy(n):
+    return sum(i * i for i in range(n))
+
+def test_stage_profiler():
+    """Проверяем профиль этапов: база, процессор и память по этапам, дампы cProfile и сводка"""
+    output_dir = tempfile.mkdtemp()
+    profiler = StageProfiler()
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        print("✅ ТЕСТ ПРОФИЛЯ ЭТАПОВ:")
+
+        # Выключенный профилировщик ничего не измеряет
+        with profiler.stage('noop') as stage:
+            assert stage is None, "Выключенный профилировщик измеряет этап"
+        assert not profiler.stages, "Этап выключенного профилировщика записан"
+
+        profiler.enable(output_dir)
+        with profiler.stage('pipeline'):
+            with profiler.stage('db'):
+                cursor.execute("SELECT pg_sleep(0.3)")
+                cursor.fetchall()
+            with profiler.stage('cpu'):
+                _busy(2_000_000)
+            with profiler.stage('memory'):
+                payload = [str(i) for i in range(300_000)]
+                del payload
+        stages = {stage['stage']: stage for stage in profiler.report()}
+        profiler.disable()
+
+        db, cpu, memory = stages['db'], stages['cpu'], stages['memory']
+        assert db['db_seconds'] >= 0.3 and db['cpu_seconds'] < 0.1, f"Ожидание базы: {db}"
+        assert next(iter(db['own_time_by_package'])) == 'ожидание базы', f"Пакеты этапа db: {db}"
+        assert cpu['cpu_seconds'] > 0.05 and cpu['db_seconds'] == 0, f"Процессор: {cpu}"
+        assert memory['peak_memory_bytes'] > 10 * 1024 * 1024, f"Пик памяти: {memory}"
+        assert stages['pipeline']['peak_memory_bytes'] >= memory['peak_memory_bytes'], "Пик внешнего этапа"
+        print(f"   ✅ База {db['db_seconds']:.2f} с, процессор {cpu['cpu_seconds']:.2f} с, "
+              f"пик {memory['peak_memory_bytes'] / 1024 / 1024:.0f} МБ")
+
+        # Внешний этап включает вложенные по часам, но не в своем cProfile
+        pipeline = stages['pipeline']
+        assert pipeline['depth'] == 0 and db['depth'] == 1, "Глубина вложенных этапов"
+        assert pipeline['wall_seconds'] >= db['wall_seconds'] + cpu['wall_seconds'], "Время внешнего этапа"
+        outer = pstats.Stats(pipeline['profile'])
+        assert not any(function == '_busy' for _, _, function in outer.stats), "Вложенный этап в cProfile внешнего"
+        inner = pstats.Stats(cpu['profile'])
+        assert any(function == '_busy' for _, _, function in inner.stats), "cProfile этапа cpu"
+        print("   ✅ Вложенные этапы: время внешнего включает их, дампы cProfile раздельные")
+
+        with open(os.path.join(output_dir, 'summary.json')) as f:
+            assert [stage['stage'] for stage in json.load(f)] == ['pipeline', 'db', 'cpu', 'memory'], "summary.json"
+        with open(os.path.join(output_dir, 'summary.txt')) as f:
+            summary = f.read()
+        assert '_busy' in summary and '  memory' in summary, "summary.txt"
+        print("   ✅ Сводка и самые затратные функции сохранены")
+
+        # Командная строка: этап команды и разделы отчета
+        cli_dir = os.path.join(output_dir, 'cli')
+        assert main.main(['--profile-stages', '--profile-dir', cli_dir, 'report', 'categories']) == 0, \
+            "Код возврата main.py"
+        with open(os.path.join(cli_dir, 'summary.json')) as f:
+            names = [stage['stage'] for stage in json.load(f)]
+        assert names == ['report', 'report.categories'], f"Этапы main.py: {names}"
+        print(f"   ✅ main.py --profile-stages: {', '.join(names)}")
+
+        cursor.close()
+        conn.close()
+        print("✅ Профиль этапов работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка в тесте профиля этапов: {e}")
+        return False
+    finally:
+        profiler.disable()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_stage_profiler()